@@ -0,0 +1,110 @@
+"""AI 答疑突发基准：全班同时点「AI 解析」时，有无上游限流排队的完成率对比。
+
+用法：
+  python benchmarks/bench_ai_burst.py
+  python benchmarks/bench_ai_burst.py --users 120 --provider-limit 8 --server asyncio
+
+本地模拟的 provider（mock_upstream）同时只接受 --provider-limit 个流，超出回 429；
+OpenAI SDK 自带的 429 重试保持默认（2 次）。对每种配置统计：
+  完成率（收到 [DONE] 且无 error）、端到端耗时 p50/p95、上游收到的 429 次数、最长排队时间。
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import http.client
+import json
+import logging
+import statistics
+import threading
+import time
+
+from werkzeug.serving import make_server
+
+from bench_quiz_questions import install_bank, make_bank
+from med_exam_toolkit import quiz
+from med_exam_toolkit.ai.client import make_client
+from med_exam_toolkit.ai.limiter import FairLimiter
+from med_exam_toolkit.gateway import Gateway
+from mock_upstream import MockUpstream
+
+_HEADERS = {"X-Session-Token": "bench", "Content-Type": "application/json"}
+
+
+def _serve(kind: str):
+    if kind == "werkzeug":
+        srv = make_server("127.0.0.1", 0, quiz.app, threaded=True)
+        threading.Thread(target=srv.serve_forever, daemon=True).start()
+        return srv.server_port, srv.shutdown
+    loop = asyncio.new_event_loop()
+    gw = Gateway(quiz.app, sse={"ai": quiz._ai_stream_async}, threads=32)
+    port = loop.run_until_complete(gw.start("127.0.0.1", 0))
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+    def stop():
+        asyncio.run_coroutine_threadsafe(gw.stop(), loop).result(10)
+        loop.call_soon_threadsafe(loop.stop)
+    return port, stop
+
+
+def _burst(port: int, users: int) -> tuple[int, list[float]]:
+    body = json.dumps({"fingerprint": quiz._banks[0].questions[0].fingerprint, "bank": 0})
+    ok, lat, lock = [0], [], threading.Lock()
+    start = threading.Barrier(users)
+
+    def one(i: int) -> None:
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=300)
+        start.wait()
+        t0 = time.perf_counter()
+        conn.request("POST", "/api/ai/chat", body=body,
+                     headers={**_HEADERS, "Cookie": f"med_exam_uid=u{i}"})
+        text = conn.getresponse().read().decode()
+        dt = time.perf_counter() - t0
+        with lock:
+            lat.append(dt)
+            if text.rstrip().endswith("data: [DONE]") and '"error"' not in text:
+                ok[0] += 1
+        conn.close()
+
+    threads = [threading.Thread(target=one, args=(i,)) for i in range(users)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return ok[0], sorted(lat)
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--users", type=int, default=60)
+    p.add_argument("--provider-limit", type=int, default=6, help="模拟 provider 的并发上限")
+    p.add_argument("--chunks", type=int, default=20)
+    p.add_argument("--chunk-delay", type=float, default=0.05)
+    p.add_argument("--server", choices=["werkzeug", "asyncio"], default="werkzeug")
+    a = p.parse_args()
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    install_bank(make_bank(200))
+    quiz._index_banks()
+    with MockUpstream(chunks=a.chunks, chunk_delay=a.chunk_delay,
+                      max_streams=a.provider_limit) as up:
+        quiz._ai_client = make_client("openai", api_key="x", base_url=up.base_url)
+        quiz._ai_model = "mock"
+        quiz._ai_async = None
+        for name, limiter in (("不限流", None),
+                              (f"限流 {a.provider_limit}", FairLimiter(concurrency=a.provider_limit))):
+            quiz._ai_limiter = limiter
+            up.rejected = up.peak_streams = 0
+            port, stop = _serve(a.server)
+            quiz._server_port = port
+            ok, lat = _burst(port, a.users)
+            stop()
+            wait = f"最长排队 {limiter.max_wait:5.1f}s" if limiter else ""
+            print(f"{a.server} {name:<8} 完成 {ok:>4}/{a.users} ({ok * 100 // a.users:3d}%)  "
+                  f"p50={statistics.median(lat):5.1f}s p95={lat[int(len(lat) * 0.95) - 1]:5.1f}s  "
+                  f"上游 429 {up.rejected:>4} 次  峰值并发 {up.peak_streams:>3}  {wait}")
+    quiz._ai_limiter = None
+
+
+if __name__ == "__main__":
+    main()
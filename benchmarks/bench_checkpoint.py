@@ -0,0 +1,97 @@
+"""enrich 断点基准：N 条完成记录下，追加日志与「每条整份重写」的墙钟时间与写盘量。
+
+用法：
+  python benchmarks/bench_checkpoint.py
+  python benchmarks/bench_checkpoint.py --n 100000 --workers 16 --legacy-n 3000
+
+旧实现每次 done() 都把全部结果以 indent=2 重写一遍，总写盘量 O(n²)，跑满 --n 要几个小时，
+因此只实测前 --legacy-n 条，并按二次方外推到 --n（标注为外推）。
+每条结果模拟 enrich 的真实返回：答案 + 约 150 字解析 + 置信度。
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from med_exam_toolkit.ai.checkpoint import Checkpoint
+
+
+class _LegacyCheckpoint(Checkpoint):
+    """改造前的 done()：持锁整份重写快照。"""
+
+    def done(self, item_id, result):
+        with self._lock:
+            self._completed[item_id] = result
+            self.checkpoint_dir.mkdir(parents=True, exist_ok=True)
+            payload = {"meta": {"tag": self.tag,
+                                "saved_at": datetime.now(timezone.utc).isoformat()},
+                       "completed": self._completed}
+            fd, tmp = tempfile.mkstemp(dir=self.checkpoint_dir, prefix=f".{self.tag}_",
+                                       suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(payload, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, self.path)
+
+
+def _result(i: int) -> dict:
+    return {"answer": "ABCDE"[i % 5], "discuss": f"第{i}题解析：" + "该选项描述的机制正确。" * 12,
+            "confidence": 0.9, "model": "gpt-4o"}
+
+
+def _disk_bytes(d: Path) -> int:
+    return sum(p.stat().st_size for p in d.iterdir() if p.is_file())
+
+
+def _run(cls, d: Path, n: int, workers: int) -> tuple[float, float]:
+    """返回 (done() 总耗时, load() 耗时)，秒。"""
+    ck = cls("bench", checkpoint_dir=d)
+    ck.load()
+    per = n // workers
+
+    def worker(w: int) -> None:
+        for i in range(w * per, (w + 1) * per):
+            ck.done(f"task-{i}", _result(i))
+
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(w,)) for w in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    ck.close()
+    dt = time.perf_counter() - t0
+
+    reloaded = cls("bench", checkpoint_dir=d)
+    t1 = time.perf_counter()
+    assert reloaded.load() == per * workers
+    return dt, time.perf_counter() - t1
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--n", type=int, default=50000, help="模拟完成的任务数")
+    p.add_argument("--workers", type=int, default=8, help="并发调用 done() 的线程数（同 --max-workers）")
+    p.add_argument("--legacy-n", type=int, default=2000, help="旧实现实测的条数")
+    a = p.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        d = Path(tmp) / "journal"
+        dt, load = _run(Checkpoint, d, a.n, a.workers)
+        print(f"追加日志   {a.n} 条: {dt:7.2f} s  ({a.n / dt:,.0f} 条/秒)  "
+              f"load() {load * 1000:.0f} ms  磁盘 {_disk_bytes(d) / 1048576:.1f} MB")
+
+        d = Path(tmp) / "legacy"
+        dt, load = _run(_LegacyCheckpoint, d, a.legacy_n, a.workers)
+        scale = (a.n / a.legacy_n) ** 2
+        print(f"整份重写   {a.legacy_n} 条: {dt:7.2f} s（实测）"
+              f" → {a.n} 条约 {dt * scale / 60:,.0f} 分钟（按 O(n²) 外推）")
+
+
+if __name__ == "__main__":
+    main()
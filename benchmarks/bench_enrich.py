@@ -0,0 +1,83 @@
+"""enrich 并发基准：模拟限流上游下，固定线程数与 asyncio + AIMD 自适应并发的对比。
+
+用法：
+  python benchmarks/bench_enrich.py
+  python benchmarks/bench_enrich.py --n 400 --capacity 24 --latency 0.2
+
+模拟上游同时最多处理 --capacity 个请求，超出回 429 + Retry-After，每个请求耗时 --latency 秒。
+固定线程数调小了吞吐上不去，调大了撞 429、按 Retry-After 退避甚至重试耗尽失败；
+AIMD 从同样的起始并发出发，自己找到上游容量附近。
+"""
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import json
+import logging
+import tempfile
+import time
+from pathlib import Path
+
+from med_exam_toolkit.ai.enricher import BankEnricher
+from med_exam_toolkit.bank import save_bank
+from med_exam_toolkit.models import Question, SubQuestion
+from mock_upstream import MockUpstream
+
+_RESULT = json.dumps({"answer": "A", "discuss": "模拟解析" * 20, "confidence": 0.9},
+                     ensure_ascii=False)
+
+
+def _bank(path: Path, n: int) -> None:
+    qs = [Question(fingerprint=f"fp{i}", mode="A1型题", unit="第一章",
+                   sub_questions=[SubQuestion(text=f"题{i}", options=["A.甲", "B.乙"], answer="")])
+          for i in range(n)]
+    save_bank(qs, path)
+
+
+def _run(tmp: Path, args, label: str, **kw) -> None:
+    up = MockUpstream(chunks=1, text=_RESULT, first_delay=args.latency,
+                      max_streams=args.capacity, retry_after=args.retry_after).start()
+    try:
+        d = tmp / label
+        d.mkdir()
+        _bank(d / "b.mqb", args.n)
+        e = BankEnricher(bank_path=d / "b.mqb", provider="openai", model="mock", api_key="x",
+                         base_url=up.base_url, checkpoint_dir=d / "ckpt", **kw)
+        t0 = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            e.run()
+        dt = time.perf_counter() - t0
+    finally:
+        up.stop()
+    tr = e._tracker
+    extra = ""
+    if e._aimd is not None:
+        st = e._aimd.stats()
+        extra = f"  并发 峰值 {st['peak']} / 结束 {st['limit']}  减半 {st['cuts']} 次"
+    print(f"{label:<14} {dt:6.1f} s  {tr.requests / dt * 60:7.0f} 题/分  "
+          f"{tr.total_tokens / dt * 60:9.0f} TPM  429×{up.rejected:<5} 失败 {tr.failed_requests:<4}"
+          f"  上游峰值并发 {up.peak_streams}{extra}")
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--n", type=int, default=300, help="小题数")
+    p.add_argument("--capacity", type=int, default=16, help="上游同时可处理的请求数")
+    p.add_argument("--latency", type=float, default=0.2, help="单个请求耗时（秒）")
+    p.add_argument("--retry-after", type=float, default=1.0, help="429 响应的 Retry-After（秒）")
+    p.add_argument("--workers", type=int, default=4, help="起始 / 固定并发（同 --max-workers）")
+    a = p.parse_args()
+    logging.disable(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        _run(tmp, a, f"threads×{a.workers}", engine="threads", max_workers=a.workers)
+        big = a.capacity * 3
+        _run(tmp, a, f"threads×{big}", engine="threads", max_workers=big)
+        _run(tmp, a, "async AIMD", engine="async", max_workers=a.workers,
+             max_concurrency=big)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""长连接基准：N 个挂起中的 AI 流下，Werkzeug 与 asyncio 网关的线程数 / 内存 / 普通请求延迟。
+
+用法：
+  python benchmarks/bench_gateway.py
+  python benchmarks/bench_gateway.py --streams 500 --hold 10
+
+AI 上游由 mock_upstream 在本地模拟，第一块数据在 --hold 秒后才发出，
+期间 N 个 /api/ai/chat 流都处于「等上游」状态；同时测量 /api/questions 的延迟。
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import http.client
+import json
+import logging
+import statistics
+import threading
+import time
+
+from openai import OpenAI
+from werkzeug.serving import make_server
+
+from bench_quiz_questions import install_bank, make_bank
+from med_exam_toolkit import quiz
+from med_exam_toolkit.gateway import Gateway
+from mock_upstream import MockUpstream
+
+_HEADERS = {"X-Session-Token": "bench", "Content-Type": "application/json"}
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return float("nan")
+
+
+def _start_werkzeug() -> tuple[int, callable]:
+    srv = make_server("127.0.0.1", 0, quiz.app, threaded=True)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv.server_port, srv.shutdown
+
+
+def _start_gateway() -> tuple[int, callable]:
+    loop = asyncio.new_event_loop()
+    gw = Gateway(quiz.app, sse={"ai": quiz._ai_stream_async},
+                 ws={"/api/asr/ws": quiz._asr_ws_async}, threads=32)
+    port = loop.run_until_complete(gw.start("127.0.0.1", 0))
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+    def stop():
+        asyncio.run_coroutine_threadsafe(gw.stop(), loop).result(10)
+        loop.call_soon_threadsafe(loop.stop)
+    return port, stop
+
+
+def _run(name: str, start, up: MockUpstream, streams: int, hold: float) -> None:
+    port, stop = start()
+    quiz._server_port = port
+    threads0, rss0 = threading.active_count(), _rss_mb()
+    body = json.dumps({"fingerprint": quiz._banks[0].questions[0].fingerprint, "bank": 0})
+    conns = []
+    for _ in range(streams):
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=hold + 30)
+        conn.request("POST", "/api/ai/chat", body=body, headers=_HEADERS)
+        conns.append(conn)
+    deadline = time.monotonic() + hold
+    while up.open_streams < streams and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    lat = []
+    probe = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    for _ in range(20):
+        t0 = time.perf_counter()
+        probe.request("GET", "/api/questions?bank=0&limit=30", headers=_HEADERS)
+        probe.getresponse().read()
+        lat.append((time.perf_counter() - t0) * 1000)
+    probe.close()
+    print(f"{name:<9} 挂起流 {up.open_streams:>5}/{streams}  "
+          f"线程 +{threading.active_count() - threads0:<5} RSS +{_rss_mb() - rss0:7.1f} MB  "
+          f"/api/questions median={statistics.median(lat):6.1f} ms max={max(lat):6.1f} ms")
+
+    for conn in conns:
+        conn.close()
+    while up.open_streams:
+        time.sleep(0.05)
+    stop()
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--streams", type=int, default=200)
+    p.add_argument("--hold", type=float, default=5.0, help="上游首块延迟（秒）")
+    p.add_argument("--questions", type=int, default=2000)
+    a = p.parse_args()
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    install_bank(make_bank(a.questions))
+    quiz._index_banks()
+    with MockUpstream(chunks=3, first_delay=a.hold) as up:
+        quiz._ai_client = OpenAI(api_key="x", base_url=up.base_url, max_retries=0)
+        quiz._ai_model = "mock"
+        for name, start in (("werkzeug", _start_werkzeug), ("asyncio", _start_gateway)):
+            _run(name, start, up, a.streams, a.hold)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""JSON 后端基准：对比 Flask 默认 provider、标准库（UTF-8 输出）与 orjson。
+
+用法：
+  python benchmarks/bench_json_provider.py
+  python benchmarks/bench_json_provider.py --questions 20000 --repeat 20
+
+对每个后端分别测量最大的几个接口的单次请求耗时（wall）与 CPU 时间：
+  - quiz  /api/exam/join     整卷 jsonify（练习模式分享，200 道大题）
+  - quiz  首次全库加载        预序列化全部小题片段（flat_json）+ 输出响应
+  - quiz  /api/info           题库统计
+  - editor /api/questions    列表页（每页 100 条）
+"""
+from __future__ import annotations
+
+import argparse
+import statistics
+import time
+from pathlib import Path
+
+from flask.json.provider import DefaultJSONProvider
+
+from bench_quiz_questions import install_bank, make_bank
+from med_exam_toolkit import editor, quiz
+from med_exam_toolkit.json_provider import HAS_ORJSON, install_json_provider
+
+_HEADERS = {"X-Session-Token": "bench"}
+
+
+def _measure(fn, repeat: int) -> tuple[list[float], list[float]]:
+    wall, cpu = [], []
+    for _ in range(repeat):
+        w0, c0 = time.perf_counter(), time.process_time()
+        fn()
+        wall.append((time.perf_counter() - w0) * 1000)
+        cpu.append((time.process_time() - c0) * 1000)
+    return wall, cpu
+
+
+def _use_backend(name: str) -> None:
+    for app in (quiz.app, editor.app):
+        if name == "flask-default":
+            app.json = DefaultJSONProvider(app)
+        else:
+            install_json_provider(app, name)
+
+
+def _cases(questions, repeat: int) -> dict:
+    qc = quiz.app.test_client()
+    ec = editor.app.test_client()
+    fps = [q.fingerprint for q in questions[:200]]
+    token = qc.post("/api/exam/share?bank=0", headers=_HEADERS,
+                    json={"fingerprints": fps, "mode": "practice"}).get_json()["token"]
+
+    def exam_join():
+        r = qc.get(f"/api/exam/join?token={token}", headers=_HEADERS)
+        assert r.status_code == 200, r.status_code
+        r.get_data()
+
+    def cold_full_bank():
+        # 每次换一个新的 BankState，模拟服务启动后的首次全库请求
+        install_bank(questions)
+        quiz._selection_cache.clear()
+        r = qc.get("/api/questions?bank=0", headers=_HEADERS)
+        assert r.status_code == 200, r.status_code
+        r.get_data()
+
+    def info():
+        quiz._resp_cache.clear()
+        r = qc.get("/api/info?bank=0", headers=_HEADERS)
+        assert r.status_code == 200, r.status_code
+        r.get_data()
+
+    def editor_list():
+        r = ec.get("/api/questions?page=1&per_page=100", headers=_HEADERS)
+        assert r.status_code == 200, r.status_code
+        r.get_data()
+
+    return {
+        "exam/join": (exam_join, repeat),
+        "首次全库": (cold_full_bank, max(1, repeat // 5)),
+        "info": (info, repeat),
+        "editor 列表": (editor_list, repeat),
+    }
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--questions", type=int, default=10000)
+    p.add_argument("--repeat", type=int, default=20)
+    a = p.parse_args()
+
+    questions = make_bank(a.questions)
+    install_bank(questions)
+    editor._questions = questions
+    editor._pin_enabled = False
+    editor._session_token = "bench"
+    editor._RATE_LIMIT = 10 ** 9
+
+    backends = ["flask-default", "json"] + (["orjson"] if HAS_ORJSON else [])
+    if not HAS_ORJSON:
+        print("[WARN] 未安装 orjson，仅对比标准库")
+    for name in backends:
+        _use_backend(name)
+        print(f"── {name} ──")
+        for case, (fn, repeat) in _cases(questions, a.repeat).items():
+            fn()   # 预热
+            wall, cpu = _measure(fn, repeat)
+            print(f"  {case:<10} wall={statistics.median(wall):8.2f} ms  "
+                  f"cpu={statistics.median(cpu):8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""progress.py 微基准：连接开销与批量同步吞吐。
+
+用法：
+  python benchmarks/bench_progress.py
+  python benchmarks/bench_progress.py --calls 5000 --sync-sessions 200 --sync-items 100
+
+1. 对比两种打开方式下同一只读查询（get_sync_status）的单次耗时：
+   - 逐次建连：每次调用 sqlite3.connect + 设置 PRAGMA（连接池之前的实现）
+   - 连接池：  progress._open 复用连接与语句缓存
+2. 离线同步：record_sessions_batch 一次提交多条会话，报告 attempts 行/秒
+   （一半指纹已有 SM-2 记录，另一半为新题）。
+3. 重度用户读接口：单个用户数万条 attempts 时错题本 / 统计页的单次耗时。
+4. 集中交卷：N 个线程同时各写一条会话，对比各自开写事务（record_session）
+   与单写线程组提交（submit_session）的吞吐、失败数和写线程指标。
+5. 清理不活跃用户：逐个 clear_user_data 与 cleanup_stale_users（经写线程分块删除）
+   的总耗时，以及清理期间在线写入（submit_session）的 p99 / 最大延迟。
+"""
+from __future__ import annotations
+
+import argparse
+import concurrent.futures
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from med_exam_toolkit import progress
+
+
+@contextmanager
+def _open_unpooled(db_path: Path):
+    """连接池之前的 _open：每次新建连接。"""
+    with sqlite3.connect(str(db_path), check_same_thread=False) as c:
+        c.row_factory = sqlite3.Row
+        c.execute("PRAGMA journal_mode=WAL")
+        c.execute("PRAGMA foreign_keys=ON")
+        yield c
+
+
+def _seed(db: Path, users: int = 50, sessions: int = 20) -> None:
+    progress.init_db(db)
+    for u in range(users):
+        for s in range(sessions):
+            progress.record_session(db, {
+                "id": f"s{s}", "mode": "practice", "total": 10, "correct": 7,
+                "items": [{"fingerprint": f"fp{u}-{s}-{i}", "result": i % 2} for i in range(10)],
+            }, user_id=f"u{u}")
+
+
+def _time_calls(db: Path, calls: int) -> list[float]:
+    samples = []
+    for i in range(calls):
+        t0 = time.perf_counter()
+        progress.get_sync_status(db, f"u{i % 50}")
+        samples.append((time.perf_counter() - t0) * 1e6)
+    return samples
+
+
+def _bench_sync(db: Path, sessions: int, items: int) -> None:
+    # 先让一半指纹存在 SM-2 记录，模拟老用户的增量同步
+    progress.record_sessions_batch(db, [{
+        "id": "warm", "items": [{"fingerprint": f"sync{i}", "result": 1}
+                                for i in range(0, sessions * items, 2)],
+    }], user_id="sync")
+    batch = [{
+        "id": f"sync-{s}", "mode": "practice", "date": "2026-01-01",
+        "items": [{"fingerprint": f"sync{(s * items + i) % (sessions * items)}",
+                   "result": (s + i) % 3 - 1} for i in range(items)],
+    } for s in range(sessions)]
+    t0 = time.perf_counter()
+    r = progress.record_sessions_batch(db, batch, user_id="sync")
+    dt = time.perf_counter() - t0
+    rows = len(r["processed"]) * items
+    print(f"批量同步 {len(r['processed'])} 会话 / {rows} 行: {dt * 1000:8.1f} ms  "
+          f"{rows / dt:10.0f} 行/秒")
+
+
+def _bench_reads(db: Path, attempts: int) -> None:
+    per = 100
+    progress.record_sessions_batch(db, [{
+        "id": f"heavy-{s}", "date": "2026-01-01",
+        "items": [{"fingerprint": f"h{(s * 37 + i) % 3000}", "result": (s + i) % 3 - 1,
+                   "unit": f"第{i % 20}章"} for i in range(per)],
+    } for s in range(attempts // per)], user_id="heavy")
+    for name, fn in (("错题本", progress.get_wrong_fingerprints),
+                     ("单元统计", progress.get_unit_stats),
+                     ("总览", progress.get_overall_stats),
+                     ("到期列表", progress.get_due_fingerprints),
+                     ("到期首页", lambda db, u: progress.get_due_page(db, u, limit=50)),
+                     ("到期数", progress.get_due_count)):
+        fn(db, "heavy")
+        s = []
+        for _ in range(20):
+            t0 = time.perf_counter()
+            fn(db, "heavy")
+            s.append((time.perf_counter() - t0) * 1000)
+        print(f"重度用户({attempts} 条) {name:<4} median={statistics.median(s):8.2f} ms")
+
+
+def _bench_burst(db: Path, clients: int, items: int) -> None:
+    def one(fn, i: int, tag: str):
+        try:
+            fn(db, {"id": f"{tag}-{i}", "mode": "exam", "total": items,
+                    "items": [{"fingerprint": f"burst{j}", "result": (i + j) % 2}
+                              for j in range(items)]}, f"stu{i}")
+            return None
+        except Exception as e:
+            return type(e).__name__
+
+    for name, fn in (("各自写事务", progress.record_session),
+                     ("单写线程", progress.submit_session)):
+        with concurrent.futures.ThreadPoolExecutor(clients) as ex:
+            t0 = time.perf_counter()
+            errs = [e for e in ex.map(lambda i: one(fn, i, name), range(clients)) if e]
+            dt = time.perf_counter() - t0
+        print(f"集中交卷 {name:<6} {clients} 并发: {dt * 1000:8.1f} ms  "
+              f"{clients / dt:8.0f} 会话/秒  失败 {len(errs)}")
+    st = progress.writer_stats(db)[str(db)]
+    print(f"  写线程: {st['commits']} 次提交 平均每组 {st['avg_group']} 条  "
+          f"提交 p95={st['commit_ms_p95']} ms  确认 p95={st['ack_ms_p95']} ms")
+    progress.close_writers()
+
+
+def _cleanup_per_user(db: Path, days: int) -> None:
+    """分块清理之前的实现：扫描全部作答历史，再逐个用户 clear_user_data。"""
+    cutoff = int((time.time() - days * 86400) * 1000)
+    with progress._open(db) as c:
+        stale = [r[0] for r in c.execute(
+            """SELECT user_id FROM (SELECT user_id, ts FROM sessions
+                                    UNION ALL SELECT user_id, ts FROM attempts)
+               GROUP BY user_id HAVING MAX(ts) < ?""", (cutoff,))]
+    for uid in stale:
+        progress.clear_user_data(db, uid)
+
+
+def _bench_cleanup(tmp: Path, users: int, sessions: int) -> None:
+    base = tmp / "cleanup.progress.db"
+    progress.init_db(base)
+    with progress._open(base) as c:
+        for u in range(users):
+            progress._record_batch(c, [
+                {"id": f"s{s}", "items": [{"fingerprint": f"fp{i}", "result": i % 2}
+                                          for i in range(15)]}
+                for s in range(sessions)], f"anon{u}")
+        for table, cols in (("sessions", ("ts",)), ("attempts", ("ts",)),
+                            ("user_question_stats", ("last_ts", "first_seen"))):
+            c.execute(f"UPDATE {table} SET "
+                      + ", ".join(f"{x} = {x} - {30 * 86400 * 1000}" for x in cols))
+    progress.close_connections(base)
+
+    def full(db):
+        while progress.cleanup_stale_users(db, 7)["remaining"]:
+            pass
+
+    for name, fn in (("逐个用户", lambda db: _cleanup_per_user(db, 7)), ("分块删除", full)):
+        db = tmp / f"cleanup-{fn is full}.progress.db"
+        shutil.copy(base, db)
+        lat, stop = [], threading.Event()
+
+        def live():
+            i = 0
+            while not stop.is_set():
+                t0 = time.perf_counter()
+                progress.submit_session(db, {"id": f"live{i}", "items": [
+                    {"fingerprint": "live", "result": 1}]}, "live")
+                lat.append((time.perf_counter() - t0) * 1000)
+                i += 1
+                time.sleep(0.005)
+
+        th = threading.Thread(target=live)
+        th.start()
+        t0 = time.perf_counter()
+        fn(db)
+        dt = time.perf_counter() - t0
+        stop.set()
+        th.join()
+        progress.close_writers()
+        lat.sort()
+        print(f"清理 {users} 用户 × {sessions * 15} 行 {name}: {dt * 1000:8.1f} ms  "
+              f"在线写入 {len(lat)} 次 p99={lat[int(len(lat) * 0.99)]:6.1f} ms "
+              f"max={lat[-1]:6.1f} ms")
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--calls", type=int, default=2000)
+    p.add_argument("--sync-sessions", type=int, default=200)
+    p.add_argument("--sync-items", type=int, default=100)
+    p.add_argument("--clients", type=int, default=200)
+    p.add_argument("--heavy", type=int, default=50000, help="重度用户的 attempts 条数")
+    p.add_argument("--stale-users", type=int, default=60, help="待清理的不活跃用户数")
+    p.add_argument("--stale-sessions", type=int, default=200, help="每个不活跃用户的会话数")
+    a = p.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Path(tmp) / "bench.progress.db"
+        _seed(db)
+
+        pooled_open = progress._open
+        for name, opener in (("逐次建连", _open_unpooled), ("连接池", pooled_open)):
+            progress._open = opener
+            try:
+                _time_calls(db, 50)   # 预热
+                s = _time_calls(db, a.calls)
+            finally:
+                progress._open = pooled_open
+            print(f"{name:<6} median={statistics.median(s):8.1f} µs  "
+                  f"p95={sorted(s)[int(len(s) * 0.95)]:8.1f} µs")
+        _bench_sync(db, a.sync_sessions, a.sync_items)
+        _bench_reads(db, a.heavy)
+        _bench_burst(db, a.clients, 100)
+        _bench_cleanup(Path(tmp), a.stale_users, a.stale_sessions)
+        progress.close_connections()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""/api/questions 延迟基准：合成一个大题库，测量「全库练习」请求的耗时。
+
+用法：
+  python benchmarks/bench_quiz_questions.py
+  python benchmarks/bench_quiz_questions.py --questions 20000 --repeat 20
+
+脚本直接在进程内用 Flask test_client 发请求，不经过网络栈，
+测得的是服务端「筛选 + 展开 + 序列化」的纯 CPU 时间。
+"""
+from __future__ import annotations
+
+import argparse
+import random
+import statistics
+import time
+from pathlib import Path
+
+from med_exam_toolkit import quiz
+from med_exam_toolkit.models import Question, SubQuestion
+
+_MODES = ["A1型题", "A2型题", "A3/A4型题", "B1型题"]
+
+
+def make_bank(n: int, seed: int = 0) -> list[Question]:
+    rng = random.Random(seed)
+    questions = []
+    for i in range(n):
+        mode = _MODES[i % len(_MODES)]
+        n_sub = 1 if mode in ("A1型题", "A2型题") else rng.randint(2, 4)
+        opts = [f"{c}.选项内容{c}{i}" for c in "ABCDE"]
+        subs = [
+            SubQuestion(
+                text=f"第{i}题第{j}小题：以下关于该疾病的描述正确的是",
+                options=[] if mode == "B1型题" else opts,
+                answer=rng.choice("ABCDE"),
+                rate=f"{rng.randint(10, 99)}%",
+                discuss="本题考查相关知识点，解析文字。" * 4,
+                point="考点",
+            )
+            for j in range(n_sub)
+        ]
+        questions.append(Question(
+            fingerprint=f"fp{i:08d}",
+            mode=mode,
+            unit=f"第{i % 30}章",
+            cls="基准题库",
+            stem="共享题干" * 10 if n_sub > 1 else "",
+            shared_options=opts if mode == "B1型题" else [],
+            sub_questions=subs,
+        ))
+    return questions
+
+
+def install_bank(questions: list[Question]) -> None:
+    """把合成题库装进 quiz 模块的全局状态，并关闭鉴权/限流。"""
+    quiz._banks = [quiz.BankState(bank_path=Path("bench.mqb"), password=None,
+                                  questions=questions)]
+    quiz._pin_enabled = False
+    quiz._session_token = "bench"
+    quiz._RATE_LIMIT = 10 ** 9
+
+
+def timed_get(client, url: str, repeat: int, etag: str | None = None) -> list[float]:
+    headers = {"X-Session-Token": "bench"}
+    if etag:
+        headers["If-None-Match"] = f'"{etag}"'
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        resp = client.get(url, headers=headers)
+        resp.get_data()
+        samples.append((time.perf_counter() - t0) * 1000)
+        assert resp.status_code == (304 if etag else 200), resp.status_code
+    return samples
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--questions", type=int, default=10000)
+    p.add_argument("--repeat", type=int, default=10)
+    a = p.parse_args()
+
+    install_bank(make_bank(a.questions))
+    client = quiz.app.test_client()
+
+    cases = {
+        "全库顺序":   "/api/questions?bank=0",
+        "全库乱序":   "/api/questions?bank=0&shuffle=1&seed=42",
+        "抽 100 题":  "/api/questions?bank=0&shuffle=1&seed=42&limit=100",
+        "按章节+难度": "/api/questions?bank=0&shuffle=1&seed=42"
+                      "&per_unit=%7B%22%E7%AC%AC3%E7%AB%A0%22%3A20%7D"
+                      "&difficulty=%7B%22easy%22%3A1%2C%22hard%22%3A1%7D",
+    }
+    # 预热一次（懒加载缓存、模板等）
+    timed_get(client, cases["全库顺序"], 1)
+    for name, url in cases.items():
+        s = timed_get(client, url, a.repeat)
+        print(f"{name:<8} median={statistics.median(s):8.1f} ms  "
+              f"min={min(s):8.1f} ms  max={max(s):8.1f} ms")
+
+    # 带 If-None-Match 的重复加载（PWA 再次打开时的情形）
+    etag = client.get(cases["全库顺序"], headers={"X-Session-Token": "bench"}).get_etag()[0]
+    s = timed_get(client, cases["全库顺序"], a.repeat, etag=etag.split(":")[0])
+    print(f"{'全库 304':<8} median={statistics.median(s):8.1f} ms  "
+          f"min={min(s):8.1f} ms  max={max(s):8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
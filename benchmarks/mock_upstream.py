@@ -0,0 +1,230 @@
+"""本地模拟上游：OpenAI 兼容的流式 chat 接口 + DashScope 实时语音识别 WebSocket
+
+用于测试和压测 quiz 的 AI / ASR 代理与 enrich，不连真实服务、不消耗 token（不随包发布）：
+
+  POST /v1/chat/completions   stream=true 时按 OpenAI SSE 格式逐块返回；
+                              first_delay 秒后才发第一块，模拟长时间挂起的流；
+                              同时进行的流超过 max_streams 时回 429（模拟 provider 限流）；
+                              非流式请求同样计入名额，first_delay 秒后返回整段结果
+  WS   /ws                    DashScope 协议：run-task → task-started，每收到一帧音频
+                              回一条 result-generated，finish-task → task-finished
+
+用法：
+    with MockUpstream(chunks=5) as up:
+        client = OpenAI(api_key="x", base_url=up.base_url)   # up.ws_url 给 ASR 用
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import threading
+import time
+
+import h11
+from wsproto import ConnectionType, WSConnection
+from wsproto.events import AcceptConnection, Request
+
+from med_exam_toolkit.gateway import WebSocket
+
+
+class MockUpstream:
+    def __init__(self, chunks: int = 3, chunk_delay: float = 0.0,
+                 first_delay: float = 0.0, text: str = "答案", max_streams: int = 0,
+                 retry_after: float = 1.0) -> None:
+        self.chunks = chunks
+        self.chunk_delay = chunk_delay
+        self.first_delay = first_delay
+        self.text = text
+        self.max_streams = max_streams       # 0 = 不限
+        self.retry_after = retry_after       # 429 响应的 Retry-After 秒数
+        self.requests: list[dict] = []       # 收到的 chat 请求体
+        self.open_streams = 0                # 当前未结束的 chat 流
+        self.peak_streams = 0
+        self.rejected = 0                    # 回了 429 的请求数
+        self.audio_frames = 0
+        self.port = 0
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._ready = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    @property
+    def ws_url(self) -> str:
+        return f"ws://127.0.0.1:{self.port}/ws"
+
+    # ── 启停（独立线程里的事件循环，同步 / 异步客户端都能连）──────────
+    def start(self) -> "MockUpstream":
+        self._thread = threading.Thread(target=self._run, name="mock-upstream", daemon=True)
+        self._thread.start()
+        self._ready.wait(5)
+        return self
+
+    def stop(self) -> None:
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+        if self._thread is not None:
+            self._thread.join(5)
+
+    def __enter__(self) -> "MockUpstream":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def _run(self) -> None:
+        asyncio.run(self._main())
+
+    async def _main(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        server = await asyncio.start_server(self._handle, "127.0.0.1", 0, backlog=4096)
+        self.port = server.sockets[0].getsockname()[1]
+        self._ready.set()
+        async with server:
+            await self._stop.wait()
+
+    # ── HTTP ────────────────────────────────────────────────────
+    async def _handle(self, reader, writer) -> None:
+        conn = h11.Connection(h11.SERVER)
+        try:
+            req, body = None, b""
+            while True:
+                event = conn.next_event()
+                if event is h11.NEED_DATA:
+                    data = await reader.read(65536)
+                    if not data:
+                        return
+                    conn.receive_data(data)
+                elif isinstance(event, h11.Request):
+                    req = event
+                elif isinstance(event, h11.Data):
+                    body += event.data
+                elif isinstance(event, h11.EndOfMessage) or event is h11.PAUSED:
+                    break
+                else:
+                    return
+            if req.target.startswith(b"/ws"):
+                await self._websocket(req, conn.trailing_data[0], reader, writer)
+            else:
+                await self._chat(conn, json.loads(body or b"{}"), writer)
+        except (ConnectionError, h11.RemoteProtocolError):
+            pass
+        finally:
+            writer.close()
+
+    async def _chat(self, conn, payload: dict, writer) -> None:
+        self.requests.append(payload)
+        model = payload.get("model", "mock")
+        if self.max_streams and self.open_streams >= self.max_streams:
+            self.rejected += 1
+            body = json.dumps({"error": {"message": "Rate limit reached", "type": "rate_limit_error",
+                                         "code": "rate_limit_exceeded"}}).encode()
+            writer.write(conn.send(h11.Response(status_code=429, headers=[
+                ("Content-Type", "application/json"), ("Content-Length", str(len(body))),
+                ("Retry-After", f"{self.retry_after:g}")])))
+            writer.write(conn.send(h11.Data(data=body)) + conn.send(h11.EndOfMessage()))
+            await writer.drain()
+            return
+
+        if not payload.get("stream"):
+            await self._complete(conn, model, writer)
+            return
+
+        writer.write(conn.send(h11.Response(status_code=200, headers=[
+            ("Content-Type", "text/event-stream"), ("Cache-Control", "no-cache")])))
+        await writer.drain()
+        self.open_streams += 1
+        self.peak_streams = max(self.peak_streams, self.open_streams)
+        try:
+            if self.first_delay:
+                await asyncio.sleep(self.first_delay)
+            for i in range(self.chunks):
+                if i and self.chunk_delay:
+                    await asyncio.sleep(self.chunk_delay)
+                await self._sse(conn, writer, _chunk(model, {"content": self.text}, None))
+            await self._sse(conn, writer, _chunk(model, {}, "stop"))
+            writer.write(conn.send(h11.Data(data=b"data: [DONE]\n\n")))
+            writer.write(conn.send(h11.EndOfMessage()))
+            await writer.drain()
+        finally:
+            self.open_streams -= 1
+
+    async def _complete(self, conn, model: str, writer) -> None:
+        """非流式：同样占一个名额，first_delay 秒后一次性返回整段文本。"""
+        self.open_streams += 1
+        self.peak_streams = max(self.peak_streams, self.open_streams)
+        try:
+            if self.first_delay:
+                await asyncio.sleep(self.first_delay)
+        finally:
+            self.open_streams -= 1
+        body = json.dumps(_completion(model, self.text * self.chunks)).encode()
+        writer.write(conn.send(h11.Response(status_code=200, headers=[
+            ("Content-Type", "application/json"), ("Content-Length", str(len(body)))])))
+        writer.write(conn.send(h11.Data(data=body)) + conn.send(h11.EndOfMessage()))
+        await writer.drain()
+
+    @staticmethod
+    async def _sse(conn, writer, obj: dict) -> None:
+        writer.write(conn.send(h11.Data(data=f"data: {json.dumps(obj)}\n\n".encode())))
+        await writer.drain()
+
+    # ── DashScope ASR ────────────────────────────────────────────
+    async def _websocket(self, req, pending: bytes, reader, writer) -> None:
+        raw = b"%s %s HTTP/1.1\r\n" % (req.method, req.target)
+        raw += b"".join(b"%s: %s\r\n" % (k, v) for k, v in req.headers) + b"\r\n"
+        ws_conn = WSConnection(ConnectionType.SERVER)
+        ws_conn.receive_data(raw)
+        if not any(isinstance(e, Request) for e in ws_conn.events()):
+            return
+        writer.write(ws_conn.send(AcceptConnection()))
+        await writer.drain()
+        ws = WebSocket(reader, writer, ws_conn, pending=pending)
+        task_id, frames = "", 0
+        try:
+            while True:
+                msg = await ws.receive()
+                if msg is None:
+                    return
+                if isinstance(msg, bytes):
+                    frames += 1
+                    self.audio_frames += 1
+                    await ws.send(_asr_event(task_id, "result-generated",
+                                             {"output": {"sentence": {"text": f"{self.text}{frames}"}}}))
+                    continue
+                action = json.loads(msg).get("header", {}).get("action")
+                if action == "run-task":
+                    task_id = json.loads(msg)["header"]["task_id"]
+                    await ws.send(_asr_event(task_id, "task-started", {}))
+                elif action == "finish-task":
+                    await ws.send(_asr_event(task_id, "result-generated",
+                                             {"output": {"sentence": {"text": f"{self.text}完"}}}))
+                    await ws.send(_asr_event(task_id, "task-finished", {}))
+                    return
+        finally:
+            await ws.close()
+
+
+def _chunk(model: str, delta: dict, finish: str | None) -> dict:
+    return {
+        "id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+    }
+
+
+def _completion(model: str, text: str) -> dict:
+    return {
+        "id": "chatcmpl-mock", "object": "chat.completion", "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "finish_reason": "stop",
+                     "message": {"role": "assistant", "content": text}}],
+        "usage": {"prompt_tokens": 10, "completion_tokens": len(text), "total_tokens": 10 + len(text)},
+    }
+
+
+def _asr_event(task_id: str, event: str, payload: dict) -> str:
+    return json.dumps({"header": {"task_id": task_id, "event": event}, "payload": payload})
@@ -0,0 +1,191 @@
+"""AI 答疑首轮回答缓存（按 prompt 内容寻址）
+
+同一道题、同一个选择，build_ai_chat_prompt 生成的首轮 prompt 完全相同，
+热门错题会被反复解析上百次。ChatCache 把完整生成过的首轮回答存进 SQLite：
+
+  键      (prompt_hash, model)；prompt_hash 覆盖 messages、max_tokens 与思考开关
+  过期    created_at 超过 ttl 的条目视为未命中，写入时顺带删除
+  容量    条目数超过 max_entries 时按最近命中时间淘汰最旧的
+  统计    hits / misses / tokens_saved 累计在库里，多个 worker 共享同一个文件
+
+用法：
+    cache = ChatCache("ai_chat_cache.db", ttl=30 * 86400, max_entries=5000)
+    key = prompt_key(messages, max_tokens=2048, thinking=None)
+    entry = cache.get(key, model)            # CachedAnswer | None
+    cache.put(key, model, content, reasoning, truncated=False, tokens=1800)
+    for ev in replay_events(entry, 24): ...  # 与 chat_completion_stream 相同格式的事件
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Iterator, NamedTuple
+
+_DDL = """
+CREATE TABLE IF NOT EXISTS chat_cache (
+    prompt_hash TEXT    NOT NULL,
+    model       TEXT    NOT NULL,
+    content     TEXT    NOT NULL,
+    reasoning   TEXT    NOT NULL DEFAULT '',
+    truncated   INTEGER NOT NULL DEFAULT 0,
+    tokens      INTEGER NOT NULL DEFAULT 0,    -- 生成一次的估算 token（输入 + 输出），命中即省下
+    created_at  REAL    NOT NULL,
+    last_hit    REAL    NOT NULL,
+    hits        INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (prompt_hash, model)
+);
+CREATE INDEX IF NOT EXISTS idx_chat_cache_last_hit ON chat_cache(last_hit);
+CREATE TABLE IF NOT EXISTS chat_cache_stats (
+    name  TEXT PRIMARY KEY,
+    value INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+class CachedAnswer(NamedTuple):
+    content:   str
+    reasoning: str
+    truncated: bool
+    tokens:    int
+
+
+def default_cache_path(bank_path: Path | str) -> Path:
+    """默认缓存文件：题库旁的 ai_chat_cache.db（quiz 取第一个题库，ai-warm 取 --bank）。"""
+    return Path(bank_path).with_name("ai_chat_cache.db")
+
+
+def prompt_key(messages: list[dict], max_tokens: int, thinking: bool | None) -> str:
+    """首轮 prompt 的内容哈希；在线答疑与 ai-warm 预生成必须用同一个函数。"""
+    raw = json.dumps({"messages": messages, "max_tokens": max_tokens, "thinking": thinking},
+                     ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def replay_events(entry: CachedAnswer, chunk_chars: int) -> Iterator[dict]:
+    """把缓存的回答切成小块，产出与 chat_completion_stream 相同的事件 dict。"""
+    for field in ("reasoning", "content"):
+        text = getattr(entry, field)
+        for i in range(0, len(text), chunk_chars):
+            piece = text[i:i + chunk_chars]
+            yield {"content": piece if field == "content" else "",
+                   "reasoning": piece if field == "reasoning" else ""}
+    if entry.truncated:
+        yield {"truncated": True}
+    yield {"done": True}
+
+
+class ChatCache:
+    """多进程共享的 SQLite 缓存：每个进程的每个线程各持一个连接（同 state.SQLiteStore）。"""
+
+    def __init__(self, path: Path | str, ttl: float = 30 * 86400, max_entries: int = 5000) -> None:
+        self.path = os.fspath(path)
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self._local = threading.local()
+        self._conn().executescript(_DDL)
+
+    def _conn(self) -> sqlite3.Connection:
+        local = self._local
+        # fork 出的子进程不能沿用父进程的连接
+        if getattr(local, "pid", None) != os.getpid():
+            c = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            c.execute("PRAGMA journal_mode=WAL")
+            c.execute("PRAGMA synchronous=NORMAL")
+            c.execute("PRAGMA busy_timeout=10000")
+            local.conn, local.pid = c, os.getpid()
+        return local.conn
+
+    def _write(self, fn):
+        c = self._conn()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(c)
+            c.execute("COMMIT")
+        except BaseException:
+            c.execute("ROLLBACK")
+            raise
+        return result
+
+    @staticmethod
+    def _bump(c, **counters: int) -> None:
+        for name, n in counters.items():
+            c.execute("""INSERT INTO chat_cache_stats(name, value) VALUES (?, ?)
+                         ON CONFLICT(name) DO UPDATE SET value = value + excluded.value""",
+                      (name, n))
+
+    # ── 读写 ─────────────────────────────────────────────────────
+    def get(self, key: str, model: str) -> CachedAnswer | None:
+        """查缓存并记一次命中 / 未命中；过期条目视为未命中。"""
+        now = time.time()
+
+        def _get(c):
+            row = c.execute(
+                """SELECT content, reasoning, truncated, tokens FROM chat_cache
+                   WHERE prompt_hash = ? AND model = ? AND created_at > ?""",
+                (key, model, now - self.ttl)).fetchone()
+            if row is None:
+                self._bump(c, misses=1)
+                return None
+            c.execute("""UPDATE chat_cache SET hits = hits + 1, last_hit = ?
+                         WHERE prompt_hash = ? AND model = ?""", (now, key, model))
+            self._bump(c, hits=1, tokens_saved=row[3])
+            return CachedAnswer(row[0], row[1], bool(row[2]), row[3])
+
+        return self._write(_get)
+
+    def contains(self, key: str, model: str) -> bool:
+        """只判断是否有未过期的条目，不计入统计（ai-warm 跳过已缓存的题用）。"""
+        row = self._conn().execute(
+            "SELECT 1 FROM chat_cache WHERE prompt_hash = ? AND model = ? AND created_at > ?",
+            (key, model, time.time() - self.ttl)).fetchone()
+        return row is not None
+
+    def put(self, key: str, model: str, content: str, reasoning: str = "",
+            truncated: bool = False, tokens: int = 0) -> None:
+        """写入一条完整回答，随后清理过期条目并按最近命中时间淘汰超出容量的部分。"""
+        now = time.time()
+
+        def _put(c):
+            c.execute(
+                """INSERT INTO chat_cache(prompt_hash, model, content, reasoning, truncated,
+                                          tokens, created_at, last_hit)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(prompt_hash, model) DO UPDATE SET
+                       content = excluded.content, reasoning = excluded.reasoning,
+                       truncated = excluded.truncated, tokens = excluded.tokens,
+                       created_at = excluded.created_at, last_hit = excluded.last_hit""",
+                (key, model, content, reasoning, int(truncated), tokens, now, now))
+            c.execute("DELETE FROM chat_cache WHERE created_at <= ?", (now - self.ttl,))
+            over = c.execute("SELECT COUNT(*) FROM chat_cache").fetchone()[0] - self.max_entries
+            if over > 0:
+                c.execute("""DELETE FROM chat_cache WHERE rowid IN (
+                                 SELECT rowid FROM chat_cache ORDER BY last_hit LIMIT ?)""",
+                          (over,))
+                self._bump(c, evictions=over)
+
+        self._write(_put)
+
+    def stats(self) -> dict:
+        c = self._conn()
+        counters = dict(c.execute("SELECT name, value FROM chat_cache_stats").fetchall())
+        entries = c.execute("SELECT COUNT(*) FROM chat_cache").fetchone()[0]
+        hits, misses = counters.get("hits", 0), counters.get("misses", 0)
+        return {
+            "entries":      entries,
+            "hits":         hits,
+            "misses":       misses,
+            "hit_rate":     round(hits / (hits + misses), 3) if hits + misses else 0.0,
+            "tokens_saved": counters.get("tokens_saved", 0),
+            "evictions":    counters.get("evictions", 0),
+        }
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and getattr(self._local, "pid", None) == os.getpid():
+            conn.close()
+            self._local.pid = None
@@ -1,4 +1,13 @@
-"""断点续传管理"""
+"""断点续传管理
+
+磁盘上两个文件：
+  {tag}.ckpt.json   快照：{"meta": ..., "completed": {id: result}}，原子 rename 写入
+  {tag}.ckpt.jsonl  日志：每完成一条追加一行 {"id": ..., "result": ...}
+
+done() 只追加一行并写入内核缓冲区，每 _FSYNC_EVERY 条或 _FSYNC_INTERVAL 秒 fsync 一次；
+日志条数超过快照条数（且不少于 _COMPACT_MIN）时把全部结果合并进快照并清空日志，
+总写盘量与完成条数成线性关系。load() 先读快照再按顺序重放日志，末尾写了一半的行截掉。
+"""
 from __future__ import annotations
 
 import json
@@ -6,6 +15,7 @@ import logging
 import os
 import tempfile
 import threading
+import time
 from datetime import datetime, timezone
 from pathlib import Path
 from typing import Any, Callable, Generator, Iterable, TypeVar
@@ -17,6 +27,10 @@ T = TypeVar("T")
 class Checkpoint:
 
     _EXT = ".ckpt.json"
+    _JOURNAL_EXT = ".ckpt.jsonl"
+    _FSYNC_EVERY    = 256     # 累计多少条 fsync 一次
+    _FSYNC_INTERVAL = 1.0     # 距上次 fsync 超过多少秒也会 fsync
+    _COMPACT_MIN    = 1000    # 日志少于此条数时不合并
 
     def __init__(
         self,
@@ -33,11 +47,22 @@ class Checkpoint:
         self._completed: dict[str, Any] = {}   # id → result（None 表示调用失败）
         self._meta: dict[str, str]      = {}
 
+        # 日志状态
+        self._journal = None                   # 追加写的文件对象，首次 done() 时打开
+        self._journal_lines = 0                # 快照之后日志里的条数
+        self._snapshot_size = 0                # 快照里的条数
+        self._unsynced      = 0
+        self._synced_at     = 0.0
+
     # ── 文件路径 ────────────────────────────────────────
     @property
     def path(self) -> Path:
         return self.checkpoint_dir / f"{self.tag}{self._EXT}"
 
+    @property
+    def journal_path(self) -> Path:
+        return self.checkpoint_dir / f"{self.tag}{self._JOURNAL_EXT}"
+
     # ── 公开属性 ────────────────────────────────────────
     @property
     def results(self) -> dict[str, Any]:
@@ -46,27 +71,60 @@ class Checkpoint:
 
     # ── 加载 ────────────────────────────────────────────
     def load(self) -> int:
-        if not self.path.exists():
-            logger.debug("断点文件不存在，全新开始: %s", self.path)
-            return 0
-
-        try:
-            raw = json.loads(self.path.read_text(encoding="utf-8"))
-            self._completed = raw.get("completed", {})
-            self._meta      = raw.get("meta", {})
+        with self._lock:
+            self._close_journal()
+            self._completed = {}
+            self._meta      = {}
+            self._snapshot_size = self._journal_lines = 0
+            if self.path.exists():
+                try:
+                    raw = json.loads(self.path.read_text(encoding="utf-8"))
+                    self._completed = raw.get("completed", {})
+                    self._meta      = raw.get("meta", {})
+                    self._snapshot_size = len(self._completed)
+                except (json.JSONDecodeError, OSError) as exc:
+                    logger.warning("断点文件损坏，忽略并重新开始: %s (%s)", self.path, exc)
+                    self._completed = {}
+            replayed = self._replay()
             count = len(self._completed)
-            logger.info("断点恢复: 已完成 %d 条  文件=%s", count, self.path)
+            if not count and not replayed:
+                logger.debug("断点文件不存在，全新开始: %s", self.path)
+                return 0
+            logger.info("断点恢复: 已完成 %d 条（日志重放 %d 条）  文件=%s",
+                        count, replayed, self.path)
             return count
-        except (json.JSONDecodeError, OSError) as exc:
-            logger.warning("断点文件损坏，忽略并重新开始: %s (%s)", self.path, exc)
-            self._completed = {}
+
+    def _replay(self) -> int:
+        """按顺序重放日志。中途崩溃可能留下写了一半的末行：截掉它，之后的追加才能从新行开始。"""
+        if not self.journal_path.exists():
             return 0
+        replayed = 0
+        try:
+            with open(self.journal_path, "rb+") as f:
+                data = f.read()
+                end = data.rfind(b"\n") + 1
+                if end < len(data):
+                    logger.warning("断点日志末行不完整，已截掉: %s", self.journal_path)
+                    f.truncate(end)
+        except OSError as exc:
+            logger.warning("断点日志读取失败: %s (%s)", self.journal_path, exc)
+            return 0
+        for line in data[:end].splitlines():
+            try:
+                entry = json.loads(line)
+                self._completed[entry["id"]] = entry["result"]
+            except (json.JSONDecodeError, UnicodeDecodeError, KeyError, TypeError):
+                logger.warning("断点日志有损坏行，已跳过: %s", self.journal_path)
+                continue
+            replayed += 1
+        self._journal_lines = replayed
+        return replayed
 
     # ── 标记完成 ─────────────────────────────────────────
     def done(self, item_id: str, result: Any) -> None:
         with self._lock:
             self._completed[item_id] = result
-            self._flush()
+            self._append(item_id, result)
 
     # ── 查询 ────────────────────────────────────────────
     def is_done(self, item_id: str) -> bool:
@@ -84,16 +142,63 @@ class Checkpoint:
         if skipped:
             logger.info("断点跳过: %d 条", skipped)
 
+    # ── 关闭 ─────────────────────────────────────────
+    def close(self) -> None:
+        """fsync 并关闭日志文件；之后再 done() 会重新打开。"""
+        with self._lock:
+            self._close_journal()
+
     # ── 清除 ────────────────────────────────────────────
     def clear(self) -> None:
-        if self.path.exists():
-            self.path.unlink()
-            logger.info("断点文件已清除: %s", self.path)
-        self._completed = {}
-        self._meta      = {}
-
-    # ── 私有：原子写盘 ───────────────────────────────────
-    def _flush(self) -> None:
+        with self._lock:
+            self._close_journal()
+            for p in (self.path, self.journal_path):
+                if p.exists():
+                    p.unlink()
+                    logger.info("断点文件已清除: %s", p)
+            self._completed = {}
+            self._meta      = {}
+            self._snapshot_size = self._journal_lines = 0
+
+    # ── 私有：追加日志 ───────────────────────────────────
+    def _append(self, item_id: str, result: Any) -> None:
+        try:
+            if self._journal is None:
+                self.checkpoint_dir.mkdir(parents=True, exist_ok=True)
+                self._journal = open(self.journal_path, "a", encoding="utf-8")
+                self._synced_at = time.monotonic()
+            self._journal.write(json.dumps({"id": item_id, "result": result},
+                                           ensure_ascii=False, separators=(",", ":")) + "\n")
+            self._journal.flush()           # 进入内核缓冲区：进程崩溃不丢，掉电最多丢一批
+            self._journal_lines += 1
+            self._unsynced += 1
+            if (self._unsynced >= self._FSYNC_EVERY
+                    or time.monotonic() - self._synced_at >= self._FSYNC_INTERVAL):
+                self._fsync()
+            if self._journal_lines >= max(self._COMPACT_MIN, self._snapshot_size):
+                self._compact()
+        except OSError:
+            # 写盘失败不能中断主流程，只记日志
+            logger.exception("断点写盘失败: %s", self.journal_path)
+
+    def _fsync(self) -> None:
+        if self._journal is not None and self._unsynced:
+            os.fsync(self._journal.fileno())
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+
+    def _close_journal(self) -> None:
+        if self._journal is None:
+            return
+        try:
+            self._fsync()
+            self._journal.close()
+        except OSError:
+            logger.exception("断点日志关闭失败: %s", self.journal_path)
+        self._journal = None
+
+    # ── 私有：合并日志进快照（原子写盘） ───────────────────
+    def _compact(self) -> None:
         self.checkpoint_dir.mkdir(parents=True, exist_ok=True)
         payload = {
             "meta": {
@@ -111,10 +216,17 @@ class Checkpoint:
         )
         try:
             with os.fdopen(fd, "w", encoding="utf-8") as f:
-                json.dump(payload, f, ensure_ascii=False, indent=2)
+                json.dump(payload, f, ensure_ascii=False, separators=(",", ":"))
+                f.flush()
+                os.fsync(f.fileno())
             os.replace(tmp_path, self.path)   # 原子 rename
         except OSError:
-            # 写盘失败不能中断主流程，只记日志
             logger.exception("断点写盘失败: %s", self.path)
             if os.path.exists(tmp_path):
                 os.unlink(tmp_path)
+            return
+        # 快照已包含日志里的全部条目，日志从头开始（此前崩溃则重放结果相同）
+        self._close_journal()
+        self.journal_path.unlink(missing_ok=True)
+        self._snapshot_size = len(self._completed)
+        self._journal_lines = 0
@@ -73,12 +73,31 @@ def is_hybrid_thinking_model(model: str) -> bool:
     return any(kw in m for kw in _HYBRID_THINKING_KEYWORDS)
 
 
+def _client_kwargs(provider: str, api_key: str, base_url: str, model: str) -> dict:
+    provider = provider.lower().strip()
+    if provider not in _PROVIDER_BASE_URLS and not base_url:
+        raise ValueError(
+            f"未知 provider: {provider!r}，可选: {list(_PROVIDER_BASE_URLS)}"
+        )
+
+    resolved_base_url = base_url or _PROVIDER_BASE_URLS.get(provider, "")
+    resolved_model    = model    or _PROVIDER_DEFAULT_MODELS.get(provider, "")
+    resolved_key      = api_key  or ("ollama" if provider == "ollama" else "sk-placeholder")
+
+    logger.info(
+        "AI 客户端: provider=%s  model=%s  base_url=%s",
+        provider, resolved_model, resolved_base_url,
+    )
+    return {"api_key": resolved_key, "base_url": resolved_base_url}
+
+
 def make_client(
     provider: str  = "openai",
     api_key:  str  = "",
     base_url: str  = "",
     model:    str  = "",
     timeout:  float = 120.0,
+    max_retries: int = 2,
 ) -> Any:
     try:
         from openai import OpenAI
@@ -87,28 +106,99 @@ def make_client(
             "AI 功能需要安装 openai 包：pip install 'med-exam-toolkit[ai]'"
         )
 
-    provider = provider.lower().strip()
-    if provider not in _PROVIDER_BASE_URLS and not base_url:
-        raise ValueError(
-            f"未知 provider: {provider!r}，可选: {list(_PROVIDER_BASE_URLS)}"
-        )
+    return OpenAI(
+        **_client_kwargs(provider, api_key, base_url, model),
+        timeout     = timeout,
+        max_retries = max_retries,
+    )
 
-    resolved_base_url = base_url or _PROVIDER_BASE_URLS.get(provider, "")
-    resolved_model    = model    or _PROVIDER_DEFAULT_MODELS.get(provider, "")
-    resolved_key      = api_key  or ("ollama" if provider == "ollama" else "sk-placeholder")
 
-    logger.info(
-        "AI 客户端: provider=%s  model=%s  base_url=%s",
-        provider, resolved_model, resolved_base_url,
-    )
+def make_async_client(
+    provider: str  = "openai",
+    api_key:  str  = "",
+    base_url: str  = "",
+    model:    str  = "",
+    timeout:  float = 120.0,
+    max_retries: int = 0,
+) -> Any:
+    """make_client 的异步版本（AsyncOpenAI）。默认不让 SDK 自行重试，
+    由调用方根据 429 / 超时调整并发后再重试。"""
+    try:
+        from openai import AsyncOpenAI
+    except ImportError:
+        raise RuntimeError(
+            "AI 功能需要安装 openai 包：pip install 'med-exam-toolkit[ai]'"
+        )
 
-    return OpenAI(
-        api_key  = resolved_key,
-        base_url = resolved_base_url,
-        timeout  = timeout,
+    return AsyncOpenAI(
+        **_client_kwargs(provider, api_key, base_url, model),
+        timeout     = timeout,
+        max_retries = max_retries,
     )
 
 
+# ── 错误分类 ──
+
+_RETRY_AFTER_MAX = 300.0   # Retry-After 最多等这么久（秒），防止异常值卡死批处理
+
+
+def _retry_after(response: Any) -> float | None:
+    """解析响应头里的 Retry-After（秒或 HTTP 日期）/ retry-after-ms。"""
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    ms = headers.get("retry-after-ms")
+    if ms:
+        try:
+            return min(_RETRY_AFTER_MAX, max(0.0, float(ms) / 1000))
+        except ValueError:
+            pass
+    raw = headers.get("retry-after")
+    if not raw:
+        return None
+    try:
+        return min(_RETRY_AFTER_MAX, max(0.0, float(raw)))
+    except ValueError:
+        pass
+    try:
+        from datetime import datetime, timezone
+        from email.utils import parsedate_to_datetime
+        when = parsedate_to_datetime(raw)
+        return min(_RETRY_AFTER_MAX,
+                   max(0.0, (when - datetime.now(timezone.utc)).total_seconds()))
+    except (TypeError, ValueError):
+        return None
+
+
+def classify_error(exc: BaseException) -> tuple[str, float | None]:
+    """按异常类型（而不是错误文本）判断如何处理一次失败的请求。
+
+    返回 (类别, Retry-After 秒)：
+      "congestion"  429 / 请求超时 / 503 过载 —— 上游忙，应降低并发后重试
+      "transient"   连接失败 / 其他 5xx —— 偶发故障，原样重试
+      "fatal"       参数错误、鉴权失败等 —— 重试无意义
+    """
+    import asyncio
+    try:
+        import openai
+    except ImportError:
+        return "fatal", None
+
+    if isinstance(exc, openai.RateLimitError):
+        return "congestion", _retry_after(exc.response)
+    if isinstance(exc, (openai.APITimeoutError, asyncio.TimeoutError)):
+        return "congestion", None
+    if isinstance(exc, openai.APIConnectionError):
+        return "transient", None
+    if isinstance(exc, openai.APIStatusError):
+        status = exc.status_code
+        if status in (503, 529):
+            return "congestion", _retry_after(exc.response)
+        if status == 408 or status >= 500:
+            return "transient", _retry_after(exc.response)
+    return "fatal", None
+
+
 def default_model(provider: str) -> str:
     return _PROVIDER_DEFAULT_MODELS.get(provider.lower(), "gpt-4o")
 
@@ -127,8 +217,6 @@ def chat_completion_stream(
     for each SSE chunk from the OpenAI-compatible streaming API.
     Yields {"done": True} at the end, or {"error": str} on failure.
     """
-    import re
-
     params = build_chat_params(
         model=model,
         messages=messages,
@@ -150,39 +238,95 @@ def chat_completion_stream(
 
     try:
         for chunk in stream:
-            if not chunk.choices:
-                continue
-            delta = chunk.choices[0].delta
-            content = getattr(delta, "content", None) or ""
-            reasoning = getattr(delta, "reasoning_content", None) or ""
-
-            # MiniMax: reasoning may come from reasoning_details
-            if not reasoning and hasattr(delta, "reasoning_details") and delta.reasoning_details:
-                for detail in delta.reasoning_details:
-                    if hasattr(detail, "text") and detail.text:
-                        reasoning = detail.text
-                        break
-
-            # MiniMax fallback: extract <think> from content
-            if not reasoning and content:
-                m = re.search(r'<think>(.*?)</think>', content, re.DOTALL)
-                if m:
-                    reasoning = m.group(1)
-                    content = re.sub(r'<think>.*?</think>', '', content, flags=re.DOTALL)
-
-            if content or reasoning:
-                yield {"content": content, "reasoning": reasoning}
-
-            # finish_reason=length 说明被 max_tokens 截断
-            finish_reason = getattr(chunk.choices[0], "finish_reason", None)
-            if finish_reason == "length":
-                yield {"truncated": True}
-                yield {"done": True}
+            events = _stream_chunk_events(chunk)
+            yield from events
+            if events and events[-1].get("done"):
                 return
+        yield {"done": True}
+    except Exception as e:
+        yield {"error": str(e)}
+
+
+async def achat_completion_stream(
+    client: Any,
+    model: str,
+    messages: list[dict],
+    temperature: float = 0.7,
+    max_tokens: int = 2048,
+    enable_thinking: bool | None = None,
+    provider: str | None = None,
+):
+    """chat_completion_stream 的异步版本：client 为 AsyncOpenAI，产出相同的 dict。
 
+    调用方中途放弃迭代（如浏览器断开）时关闭上游流，不再继续消耗 token。
+    """
+    params = build_chat_params(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        enable_thinking=enable_thinking,
+        provider=provider,
+    )
+    params["stream"] = True
+    extra_body = params.pop("extra_body", None)
+
+    try:
+        stream = await client.chat.completions.create(**params, extra_body=extra_body)
+    except Exception as e:
+        yield {"error": str(e)}
+        return
+
+    try:
+        async for chunk in stream:
+            events = _stream_chunk_events(chunk)
+            for ev in events:
+                yield ev
+            if events and events[-1].get("done"):
+                return
         yield {"done": True}
     except Exception as e:
         yield {"error": str(e)}
+    finally:
+        close = getattr(stream, "close", None)
+        if close is not None:
+            await close()
+
+
+def _stream_chunk_events(chunk: Any) -> list[dict]:
+    """把一个流式 chunk 转成 0~3 个事件 dict（content/reasoning、truncated、done）。"""
+    import re
+
+    if not chunk.choices:
+        return []
+    events: list[dict] = []
+    delta = chunk.choices[0].delta
+    content = getattr(delta, "content", None) or ""
+    reasoning = getattr(delta, "reasoning_content", None) or ""
+
+    # MiniMax: reasoning may come from reasoning_details
+    if not reasoning and hasattr(delta, "reasoning_details") and delta.reasoning_details:
+        for detail in delta.reasoning_details:
+            if hasattr(detail, "text") and detail.text:
+                reasoning = detail.text
+                break
+
+    # MiniMax fallback: extract <think> from content
+    if not reasoning and content:
+        m = re.search(r'<think>(.*?)</think>', content, re.DOTALL)
+        if m:
+            reasoning = m.group(1)
+            content = re.sub(r'<think>.*?</think>', '', content, flags=re.DOTALL)
+
+    if content or reasoning:
+        events.append({"content": content, "reasoning": reasoning})
+
+    # finish_reason=length 说明被 max_tokens 截断
+    finish_reason = getattr(chunk.choices[0], "finish_reason", None)
+    if finish_reason == "length":
+        events.append({"truncated": True})
+        events.append({"done": True})
+    return events
 
 
 def build_chat_params(
@@ -299,6 +299,14 @@ def estimate_prompt_tokens(prompt_text: str) -> int:
     return int(len(prompt_text) / _CHARS_PER_TOKEN) + _SYSTEM_TOKEN_OVERHEAD
 
 
+def estimate_output_tokens(model: str, enable_thinking: bool | None = None) -> int:
+    """单题输出 token 的均值估算（推理/思考模式含思维链）。"""
+    from med_exam_toolkit.ai.client import is_reasoning_model, is_hybrid_thinking_model
+
+    thinking = is_reasoning_model(model) or (is_hybrid_thinking_model(model) and enable_thinking)
+    return _OUTPUT_TOKEN_ESTIMATE_THINK if thinking else _OUTPUT_TOKEN_ESTIMATE
+
+
 def estimate_task_cost(
     model: str,
     tasks: list[dict],
@@ -318,14 +326,9 @@ def estimate_task_cost(
           "model":            str,
         }
     """
-    from med_exam_toolkit.ai.client import is_reasoning_model, is_hybrid_thinking_model
     from med_exam_toolkit.ai.prompt import build_subquestion_prompt
 
-    pure_r   = is_reasoning_model(model)
-    hybrid   = is_hybrid_thinking_model(model)
-    thinking = pure_r or (hybrid and enable_thinking)
-
-    out_est = _OUTPUT_TOKEN_ESTIMATE_THINK if thinking else _OUTPUT_TOKEN_ESTIMATE
+    out_est = estimate_output_tokens(model, enable_thinking)
 
     total_input = 0
     for t in tasks:
@@ -368,20 +371,21 @@ class CostTracker:
     _requests:         int = 0
     _failed_requests:  int = 0
 
-    def add_response(self, response: object) -> None:
-        """从 API 响应对象中提取并累加 token 用量。"""
+    def add_response(self, response: object) -> int:
+        """从 API 响应对象中提取并累加 token 用量，返回本次的合计 token（无 usage 时为 0）。"""
         try:
             usage = getattr(response, "usage", None)
             if usage is None:
-                return
+                return 0
             pt = getattr(usage, "prompt_tokens",     0) or 0
             ct = getattr(usage, "completion_tokens", 0) or 0
             with self._lock:
                 self._prompt_tokens     += pt
                 self._completion_tokens += ct
                 self._requests          += 1
+            return pt + ct
         except Exception:
-            pass
+            return 0
 
     def add_failure(self) -> None:
         with self._lock:
@@ -1,6 +1,7 @@
 """BankEnricher — 批量 AI 补全小题答案/解析"""
 from __future__ import annotations
 
+import asyncio
 import hashlib
 import json
 import logging
@@ -13,7 +14,10 @@ from typing import Any
 
 from med_exam_toolkit.ai.checkpoint import Checkpoint
 from med_exam_toolkit.ai.client import make_client
-from med_exam_toolkit.ai.cost import CostTracker, estimate_task_cost
+from med_exam_toolkit.ai.cost import (
+    CostTracker, estimate_output_tokens, estimate_prompt_tokens, estimate_task_cost,
+)
+from med_exam_toolkit.ai.limiter import RateBudget
 from med_exam_toolkit.ai.prompt import build_subquestion_prompt
 from med_exam_toolkit.ai.result import apply_to_subquestion, parse_response, validate_result
 from med_exam_toolkit.bank import load_bank, save_bank
@@ -22,6 +26,11 @@ from med_exam_toolkit.models import Question
 logger = logging.getLogger(__name__)
 
 _W = 60  # 分隔线宽度
+_C_MODE, _C_JOB, _C_UNIT = 10, 10, 16   # 进度行各列宽度
+
+_MAX_RETRIES    = 3     # 连接失败 / 5xx 的重试次数
+_MAX_CONGESTION = 8     # asyncio 引擎下 429 / 超时的重试次数（每次都会先降并发）
+_BASE_DELAY     = 2.0   # 无 Retry-After 时的退避基数（秒）
 
 
 import unicodedata
@@ -46,6 +55,16 @@ def _ljust(s: str, width: int) -> str:
     return s + " " * pad
 
 
+def _k(n: float) -> str:
+    """token 数缩写：45200 → 45.2k"""
+    return f"{n / 1000:.1f}k" if n >= 1000 else f"{n:.0f}"
+
+
+def _quota(n: int, fmt=str) -> str:
+    """配额显示，0 表示不限"""
+    return fmt(n) if n else "不限"
+
+
 def _bar(done: int, total: int, bar_width: int = 20) -> str:
     """进度条，计数部分固定宽度避免抖动"""
     filled   = int(bar_width * done / total) if total else 0
@@ -70,6 +89,10 @@ class BankEnricher:
         api_key: str = "",
         base_url: str = "",
         max_workers: int = 4,
+        engine: str = "async",
+        max_concurrency: int = 0,
+        rpm: int = 0,
+        tpm: int = 0,
         resume: bool = True,
         checkpoint_dir: Path = Path("data/checkpoints"),
         modes_filter: list[str] | None = None,
@@ -96,6 +119,11 @@ class BankEnricher:
         self.api_key = api_key
         self.base_url = base_url
         self.max_workers = max_workers
+        if engine not in ("async", "threads"):
+            raise ValueError(f"未知 engine: {engine!r}，可选: async / threads")
+        self.engine = engine
+        # async 引擎从 max_workers 起步，按上游反馈在 [1, max_concurrency] 内自适应
+        self.max_concurrency = max(max_workers, max_concurrency or max_workers * 8)
         self.resume = resume
         self.modes_filter = modes_filter or []
         self.chapters_filter = chapters_filter or []
@@ -128,6 +156,9 @@ class BankEnricher:
         self._questions: list[Question] = []
         self._start_time: float = 0.0
         self._tracker = CostTracker(model=model)  # token 用量累加器
+        self._aimd = None                           # async 引擎的 AimdLimiter
+        self._budget = RateBudget(rpm=rpm, tpm=tpm)  # provider 的 RPM/TPM 配额（0=不限）
+        self._progress: dict[str, int] = {}
 
     # ─────────────────────────────── 入口 ───────────────────────────────
 
@@ -155,7 +186,10 @@ class BankEnricher:
             return
 
         if pending:
-            self._process(pending, questions)
+            try:
+                self._process(pending, questions)
+            finally:
+                self._ckpt.close()      # fsync 断点日志
         else:
             print("\n  ✅ 无需处理，全部任务已完成")
 
@@ -293,7 +327,13 @@ class BankEnricher:
         print(f"{'─' * _W}")
         print(f"  provider:  {self.provider}")
         print(f"  model:     {self.model}")
-        print(f"  workers:   {self.max_workers}")
+        if self.engine == "async":
+            print(f"  并发:      自适应 {self.max_workers} → 最多 {self.max_concurrency}（asyncio + AIMD）")
+        else:
+            print(f"  workers:   {self.max_workers}（线程池）")
+        if self._budget.enabled:
+            print(f"  配额:      {_quota(self._budget.requests.capacity)} 请求/分钟 · "
+                  f"{_quota(self._budget.tokens.capacity)} token/分钟")
         from med_exam_toolkit.ai.client import is_reasoning_model, is_hybrid_thinking_model
         pure_r  = is_reasoning_model(self.model)
         hybrid  = is_hybrid_thinking_model(self.model)
@@ -376,32 +416,111 @@ class BankEnricher:
     # ─────────────────────────────── 并发 ───────────────────────────────
 
     def _process(self, pending: list[dict], questions: list[Question]) -> None:
-        client = make_client(
-            provider=self.provider,
-            api_key=self.api_key,
-            base_url=self.base_url,
-            model=self.model,
-            timeout=self.timeout,
-        )
-
-        total   = len(pending)
-        success = 0
-        failed  = 0
-        interrupted = False
+        total = len(pending)
+        self._progress = {"total": total, "success": 0, "failed": 0}
 
         # 进度条宽 = [20] + 空格 + "digits/digits"
         _cnt_w = len(str(total)) * 2 + 1   # "nn/nn"
         C_BAR  = 22 + _cnt_w
-        C_MODE, C_JOB, C_UNIT = 10, 10, 16
 
         print(f"  🚀 开始处理  按 Ctrl+C 可安全中断\n")
         print(
             f"  {_ljust('进度条', C_BAR)}  状态  "
-            f"{_ljust('题型', C_MODE)}  {_ljust('任务', C_JOB)}  "
-            f"{_ljust('章节', C_UNIT)}  AI结果预览"
+            f"{_ljust('题型', _C_MODE)}  {_ljust('任务', _C_JOB)}  "
+            f"{_ljust('章节', _C_UNIT)}  AI结果预览"
+        )
+        print(f"  {'─'*C_BAR}  {'─'*4}  {'─'*_C_MODE}  {'─'*_C_JOB}  {'─'*_C_UNIT}  {'─'*30}")
+
+        if self.engine == "async":
+            interrupted = self._process_async(pending, questions)
+        else:
+            interrupted = self._process_threads(pending, questions)
+
+        success, failed = self._progress["success"], self._progress["failed"]
+        elapsed = time.time() - self._start_time
+        print(f"\n{'─' * _W}")
+        if interrupted:
+            untouched = total - success - failed
+            print(
+                f"  🛑 已中断  ✅成功: {success}  ❌失败: {failed}  "
+                f"⏭跳过: {untouched}  ⏱耗时: {elapsed:.1f}s"
+            )
+            print(f"  断点已保存，下次 --resume 可续跑")
+        else:
+            avg = elapsed / total if total else 0
+            print(
+                f"  🏁 处理完成  ✅成功: {success}  ❌失败: {failed}  "
+                f"共: {total}  ⏱耗时: {elapsed:.1f}s  均速: {avg:.1f}s/题"
+            )
+        if self._aimd is not None:
+            st = self._aimd.stats()
+            print(
+                f"  📈 自适应并发  结束时: {st['limit']}  峰值: {st['peak']}  "
+                f"限流减半: {st['cuts']} 次"
+            )
+        if self._budget.enabled:
+            b = self._budget
+            print(
+                f"  📏 配额利用  60 秒窗口峰值  RPM {b.peak_rpm}/{_quota(b.requests.capacity)}  "
+                f"TPM {_k(b.peak_tpm)}/{_quota(b.tokens.capacity, _k)}  "
+                f"等待配额: {b.waited:.1f}s（各请求累计）"
+            )
+
+    def _report(
+        self,
+        task: dict[str, Any],
+        questions: list[Question],
+        result: dict[str, Any] | None,
+        exc: BaseException | None = None,
+    ) -> None:
+        """记录一个任务的结果（写断点 + 打印一行进度）。线程池与 asyncio 两条路径共用。"""
+        prog = self._progress
+        done = prog["success"] + prog["failed"] + 1
+        q    = questions[task["qi"]]
+        job  = ("答案+解析" if task["need_answer"] and task["need_discuss"]
+                else "补答案" if task["need_answer"] else "补解析")
+        bar  = _bar(done, prog["total"])
+        C_BAR = 22 + len(str(prog["total"])) * 2 + 1
+
+        self._ckpt.done(task["task_id"], result or None)
+        if result:
+            prog["success"] += 1
+            mark = "✅"
+            tail = ""
+            if result.get("answer"):
+                tail += f"答案={result['answer']}  "
+            if result.get("discuss"):
+                tail += _trunc(result["discuss"], 25)
+            tail += f" [置信:{result.get('confidence', 0.0):.2f}]"
+        else:
+            prog["failed"] += 1
+            mark = "❌"
+            tail = f"异常: {str(exc)[:35]}" if exc is not None else "AI 返回为空"
+        if self._aimd is not None:
+            tail += f"  [并发:{self._aimd.window}]"
+        if self._budget.enabled:
+            u = self._budget.utilisation()
+            tail += (f"  [RPM:{u['rpm']}/{_quota(u['rpm_limit'])}"
+                     f" TPM:{_k(u['tpm'])}/{_quota(u['tpm_limit'], _k)}]")
+        print(
+            f"  {_ljust(bar, C_BAR)}  {mark}    "
+            f"{_ljust(q.mode or '', _C_MODE)}  "
+            f"{_ljust(job, _C_JOB)}  "
+            f"{_ljust(_trunc(q.unit or '', 8), _C_UNIT)}  "
+            f"{tail}"
+        )
+
+    def _process_threads(self, pending: list[dict], questions: list[Question]) -> bool:
+        """固定 max_workers 个线程。返回是否被 Ctrl+C 中断。"""
+        client = make_client(
+            provider=self.provider,
+            api_key=self.api_key,
+            base_url=self.base_url,
+            model=self.model,
+            timeout=self.timeout,
         )
-        print(f"  {'─'*C_BAR}  {'─'*4}  {'─'*C_MODE}  {'─'*C_JOB}  {'─'*C_UNIT}  {'─'*30}")
 
+        interrupted = False
         with ThreadPoolExecutor(
             max_workers=self.max_workers,
             thread_name_prefix="ai-enrich",
@@ -414,54 +533,12 @@ class BankEnricher:
                 for future in as_completed(futures):
                     if self._shutdown.is_set():
                         break
-
-                    t    = futures[future]
-                    done = success + failed + 1
-                    q    = questions[t["qi"]]
-                    sq   = q.sub_questions[t["si"]]
-                    job  = ("答案+解析" if t["need_answer"] and t["need_discuss"]
-                            else "补答案" if t["need_answer"] else "补解析")
-                    bar  = _bar(done, total)
-
+                    t = futures[future]
                     try:
-                        result = future.result()
-                        if result:
-                            self._ckpt.done(t["task_id"], result)
-                            success += 1
-                            preview = ""
-                            if result.get("answer"):
-                                preview += f"答案={result['answer']}  "
-                            if result.get("discuss"):
-                                preview += _trunc(result["discuss"], 25)
-                            conf = result.get("confidence", 0.0)
-                            print(
-                                f"  {_ljust(bar, C_BAR)}  ✅    "
-                                f"{_ljust(q.mode or '', C_MODE)}  "
-                                f"{_ljust(job, C_JOB)}  "
-                                f"{_ljust(_trunc(q.unit or '', 8), C_UNIT)}  "
-                                f"{preview} [置信:{conf:.2f}]"
-                            )
-                        else:
-                            self._ckpt.done(t["task_id"], None)
-                            failed += 1
-                            print(
-                                f"  {_ljust(bar, C_BAR)}  ❌    "
-                                f"{_ljust(q.mode or '', C_MODE)}  "
-                                f"{_ljust(job, C_JOB)}  "
-                                f"{_ljust(_trunc(q.unit or '', 8), C_UNIT)}  "
-                                f"AI 返回为空"
-                            )
+                        self._report(t, questions, future.result())
                     except Exception as exc:  # noqa: BLE001
-                        self._ckpt.done(t["task_id"], None)
-                        failed += 1
                         logger.exception("任务异常: %s", exc)
-                        print(
-                            f"  {_ljust(bar, C_BAR)}  ❌    "
-                            f"{_ljust(q.mode or '', C_MODE)}  "
-                            f"{_ljust(job, C_JOB)}  "
-                            f"{_ljust(_trunc(q.unit or '', 8), C_UNIT)}  "
-                            f"异常: {str(exc)[:35]}"
-                        )
+                        self._report(t, questions, None, exc)
 
             except KeyboardInterrupt:
                 interrupted = True
@@ -470,38 +547,56 @@ class BankEnricher:
                 for f in futures:
                     f.cancel()
                 pool.shutdown(wait=False, cancel_futures=True)
+        return interrupted
 
-        elapsed = time.time() - self._start_time
-        print(f"\n{'─' * _W}")
-        if interrupted:
-            untouched = total - success - failed
-            print(
-                f"  🛑 已中断  ✅成功: {success}  ❌失败: {failed}  "
-                f"⏭跳过: {untouched}  ⏱耗时: {elapsed:.1f}s"
-            )
-            print(f"  断点已保存，下次 --resume 可续跑")
-        else:
-            avg = elapsed / total if total else 0
-            print(
-                f"  🏁 处理完成  ✅成功: {success}  ❌失败: {failed}  "
-                f"共: {total}  ⏱耗时: {elapsed:.1f}s  均速: {avg:.1f}s/题"
-            )
+    def _process_async(self, pending: list[dict], questions: list[Question]) -> bool:
+        """asyncio + AIMD 自适应并发。返回是否被 Ctrl+C 中断。"""
+        from med_exam_toolkit.ai.limiter import AimdLimiter
+        self._aimd = AimdLimiter(initial=self.max_workers, ceiling=self.max_concurrency)
+        try:
+            asyncio.run(self._run_async(pending, questions))
+        except KeyboardInterrupt:
+            self._shutdown.set()
+            print("\n\n  ⚠️  Ctrl+C 中断，已取消进行中的请求")
+            return True
+        return False
+
+    async def _run_async(self, pending: list[dict], questions: list[Question]) -> None:
+        from med_exam_toolkit.ai.client import make_async_client
+        client = make_async_client(
+            provider=self.provider,
+            api_key=self.api_key,
+            base_url=self.base_url,
+            model=self.model,
+            timeout=self.timeout,
+            max_retries=0,          # 重试由 _call_ai_async 负责，先让并发降下来
+        )
+        tasks = iter(pending)
 
-    # ─────────────────────────────── 单次 AI ───────────────────────────────
+        async def worker() -> None:
+            # 协程数 = 并发上限；实际同时在途的请求数由 AIMD 窗口控制
+            for t in tasks:
+                if self._shutdown.is_set():
+                    return
+                try:
+                    result = await self._call_ai_async(client, t, questions)
+                except Exception as exc:  # noqa: BLE001
+                    logger.exception("任务异常: %s", exc)
+                    self._report(t, questions, None, exc)
+                else:
+                    self._report(t, questions, result)
 
-    def _call_ai(
-        self,
-        client: Any,
-        task: dict[str, Any],
-        questions: list[Question],
-    ) -> dict[str, Any] | None:
-        if self._shutdown.is_set():
-            return None
+        try:
+            await asyncio.gather(*(worker() for _ in range(self._aimd.ceiling)))
+        finally:
+            await client.close()
+
+    # ─────────────────────────────── 单次 AI ───────────────────────────────
 
+    def _build_params(self, task: dict[str, Any], questions: list[Question]) -> dict[str, Any]:
         from med_exam_toolkit.ai.client import (
             build_chat_params, adapt_messages_for_reasoning,
             is_reasoning_model, is_hybrid_thinking_model,
-            extract_response_text,
         )
 
         q  = questions[task["qi"]]
@@ -525,7 +620,7 @@ class BankEnricher:
             {"role": "user",   "content": prompt},
         ]
         messages = adapt_messages_for_reasoning(self.model, raw_messages)
-        params   = build_chat_params(
+        return build_chat_params(
             model           = self.model,
             messages        = messages,
             temperature     = 0.2,
@@ -534,46 +629,49 @@ class BankEnricher:
             provider        = self.provider,
         )
 
-        # 带指数退避的重试：应对速率限制（429）和瞬时网络抖动
-        # 最多重试 3 次，等待间隔依次为 2s、4s、8s
-        MAX_RETRIES  = 3
-        base_delay   = 2.0
-        last_exc: Exception | None = None
+    def _estimate_tokens(self, params: dict[str, Any]) -> int:
+        """预扣 TPM 配额用：prompt 长度估算 + 输出均值，响应回来后按实际用量结算。"""
+        text = "".join(str(m.get("content") or "") for m in params["messages"])
+        return estimate_prompt_tokens(text) + estimate_output_tokens(self.model, self.enable_thinking)
+
+    def _call_ai(
+        self,
+        client: Any,
+        task: dict[str, Any],
+        questions: list[Question],
+    ) -> dict[str, Any] | None:
+        if self._shutdown.is_set():
+            return None
+
+        from med_exam_toolkit.ai.client import classify_error
 
-        for attempt in range(MAX_RETRIES + 1):
+        params = self._build_params(task, questions)
+        est    = self._estimate_tokens(params)
+
+        # 按异常类型重试：429 / 超时 / 5xx / 连接失败可重试，参数或鉴权错误直接放弃；
+        # 上游给了 Retry-After 就按它等，否则 2s → 4s → 8s
+        last_exc: Exception | None = None
+        for attempt in range(_MAX_RETRIES + 1):
             if self._shutdown.is_set():
                 return None
-
+            self._budget.take(est)
             try:
                 response = client.chat.completions.create(**params)
                 break   # 请求成功，跳出重试循环
-
             except Exception as exc:  # noqa: BLE001
                 last_exc = exc
+                self._budget.cancel(est)
                 if self._shutdown.is_set():
                     return None
-
-                # 判断是否值得重试（速率限制或临时网络错误）
-                exc_str = str(exc).lower()
-                retryable = (
-                    "429" in exc_str           # rate limit
-                    or "rate limit" in exc_str
-                    or "timeout" in exc_str
-                    or "connection" in exc_str
-                    or "502" in exc_str
-                    or "503" in exc_str
-                )
-
-                if retryable and attempt < MAX_RETRIES:
-                    delay = base_delay * (2 ** attempt)   # 2s → 4s → 8s
+                kind, retry_after = classify_error(exc)
+                if kind != "fatal" and attempt < _MAX_RETRIES:
+                    delay = retry_after or _BASE_DELAY * (2 ** attempt)
                     logger.warning(
                         "AI 请求失败 (attempt %d/%d)，%.0fs 后重试: %s",
-                        attempt + 1, MAX_RETRIES, delay, exc,
+                        attempt + 1, _MAX_RETRIES, delay, exc,
                     )
                     time.sleep(delay)
                     continue
-
-                # 不可重试，或已达最大次数
                 logger.warning("AI 请求异常: %s", exc)
                 self._tracker.add_failure()
                 return None
@@ -583,10 +681,67 @@ class BankEnricher:
             self._tracker.add_failure()
             return None
 
-        content, reasoning_text = extract_response_text(response)
-        # 记录实际 token 用量（线程安全）
-        self._tracker.add_response(response)
+        self._budget.settle(est, self._tracker.add_response(response))
+        return self._parse_result(task, response)
+
+    async def _call_ai_async(
+        self,
+        client: Any,
+        task: dict[str, Any],
+        questions: list[Question],
+    ) -> dict[str, Any] | None:
+        """单次请求（asyncio 版）：先向 AIMD 申请名额、再扣 RPM/TPM 配额，结果反馈给 AIMD 调整并发。
+
+        429 / 超时属于正常的限流信号：减半并发、本请求按 Retry-After 等待后重试，最多 _MAX_CONGESTION 次；
+        其他可重试错误按 2s → 4s → 8s 退避，最多 _MAX_RETRIES 次。
+        """
+        from med_exam_toolkit.ai.client import classify_error
+
+        limiter = self._aimd
+        params  = self._build_params(task, questions)
+        est     = self._estimate_tokens(params)
+        congested = retried = 0
+        while not self._shutdown.is_set():
+            epoch = await limiter.acquire()
+            try:
+                await self._budget.take_async(est)
+                response = await client.chat.completions.create(**params)
+            except Exception as exc:  # noqa: BLE001
+                self._budget.cancel(est)
+                kind, retry_after = classify_error(exc)
+                if kind == "congestion":
+                    cuts = limiter.cuts
+                    await limiter.release(epoch, "congestion")
+                    if limiter.cuts > cuts:
+                        logger.info("上游限流（%s），并发降至 %d", type(exc).__name__, limiter.window)
+                    congested += 1
+                    if congested <= _MAX_CONGESTION:
+                        await asyncio.sleep(retry_after or min(_BASE_DELAY * congested, 30.0))
+                        continue
+                else:
+                    await limiter.release(epoch, "error")
+                    retried += 1
+                    if kind == "transient" and retried <= _MAX_RETRIES:
+                        delay = retry_after or _BASE_DELAY * (2 ** (retried - 1))
+                        logger.warning("AI 请求失败 (attempt %d/%d)，%.0fs 后重试: %s",
+                                       retried, _MAX_RETRIES, delay, exc)
+                        await asyncio.sleep(delay)
+                        continue
+                logger.warning("AI 请求异常，放弃: %s", exc)
+                self._tracker.add_failure()
+                return None
+            except BaseException:
+                await asyncio.shield(limiter.release(epoch, "error"))   # 被取消（Ctrl+C）
+                raise
+            await limiter.release(epoch, "ok")
+            self._budget.settle(est, self._tracker.add_response(response))
+            return self._parse_result(task, response)
+        return None
 
+    def _parse_result(self, task: dict[str, Any], response: Any) -> dict[str, Any] | None:
+        from med_exam_toolkit.ai.client import extract_response_text
+
+        content, reasoning_text = extract_response_text(response)
         if reasoning_text:
             logger.debug("推理过程 (%d chars): %s…", len(reasoning_text), reasoning_text[:100])
 
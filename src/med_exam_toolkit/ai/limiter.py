@@ -0,0 +1,366 @@
+"""AI 请求准入：并发上限 + 每分钟 token 预算 + 按用户轮转的公平队列；批处理用的 AIMD 自适应并发与 RPM/TPM 配额
+
+用法：
+    limiter = FairLimiter(concurrency=8, tpm=60000)
+    ticket = limiter.enqueue(user_id, tokens=1500)      # 队列满时抛 QueueFull
+    while not limiter.wait(ticket, 1.0):                # 异步代码用 await limiter.wait_async(...)
+        print("前面还有", limiter.position(ticket), "个请求")
+    try:
+        ...                                             # 调用上游
+    finally:
+        limiter.release(ticket, used_tokens=1200)       # 未获准时等同取消排队
+
+排队规则：每个用户一条 FIFO，用户之间轮转放行，一个人连点十次不会挤掉别人。
+放行条件是「有空闲并发」且「token 桶够扣」；预扣的 token 在 release 时按实际用量退回。
+线程与事件循环混用安全：状态由一把锁保护，异步等待方通过 call_soon_threadsafe 唤醒。
+"""
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class QueueFull(Exception):
+    """排队人数已达上限。"""
+
+
+class TokenBucket:
+    """每分钟 token 预算：容量为 per_minute，按秒匀速回填；per_minute<=0 表示不限。"""
+
+    def __init__(self, per_minute: int, clock=time.monotonic) -> None:
+        self.capacity = max(0, per_minute)
+        self._rate = self.capacity / 60.0
+        self._clock = clock
+        self._level = float(self.capacity)
+        self._ts = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._level = min(self.capacity, self._level + (now - self._ts) * self._rate)
+        self._ts = now
+
+    def try_take(self, n: int) -> float:
+        """够扣则扣掉并返回 0，否则返回还需等待的秒数。超过容量的请求按容量计，避免永远等不到。"""
+        if not self.capacity:
+            return 0.0
+        n = min(n, self.capacity)
+        with self._lock:
+            self._refill()
+            if self._level >= n:
+                self._level -= n
+                return 0.0
+            return (n - self._level) / self._rate
+
+    def refund(self, n: int) -> None:
+        """退回 n 个 token；n 为负时补扣（实际用量超过预扣）。"""
+        if not self.capacity or not n:
+            return
+        with self._lock:
+            self._refill()
+            self._level = min(self.capacity, self._level + n)
+
+    @property
+    def level(self) -> float:
+        if not self.capacity:
+            return float("inf")
+        with self._lock:
+            self._refill()
+            return self._level
+
+
+class RateBudget:
+    """provider 的每分钟请求数（RPM）+ token（TPM）配额，供 enrich 批处理使用；线程安全。
+
+    发请求前按预估 token 扣额度（take / take_async），拿到响应后按实际用量多退少补（settle），
+    请求失败退回 token（cancel，请求数不退：被拒的请求多数 provider 也计入 RPM）。
+    utilisation() 给出最近 60 秒的实际用量，用于进度显示；peak_rpm / peak_tpm 是运行期间的最大值。
+        budget = RateBudget(rpm=500, tpm=60000)
+        budget.take(est)                      # 异步代码用 await budget.take_async(est)
+        ...
+        budget.settle(est, used_tokens)
+    """
+
+    _WINDOW = 60.0
+
+    def __init__(self, rpm: int = 0, tpm: int = 0, clock=time.monotonic) -> None:
+        self.requests = TokenBucket(rpm, clock)
+        self.tokens = TokenBucket(tpm, clock)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._recent: deque[tuple[float, int]] = deque()   # 最近 60 秒完成的 (时间, token)
+        self._recent_tokens = 0
+        self.waited = 0.0                                  # 因配额不足累计等待的秒数
+        self.peak_rpm = self.peak_tpm = 0                  # 任一 60 秒窗口内的最大用量
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.requests.capacity or self.tokens.capacity)
+
+    def try_take(self, tokens: int) -> float:
+        """两个桶都够扣才扣并返回 0；否则不扣，返回还需等待的秒数。"""
+        wait = self.requests.try_take(1)
+        if wait:
+            return wait
+        wait = self.tokens.try_take(tokens)
+        if wait:
+            self.requests.refund(1)
+        return wait
+
+    def take(self, tokens: int) -> None:
+        while (wait := self.try_take(tokens)) > 0:
+            self._note_wait(wait)
+            time.sleep(wait)
+
+    async def take_async(self, tokens: int) -> None:
+        while (wait := self.try_take(tokens)) > 0:
+            self._note_wait(wait)
+            await asyncio.sleep(wait)
+
+    def settle(self, estimated: int, used: int) -> None:
+        """按实际用量结算；响应没带 usage（used=0）时按预估计。"""
+        used = used or estimated
+        self.tokens.refund(estimated - used)
+        with self._lock:
+            now = self._clock()
+            self._recent.append((now, used))
+            self._recent_tokens += used
+            self._trim(now)
+            self.peak_rpm = max(self.peak_rpm, len(self._recent))
+            self.peak_tpm = max(self.peak_tpm, self._recent_tokens)
+
+    def cancel(self, estimated: int) -> None:
+        self.tokens.refund(estimated)
+
+    def utilisation(self) -> dict:
+        """最近 60 秒的实际请求数 / token 数与对应配额（0=不限）。"""
+        with self._lock:
+            self._trim(self._clock())
+            return {"rpm": len(self._recent), "tpm": self._recent_tokens,
+                    "rpm_limit": self.requests.capacity, "tpm_limit": self.tokens.capacity}
+
+    def _trim(self, now: float) -> None:
+        while self._recent and self._recent[0][0] <= now - self._WINDOW:
+            self._recent_tokens -= self._recent.popleft()[1]
+
+    def _note_wait(self, wait: float) -> None:
+        with self._lock:
+            self.waited += wait
+
+
+class Ticket:
+    """一次排队请求；granted 为 True 后才可调用上游。"""
+    __slots__ = ("user", "tokens", "granted", "done", "enqueued_at",
+                 "_event", "_loop", "_future")
+
+    def __init__(self, user: str, tokens: int) -> None:
+        self.user = user
+        self.tokens = tokens
+        self.granted = False
+        self.done = False
+        self.enqueued_at = time.monotonic()
+        self._event = threading.Event()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._future: asyncio.Future | None = None
+
+    def _wake(self) -> None:
+        self._event.set()
+        if self._future is not None:
+            self._loop.call_soon_threadsafe(_resolve, self._future)
+
+
+def _resolve(fut: asyncio.Future) -> None:
+    if not fut.done():
+        fut.set_result(None)
+
+
+class FairLimiter:
+    """单个 provider 的准入控制。concurrency：同时进行的上游请求数；tpm：每分钟 token 预算（0=不限）；
+    max_queue：排队上限，超出时 enqueue 抛 QueueFull。"""
+
+    def __init__(self, concurrency: int, tpm: int = 0, max_queue: int = 500,
+                 clock=time.monotonic) -> None:
+        self.concurrency = max(1, concurrency)
+        self.bucket = TokenBucket(tpm, clock=clock)
+        self.max_queue = max(0, max_queue)
+        self._lock = threading.Lock()
+        self._queues: OrderedDict[str, deque[Ticket]] = OrderedDict()   # 轮转顺序即放行顺序
+        self._waiting = 0
+        self.active = 0
+        # 统计
+        self.granted = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self.max_wait = 0.0
+
+    # ── 排队 / 放行 ───────────────────────────────────────────────
+    def enqueue(self, user: str, tokens: int = 0) -> Ticket:
+        ticket = Ticket(user or "_anon", max(0, tokens))
+        with self._lock:
+            if self._waiting >= self.max_queue and self.active >= self.concurrency:
+                self.rejected += 1
+                raise QueueFull(f"排队人数已满（{self._waiting}）")
+            self._queues.setdefault(ticket.user, deque()).append(ticket)
+            self._waiting += 1
+            self._dispatch()
+        return ticket
+
+    def _dispatch(self) -> None:
+        """在锁内调用：按用户轮转放行，直到并发或 token 预算用尽。"""
+        while self._queues and self.active < self.concurrency:
+            user, q = next(iter(self._queues.items()))
+            ticket = q[0]
+            if self.bucket.try_take(ticket.tokens) > 0:
+                return          # token 不够：等回填，由等待方超时后再次触发
+            q.popleft()
+            del self._queues[user]
+            if q:
+                self._queues[user] = q          # 还有请求的用户排到轮转末尾
+            self._waiting -= 1
+            self.active += 1
+            self.granted += 1
+            ticket.granted = True
+            self.max_wait = max(self.max_wait, time.monotonic() - ticket.enqueued_at)
+            ticket._wake()
+
+    def poll(self) -> None:
+        """token 回填后重新尝试放行（等待方每次超时时调用）。"""
+        with self._lock:
+            self._dispatch()
+
+    def position(self, ticket: Ticket) -> int:
+        """按轮转规则算出排在 ticket 之前、会先被放行的请求数；已放行返回 0。"""
+        with self._lock:
+            if ticket.granted or ticket.done:
+                return 0
+            q = self._queues.get(ticket.user)
+            if q is None:
+                return 0
+            k = q.index(ticket)
+            ahead, before = 0, True
+            for user, other in self._queues.items():
+                if user == ticket.user:
+                    before = False
+                    ahead += k
+                    continue
+                # 轮转中排在前面的用户第 k 轮也先于本请求，后面的用户只算前 k 轮
+                ahead += min(len(other), k + 1 if before else k)
+            return ahead
+
+    def release(self, ticket: Ticket, used_tokens: int | None = None) -> None:
+        """请求结束：归还并发名额、退回多扣的 token；尚未放行的票据从队列移除。
+
+        used_tokens 为 None 表示没有产生用量（生成器未启动、上游未调用），预扣全部退回。
+        """
+        with self._lock:
+            if ticket.done:
+                return
+            ticket.done = True
+            if ticket.granted:
+                self.active -= 1
+                self.bucket.refund(min(ticket.tokens, self.bucket.capacity) - (used_tokens or 0))
+            else:
+                q = self._queues.get(ticket.user)
+                if q is not None and ticket in q:
+                    q.remove(ticket)
+                    self._waiting -= 1
+                    if not q:
+                        del self._queues[ticket.user]
+                self.cancelled += 1
+            self._dispatch()
+
+    # ── 等待 ─────────────────────────────────────────────────────
+    def wait(self, ticket: Ticket, timeout: float) -> bool:
+        """阻塞等待放行，最多 timeout 秒；返回是否已放行。"""
+        if not ticket.granted:
+            ticket._event.wait(timeout)
+            if not ticket.granted:
+                self.poll()
+        return ticket.granted
+
+    async def wait_async(self, ticket: Ticket, timeout: float) -> bool:
+        """wait 的协程版本，不占线程。"""
+        if not ticket.granted:
+            if ticket._future is None:
+                ticket._loop = asyncio.get_running_loop()
+                ticket._future = ticket._loop.create_future()
+                if ticket.granted:          # 创建 future 之前已被放行
+                    _resolve(ticket._future)
+            try:
+                await asyncio.wait_for(asyncio.shield(ticket._future), timeout)
+            except asyncio.TimeoutError:
+                self.poll()
+        return ticket.granted
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "active": self.active, "waiting": self._waiting,
+                "concurrency": self.concurrency, "tpm": self.bucket.capacity,
+                "granted": self.granted, "rejected": self.rejected,
+                "cancelled": self.cancelled, "max_wait_s": round(self.max_wait, 2),
+            }
+
+
+class AimdLimiter:
+    """按上游反馈自适应的并发上限（AIMD，批处理用，仅限单个事件循环内使用）。
+
+    首次拥塞前每个成功的请求把上限 +1（慢启动，每轮窗口翻倍），之后每个成功 +1/上限
+    （约每轮满窗口 +1）；429 / 超时把上限减半，同一轮窗口里先前发出的请求再报拥塞不重复减半。
+    Retry-After 由调用方对被拒的那个请求单独等待，不暂停其他请求。
+        limiter = AimdLimiter(initial=4, ceiling=64)
+        epoch = await limiter.acquire()
+        ...
+        await limiter.release(epoch, "ok")        # 或 "congestion" / "error"
+    """
+
+    def __init__(self, initial: int, ceiling: int, floor: int = 1) -> None:
+        self.floor = max(1, floor)
+        self.ceiling = max(self.floor, ceiling)
+        self.limit = float(min(self.ceiling, max(self.floor, initial)))
+        self.inflight = 0
+        self._epoch = 0                 # 每次减半 +1
+        self._slow_start = True         # 首次拥塞后转为线性增长
+        self._cond: asyncio.Condition | None = None
+        # 统计
+        self.peak = self.limit
+        self.cuts = 0
+
+    @property
+    def window(self) -> int:
+        return int(self.limit)
+
+    def _condition(self) -> asyncio.Condition:
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def acquire(self) -> int:
+        """等到在途请求数低于当前上限；返回本次请求所属的窗口编号。"""
+        cond = self._condition()
+        async with cond:
+            await cond.wait_for(lambda: self.inflight < self.window)
+            self.inflight += 1
+            return self._epoch
+
+    async def release(self, epoch: int, outcome: str) -> None:
+        """请求结束。outcome：ok / congestion（429、超时）/ error（其他失败，不调整上限）。"""
+        cond = self._condition()
+        async with cond:
+            self.inflight -= 1
+            if outcome == "ok":
+                step = 1.0 if self._slow_start else 1 / self.limit
+                self.limit = min(self.ceiling, self.limit + step)
+                self.peak = max(self.peak, self.limit)
+            elif outcome == "congestion" and epoch == self._epoch:
+                self._slow_start = False
+                self.limit = max(self.floor, self.limit / 2)
+                self._epoch += 1
+                self.cuts += 1
+            cond.notify_all()
+
+    def stats(self) -> dict:
+        return {"limit": self.window, "inflight": self.inflight,
+                "peak": int(self.peak), "cuts": self.cuts}
@@ -0,0 +1,136 @@
+"""AI 答疑缓存预热：按全体用户的错题统计，离线预生成热门错题的首轮解析
+
+quiz 的首轮答疑按 prompt 内容寻址缓存（见 chat_cache）。这里从进度库找出错误率最高的题
+和最常被选的错误选项，用与在线答疑完全相同的 prompt 与参数并发生成，写进同一个缓存文件；
+学生点开这些题的 AI 解析时直接命中，按流式节奏即时回放。
+
+用法：
+    hot = progress.get_hot_wrong_answers(db_path, limit=200)
+    targets = plan_targets(questions, hot, max_tokens=2048, thinking=None)
+    stats = warm_cache(targets, cache, client, model, provider, max_tokens=2048,
+                       thinking=None, workers=4)
+"""
+from __future__ import annotations
+
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, NamedTuple
+
+from med_exam_toolkit.ai.chat_cache import ChatCache, prompt_key
+from med_exam_toolkit.ai.client import chat_completion_stream
+from med_exam_toolkit.ai.cost import _CHARS_PER_TOKEN, estimate_prompt_tokens
+from med_exam_toolkit.ai.prompt import build_ai_chat_prompt
+from med_exam_toolkit.models import Question
+
+
+class WarmTarget(NamedTuple):
+    """一条待预生成的首轮答疑：某题某小题 + 学生的错误选择。"""
+    fingerprint: str
+    sq_index:    int
+    user_answer: str
+    wrong_rate:  float    # 该题的整体错误率
+    count:       int      # 选这个错误选项的次数
+    messages:    list[dict]
+    key:         str
+
+
+def plan_targets(questions: list[Question], hot: list[dict],
+                 max_tokens: int, thinking: bool | None) -> list[WarmTarget]:
+    """把 get_hot_wrong_answers 的排行转换成预生成任务，顺序即优先级。
+
+    题库里已找不到的指纹、越界的小题序号直接跳过；prompt 与 quiz 的 api_ai_chat 完全一致，
+    max_tokens / thinking 必须与 quiz 启动参数相同，否则缓存键对不上。
+    """
+    by_fp = {q.fingerprint: q for q in questions if q.fingerprint}
+    targets: list[WarmTarget] = []
+    for row in hot:
+        q = by_fp.get(row["fingerprint"])
+        if q is None:
+            continue
+        for sq_index, answer, count in row["answers"]:
+            if not 0 <= sq_index < len(q.sub_questions):
+                continue
+            messages = build_ai_chat_prompt(q, sq_index, answer)
+            targets.append(WarmTarget(row["fingerprint"], sq_index, answer, row["wrong_rate"],
+                                      count, messages, prompt_key(messages, max_tokens, thinking)))
+    return targets
+
+
+def _generate(target: WarmTarget, cache: ChatCache, client: Any, model: str, provider: str,
+              max_tokens: int, thinking: bool | None) -> tuple[str, int]:
+    """生成一条并写入缓存，返回 (状态, 估算 token)；状态为 ok / skip / 错误信息。"""
+    if cache.contains(target.key, model):
+        return "skip", 0
+    content: list[str] = []
+    reasoning: list[str] = []
+    truncated = done = False
+    for ev in chat_completion_stream(
+        client=client,
+        model=model,
+        messages=target.messages,
+        temperature=0.7,
+        max_tokens=max_tokens,
+        enable_thinking=thinking,
+        provider=provider,
+    ):
+        if ev.get("error"):
+            return ev["error"], 0
+        content.append(ev.get("content", ""))
+        reasoning.append(ev.get("reasoning", ""))
+        truncated = truncated or bool(ev.get("truncated"))
+        done = done or bool(ev.get("done"))
+    text = "".join(content)
+    if not done or not text:
+        return "AI 返回为空", 0
+    # token 估算与 quiz 在线答疑写缓存时一致
+    chars = len(text) + sum(map(len, reasoning))
+    tokens = (estimate_prompt_tokens(json.dumps(target.messages, ensure_ascii=False))
+              + int(chars / _CHARS_PER_TOKEN))
+    cache.put(target.key, model, text, "".join(reasoning), truncated, tokens)
+    return "ok", tokens
+
+
+def warm_cache(targets: list[WarmTarget], cache: ChatCache, client: Any, model: str,
+               provider: str, max_tokens: int, thinking: bool | None,
+               workers: int = 4) -> dict:
+    """并发预生成 targets，已在缓存中的跳过；逐条打印进度，返回统计。"""
+    total = len(targets)
+    stats = {"generated": 0, "skipped": 0, "failed": 0, "tokens": 0}
+    t0 = time.time()
+    digits = len(str(total))
+
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="ai-warm") as pool:
+        futures = {
+            pool.submit(_generate, t, cache, client, model, provider, max_tokens, thinking): t
+            for t in targets
+        }
+        try:
+            for n, future in enumerate(as_completed(futures), 1):
+                t = futures[future]
+                try:
+                    status, tokens = future.result()
+                except Exception as exc:  # noqa: BLE001
+                    status, tokens = f"异常: {exc}", 0
+                if status == "ok":
+                    stats["generated"] += 1
+                    stats["tokens"] += tokens
+                    mark = "✅"
+                elif status == "skip":
+                    stats["skipped"] += 1
+                    mark = "⏭ "
+                else:
+                    stats["failed"] += 1
+                    mark = "❌"
+                print(f"  [{n:>{digits}}/{total}] {mark} {t.fingerprint[:10]} 小题{t.sq_index + 1} "
+                      f"选{t.user_answer:<4} 错误率 {t.wrong_rate:.0%}  {t.count} 人次"
+                      + ("" if status in ("ok", "skip") else f"  {status[:40]}"))
+        except KeyboardInterrupt:
+            print("\n  ⚠️  Ctrl+C 中断，已生成的条目已写入缓存")
+            for f in futures:
+                f.cancel()
+            pool.shutdown(wait=False, cancel_futures=True)
+            stats["interrupted"] = True
+
+    stats["elapsed"] = round(time.time() - t0, 1)
+    return stats
@@ -25,11 +25,12 @@ from __future__ import annotations
 import hashlib
 import hmac
 import secrets
-import threading
 import time
 
 from flask import request
 
+from med_exam_toolkit.state import MemoryStore, StateStore
+
 _CHARSET  = "ABCDEFGHJKMNPQRTUVWXY346789"
 _CODE_LEN = 8
 _AUTH_COOKIE = "med_exam_auth"
@@ -104,31 +105,35 @@ _CAPTCHA_THRESHOLD = 3   # 累计失败几次后要求验证码
 
 # 递进封锁：(累计失败次数, 封锁秒数)
 _LOCK_STAGES = [(5, 300), (10, 3600), (20, 86400)]
+_BRUTE_TTL = _LOCK_STAGES[-1][1]   # 最后一次失败后保留计数的时长
+
+# 暴破计数与验证码存放在 StateStore 中；quiz 多进程运行时换成共享的 SQLiteStore
+_store: StateStore = MemoryStore()
 
-_brute: dict[str, dict] = {}
-_brute_lock = threading.Lock()
+
+def use_store(store: StateStore) -> None:
+    """切换暴破计数与验证码的存储。"""
+    global _store
+    _store = store
 
 
 def check_brute_force(ip: str) -> tuple[bool, int]:
     """返回 (allowed, retry_after_seconds)。"""
-    now = time.monotonic()
-    with _brute_lock:
-        state = _brute.get(ip)
-        if not state:
-            return True, 0
-        locked_until = state.get("locked_until", 0)
-        if locked_until > now:
-            return False, int(locked_until - now)
-        state["failures"] = [t for t in state["failures"] if now - t < _WINDOW_SEC]
+    now = time.time()
+    state = _store.get("auth_brute", ip)
+    if not state:
         return True, 0
+    locked_until = state.get("locked_until", 0)
+    if locked_until > now:
+        return False, int(locked_until - now)
+    return True, 0
 
 
 def record_failure(ip: str) -> None:
-    now = time.monotonic()
-    with _brute_lock:
-        if ip not in _brute:
-            _brute[ip] = {"failures": [], "locked_until": 0, "total": 0}
-        state = _brute[ip]
+    now = time.time()
+
+    def fn(state):
+        state = state or {"failures": [], "locked_until": 0, "total": 0}
         state["failures"] = [t for t in state["failures"] if now - t < _WINDOW_SEC]
         state["failures"].append(now)
         state["total"] = state.get("total", 0) + 1
@@ -138,18 +143,19 @@ def record_failure(ip: str) -> None:
                 state["locked_until"] = now + secs
                 state["failures"] = []
                 break
+        return state
+
+    _store.update("auth_brute", ip, fn, ttl=_BRUTE_TTL)
 
 
 def record_success(ip: str) -> None:
-    with _brute_lock:
-        _brute.pop(ip, None)
+    _store.pop("auth_brute", ip)
 
 
 def needs_captcha(ip: str) -> bool:
     """累计失败次数达到阈值后要求验证码。"""
-    with _brute_lock:
-        state = _brute.get(ip)
-        return bool(state and state.get("total", 0) >= _CAPTCHA_THRESHOLD)
+    state = _store.get("auth_brute", ip)
+    return bool(state and state.get("total", 0) >= _CAPTCHA_THRESHOLD)
 
 
 # ── 图形验证码（SVG 数学题） ──────────────────────────────────────────────
@@ -157,8 +163,7 @@ def needs_captcha(ip: str) -> bool:
 import secrets as _secrets
 import html as _html
 
-_captchas: dict[str, dict] = {}   # token → {answer, expires}
-_captcha_lock = threading.Lock()
+_CAPTCHA_TTL = 300   # 5 分钟
 
 
 def new_captcha() -> tuple[str, str]:
@@ -185,15 +190,7 @@ def new_captcha() -> tuple[str, str]:
         question, answer = f"{dividend} ÷ {divisor} = ?", quotient
 
     token = _secrets.token_hex(12)
-    expires = time.monotonic() + 300   # 5 分钟
-
-    with _captcha_lock:
-        _captchas[token] = {"answer": answer, "expires": expires}
-        # 清理过期
-        now = time.monotonic()
-        expired = [k for k, v in _captchas.items() if v["expires"] < now]
-        for k in expired:
-            del _captchas[k]
+    _store.set("captcha", token, answer, ttl=_CAPTCHA_TTL)   # 过期后自动失效
 
     svg = _render_captcha_svg(question)
     return token, svg
@@ -203,14 +200,13 @@ def verify_captcha(token: str, answer: str, ip: str = "") -> bool:
     """校验验证码（单次有效）。
     答案错误或 token 过期均调用 record_failure(ip)，防止暴力破解验证码。
     """
-    with _captcha_lock:
-        entry = _captchas.pop(token, None)
-    if not entry or time.monotonic() > entry["expires"]:
+    expected = _store.pop("captcha", token)
+    if expected is None:
         if ip:
             record_failure(ip)
         return False
     try:
-        ok = int(answer.strip()) == entry["answer"]
+        ok = int(answer.strip()) == expected
     except (ValueError, AttributeError):
         ok = False
     if not ok and ip:
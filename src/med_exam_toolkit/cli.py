@@ -176,6 +176,9 @@ def export(ctx, input_dir, output_dir, formats, split_options, dedup, strategy,
 @click.option("--difficulty-mode", type=click.Choice(["global", "per_mode"]), default="global",
               help="难度分配策略: global=先难度后题型(默认), per_mode=先题型后难度")
 @click.option("--seed", default=None, type=int, help="随机种子 (固定种子可复现)")
+@click.option("--copies", default=1, type=click.IntRange(min=1), help="一次生成的平行试卷份数")
+@click.option("--max-overlap", default=1.0, type=click.FloatRange(0, 1),
+              help="多份试卷间的最大重复率 (0~1), 如 0.2 表示任意两份最多 20% 相同")
 @click.option("--show-answers/--hide-answers", default=False, help="题目中显示答案")
 @click.option("--answer-sheet/--no-answer-sheet", default=True, help="末尾附答案页")
 @click.option("--show-discuss/--no-discuss", default=False, help="答案页附解析")
@@ -187,8 +190,8 @@ def export(ctx, input_dir, output_dir, formats, split_options, dedup, strategy,
 @click.option("--password", default=None, help="题库解密密码")
 @click.pass_context
 def generate(ctx, input_dir, output, title, subtitle, cls, unit, mode, count, count_mode,
-             per_mode, difficulty, difficulty_mode, seed, show_answers, answer_sheet,
-             show_discuss, total_score, score, time_limit, dedup, bank, password):
+             per_mode, difficulty, difficulty_mode, seed, copies, max_overlap, show_answers,
+             answer_sheet, show_discuss, total_score, score, time_limit, dedup, bank, password):
     """自动组卷: 随机抽题 → 导出 Word 试卷"""
 
     cfg = ctx.obj["config"]
@@ -240,6 +243,8 @@ def generate(ctx, input_dir, output, title, subtitle, cls, unit, mode, count, co
         difficulty_dist=diff_dist or None,
         difficulty_mode = difficulty_mode,
         seed=seed,
+        copies=copies,
+        max_overlap=max_overlap,
         show_answers=show_answers,
         answer_sheet=answer_sheet,
         show_discuss=show_discuss,
@@ -249,16 +254,26 @@ def generate(ctx, input_dir, output, title, subtitle, cls, unit, mode, count, co
     # 生成
     try:
         gen = ExamGenerator(questions, exam_cfg)
-        selected = gen.generate()
-        click.echo(gen.summary(selected))
+        papers = gen.generate_batch()
     except ExamGenerationError as e:
         click.echo(f"[ERROR] {e}")
         sys.exit(1)
 
-    # 导出
+    # 导出（多份时输出 exam_01.docx, exam_02.docx ...）
     exporter = ExamDocxExporter(exam_cfg)
-    fp = exporter.export(selected, Path(output))
-    click.echo(f"✅ 试卷已生成: {fp}")
+    for n, selected in enumerate(papers, 1):
+        if copies > 1:
+            click.echo(f"\n── 第 {n}/{copies} 份 ──")
+        click.echo(gen.summary(selected))
+        out = Path(output)
+        if copies > 1:
+            # 序号加在扩展名之前：paper.docx → paper_01.docx（导出器会 with_suffix）
+            out = out.with_name(f"{out.stem}_{n:02d}{out.suffix}")
+        fp = exporter.export(selected, out)
+        click.echo(f"✅ 试卷已生成: {fp}")
+    if copies > 1:
+        worst = max(gen.overlap(a, b) for i, a in enumerate(papers) for b in papers[i + 1:])
+        click.echo(f"📊 {copies} 份试卷，两两最大重复率 {worst:.0%}")
 
 @cli.command()
 @click.option("-i", "--input-dir", default=None, help="JSON 文件目录")
@@ -465,7 +480,16 @@ def reindex(ctx, bank, password):
 @click.option("--model", default="", help="模型名")
 @click.option("--api-key", default="", envvar="OPENAI_API_KEY", help="API Key（也可用环境变量 OPENAI_API_KEY）")
 @click.option("--base-url", default="", help="自定义 API Base URL")
-@click.option("--max-workers", default=0, type=int, help="并发数（默认 4）")
+@click.option("--max-workers", default=0, type=int,
+              help="并发数（默认 4）；async 引擎下为起始并发")
+@click.option("--engine", type=click.Choice(["async", "threads"]), default=None,
+              help="async（默认）：按 429/超时自适应并发；threads：固定 --max-workers 个线程")
+@click.option("--max-concurrency", default=0, type=int,
+              help="async 引擎的并发上限（默认 --max-workers × 8）")
+@click.option("--rpm", default=None, type=click.IntRange(min=0),
+              help="每分钟请求数配额（默认取 config.yaml ai.rate_limits.<provider>.rpm，0=不限）")
+@click.option("--tpm", default=None, type=click.IntRange(min=0),
+              help="每分钟 token 配额（默认取 config.yaml ai.rate_limits.<provider>.tpm，0=不限）")
 @click.option("--resume/--no-resume", default=True, help="是否断点续跑")
 @click.option("--checkpoint-dir", default="", help="断点目录")
 @click.option("--mode", "filter_modes", multiple=True, help="仅处理指定题型，如 A1型题")
@@ -485,9 +509,9 @@ def reindex(ctx, bank, password):
 @click.option("--thinking/--no-thinking", default=None,
               help="混合思考模型（如 Qwen3）是否开启深度思考；纯推理模型（o1/R1）忽略此参数")
 def enrich(bank, input_dir, output, password, provider, model, api_key, base_url,
-           max_workers, resume, checkpoint_dir, filter_modes, filter_units,
-           limit, dry_run, only_missing, apply_ai, in_place, write_json,
-           timeout, thinking):
+           max_workers, engine, max_concurrency, rpm, tpm, resume, checkpoint_dir,
+           filter_modes, filter_units, limit, dry_run, only_missing, apply_ai,
+           in_place, write_json, timeout, thinking):
     """AI 补全题库：为缺答案/缺解析的小题自动生成内容
 
     \b
@@ -522,6 +546,11 @@ def enrich(bank, input_dir, output, password, provider, model, api_key, base_url
     api_key        = api_key        or ai_cfg.get("api_key",        "")
     base_url       = base_url       or ai_cfg.get("base_url",       "")
     max_workers    = max_workers    or int(ai_cfg.get("max_workers", 4))
+    engine         = engine         or ai_cfg.get("engine",         "async")
+    max_concurrency = max_concurrency or int(ai_cfg.get("max_concurrency", 0))
+    quota          = (ai_cfg.get("rate_limits") or {}).get(provider.lower().strip()) or {}
+    rpm            = int(quota.get("rpm", 0)) if rpm is None else rpm
+    tpm            = int(quota.get("tpm", 0)) if tpm is None else tpm
     checkpoint_dir = checkpoint_dir or ai_cfg.get("checkpoint_dir", "data/checkpoints")
 
     if not bank and not input_dir:
@@ -571,6 +600,10 @@ def enrich(bank, input_dir, output, password, provider, model, api_key, base_url
         api_key=api_key,
         base_url=base_url,
         max_workers=max_workers,
+        engine=engine,
+        max_concurrency=max_concurrency,
+        rpm=rpm,
+        tpm=tpm,
         resume=resume,
         checkpoint_dir=Path(checkpoint_dir),
         modes_filter=list(filter_modes),
@@ -586,6 +619,86 @@ def enrich(bank, input_dir, output, password, provider, model, api_key, base_url
     )
     enricher.run()
 
+@cli.command("ai-warm")
+@click.option("--bank", required=True, type=click.Path(exists=True), help=".mqb 题库路径")
+@click.option("--password", default=None, help="题库密码")
+@click.option("--db", default=None, type=click.Path(exists=True, dir_okay=False),
+              help="进度数据库（默认题库旁的 .progress.db）")
+@click.option("--cache", default="", help="AI 答疑缓存文件（默认题库旁的 ai_chat_cache.db，与 quiz 相同）")
+@click.option("--provider", default="", help="AI provider（须与 quiz 的 --ai-provider 一致）")
+@click.option("--model", default="", help="模型名（须与 quiz 的 --ai-model 一致）")
+@click.option("--api-key", default="", envvar="OPENAI_API_KEY", help="API Key（也可用环境变量 OPENAI_API_KEY）")
+@click.option("--base-url", default="", help="自定义 API Base URL")
+@click.option("--max-tokens", default=0, type=int, help="单次最大输出 token（须与 quiz 的 --ai-max-tokens 一致，0=默认 2048）")
+@click.option("--thinking/--no-thinking", default=None, help="混合思考模型的思考开关（须与 quiz 一致）")
+@click.option("--limit", default=200, type=click.IntRange(min=1), help="按错误率取前多少道题（默认 200）")
+@click.option("--per-question", default=2, type=click.IntRange(min=1), help="每道题预生成几个最常见的错误选项（默认 2）")
+@click.option("--min-attempts", default=5, type=click.IntRange(min=1), help="作答少于此次数的题不参与排名（默认 5）")
+@click.option("--workers", default=4, type=click.IntRange(min=1), help="并发请求数（默认 4）")
+@click.option("--cache-ttl", default=30, type=click.IntRange(min=1), help="缓存有效期（天，须与 quiz 一致）")
+@click.option("--cache-max", default=5000, type=click.IntRange(min=1), help="缓存最多条目数（须与 quiz 一致）")
+@click.option("--dry-run", is_flag=True, help="只列出待生成的题目，不调用 AI")
+@click.pass_context
+def ai_warm(ctx, bank, password, db, cache, provider, model, api_key, base_url, max_tokens,
+            thinking, limit, per_question, min_attempts, workers, cache_ttl, cache_max, dry_run):
+    """按全体用户的错题统计，预生成热门错题的 AI 首轮解析
+
+    \b
+    从进度库按错误率排出高错题，每题取最常被选的错误选项，用与 quiz 在线答疑
+    完全相同的 prompt 并发生成，写入 quiz 的 AI 答疑缓存；已缓存的条目跳过。
+    学生之后点开这些题的 AI 解析会直接命中缓存、即时回放。
+    模型、--max-tokens、--thinking 须与 quiz 启动参数一致，否则缓存键对不上。
+    错误选项来自升级后记录的作答明细（progress compact 合并过的历史不含选项）。
+    示例：med-exam ai-warm --bank 内科.mqb --limit 300 --workers 8
+    """
+    from med_exam_toolkit import progress
+    from med_exam_toolkit.ai.chat_cache import ChatCache, default_cache_path
+    from med_exam_toolkit.ai.client import default_model, make_client
+    from med_exam_toolkit.ai.warm import plan_targets, warm_cache
+    from med_exam_toolkit.models import sanitize_questions
+
+    ai_cfg = (ctx.obj or {}).get("config", {}).get("ai", {})
+    provider   = provider or ai_cfg.get("provider", "")
+    model      = model    or ai_cfg.get("model", "") or (default_model(provider) if provider else "")
+    api_key    = api_key  or ai_cfg.get("api_key", "")
+    base_url   = base_url or ai_cfg.get("base_url", "")
+    max_tokens = max_tokens if max_tokens > 0 else 2048
+
+    bank_path = Path(bank).resolve()
+    db_path = Path(db) if db else progress.db_path_for_bank(bank_path)
+    if not db_path.exists():
+        raise click.UsageError(f"未找到进度数据库: {db_path}")
+    progress.init_db(db_path)
+
+    # 与 quiz 加载题库时一致：先修正答案/解析对调，prompt 才能逐字相同
+    questions = load_bank(bank_path, password)
+    sanitize_questions(questions)
+    hot = progress.get_hot_wrong_answers(db_path, limit=limit, min_attempts=min_attempts,
+                                         per_question=per_question)
+    targets = plan_targets(questions, hot, max_tokens, thinking)
+    click.echo(f"[INFO] 高错题 {len(hot)} 道，待预生成 {len(targets)} 条"
+               f"（{sum(1 for h in hot if not h['answers'])} 道暂无错误选项记录）")
+    if dry_run:
+        for t in targets:
+            click.echo(f"  {t.fingerprint[:10]} 小题{t.sq_index + 1} 选{t.user_answer:<4} "
+                       f"错误率 {t.wrong_rate:.0%}  {t.count} 人次")
+        return
+    if not targets:
+        return
+    if not provider or not api_key:
+        raise click.UsageError("请指定 --provider 与 --api-key（或在 config.yaml 的 ai 段配置）")
+
+    cache_path = Path(cache) if cache else default_cache_path(bank_path)
+    chat_cache = ChatCache(cache_path, ttl=cache_ttl * 86400, max_entries=cache_max)
+    client = make_client(provider=provider, api_key=api_key, base_url=base_url, model=model)
+    click.echo(f"[INFO] 模型 {model}，缓存 {cache_path}，并发 {workers}")
+    r = warm_cache(targets, chat_cache, client, model, provider, max_tokens, thinking,
+                   workers=workers)
+    s = chat_cache.stats()
+    click.echo(f"[INFO] 新生成 {r['generated']} 条，已缓存跳过 {r['skipped']} 条，失败 {r['failed']} 条，"
+               f"约 {r['tokens']} token，耗时 {r['elapsed']}s；缓存共 {s['entries']} 条")
+    chat_cache.close()
+
 @cli.command()
 @click.option("--bank", required=True, type=click.Path(exists=True), help=".mqb 题库路径")
 @click.option("--password", default=None, help="题库密码")
@@ -613,6 +726,31 @@ def inspect(bank, password, filter_modes, filter_units, keyword,
     run_inspect(bank, password, filter_modes, filter_units, keyword,
                 has_ai, missing, limit, full, show_ai)
 
+def _server_options(f):
+    """quiz / edit 共用的服务器选项。"""
+    for opt in reversed([
+        click.option("--server", default="werkzeug", type=click.Choice(["werkzeug", "gunicorn", "asyncio"]),
+                     help="HTTP 服务器：werkzeug（默认）、gunicorn（生产，需 pip install med-exam-kit[server]）"
+                          "或 asyncio（AI 流 / 语音识别长连接不占线程）"),
+        click.option("--threads", default=32, type=click.IntRange(min=1),
+                     help="每个 worker 的线程数（gunicorn 下 SSE / WebSocket 长连接各占一个；asyncio 下只处理普通请求）"),
+        click.option("--keepalive", default=5, type=click.IntRange(min=0),
+                     help="keep-alive 空闲超时（秒，gunicorn / asyncio）"),
+        click.option("--backlog", default=2048, type=click.IntRange(min=1),
+                     help="gunicorn 监听队列长度，超出并发的连接在此排队"),
+        click.option("--max-connections", default=1000, type=click.IntRange(min=1),
+                     help="gunicorn 每个 worker 同时持有的最大连接数"),
+    ]):
+        f = opt(f)
+    return f
+
+
+def _make_server_options(server, threads, keepalive, backlog, max_connections):
+    from med_exam_toolkit.serving import ServerOptions
+    return ServerOptions(server=server, threads=threads, keepalive=keepalive,
+                         backlog=backlog, max_connections=max_connections)
+
+
 @cli.command()
 @click.option("--bank", required=True, type=click.Path(exists=True), help=".mqb 题库路径")
 @click.option("--password", default=None, help="题库密码")
@@ -620,8 +758,10 @@ def inspect(bank, password, filter_modes, filter_units, keyword,
 @click.option("--host", default="127.0.0.1", help="监听地址（默认 127.0.0.1）")
 @click.option("--no-browser", is_flag=True, default=False, help="不自动打开浏览器")
 @click.option("--no-pin", is_flag=True, default=False, help="禁用访问码验证（仅限受信任的本地网络）")
+@_server_options
 @click.pass_context
-def edit(ctx, bank, password, port, host, no_browser, no_pin):
+def edit(ctx, bank, password, port, host, no_browser, no_pin,
+         server, threads, keepalive, backlog, max_connections):
     """在浏览器中编辑题库（本地 Web 编辑器）
 
     \b
@@ -639,7 +779,8 @@ def edit(ctx, bank, password, port, host, no_browser, no_pin):
     from med_exam_toolkit.editor import start_editor
     start_editor(bank, port=port, host=host, no_browser=no_browser, password=password,
                  no_pin=no_pin, s3_endpoint=s3_endpoint, s3_bucket=s3_bucket,
-                 s3_access_key=s3_access_key, s3_secret_key=s3_secret_key)
+                 s3_access_key=s3_access_key, s3_secret_key=s3_secret_key,
+                 server=_make_server_options(server, threads, keepalive, backlog, max_connections))
 
 @cli.command()
 @click.option("--bank", "-b", "banks", multiple=True, type=click.Path(exists=True),
@@ -657,15 +798,28 @@ def edit(ctx, bank, password, port, host, no_browser, no_pin):
 @click.option("--ai-base-url", default="", help="AI API Base URL（自定义端点）")
 @click.option("--ai-thinking/--ai-no-thinking", default=None, help="混合思考模型的思考开关")
 @click.option("--ai-max-tokens", default=0, type=int, help="AI 单次最大输出 token 数（0=默认 2048）")
+@click.option("--ai-concurrency", default=None, type=click.IntRange(min=0),
+              help="同时请求 AI 上游的流数，超出的按用户轮转排队（默认 8，0=不限）")
+@click.option("--ai-tpm", default=None, type=click.IntRange(min=0),
+              help="AI 上游每分钟 token 预算（默认 0=不限）")
+@click.option("--ai-cache", default="", help="AI 首轮答疑缓存文件（默认题库旁的 ai_chat_cache.db）")
+@click.option("--ai-cache-ttl", default=30, type=click.IntRange(min=1), help="AI 缓存有效期（天，默认 30）")
+@click.option("--ai-cache-max", default=5000, type=click.IntRange(min=1), help="AI 缓存最多条目数（默认 5000）")
+@click.option("--no-ai-cache", is_flag=True, default=False, help="关闭 AI 答疑缓存")
 @click.option("--asr-key", default="", help="ASR API Key（DashScope）")
 @click.option("--asr-model", default="", help="ASR 模型名（默认 qwen3-asr-flash）")
 @click.option("--asr-base-url", default="", help="ASR WebSocket URL")
 @click.option("--cleanup-days", default=0, type=int, help="不活跃用户数据保留天数（0=默认 7 天）")
 @click.option("--debug", is_flag=True, default=False, help="启用调试端点（仅排障用，切勿在生产环境开启）")
+@click.option("--workers", default=1, type=click.IntRange(min=1), help="worker 进程数（>1 时多进程共享端口，仅 POSIX）")
+@click.option("--state-db", default="", help="共享运行时状态的 SQLite 文件（多进程时默认放在进度库旁边）")
+@_server_options
 @click.pass_context
 def quiz(ctx, banks, password, port, host, no_browser, no_record, no_pin, pin,
          ai_provider, ai_model, ai_key, ai_base_url, ai_thinking, ai_max_tokens,
-         asr_key, asr_model, asr_base_url, cleanup_days, debug):
+         ai_concurrency, ai_tpm, ai_cache, ai_cache_ttl, ai_cache_max, no_ai_cache,
+         asr_key, asr_model, asr_base_url, cleanup_days, debug, workers, state_db,
+         server, threads, keepalive, backlog, max_connections):
     """启动医考练习 Web 应用（练习/考试/背题模式，支持多题库）
 
     \b
@@ -674,6 +828,8 @@ def quiz(ctx, banks, password, port, host, no_browser, no_record, no_pin, pin,
     多题库示例：med-exam quiz -b 内科.mqb -b 外科.mqb
     AI 答疑：  med-exam quiz -b x.mqb --ai-provider qwen --ai-key sk-xxx
     语音识别：  med-exam quiz -b x.mqb --asr-key sk-xxx
+    多进程：    med-exam quiz -b x.mqb --host 0.0.0.0 --workers 4
+    生产部署：  med-exam quiz -b x.mqb --server gunicorn --workers 4 --threads 64
     按 Ctrl+C 退出
     """
     if not banks:
@@ -686,6 +842,10 @@ def quiz(ctx, banks, password, port, host, no_browser, no_record, no_pin, pin,
     ai_model    = ai_model    or ai_cfg.get("model", "")
     ai_key      = ai_key      or ai_cfg.get("api_key", "")
     ai_base_url = ai_base_url or ai_cfg.get("base_url", "")
+    if ai_concurrency is None:
+        ai_concurrency = int(ai_cfg.get("concurrency", 8))
+    if ai_tpm is None:
+        ai_tpm = int(ai_cfg.get("tpm", 0))
     asr_cfg = ctx_cfg.get("asr", {})
     asr_key      = asr_key      or asr_cfg.get("api_key", "")
     asr_model    = asr_model    or asr_cfg.get("model", "")
@@ -697,8 +857,54 @@ def quiz(ctx, banks, password, port, host, no_browser, no_record, no_pin, pin,
                ai_provider=ai_provider, ai_model=ai_model,
                ai_api_key=ai_key, ai_base_url=ai_base_url,
                ai_thinking=ai_thinking, ai_max_tokens=ai_max_tokens,
+               ai_concurrency=ai_concurrency, ai_tpm=ai_tpm,
+               ai_cache=ai_cache, ai_cache_ttl_days=ai_cache_ttl, ai_cache_max=ai_cache_max,
+               no_ai_cache=no_ai_cache,
                asr_api_key=asr_key, asr_model=asr_model, asr_base_url=asr_base_url,
-               cleanup_days=cleanup_days, debug=debug)
+               cleanup_days=cleanup_days, debug=debug,
+               workers=workers, state_db=state_db,
+               server=_make_server_options(server, threads, keepalive, backlog, max_connections))
+
+
+@cli.group("progress")
+def progress_group():
+    """做题进度数据库（.progress.db）维护"""
+
+
+@progress_group.command("compact")
+@click.option("--bank", "-b", "banks", multiple=True, type=click.Path(exists=True),
+              help=".mqb 题库路径，处理与之同目录的 .progress.db（可重复）")
+@click.option("--db", "dbs", multiple=True, type=click.Path(exists=True, dir_okay=False),
+              help="直接指定 .progress.db 路径（可重复）")
+@click.option("--days", default=90, type=click.IntRange(min=0), help="保留逐条明细的天数（默认 90）")
+@click.option("--vacuum/--no-vacuum", default=True, help="压缩后做增量 VACUUM 归还磁盘空间")
+def progress_compact(banks, dbs, days, vacuum):
+    """把早于保留期的逐条作答记录合并为按天汇总，并回收空间
+
+    \b
+    错题本、统计、复习队列的结果不受影响；只丢失同一天内每次作答的先后、所属会话与所选选项。
+    可在 quiz 服务运行时执行（分批提交）。首次执行会做一次完整 VACUUM。
+    示例：med-exam progress compact -b 内科.mqb --days 30
+    """
+    from med_exam_toolkit import progress
+
+    paths = [progress.db_path_for_bank(Path(b)) for b in banks] + [Path(d) for d in dbs]
+    if not paths:
+        raise click.UsageError("请用 -b 指定题库或用 --db 指定进度数据库")
+    for db in paths:
+        if not db.exists():
+            click.echo(f"[WARN] 未找到进度数据库: {db}")
+            continue
+        progress.init_db(db)
+        r = progress.compact_attempts(db, older_than_days=days, vacuum=vacuum)
+        click.echo(f"[INFO] {db.name}: 合并 {r['rows_compacted']} 条作答 → "
+                   f"{r['daily_rows']} 条日汇总")
+        click.echo(f"       占用 {r['bytes_before'] / 1048576:.1f} MB → "
+                   f"{r['bytes_after'] / 1048576:.1f} MB（回收 {r['reclaimed'] / 1048576:.1f} MB）"
+                   + ("，已转换为增量 VACUUM 模式" if r["vacuum_converted"] else ""))
+        for name, (before, after) in r["queries"].items():
+            speedup = f"{before / after:.1f}x" if after else "-"
+            click.echo(f"       {name}: {before:.1f} ms → {after:.1f} ms（{speedup}）")
 
 
 def main():
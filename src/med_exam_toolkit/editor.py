@@ -14,6 +14,9 @@ from typing import Any
 
 from flask import Flask, jsonify, request, render_template, make_response
 from flask_compress import Compress
+from med_exam_toolkit.json_provider import install_json_provider
+from med_exam_toolkit.serving import ServerOptions, describe, run_asyncio, run_gunicorn
+from med_exam_toolkit.static_assets import StaticAssets
 
 # ── 全局状态 ──
 _questions:     list        = []
@@ -75,7 +78,9 @@ app.config["JSON_AS_ASCII"] = False
 # 防止超大请求体导致 OOM：编辑器只处理题库文件，限制为 64 MB
 # 超过此限制 Flask 自动返回 413 Request Entity Too Large
 app.config["MAX_CONTENT_LENGTH"] = 64 * 1024 * 1024  # 64 MB
+install_json_provider(app)
 Compress(app)
+_static = StaticAssets(app)
 
 
 @app.errorhandler(413)
@@ -676,7 +681,8 @@ def start_editor(bank_path: str, port: int = 5173, host: str = "127.0.0.1",
                  no_browser: bool = False, password: str | None = None,
                  no_pin: bool = False,
                  s3_endpoint: str = "", s3_bucket: str = "",
-                 s3_access_key: str = "", s3_secret_key: str = "") -> None:
+                 s3_access_key: str = "", s3_secret_key: str = "",
+                 server: ServerOptions | None = None) -> None:
     from med_exam_toolkit.bank import load_bank
     from med_exam_toolkit.auth import generate_access_code
 
@@ -688,7 +694,7 @@ def start_editor(bank_path: str, port: int = 5173, host: str = "127.0.0.1",
     _server_port   = port
     _server_host   = host
     _session_token = secrets.token_hex(32)
-    _asset_ver     = secrets.token_hex(8)
+    _asset_ver     = _static.load(precompress=False)
     _s3_endpoint   = s3_endpoint
     _s3_bucket     = s3_bucket
     _s3_access_key = s3_access_key
@@ -731,11 +737,22 @@ def start_editor(bank_path: str, port: int = 5173, host: str = "127.0.0.1",
         print()
         print("  ⚠️  访问码验证已关闭（--no-pin），任何人可直接访问")
         print()
+    # 题库在内存中编辑、由 _write_lock 串行保存，只能单进程运行
+    opts = (server or ServerOptions()).resolve()
+    print(f"[INFO] 服务器: {describe(opts)}")
+    # gunicorn 的 worker 由 fork 得到，预压缩要在 fork 前完成
+    _static.precompress(background=opts.server != "gunicorn")
     print("[INFO] 按 Ctrl+C 退出")
 
     if not no_browser:
         threading.Timer(0.8, lambda: webbrowser.open(local_url)).start()
 
+    if opts.server == "gunicorn":
+        run_gunicorn(app, host, port, opts)
+        return
+    if opts.server == "asyncio":
+        run_asyncio(app, host, port, opts)
+        return
     # threaded=True：每个请求在独立线程中处理，支持多用户并发访问
     # 写操作已通过 _write_lock (RLock) 保护，读操作无锁并发安全
     app.run(host=host, port=port, debug=False, use_reloader=False, threaded=True)
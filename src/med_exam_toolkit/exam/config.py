@@ -23,6 +23,8 @@ class ExamConfig:
     difficulty_mode: str = "global"  # "global" = 方案A(先难度后题型), "per_mode" = 方案B(先题型后难度)
 
     seed: int | None = None
+    copies: int = 1                          # 一次生成的平行试卷份数
+    max_overlap: float = 1.0                 # 任意两份试卷的最大重复率 (0~1)
     show_answers: bool = False
     answer_sheet: bool = True
     show_discuss: bool = False
@@ -0,0 +1,81 @@
+"""按"花费"凑满目标数量的抽题器（有界子集和）
+
+组卷与刷题抽样都要解决同一个问题：从一个已排好优先级的候选列表里挑一批题，
+使花费（小题数 / 大题数）之和恰好等于目标。小题模式下一道 A3/A4 题的花费是
+它的子题数，单纯贪心经常差一两道凑不满。
+
+fill_exact 先走一遍贪心（与旧实现结果一致，绝大多数情况直接命中），
+命中不了再按"不同花费值"做有界背包，求出 ≤ target 的最大可达和。
+同一花费的题目按候选列表中的先后取用，因此调用方的打乱 / 排序仍然有效。
+复杂度 O(k·target)，k 为不同花费值的个数（通常只有 1~5 种）。
+"""
+from __future__ import annotations
+
+from typing import Callable, Sequence, TypeVar
+
+T = TypeVar("T")
+
+
+def fill_exact(items: Sequence[T], target: int, cost: Callable[[T], int]) -> list[T]:
+    """从 items 中挑出花费之和尽量接近且不超过 target 的子集
+
+    可行时保证恰好等于 target；返回的题目保持 items 中的相对顺序。
+    花费 ≤ 0 的条目不参与凑数。
+    """
+    if target <= 0 or not items:
+        return []
+    costs = [cost(it) for it in items]
+
+    # 第一轮：贪心，能命中就沿用（保持与旧版一致的抽题结果）
+    picked_idx: list[int] = []
+    total = 0
+    for i, c in enumerate(costs):
+        if 0 < c and total + c <= target:
+            picked_idx.append(i)
+            total += c
+            if total == target:
+                return [items[i] for i in picked_idx]
+    if total == sum(c for c in costs if c > 0):
+        # 全部用上也不超过 target，没有更好的选法
+        return [items[i] for i in picked_idx]
+
+    # 第二轮：按花费值分组做有界背包
+    by_cost: dict[int, list[int]] = {}
+    for i, c in enumerate(costs):
+        if 0 < c <= target:
+            by_cost.setdefault(c, []).append(i)
+
+    # grp[s]：和 s 首次可达时所在的分组；take[s]：该分组里用了几个
+    groups = list(by_cost.items())
+    grp = [-1] * (target + 1)
+    take = [0] * (target + 1)
+    reach = bytearray(target + 1)
+    reach[0] = 1
+    for g, (c, idxs) in enumerate(groups):
+        limit = len(idxs)
+        used = [0] * (target + 1)
+        for s in range(c, target + 1):
+            if not reach[s] and reach[s - c] and used[s - c] < limit:
+                reach[s] = 1
+                used[s] = used[s - c] + 1
+                grp[s] = g
+                take[s] = used[s]
+            if reach[target]:
+                break
+        if reach[target]:
+            break
+
+    best = target
+    while not reach[best]:
+        best -= 1
+    if best <= total:
+        return [items[i] for i in picked_idx]
+
+    chosen: list[int] = []
+    s = best
+    while s > 0:
+        c, idxs = groups[grp[s]]
+        chosen.extend(idxs[:take[s]])
+        s -= c * take[s]
+    chosen.sort()
+    return [items[i] for i in chosen]
@@ -2,8 +2,10 @@
 from __future__ import annotations
 import random
 from collections import Counter, defaultdict
+from dataclasses import replace
 from med_exam_toolkit.models import Question
 from med_exam_toolkit.exam.config import ExamConfig
+from med_exam_toolkit.exam.fill import fill_exact
 
 DIFFICULTY_LABELS = {
     "easy": "简单",
@@ -24,6 +26,8 @@ class ExamGenerator:
         self.config = config
         self._rng = random.Random(config.seed)
         self._by_sub = config.count_mode == "sub"
+        # 多份试卷时记录每道题已被用过几次，后续试卷优先抽未用过的题
+        self._usage: Counter = Counter()
 
     # ── 计数工具 ──
 
@@ -44,73 +48,31 @@ class ExamGenerator:
 
     # ── 核心抽取 ──
 
+    @staticmethod
+    def _key(q: Question):
+        """跨试卷识别同一道题（截断副本与原题视为同一题）"""
+        return q.fingerprint or id(q)
+
     def _greedy_fill(self, pool: list[Question], target: int, used_ids: set[int]) -> list[Question]:
         available = [q for q in pool if id(q) not in used_ids]
         self._rng.shuffle(available)
-        picked = []
-        total = 0
-
-        # 第一轮：贪心塞能放下的
-        remaining = []
-        for q in available:
-            c = self._cost(q)
-            if total + c <= target:
-                picked.append(q)
-                used_ids.add(id(q))
-                total += c
-                if total == target:
-                    return picked
-            else:
-                remaining.append(q)
-
-        # 第二轮：找 cost <= gap 且最大的
-        while total < target and remaining:
-            gap = target - total
-            best = None
-            best_c = 0
-            best_idx = -1
-            for i, q in enumerate(remaining):
-                c = self._cost(q)
-                if c <= gap and c > best_c:
-                    best = q
-                    best_c = c
-                    best_idx = i
-            if best is not None:
-                picked.append(best)
-                used_ids.add(id(best))
-                total += best_c
-                remaining.pop(best_idx)
-                if total == target:
-                    return picked
-            else:
-                break
-
-        # 第三轮（仅小题模式）：截断凑满
-        if self._by_sub and total < target and remaining:
-            gap = target - total
-
-            # 优先找子题数刚好 == gap 的
-            exact = None
-            exact_idx = -1
-            for i, q in enumerate(remaining):
-                if self._sub_count(q) == gap:
-                    exact = q
-                    exact_idx = i
-                    break
-            if exact is not None:
-                picked.append(exact)
-                used_ids.add(id(exact))
-                remaining.pop(exact_idx)
-                return picked
-
-            # 找不到精确匹配，选子题数最少且 > gap 的截断
-            candidates = [(i, q) for i, q in enumerate(remaining) if self._sub_count(q) > gap]
+        if self._usage:
+            available.sort(key=lambda q: self._usage[self._key(q)])
+
+        # 精确凑数：可行时保证不截断任何大题
+        picked = fill_exact(available, target, self._cost)
+        for q in picked:
+            used_ids.add(id(q))
+
+        # 仅小题模式、且无论怎么组合都凑不满时，截断一道大题补足
+        gap = target - self._total_cost(picked)
+        if self._by_sub and gap > 0:
+            candidates = [q for q in available
+                          if id(q) not in used_ids and self._sub_count(q) > gap]
             if candidates:
-                candidates.sort(key=lambda x: self._sub_count(x[1]))
-                idx, q = candidates[0]
+                q = min(candidates, key=self._sub_count)
                 sc = self._sub_count(q)
-                q.sub_questions = q.sub_questions[:gap]
-                picked.append(q)
+                picked.append(replace(q, sub_questions=q.sub_questions[:gap]))
                 used_ids.add(id(q))
                 print(f"[INFO] 截断大题（原 {sc} 子题 → 保留 {gap} 子题）")
 
@@ -141,6 +103,43 @@ class ExamGenerator:
         selected.sort(key=lambda q: (order.get(q.mode, 99), q.unit))
         return selected
 
+    def generate_batch(self, copies: int | None = None,
+                       max_overlap: float | None = None,
+                       attempts: int = 20) -> list[list[Question]]:
+        """一次生成多份平行试卷
+
+        后一份试卷优先抽取前面用得少的题；若与已有试卷的重复率仍超过
+        max_overlap，则重新抽取（最多 attempts 次），取重复率最低的一份。
+        """
+        copies = self.config.copies if copies is None else copies
+        max_overlap = self.config.max_overlap if max_overlap is None else max_overlap
+
+        papers: list[list[Question]] = []
+        for n in range(copies):
+            best, best_ov = None, 0.0
+            for _ in range(max(1, attempts)):
+                paper = self.generate()
+                ov = max((self.overlap(paper, p) for p in papers), default=0.0)
+                if best is None or ov < best_ov:
+                    best, best_ov = paper, ov
+                if ov <= max_overlap:
+                    break
+            if best_ov > max_overlap:
+                print(f"[WARN] 第 {n + 1} 份试卷与已有试卷重复率 {best_ov:.0%}，"
+                      f"超过上限 {max_overlap:.0%}（题库不足）")
+            papers.append(best)
+            self._usage.update(self._key(q) for q in best)
+        return papers
+
+    @classmethod
+    def overlap(cls, a: list[Question], b: list[Question]) -> float:
+        """两份试卷的重复率：共同大题数 / 较小试卷的大题数"""
+        ka = {cls._key(q) for q in a}
+        kb = {cls._key(q) for q in b}
+        if not ka or not kb:
+            return 0.0
+        return len(ka & kb) / min(len(ka), len(kb))
+
     def summary(self, selected: list[Question]) -> str:
         total_subs = self._total_subs(selected)
         by_mode_subs = Counter()
@@ -447,14 +446,15 @@ class ExamGenerator:
         total_cost = sum(self._cost(q) for q in selected)
         if total_cost > total_need:
             overflow = total_cost - total_need
-            # 从后往前找多子题的大题，截断子题
-            for q in reversed(selected):
+            # 从后往前找多子题的大题，截断子题（替换为副本，不改动题库原题）
+            for i in range(len(selected) - 1, -1, -1):
                 if overflow <= 0:
                     break
+                q = selected[i]
                 sc = self._sub_count(q)
                 if sc > 1:
                     can_trim = min(sc - 1, overflow)
-                    q.sub_questions = q.sub_questions[:sc - can_trim]
+                    selected[i] = replace(q, sub_questions=q.sub_questions[:sc - can_trim])
                     overflow -= can_trim
             # 如果截断后还多，移除整题
             while overflow > 0:
@@ -0,0 +1,506 @@
+"""asyncio 网关：长连接流式接口跑在事件循环上，其余请求交给 Flask
+
+Werkzeug / gunicorn 下，AI 答疑的 SSE 流在上游生成期间一直占着一个线程，
+ASR WebSocket 代理每个连接占两个线程。网关（quiz --server asyncio）改为：
+
+  - 一个事件循环负责全部连接的收发（h11 解析 HTTP/1.1，wsproto 处理 WebSocket）
+  - 普通请求构造 WSGI environ，在有界线程池里调用 Flask app，超出线程数的请求排队等待
+  - SSE：视图照常做鉴权、参数校验、拼 prompt，然后把流式任务放进
+    environ["med_exam.stream"] 并返回空的 event-stream 响应；网关按任务的 kind
+    调用对应的异步生成器（AsyncOpenAI），逐条写出 SSE 事件；任务里的 on_close
+    回调在流结束后（含客户端提前断开、生成器未启动）总会被调用一次
+  - WebSocket：同一路径另注册一个普通 GET 视图作为准入检查。网关去掉 Upgrade 头
+    在线程池里调用它（经过全部中间件和 before_request：访问码、限流、封禁），
+    返回 2xx 才握手，之后由对应的协程处理，上游连接同样是异步的（connect_ws）
+
+空闲的流只占一个协程和它的缓冲区，不再占 OS 线程。
+"""
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import io
+import ssl
+import sys
+from typing import AsyncIterator, Awaitable, Callable, Optional
+from urllib.parse import unquote, urlsplit
+
+import h11
+from wsproto import ConnectionType, WSConnection
+from wsproto.events import (
+    AcceptConnection, BytesMessage, CloseConnection, Message, Ping, RejectConnection,
+    Request, TextMessage,
+)
+from wsproto.utilities import LocalProtocolError as WSProtocolError
+
+STREAM_KEY = "med_exam.stream"      # environ 中的延迟流式任务
+GATEWAY_KEY = "med_exam.gateway"    # environ 标记：请求来自网关
+
+_READ_SIZE = 64 * 1024
+_HEADER_TIMEOUT = 30.0       # 读完一个请求（头 + 体）的时限，防慢速攻击
+
+
+SSEHandler = Callable[[dict], AsyncIterator[str]]
+WSHandler = Callable[["WebSocket", dict], Awaitable[None]]
+
+
+# ════════════════════════════════════════════
+# WebSocket（服务端 / 客户端共用）
+# ════════════════════════════════════════════
+
+class WebSocketClosed(Exception):
+    pass
+
+
+class WebSocket:
+    """wsproto 之上的最小异步 WebSocket：receive() 取一条完整消息，连接关闭时返回 None。"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                 conn: WSConnection, pending: bytes = b"") -> None:
+        self._reader = reader
+        self._writer = writer
+        self._conn = conn
+        self._inbox: asyncio.Queue = asyncio.Queue()
+        self._closed = False
+        self._parts: list = []
+        if pending:
+            self._conn.receive_data(pending)
+        self._pump_task = asyncio.ensure_future(self._pump())
+
+    async def _pump(self) -> None:
+        try:
+            while True:
+                for event in self._conn.events():
+                    if isinstance(event, Message):
+                        self._parts.append(event.data)
+                        if event.message_finished:
+                            joiner = "" if isinstance(event, TextMessage) else b""
+                            msg = joiner.join(self._parts)
+                            self._parts = []
+                            await self._inbox.put(msg)
+                    elif isinstance(event, Ping):
+                        await self._send_raw(self._conn.send(event.response()))
+                    elif isinstance(event, CloseConnection):
+                        if not self._closed:
+                            self._closed = True
+                            try:
+                                await self._send_raw(self._conn.send(event.response()))
+                            except (WSProtocolError, ConnectionError):
+                                pass
+                        return
+                data = await self._reader.read(_READ_SIZE)
+                if not data:
+                    return
+                self._conn.receive_data(data)
+        except (ConnectionError, WSProtocolError, asyncio.IncompleteReadError):
+            return
+        finally:
+            self._closed = True
+            self._inbox.put_nowait(None)
+
+    async def _send_raw(self, data: bytes) -> None:
+        self._writer.write(data)
+        await self._writer.drain()
+
+    async def send(self, data: str | bytes) -> None:
+        if self._closed:
+            raise WebSocketClosed()
+        event = TextMessage(data=data) if isinstance(data, str) else BytesMessage(data=data)
+        try:
+            await self._send_raw(self._conn.send(event))
+        except (ConnectionError, WSProtocolError) as e:
+            self._closed = True
+            raise WebSocketClosed() from e
+
+    async def receive(self, timeout: Optional[float] = None) -> str | bytes | None:
+        """下一条消息；连接关闭返回 None，超时抛 asyncio.TimeoutError。"""
+        if self._closed and self._inbox.empty():
+            return None
+        return await asyncio.wait_for(self._inbox.get(), timeout)
+
+    async def close(self, code: int = 1000) -> None:
+        if not self._closed:
+            self._closed = True
+            try:
+                await self._send_raw(self._conn.send(CloseConnection(code=code)))
+            except (ConnectionError, WSProtocolError):
+                pass
+        self._pump_task.cancel()
+        try:
+            self._writer.close()
+        except Exception:
+            pass
+
+
+async def connect_ws(url: str, headers: list[tuple[str, str]] = (),
+                     timeout: float = 10.0) -> WebSocket:
+    """异步 WebSocket 客户端（ws:// 或 wss://），用于连接上游服务。"""
+    u = urlsplit(url)
+    secure = u.scheme == "wss"
+    port = u.port or (443 if secure else 80)
+    target = (u.path or "/") + (f"?{u.query}" if u.query else "")
+    ctx = ssl.create_default_context() if secure else None
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(u.hostname, port, ssl=ctx), timeout)
+    conn = WSConnection(ConnectionType.CLIENT)
+    writer.write(conn.send(Request(
+        host=u.netloc, target=target,
+        extra_headers=[(k.encode(), v.encode()) for k, v in headers])))
+    await writer.drain()
+
+    async def _handshake() -> None:
+        while True:
+            data = await reader.read(_READ_SIZE)
+            if not data:
+                raise ConnectionError("上游在握手时关闭了连接")
+            conn.receive_data(data)
+            for event in conn.events():
+                if isinstance(event, AcceptConnection):
+                    return
+                if isinstance(event, RejectConnection):
+                    raise ConnectionError(f"上游拒绝连接: HTTP {event.status_code}")
+
+    try:
+        await asyncio.wait_for(_handshake(), timeout)
+    except BaseException:
+        writer.close()
+        raise
+    return WebSocket(reader, writer, conn)
+
+
+# ════════════════════════════════════════════
+# HTTP 网关
+# ════════════════════════════════════════════
+
+class Gateway:
+    """app：WSGI 应用；sse：kind → 异步生成器（产出已编码好的 SSE 文本）；
+    ws：path → 协程 handler(ws, environ)；threads：调用 Flask 的线程数；
+    keepalive：两个请求之间连接最多空闲的秒数，0 表示每个响应后关闭连接。"""
+
+    def __init__(self, app, *, sse: dict[str, SSEHandler] | None = None,
+                 ws: dict[str, WSHandler] | None = None, threads: int = 32,
+                 keepalive: float = 5.0, max_body: int = 32 * 1024 * 1024,
+                 server_name: str = "127.0.0.1", server_port: int = 0) -> None:
+        self.app = app
+        self.max_body = max_body
+        self.sse = sse or {}
+        self.ws = ws or {}
+        self.keepalive = keepalive
+        self.server_name = server_name
+        self.server_port = server_port
+        self._pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix="gateway-wsgi")
+        self.streams = 0            # 当前打开的 SSE / WebSocket 数
+        self._server: asyncio.base_events.Server | None = None
+        self._conns: set[asyncio.Task] = set()
+
+    # ── 启停 ──────────────────────────────────────────────────────
+    async def start(self, host: str = "127.0.0.1", port: int = 0, sock=None,
+                    backlog: int = 2048) -> int:
+        """开始监听，返回实际端口。"""
+        if sock is not None:
+            self._server = await asyncio.start_server(self._handle, sock=sock, backlog=backlog)
+        else:
+            self._server = await asyncio.start_server(self._handle, host, port, backlog=backlog)
+        port = self._server.sockets[0].getsockname()[1]
+        self.server_port = self.server_port or port
+        return port
+
+    async def serve_forever(self) -> None:
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+        # 还挂着的连接（空闲 keep-alive、未结束的流）直接取消，finally 里会关掉上游
+        for task in list(self._conns):
+            task.cancel()
+        if self._conns:
+            await asyncio.wait(self._conns, timeout=5)
+        if self._server is not None:
+            await self._server.wait_closed()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    # ── 连接处理 ─────────────────────────────────────────────────
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        conn = h11.Connection(h11.SERVER, max_incomplete_event_size=64 * 1024)
+        peer = writer.get_extra_info("peername") or ("", 0)
+        task = asyncio.current_task()
+        self._conns.add(task)
+        try:
+            idle = False
+            while True:
+                req = await self._next_request(conn, reader, idle)
+                idle = True
+                if not isinstance(req, h11.Request):
+                    return
+                body = await self._read_body(conn, reader, writer)
+                if body is None:
+                    return
+                environ = self._environ(req, body, peer)
+                if self._is_upgrade(req) and environ["PATH_INFO"] in self.ws:
+                    await self._websocket(conn, req, environ, reader, writer)
+                    return
+                await self._dispatch(conn, environ, reader, writer)
+                if conn.our_state is h11.MUST_CLOSE or conn.their_state is h11.MUST_CLOSE:
+                    return
+                try:
+                    conn.start_next_cycle()
+                except h11.LocalProtocolError:
+                    return
+        except (ConnectionError, asyncio.TimeoutError, h11.RemoteProtocolError,
+                asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            pass    # stop() 取消；正常结束，避免 start_server 的回调把取消当异常记日志
+        finally:
+            self._conns.discard(task)
+            try:
+                writer.close()
+            except Exception:
+                pass
+
+    async def _next_request(self, conn: h11.Connection, reader, idle: bool):
+        """读下一个请求头。idle=True（上一个响应已发完）时等首个字节最多 keepalive 秒；
+        连接上的第一个请求、以及收到首字节之后，都按 _HEADER_TIMEOUT 读完请求头。"""
+        event = conn.next_event()
+        if event is not h11.NEED_DATA:
+            return event                    # 流水线里已缓存了下一个请求
+        if idle:
+            conn.receive_data(await asyncio.wait_for(reader.read(_READ_SIZE), self.keepalive))
+        return await self._next_event(conn, reader, _HEADER_TIMEOUT)
+
+    def _response_headers(self, headers: list) -> list:
+        # keepalive=0：告诉客户端本响应后关闭，h11 随之进入 MUST_CLOSE
+        return headers + [("Connection", "close")] if self.keepalive <= 0 else headers
+
+    @staticmethod
+    async def _next_event(conn: h11.Connection, reader, timeout: float):
+        while True:
+            event = conn.next_event()
+            if event is not h11.NEED_DATA:
+                return event
+            conn.receive_data(await asyncio.wait_for(reader.read(_READ_SIZE), timeout))
+
+    async def _read_body(self, conn, reader, writer) -> bytes | None:
+        if conn.client_is_waiting_for_100_continue:
+            writer.write(conn.send(h11.InformationalResponse(status_code=100, headers=[])))
+        chunks, size = [], 0
+        while True:
+            event = await self._next_event(conn, reader, _HEADER_TIMEOUT)
+            if isinstance(event, h11.Data):
+                size += len(event.data)
+                if size > self.max_body:
+                    await self._simple(conn, writer, 413, b"request too large")
+                    return None
+                chunks.append(event.data)
+            elif isinstance(event, h11.EndOfMessage):
+                return b"".join(chunks)
+            elif event is h11.PAUSED:      # Upgrade 请求：没有请求体
+                return b""
+            else:
+                return None
+
+    @staticmethod
+    def _is_upgrade(req: h11.Request) -> bool:
+        return any(k == b"upgrade" and v.lower() == b"websocket" for k, v in req.headers)
+
+    def _environ(self, req: h11.Request, body: bytes, peer) -> dict:
+        path, _, query = req.target.partition(b"?")
+        env = {
+            "REQUEST_METHOD":    req.method.decode("ascii"),
+            "SCRIPT_NAME":       "",
+            "PATH_INFO":         unquote(path.decode("latin-1"), "latin-1"),
+            "QUERY_STRING":      query.decode("latin-1"),
+            "SERVER_NAME":       self.server_name,
+            "SERVER_PORT":       str(self.server_port),
+            "SERVER_PROTOCOL":   "HTTP/" + req.http_version.decode("ascii"),
+            "REMOTE_ADDR":       peer[0],
+            "REMOTE_PORT":       str(peer[1]),
+            "wsgi.version":      (1, 0),
+            "wsgi.url_scheme":   "http",
+            "wsgi.input":        io.BytesIO(body),
+            "wsgi.errors":       sys.stderr,
+            "wsgi.multithread":  True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once":     False,
+            GATEWAY_KEY:         True,
+        }
+        for name, value in req.headers:
+            key = name.decode("latin-1").upper().replace("-", "_")
+            value = value.decode("latin-1")
+            if key == "CONTENT_TYPE":
+                env["CONTENT_TYPE"] = value
+            elif key == "CONTENT_LENGTH":
+                env["CONTENT_LENGTH"] = value
+            else:
+                key = "HTTP_" + key
+                env[key] = f"{env[key]},{value}" if key in env else value
+        env.setdefault("CONTENT_LENGTH", str(len(body)))
+        return env
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._pool, fn, *args)
+
+    # ── 普通请求 / SSE ───────────────────────────────────────────
+    async def _dispatch(self, conn, environ: dict, reader, writer) -> None:
+        status, headers, body_iter = await self._run(self._call_app, environ)
+        head = environ["REQUEST_METHOD"] == "HEAD"
+        job = environ.get(STREAM_KEY)
+        handler = self.sse.get(job.get("kind")) if job else None
+        if handler is not None:
+            # 延迟流式：视图只做了校验，正文由事件循环从上游异步生成
+            _close(body_iter)
+            headers = [(k, v) for k, v in headers
+                       if k.lower() not in ("content-length", "content-encoding")]
+            try:
+                await self._send(writer, conn.send(h11.Response(
+                    status_code=status, headers=self._response_headers(headers))))
+                self.streams += 1
+                agen = handler(job)
+                try:
+                    await self._stream(conn, reader, writer, agen)
+                finally:
+                    self.streams -= 1
+                    await agen.aclose()
+                await self._send(writer, conn.send(h11.EndOfMessage()))
+            finally:
+                # 生成器没来得及启动（客户端已断开）时它的 finally 不会执行，由 on_close 兜底释放资源
+                on_close = job.get("on_close")
+                if on_close is not None:
+                    on_close()
+            return
+
+        try:
+            await self._send(writer, conn.send(h11.Response(
+                status_code=status, headers=self._response_headers(headers))))
+            if isinstance(body_iter, (list, tuple)):
+                for chunk in body_iter:
+                    if chunk and not head:
+                        await self._send(writer, conn.send(h11.Data(data=chunk)))
+            else:
+                it = iter(body_iter)
+                while True:
+                    chunk = await self._run(next, it, None)
+                    if chunk is None:
+                        break
+                    if chunk and not head:
+                        await self._send(writer, conn.send(h11.Data(data=chunk)))
+            await self._send(writer, conn.send(h11.EndOfMessage()))
+        finally:
+            await self._run(_close, body_iter)
+
+    async def _stream(self, conn, reader, writer, agen) -> None:
+        """写出 SSE 正文，同时盯住读端：客户端断开时立即取消生成器（排队、等上游首块期间
+        没有数据可写，单靠写失败发现不了断开）。"""
+        async def _write_all():
+            async for text in agen:
+                await self._send(writer, conn.send(h11.Data(data=text.encode("utf-8"))))
+
+        send = asyncio.ensure_future(_write_all())
+        try:
+            while not send.done():
+                peek = asyncio.ensure_future(reader.read(_READ_SIZE))
+                await asyncio.wait({send, peek}, return_when=asyncio.FIRST_COMPLETED)
+                if not peek.done():
+                    peek.cancel()
+                    break
+                data = peek.result()
+                if not data:
+                    raise ConnectionError("客户端已断开")
+                conn.receive_data(data)     # 流水线上的下一个请求，留给下一轮处理
+            await send
+        finally:
+            if not send.done():
+                send.cancel()
+                await asyncio.gather(send, return_exceptions=True)
+
+    def _call_app(self, environ: dict):
+        captured = {}
+
+        def start_response(status, headers, exc_info=None):
+            captured["status"] = int(status.split(" ", 1)[0])
+            captured["headers"] = [(k, v) for k, v in headers]
+            return lambda data: None
+
+        body = self.app(environ, start_response)
+        if isinstance(body, list):
+            return captured["status"], captured["headers"], body
+        # 取第一块以确保 start_response 已被调用（生成器式响应）
+        it = iter(body)
+        first = next(it, None)
+        rest = _Chain(first, it, body)
+        return captured["status"], captured["headers"], rest
+
+    @staticmethod
+    async def _send(writer, data: bytes) -> None:
+        writer.write(data)
+        await writer.drain()
+
+    async def _simple(self, conn, writer, status: int, text: bytes) -> None:
+        await self._send(writer, conn.send(h11.Response(
+            status_code=status,
+            headers=[("Content-Type", "text/plain"), ("Content-Length", str(len(text))),
+                     ("Connection", "close")])))
+        await self._send(writer, conn.send(h11.Data(data=text)))
+        await self._send(writer, conn.send(h11.EndOfMessage()))
+
+    # ── WebSocket ────────────────────────────────────────────────
+    async def _websocket(self, conn, req: h11.Request, environ: dict, reader, writer) -> None:
+        check = {k: v for k, v in environ.items() if k not in ("HTTP_UPGRADE", "HTTP_CONNECTION")}
+        status, headers, body = await self._run(self._call_app_fully, check)
+        if not 200 <= status < 300:
+            headers = [(k, v) for k, v in headers if k.lower() != "content-length"]
+            headers += [("Content-Length", str(len(body))), ("Connection", "close")]
+            await self._send(writer, conn.send(h11.Response(status_code=status, headers=headers)))
+            await self._send(writer, conn.send(h11.Data(data=body)))
+            await self._send(writer, conn.send(h11.EndOfMessage()))
+            return
+
+        # h11 已经解析了握手请求，按原样交给 wsproto 生成 101 响应
+        raw = b"%s %s HTTP/1.1\r\n" % (req.method, req.target)
+        raw += b"".join(b"%s: %s\r\n" % (k, v) for k, v in req.headers) + b"\r\n"
+        ws_conn = WSConnection(ConnectionType.SERVER)
+        ws_conn.receive_data(raw)
+        request = next((e for e in ws_conn.events() if isinstance(e, Request)), None)
+        if request is None:
+            return
+        await self._send(writer, ws_conn.send(AcceptConnection()))
+        ws = WebSocket(reader, writer, ws_conn, pending=conn.trailing_data[0])
+        self.streams += 1
+        try:
+            await self.ws[environ["PATH_INFO"]](ws, environ)
+        finally:
+            self.streams -= 1
+            await ws.close()
+
+    def _call_app_fully(self, environ: dict):
+        status, headers, body_iter = self._call_app(environ)
+        try:
+            return status, headers, b"".join(body_iter)
+        finally:
+            _close(body_iter)
+
+
+class _Chain:
+    """把已取出的第一块和剩余的 WSGI 迭代器拼回去，并保留 close()。"""
+
+    def __init__(self, first, it, body) -> None:
+        self._first, self._it, self._body = first, it, body
+
+    def __iter__(self):
+        if self._first is not None:
+            yield self._first
+        yield from self._it
+
+    def close(self) -> None:
+        _close(self._body)
+
+
+def _close(body) -> None:
+    close = getattr(body, "close", None)
+    if close is not None:
+        close()
+
+
@@ -0,0 +1,107 @@
+"""Flask JSON 序列化后端
+
+quiz / editor 的大响应（/api/questions、/api/exam/join、/api/wrongbook、编辑器列表）
+序列化耗时可观。安装了 orjson 时用它编码，否则退回标准库 json。两者输出语义一致：
+键排序、紧凑分隔符，并遵循 app.config["JSON_AS_ASCII"]（Flask 3 已不再读取该配置）。
+
+后端选择：install_json_provider(app, backend) 的参数 > 环境变量 MED_EXAM_JSON > auto。
+"""
+from __future__ import annotations
+
+import os
+from typing import Any
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+_COMPACT = (",", ":")
+
+
+class StdJSONProvider(DefaultJSONProvider):
+    """标准库 json；与 Flask 默认实现相同，但遵循 JSON_AS_ASCII 配置。"""
+
+    name = "json"
+
+    def __init__(self, app: Flask):
+        super().__init__(app)
+        self.ensure_ascii = bool(app.config.get("JSON_AS_ASCII", True))
+
+
+class OrjsonProvider(StdJSONProvider):
+    """orjson 编码 / 解码；遇到 orjson 不支持的参数或数据时回退到标准库。"""
+
+    name = "orjson"
+
+    def _fast_ok(self, kwargs: dict) -> bool:
+        # orjson 只能输出紧凑、UTF-8 的 JSON；缩进、转义等需求交给标准库。
+        # 未传 separators 时标准库用 ", " / ": "，只有显式要求紧凑分隔符才能走 orjson
+        if self.ensure_ascii:
+            return False
+        if kwargs.keys() - {"separators", "sort_keys", "default"}:
+            return False
+        return tuple(kwargs.get("separators") or ()) == _COMPACT
+
+    def _encode(self, obj: Any, sort_keys: bool, default) -> bytes | None:
+        # 日期 / dataclass 交给 Flask 的 default 处理，保证与标准库输出一致
+        opt = (orjson.OPT_NON_STR_KEYS
+               | orjson.OPT_PASSTHROUGH_DATETIME
+               | orjson.OPT_PASSTHROUGH_DATACLASS)
+        if sort_keys:
+            opt |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(obj, default=default, option=opt)
+        except orjson.JSONEncodeError:
+            return None   # 例如超过 64 位的整数
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if self._fast_ok(kwargs):
+            data = self._encode(obj, kwargs.get("sort_keys", self.sort_keys),
+                                kwargs.get("default", self.default))
+            if data is not None:
+                return data.decode()
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s: str | bytes, **kwargs: Any) -> Any:
+        if not kwargs:
+            try:
+                return orjson.loads(s)
+            except orjson.JSONDecodeError:
+                pass   # NaN / 超大整数等标准库可接受的写法，交给标准库再试
+        return super().loads(s, **kwargs)
+
+    def response(self, *args: Any, **kwargs: Any):
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        if not indent and not self.ensure_ascii:
+            obj = self._prepare_response_obj(args, kwargs)
+            data = self._encode(obj, self.sort_keys, self.default)
+            if data is not None:
+                return self._app.response_class(data + b"\n", mimetype=self.mimetype)
+        return super().response(*args, **kwargs)
+
+
+_BACKENDS = {"json": StdJSONProvider, "orjson": OrjsonProvider}
+
+
+def install_json_provider(app: Flask, backend: str | None = None) -> str:
+    """为 app 安装 JSON 后端，返回实际生效的后端名。
+
+    backend: "auto"（默认，有 orjson 就用）| "orjson" | "json"。
+    需在设置完 JSON_AS_ASCII 之后调用。
+    """
+    backend = (backend or os.environ.get("MED_EXAM_JSON") or "auto").strip().lower()
+    if backend not in ("auto", *_BACKENDS):
+        print(f"[WARN] 未知的 JSON 后端 {backend!r}，改用 auto")
+        backend = "auto"
+    if backend == "orjson" and not HAS_ORJSON:
+        print("[WARN] 未安装 orjson，JSON 序列化回退到标准库（pip install orjson）")
+        backend = "json"
+    if backend == "auto":
+        backend = "orjson" if HAS_ORJSON else "json"
+    app.json = _BACKENDS[backend](app)
+    return backend
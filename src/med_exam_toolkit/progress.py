@@ -12,14 +12,19 @@
 from __future__ import annotations
 
 import json
+import os
+import queue
 import sqlite3
+import threading
 import time
+from collections import deque
 from contextlib import contextmanager
 from datetime import date, timedelta
 from pathlib import Path
 
 _DEFAULT_EF = 2.5
 _MIN_EF     = 1.3
+_MAX_INTERVAL = 36500   # 天；连续答对时间隔指数增长，不封顶会超出 date 的取值范围
 LEGACY_USER = "_legacy"
 
 _DDL = """
@@ -47,7 +52,9 @@ CREATE TABLE IF NOT EXISTS attempts (
     result      INTEGER NOT NULL,
     mode        TEXT,
     unit        TEXT,
-    ts          INTEGER NOT NULL
+    ts          INTEGER NOT NULL,
+    answer      TEXT,                         -- 所选选项（多选排序拼接）；旧客户端 / 跳过为 NULL
+    sq_index    INTEGER                       -- 小题序号，与 answer 同时记录
 );
 CREATE INDEX IF NOT EXISTS idx_att_fp     ON attempts(fingerprint);
 CREATE INDEX IF NOT EXISTS idx_att_ts     ON attempts(ts);
@@ -65,6 +72,50 @@ CREATE TABLE IF NOT EXISTS sm2 (
     PRIMARY KEY (user_id, fingerprint)
 );
 
+-- 压缩后的历史作答：早于保留期的 attempts 按 (用户, 题目, 日期, 单元) 合并成一行，
+-- 保留错题本 / 统计页重算所需的全部计数（见 compact_attempts）
+CREATE TABLE IF NOT EXISTS attempts_daily (
+    user_id     TEXT    NOT NULL,
+    fingerprint TEXT    NOT NULL,
+    day         TEXT    NOT NULL,             -- UTC 日期 YYYY-MM-DD
+    unit        TEXT    NOT NULL DEFAULT '',
+    total       INTEGER NOT NULL DEFAULT 0,   -- 作答次数（不含跳过）
+    correct     INTEGER NOT NULL DEFAULT 0,
+    wrong       INTEGER NOT NULL DEFAULT 0,
+    skipped     INTEGER NOT NULL DEFAULT 0,
+    first_ts    INTEGER NOT NULL,
+    last_ts     INTEGER NOT NULL DEFAULT 0,   -- 当天最后一次作答（不含跳过）
+    PRIMARY KEY (user_id, fingerprint, day, unit)
+) WITHOUT ROWID;
+
+-- 按 (用户, 题目) 汇总的做题统计，与 attempts 在同一事务内增量维护；
+-- 错题本、统计页直接读这里，不再对整段 attempts 历史做 GROUP BY
+CREATE TABLE IF NOT EXISTS user_question_stats (
+    user_id     TEXT    NOT NULL,
+    fingerprint TEXT    NOT NULL,
+    total       INTEGER NOT NULL DEFAULT 0,   -- 作答次数（不含跳过）
+    correct     INTEGER NOT NULL DEFAULT 0,
+    wrong       INTEGER NOT NULL DEFAULT 0,
+    skipped     INTEGER NOT NULL DEFAULT 0,
+    last_ts     INTEGER NOT NULL DEFAULT 0,   -- 最近一次作答（不含跳过）
+    first_seen  INTEGER NOT NULL,
+    PRIMARY KEY (user_id, fingerprint)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_uqs_wrong
+    ON user_question_stats(user_id, wrong DESC, last_ts DESC, correct, total)
+    WHERE wrong > 0;
+
+CREATE TABLE IF NOT EXISTS user_unit_stats (
+    user_id TEXT    NOT NULL,
+    unit    TEXT    NOT NULL,
+    total   INTEGER NOT NULL DEFAULT 0,
+    correct INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, unit)
+) WITHOUT ROWID;
+
+-- 复习队列：按到期日取最早到期的若干题，(user_id, next_due, fingerprint) 覆盖查询
+CREATE INDEX IF NOT EXISTS idx_sm2_due ON sm2(user_id, next_due, fingerprint);
+
 CREATE TABLE IF NOT EXISTS exam_sessions (
     id           TEXT    PRIMARY KEY,
     answers_json TEXT    NOT NULL DEFAULT '{}',
@@ -80,18 +131,130 @@ def db_path_for_bank(bank_path: Path) -> Path:
     return bank_path.with_suffix(".progress.db")
 
 
+# ── 连接池 ────────────────────────────────────────────────────────────
+#
+# 每个数据库文件一个连接池。Flask 开发服务器每个请求一个新线程，
+# 按线程缓存连接起不到作用，所以用"借出 / 归还"的池：连接跨请求复用，
+# PRAGMA 只在建连时设置一次，sqlite3 的语句缓存（cached_statements）也随之生效。
+
+_POOL_SIZE         = 8                   # 每个库最多保留的空闲连接数
+_CACHED_STATEMENTS = 256
+_PRAGMAS = (
+    # 新库开启增量 VACUUM，删除数据后可逐步归还空间。必须在切换 WAL、建表之前设置；
+    # 对已有库不生效（转换见 enable_incremental_vacuum）
+    "PRAGMA auto_vacuum=INCREMENTAL",
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",         # WAL 下安全：断电最多丢最近一次提交，不会损坏
+    "PRAGMA foreign_keys=ON",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=67108864",         # 64 MB
+    "PRAGMA cache_size=-16000",          # 约 16 MB 页缓存
+)
+
+
+def _inode(path: str):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_dev, st.st_ino
+
+
+class _ConnPool:
+    def __init__(self, path: str):
+        self.path  = path
+        self.ino   = None                # 文件被删除 / 替换后据此丢弃旧连接
+        self._idle: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        c = sqlite3.connect(self.path, check_same_thread=False,
+                            cached_statements=_CACHED_STATEMENTS)
+        c.row_factory = sqlite3.Row
+        for pragma in _PRAGMAS:
+            c.execute(pragma)
+        return c
+
+    def acquire(self) -> sqlite3.Connection:
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self._connect()
+
+    def release(self, c: sqlite3.Connection) -> None:
+        if c.in_transaction:
+            c.rollback()
+        with self._lock:
+            if len(self._idle) < _POOL_SIZE:
+                self._idle.append(c)
+                return
+        c.close()
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for c in idle:
+            c.close()
+
+
+_pools: dict[str, _ConnPool] = {}
+_pools_lock = threading.Lock()
+
+
+def _pool(db_path: Path) -> _ConnPool:
+    key = os.fspath(db_path)
+    ino = _inode(key)
+    p = _pools.get(key)
+    if p is not None:
+        if p.ino == ino:
+            return p
+        if p.ino is None and ino is not None:
+            p.ino = ino                  # 首次连接时才创建出文件
+            return p
+    with _pools_lock:
+        p = _pools.get(key)
+        if p is None or (p.ino is not None and p.ino != ino):
+            if p is not None:
+                p.close()
+                _due_dirty(None)          # 库文件被替换：到期数缓存整体作废
+                _flush_due_dirty(key)
+            p = _pools[key] = _ConnPool(key)
+            p.ino = ino
+        return p
+
+
+def close_connections(db_path: Path | None = None) -> None:
+    """关闭连接池中的空闲连接（db_path 为空时关闭全部），用于测试与进程退出。"""
+    with _pools_lock:
+        if db_path is None:
+            pools = list(_pools.values())
+            _pools.clear()
+        else:
+            p = _pools.pop(os.fspath(db_path), None)
+            pools = [p] if p else []
+    for p in pools:
+        p.close()
+
+
 @contextmanager
 def _open(db_path: Path):
-    with sqlite3.connect(str(db_path), check_same_thread=False) as c:
-        c.row_factory = sqlite3.Row
-        c.execute("PRAGMA journal_mode=WAL")
-        c.execute("PRAGMA foreign_keys=ON")
-        yield c
+    """借出一个连接；正常退出时提交，异常时回滚，随后归还连接池。"""
+    pool = _pool(db_path)
+    c = pool.acquire()
+    try:
+        with c:
+            yield c
+    finally:
+        pool.release(c)
+        _flush_due_dirty(pool.path)
 
 
 def init_db(db_path: Path) -> None:
     """初始化或升级数据库，幂等安全。"""
     with _open(db_path) as c:
+        has_stats = c.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='user_question_stats'"
+        ).fetchone()
         # 建新表
         c.executescript(_DDL)
 
@@ -141,78 +304,234 @@ def init_db(db_path: Path) -> None:
                 c.execute("ALTER TABLE attempts ADD COLUMN user_id TEXT NOT NULL DEFAULT '_legacy'")
             except sqlite3.OperationalError:
                 pass
+        # 迁移旧版 attempts（加所选选项列，供 ai-warm 统计热门错误选项）
+        for col, decl in (("answer", "TEXT"), ("sq_index", "INTEGER")):
+            if col not in cols_att:
+                c.execute(f"ALTER TABLE attempts ADD COLUMN {col} {decl}")
+
+        # 旧库首次升级：由已有 attempts 回填汇总表
+        if not has_stats:
+            _rebuild_stats(c)
 
 
 # ── 写操作 ────────────────────────────────────────────────────────────
 
-def record_session(db_path: Path, session: dict, user_id: str = LEGACY_USER) -> None:
-    now_ms = int(time.time() * 1000)
-    # 优先使用客户端传来的本地日期（避免服务端UTC与用户时区不符导致SM-2日期偏差）
+def _session_date(session: dict) -> str:
+    """优先使用客户端传来的本地日期（避免服务端UTC与用户时区不符导致SM-2日期偏差）"""
     client_date = session.get("date", "")
     try:
         date.fromisoformat(client_date)  # validate YYYY-MM-DD
     except (ValueError, TypeError):
         client_date = ""
-    today = client_date if client_date else date.today().isoformat()
-    items  = session.get("items", [])
+    return client_date if client_date else date.today().isoformat()
+
 
+def _session_row(session: dict, user_id: str, today: str, now_ms: int) -> tuple:
+    return (session["id"], user_id, session.get("mode"),
+            session.get("total", 0), session.get("correct", 0),
+            session.get("wrong", 0), session.get("skip", 0),
+            session.get("time_sec", 0), session.get("date", today),
+            json.dumps(session.get("units", []), ensure_ascii=False), now_ms)
+
+
+_SESSION_COLS = "(id,user_id,mode,total,correct,wrong,skip,time_sec,sess_date,units,ts)"
+
+
+def record_session(db_path: Path, session: dict, user_id: str = LEGACY_USER) -> None:
     with _open(db_path) as c:
-        c.execute(
-            """INSERT OR REPLACE INTO sessions
-               (id,user_id,mode,total,correct,wrong,skip,time_sec,sess_date,units,ts)
-               VALUES (?,?,?,?,?,?,?,?,?,?,?)""",
-            (session["id"], user_id, session.get("mode"),
-             session.get("total",0), session.get("correct",0),
-             session.get("wrong",0), session.get("skip",0),
-             session.get("time_sec",0), session.get("date",today),
-             json.dumps(session.get("units",[]), ensure_ascii=False), now_ms),
-        )
+        _record_session(c, session, user_id)
+
+
+def _record_session(c, session: dict, user_id: str) -> None:
+    # 按 (user_id, session_id) 幂等：WriterBusy 超时后任务仍会落盘，
+    # 客户端重试同一会话时不能再写一遍 attempts / SM-2
+    if c.execute("SELECT 1 FROM sessions WHERE user_id=? AND id=?",
+                 (user_id, session["id"])).fetchone():
+        return
+    now_ms = int(time.time() * 1000)
+    today  = _session_date(session)
+    c.execute(
+        f"INSERT INTO sessions {_SESSION_COLS} VALUES (?,?,?,?,?,?,?,?,?,?,?)",
+        _session_row(session, user_id, today, now_ms),
+    )
+    _write_items(c, user_id, [(session["id"], today, session.get("items", []))],
+                 now_ms, "INSERT")
+
+
+def _sm2_step(ef: float, interval: int, reps: int, quality: int) -> tuple[float, int, int]:
+    """SM-2 单步状态转移，返回新的 (ef, interval, reps)。"""
+    if quality < 3:
+        reps = 0; interval = 1   # 答错：明天再复习（原为 0，会导致当天反复出现）
+    else:
+        if   reps == 0: interval = 1   # 第1次答对：明天复习
+        elif reps == 1: interval = 6   # 第2次答对：6天后
+        else:           interval = min(round(interval * ef), _MAX_INTERVAL)
+        reps += 1
+    ef = max(_MIN_EF, ef + 0.1 - (5-quality)*(0.08 + (5-quality)*0.02))
+    return ef, interval, reps
+
+
+_SQL_CHUNK = 500   # IN (...) 每批的参数个数，低于旧版 SQLite 的 999 上限
+_ANSWER_MAX = 16   # answer 字段的最大长度（选项字母拼接），超出视为无效输入
+
+
+def _item_choice(item: dict, res: int) -> tuple[str | None, int | None]:
+    """取出作答的所选选项与小题序号；跳过、旧客户端未上报或格式不对时为 (None, None)。"""
+    answer = item.get("answer")
+    if res == -1 or not isinstance(answer, str) or not 0 < len(answer) <= _ANSWER_MAX:
+        return None, None
+    try:
+        return answer, max(0, int(item.get("si") or 0))
+    except (TypeError, ValueError):
+        return answer, 0
+
+
+def _write_items(c, user_id: str, batches: list[tuple[str, str, list]],
+                 now_ms: int, attempt_verb: str) -> int:
+    """批量写入 attempts 并更新 SM-2，返回写入的 attempt 条数。
+
+    batches: [(session_id, today, items), ...]，按提交顺序排列。
+    涉及的 sm2 行一次性预取，在 Python 中按顺序逐条推进状态（同一指纹在一次
+    提交中出现多次时与逐条更新结果一致），最后用一条 executemany upsert 写回。
+    """
+    attempts: list[tuple] = []
+    updates:  list[tuple[str, int, str]] = []     # (fingerprint, quality, today)
+    for sid, today, items in batches:
         for item in items:
             fp  = item.get("fingerprint")
             res = item.get("result", -1)
             if not fp:
                 continue
-            c.execute(
-                """INSERT INTO attempts
-                   (user_id,fingerprint,session_id,result,mode,unit,ts)
-                   VALUES (?,?,?,?,?,?,?)""",
-                (user_id, fp, session["id"], res,
-                 item.get("mode"), item.get("unit"), now_ms),
-            )
+            attempts.append((user_id, fp, sid, res, item.get("mode"), item.get("unit"), now_ms,
+                             *_item_choice(item, res)))
             if res != -1:
                 # 优先使用 item 中携带的 SM-2 quality（0-5），
                 # 背题模式会传入精确评分；练习/考试模式回退到二值映射
                 quality = item.get("quality")
                 if quality is None:
                     quality = 4 if res == 1 else 1
-                quality = max(0, min(5, int(quality)))
-                _update_sm2(c, user_id, fp, quality, today)
+                updates.append((fp, max(0, min(5, int(quality))), today))
 
+    if attempts:
+        c.executemany(
+            f"""{attempt_verb} INTO attempts
+               (user_id,fingerprint,session_id,result,mode,unit,ts,answer,sq_index)
+               VALUES (?,?,?,?,?,?,?,?,?)""",
+            attempts,
+        )
+        _bump_stats(c, user_id, attempts)
+        _due_dirty(user_id)
+    if not updates:
+        return len(attempts)
 
-def _update_sm2(c, user_id: str, fingerprint: str, quality: int, today: str) -> None:
-    row = c.execute(
-        "SELECT ef,interval,reps FROM sm2 WHERE user_id=? AND fingerprint=?",
-        (user_id, fingerprint),
-    ).fetchone()
-    ef       = float(row["ef"])     if row else _DEFAULT_EF
-    interval = int(row["interval"]) if row else 0
-    reps     = int(row["reps"])     if row else 0
+    # 1) 预取现有 SM-2 状态
+    state: dict[str, tuple[float, int, int]] = {}
+    fps = list({fp for fp, _, _ in updates})
+    for i in range(0, len(fps), _SQL_CHUNK):
+        chunk = fps[i:i + _SQL_CHUNK]
+        rows = c.execute(
+            f"""SELECT fingerprint,ef,interval,reps FROM sm2
+                WHERE user_id=? AND fingerprint IN ({",".join("?" * len(chunk))})""",
+            (user_id, *chunk),
+        ).fetchall()
+        for r in rows:
+            state[r["fingerprint"]] = (float(r["ef"]), int(r["interval"]), int(r["reps"]))
 
-    if quality < 3:
-        reps = 0; interval = 1   # 答错：明天再复习（原为 0，会导致当天反复出现）
-    else:
-        if   reps == 0: interval = 1   # 第1次答对：明天复习
-        elif reps == 1: interval = 6   # 第2次答对：6天后
-        else:           interval = round(interval * ef)
-        reps += 1
-    ef = max(_MIN_EF, ef + 0.1 - (5-quality)*(0.08 + (5-quality)*0.02))
-    next_due = (date.fromisoformat(today) + timedelta(days=interval)).isoformat()
+    # 2) 按顺序推进状态，同一指纹只保留最后一次结果
+    days: dict[str, date] = {}
+    final: dict[str, tuple] = {}
+    for fp, quality, today in updates:
+        ef, interval, reps = _sm2_step(*state.get(fp, (_DEFAULT_EF, 0, 0)), quality)
+        state[fp] = (ef, interval, reps)
+        final[fp] = (ef, interval, reps, today)
+    for fp, (ef, interval, reps, today) in final.items():
+        d = days.get(today) or days.setdefault(today, date.fromisoformat(today))
+        final[fp] = (user_id, fp, ef, interval, reps,
+                     (d + timedelta(days=interval)).isoformat(), now_ms)
+
+    # 3) 一次写回
+    c.executemany(
+        """INSERT INTO sm2 (user_id,fingerprint,ef,interval,reps,next_due,updated_at)
+           VALUES (?,?,?,?,?,?,?)
+           ON CONFLICT(user_id,fingerprint) DO UPDATE SET
+               ef=excluded.ef, interval=excluded.interval, reps=excluded.reps,
+               next_due=excluded.next_due, updated_at=excluded.updated_at""",
+        sorted(final.values(), key=lambda r: r[1]),   # 按主键顺序写，减少 B 树页跳转
+    )
+    return len(attempts)
+
+
+def _bump_stats(c, user_id: str, attempts: list[tuple]) -> None:
+    """把新写入的 attempts 累加进 user_question_stats / user_unit_stats。"""
+    per_fp:   dict[str, list[int]] = {}
+    per_unit: dict[str, list[int]] = {}
+    for _, fp, _, res, _, unit, ts, *_ in attempts:
+        s = per_fp.get(fp)
+        if s is None:
+            s = per_fp[fp] = [0, 0, 0, 0, 0, ts]   # total correct wrong skipped last_ts first_seen
+        if res == -1:
+            s[3] += 1
+        else:
+            s[0] += 1
+            s[1] += res == 1
+            s[2] += res == 0
+            s[4] = max(s[4], ts)
+            if unit:
+                u = per_unit.setdefault(unit, [0, 0])
+                u[0] += 1
+                u[1] += res == 1
+        s[5] = min(s[5], ts)
+    c.executemany(
+        """INSERT INTO user_question_stats
+               (user_id,fingerprint,total,correct,wrong,skipped,last_ts,first_seen)
+           VALUES (?,?,?,?,?,?,?,?)
+           ON CONFLICT(user_id,fingerprint) DO UPDATE SET
+               total=total+excluded.total, correct=correct+excluded.correct,
+               wrong=wrong+excluded.wrong, skipped=skipped+excluded.skipped,
+               last_ts=MAX(last_ts,excluded.last_ts),
+               first_seen=MIN(first_seen,excluded.first_seen)""",
+        [(user_id, fp, *v) for fp, v in sorted(per_fp.items())],
+    )
+    if per_unit:
+        c.executemany(
+            """INSERT INTO user_unit_stats (user_id,unit,total,correct) VALUES (?,?,?,?)
+               ON CONFLICT(user_id,unit) DO UPDATE SET
+                   total=total+excluded.total, correct=correct+excluded.correct""",
+            [(user_id, unit, *v) for unit, v in per_unit.items()],
+        )
+
+
+# attempts 与已压缩的 attempts_daily 合并成统一的计数行，供重算汇总表使用
+_ATTEMPT_ROWS = """
+    SELECT user_id, fingerprint, COALESCE(unit,'') AS unit,
+           result!=-1 AS total, result=1 AS correct, result=0 AS wrong, result=-1 AS skipped,
+           ts AS first_ts, CASE WHEN result!=-1 THEN ts ELSE 0 END AS last_ts
+    FROM attempts {where}
+    UNION ALL
+    SELECT user_id, fingerprint, unit, total, correct, wrong, skipped, first_ts, last_ts
+    FROM attempts_daily {where}"""
+
+
+def _rebuild_stats(c, user_id: str | None = None) -> None:
+    """由 attempts + attempts_daily 全量重算汇总表（user_id 为空时重算所有用户）。"""
+    where, args = ("WHERE user_id=?", (user_id,) * 2) if user_id is not None else ("", ())
+    rows = _ATTEMPT_ROWS.format(where=where)
+    _due_dirty(user_id)
+    c.execute(f"DELETE FROM user_question_stats {where}", args[:1])
+    c.execute(f"DELETE FROM user_unit_stats {where}", args[:1])
     c.execute(
-        """INSERT OR REPLACE INTO sm2
-           (user_id,fingerprint,ef,interval,reps,next_due,updated_at)
-           VALUES (?,?,?,?,?,?,?)""",
-        (user_id, fingerprint, ef, interval, reps, next_due,
-         int(time.time()*1000)),
+        f"""INSERT INTO user_question_stats
+                (user_id,fingerprint,total,correct,wrong,skipped,last_ts,first_seen)
+            SELECT user_id, fingerprint, SUM(total), SUM(correct), SUM(wrong), SUM(skipped),
+                   MAX(last_ts), MIN(first_ts)
+            FROM ({rows}) GROUP BY user_id, fingerprint""",
+        args,
+    )
+    c.execute(
+        f"""INSERT INTO user_unit_stats (user_id,unit,total,correct)
+            SELECT user_id, unit, SUM(total), SUM(correct) FROM ({rows})
+            WHERE unit!='' GROUP BY user_id, unit HAVING SUM(total)>0""",
+        args,
     )
 
 
@@ -223,76 +542,279 @@ def record_sessions_batch(
 ) -> dict:
     """批量写入多条答题会话（供离线同步端点使用）。
 
-    - 已存在的 session_id 用 INSERT OR IGNORE 跳过（不覆盖服务端已有记录）
-    - attempts 同理：重复 (user_id, fingerprint, session_id) 由 UNIQUE INDEX 去重
+    - 已存在的 session_id 跳过（不覆盖服务端已有记录）
+    - 同一批次内重复的 session_id 只写入第一条
     - 返回 {processed: [session_id, ...], skipped: [session_id, ...]}
     """
+    with _open(db_path) as c:
+        return _record_batch(c, sessions, user_id)
+
+
+def _record_batch(c, sessions: list[dict], user_id: str) -> dict:
     processed: list[str] = []
     skipped:   list[str] = []
     now_ms = int(time.time() * 1000)
 
-    with _open(db_path) as c:
-        for session in sessions:
-            sid = session.get("id")
-            if not sid:
-                continue
+    sids = [s.get("id") for s in sessions if s.get("id")]
+    # 一次查出已存在的 session（离线重传场景）
+    existing: set[str] = set()
+    uniq = list(dict.fromkeys(sids))
+    for i in range(0, len(uniq), _SQL_CHUNK):
+        chunk = uniq[i:i + _SQL_CHUNK]
+        existing.update(r[0] for r in c.execute(
+            f"SELECT id FROM sessions WHERE user_id=? AND id IN ({','.join('?' * len(chunk))})",
+            (user_id, *chunk),
+        ))
 
-            # 优先使用客户端传来的本地日期（时区修复）
-            client_date = session.get("date", "")
-            try:
-                date.fromisoformat(client_date)
-            except (ValueError, TypeError):
-                client_date = ""
-            today = client_date if client_date else date.today().isoformat()
-
-            # 检查 session 是否已存在（离线重传场景）
-            exists = c.execute(
-                "SELECT 1 FROM sessions WHERE user_id=? AND id=?", (user_id, sid)
-            ).fetchone()
-            if exists:
-                skipped.append(sid)
-                continue
+    rows:    list[tuple] = []
+    batches: list[tuple[str, str, list]] = []
+    for session in sessions:
+        sid = session.get("id")
+        if not sid:
+            continue
+        if sid in existing:
+            skipped.append(sid)
+            continue
+        existing.add(sid)
+        today = _session_date(session)
+        rows.append(_session_row(session, user_id, today, now_ms))
+        batches.append((sid, today, session.get("items", [])))
+        processed.append(sid)
 
-            # 写入 session 行
-            c.execute(
-                """INSERT OR IGNORE INTO sessions
-                   (id,user_id,mode,total,correct,wrong,skip,time_sec,sess_date,units,ts)
-                   VALUES (?,?,?,?,?,?,?,?,?,?,?)""",
-                (sid, user_id, session.get("mode"),
-                 session.get("total", 0), session.get("correct", 0),
-                 session.get("wrong", 0), session.get("skip", 0),
-                 session.get("time_sec", 0), session.get("date", today),
-                 json.dumps(session.get("units", []), ensure_ascii=False), now_ms),
-            )
-
-            # 写入 attempts + 更新 SM-2
-            for item in session.get("items", []):
-                fp  = item.get("fingerprint")
-                res = item.get("result", -1)
-                if not fp:
-                    continue
-                try:
-                    c.execute(
-                        """INSERT INTO attempts
-                           (user_id,fingerprint,session_id,result,mode,unit,ts)
-                           VALUES (?,?,?,?,?,?,?)""",
-                        (user_id, fp, sid, res,
-                         item.get("mode"), item.get("unit"), now_ms),
-                    )
-                except Exception:
-                    pass  # 重复 attempt，跳过
-                if res != -1:
-                    quality = item.get("quality")
-                    if quality is None:
-                        quality = 4 if res == 1 else 1
-                    quality = max(0, min(5, int(quality)))
-                    _update_sm2(c, user_id, fp, quality, today)
-
-            processed.append(sid)
+    if rows:
+        c.executemany(
+            f"INSERT OR IGNORE INTO sessions {_SESSION_COLS} VALUES (?,?,?,?,?,?,?,?,?,?,?)",
+            rows,
+        )
+        _write_items(c, user_id, batches, now_ms, "INSERT OR IGNORE")
 
     return {"processed": processed, "skipped": skipped}
 
 
+# ── 单写线程 + 组提交 ─────────────────────────────────────────────────
+#
+# 考试集中交卷时，每个 /api/record、/api/sync 请求各开一个写事务，SQLite 的写锁
+# 互相争抢，经常出现 "database is locked"。改为每个库一个专职写线程：请求把会话
+# 放进有界队列后等待，写线程一次取出当前排队的全部请求，在同一个事务里写完并提交
+# （synchronous=FULL，每组只 fsync 一次），提交成功后才逐个通知请求返回。
+# 单个请求出错只回滚它自己的 SAVEPOINT，不影响同组的其他请求。
+
+_QUEUE_MAX      = 2000               # 排队请求上限，超过即返回"繁忙"
+_GROUP_MAX      = 256                # 每次提交最多合并的请求数
+_SUBMIT_TIMEOUT = 30.0               # 请求等待落盘的最长秒数
+_LATENCY_WINDOW = 512                # 统计延迟分位数的样本窗口
+
+
+class WriterBusy(RuntimeError):
+    """写入队列已满或等待超时。"""
+
+
+class _Job:
+    __slots__ = ("fn", "args", "done", "result", "error", "t_enq")
+
+    def __init__(self, fn, args: tuple):
+        self.fn     = fn
+        self.args   = args
+        self.done   = threading.Event()
+        self.result = None
+        self.error: Exception | None = None
+        self.t_enq  = time.perf_counter()
+
+
+def _percentile(samples, q: float) -> float:
+    if not samples:
+        return 0.0
+    xs = sorted(samples)
+    return xs[min(len(xs) - 1, int(len(xs) * q))]
+
+
+class _Writer:
+    def __init__(self, path: str):
+        self.path   = path
+        self.queue: queue.Queue[_Job | None] = queue.Queue(maxsize=_QUEUE_MAX)
+        self.commits = 0
+        self.jobs    = 0
+        self.failed  = 0
+        self.max_depth = 0
+        self._commit_ms: deque[float] = deque(maxlen=_LATENCY_WINDOW)
+        self._ack_ms:    deque[float] = deque(maxlen=_LATENCY_WINDOW)
+        self._group_n:   deque[int]   = deque(maxlen=_LATENCY_WINDOW)
+        self._conn: sqlite3.Connection | None = None
+        self._ino  = None
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name=f"progress-writer:{Path(path).name}")
+        self._thread.start()
+
+    def submit(self, fn, *args, timeout: float = _SUBMIT_TIMEOUT):
+        job = _Job(fn, args)
+        try:
+            self.queue.put(job, timeout=timeout)
+        except queue.Full:
+            raise WriterBusy("写入队列已满，请稍后重试") from None
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+        if not job.done.wait(timeout):
+            raise WriterBusy("等待写入超时")   # 任务仍会被写入，客户端重试时按 session_id 去重
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def close(self, timeout: float = 10.0) -> None:
+        """写完已排队的请求后结束线程。"""
+        self.queue.put(None)
+        self._thread.join(timeout)
+
+    def _connect(self) -> sqlite3.Connection:
+        c = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None,
+                            cached_statements=_CACHED_STATEMENTS)
+        c.row_factory = sqlite3.Row
+        for pragma in _PRAGMAS:
+            c.execute(pragma)
+        c.execute("PRAGMA synchronous=FULL")   # 提交即落盘；代价由整组请求分摊
+        c.execute("PRAGMA busy_timeout=5000")
+        return c
+
+    def _run(self) -> None:
+        stop = False
+        while not stop:
+            group = [self.queue.get()]
+            while len(group) < _GROUP_MAX:
+                try:
+                    group.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in group:
+                stop = True
+                group = [j for j in group if j is not None]
+            if group:
+                self._commit(group)
+        if self._conn is not None:
+            self._conn.close()
+
+    def _commit(self, group: list[_Job]) -> None:
+        t0 = time.perf_counter()
+        try:
+            if self._conn is None or _inode(self.path) != self._ino:
+                if self._conn is not None:
+                    self._conn.close()
+                self._conn = self._connect()
+                self._ino = _inode(self.path)
+            c = self._conn
+            c.execute("BEGIN IMMEDIATE")
+            try:
+                for job in group:
+                    c.execute("SAVEPOINT job")
+                    try:
+                        job.result = job.fn(c, *job.args)
+                    except Exception as e:
+                        job.error = e
+                        c.execute("ROLLBACK TO job")
+                    c.execute("RELEASE job")
+                c.execute("COMMIT")
+            except BaseException:
+                if c.in_transaction:
+                    c.execute("ROLLBACK")
+                raise
+        except Exception as e:
+            # 整组提交失败（磁盘满、库被锁住等）：所有请求都按失败返回
+            for job in group:
+                job.error = job.error or e
+            if self._conn is not None:
+                try:
+                    self._conn.close()
+                except sqlite3.Error:
+                    pass
+            self._conn = None
+        _flush_due_dirty(self.path)
+        t1 = time.perf_counter()
+        self.commits += 1
+        self._commit_ms.append((t1 - t0) * 1000)
+        self._group_n.append(len(group))
+        for job in group:
+            self.jobs += 1
+            self.failed += job.error is not None
+            self._ack_ms.append((t1 - job.t_enq) * 1000)
+            job.done.set()
+
+    def stats(self) -> dict:
+        commit, ack, n = list(self._commit_ms), list(self._ack_ms), list(self._group_n)
+        return {
+            "queue_depth":    self.queue.qsize(),
+            "queue_max":      _QUEUE_MAX,
+            "max_depth":      self.max_depth,
+            "commits":        self.commits,
+            "jobs":           self.jobs,
+            "failed":         self.failed,
+            "avg_group":      round(sum(n) / len(n), 2) if n else 0.0,
+            "commit_ms_p50":  round(_percentile(commit, 0.5), 2),
+            "commit_ms_p95":  round(_percentile(commit, 0.95), 2),
+            "ack_ms_p50":     round(_percentile(ack, 0.5), 2),
+            "ack_ms_p95":     round(_percentile(ack, 0.95), 2),
+        }
+
+
+_writers: dict[str, _Writer] = {}
+
+
+def _writer(db_path: Path) -> _Writer:
+    key = os.fspath(db_path)
+    w = _writers.get(key)
+    if w is None:
+        with _pools_lock:
+            w = _writers.get(key)
+            if w is None:
+                w = _writers[key] = _Writer(key)
+    return w
+
+
+def submit_session(db_path: Path, session: dict, user_id: str = LEGACY_USER) -> None:
+    """经写线程写入一条会话，落盘后返回。与 record_session 语义相同。
+
+    队列已满或等待超时抛出 WriterBusy。
+    """
+    _writer(db_path).submit(_record_session, session, user_id)
+
+
+def submit_sessions_batch(db_path: Path, sessions: list[dict],
+                          user_id: str = LEGACY_USER) -> dict:
+    """经写线程批量写入会话，落盘后返回。与 record_sessions_batch 语义相同。"""
+    return _writer(db_path).submit(_record_batch, sessions, user_id)
+
+
+def writer_stats(db_path: Path | None = None) -> dict:
+    """写线程指标：{db 路径: {queue_depth, commits, commit_ms_p95, ...}}"""
+    ws = _writers if db_path is None else {
+        k: w for k, w in _writers.items() if k == os.fspath(db_path)}
+    return {k: w.stats() for k, w in list(ws.items())}
+
+
+def close_writers(timeout: float = 10.0) -> None:
+    """写完所有排队请求并停止写线程，用于测试与进程退出。"""
+    with _pools_lock:
+        ws = list(_writers.values())
+        _writers.clear()
+    for w in ws:
+        w.close(timeout)
+
+
+_forked_leftovers: list = []
+
+
+def _reset_after_fork() -> None:
+    """fork 出的子进程（quiz --workers N）不能沿用父进程的连接和写线程——线程
+    不会被复制过来，连接也不能跨进程共用。清空后由子进程按需重建；旧对象留住引用，
+    避免被回收时关闭父进程仍在使用的连接。fork 时可能有线程正持有锁，一并换新。"""
+    global _pools_lock, _due_lock
+    _forked_leftovers.append((dict(_pools), dict(_writers)))
+    _pools.clear()
+    _writers.clear()
+    _pools_lock = threading.Lock()
+    _due_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
 def get_sync_status(db_path: Path, user_id: str = LEGACY_USER) -> dict:
     """返回数据库中该用户的会话数和最近同步时间，供前端展示。"""
     with _open(db_path) as c:
@@ -312,6 +834,10 @@ def clear_user_data(db_path: Path, user_id: str) -> dict:
         att  = c.execute("DELETE FROM attempts WHERE user_id=?", (user_id,)).rowcount
         sess = c.execute("DELETE FROM sessions WHERE user_id=?", (user_id,)).rowcount
         sm2  = c.execute("DELETE FROM sm2      WHERE user_id=?", (user_id,)).rowcount
+        att += c.execute("DELETE FROM attempts_daily WHERE user_id=?", (user_id,)).rowcount
+        c.execute("DELETE FROM user_question_stats WHERE user_id=?", (user_id,))
+        c.execute("DELETE FROM user_unit_stats     WHERE user_id=?", (user_id,))
+        _due_dirty(user_id)
     return {"attempts": att, "sessions": sess, "sm2_cards": sm2}
 
 
@@ -339,8 +865,8 @@ def migrate_user_data(db_path: Path, from_uid: str, to_uid: str) -> dict:
         ).rowcount
         att = c.execute(
             """INSERT INTO attempts
-                   (user_id, fingerprint, session_id, result, mode, unit, ts)
-               SELECT ?, fingerprint, session_id, result, mode, unit, ts
+                   (user_id, fingerprint, session_id, result, mode, unit, ts, answer, sq_index)
+               SELECT ?, fingerprint, session_id, result, mode, unit, ts, answer, sq_index
                FROM attempts WHERE user_id=?""",
             (to_uid, from_uid),
         ).rowcount
@@ -351,11 +877,105 @@ def migrate_user_data(db_path: Path, from_uid: str, to_uid: str) -> dict:
                FROM sm2 WHERE user_id=?""",
             (to_uid, from_uid),
         ).rowcount
-        for tbl in ("attempts", "sessions", "sm2"):
+        att += c.execute(
+            """INSERT INTO attempts_daily
+                   (user_id, fingerprint, day, unit, total, correct, wrong, skipped,
+                    first_ts, last_ts)
+               SELECT ?, fingerprint, day, unit, total, correct, wrong, skipped,
+                      first_ts, last_ts
+               FROM attempts_daily WHERE user_id=?
+               ON CONFLICT(user_id, fingerprint, day, unit) DO UPDATE SET
+                   total=total+excluded.total, correct=correct+excluded.correct,
+                   wrong=wrong+excluded.wrong, skipped=skipped+excluded.skipped,
+                   first_ts=MIN(first_ts, excluded.first_ts),
+                   last_ts=MAX(last_ts, excluded.last_ts)""",
+            (to_uid, from_uid),
+        ).rowcount
+        for tbl in ("attempts", "attempts_daily", "sessions", "sm2"):
             c.execute(f"DELETE FROM {tbl} WHERE user_id=?", (from_uid,))  # noqa: S608
+        # attempts 已全量并入 to_uid，汇总表按 to_uid 重算
+        _rebuild_stats(c, to_uid)
+        _rebuild_stats(c, from_uid)
+        _due_dirty(to_uid)
+        _due_dirty(from_uid)
     return {"sessions": sess, "attempts": att, "sm2_cards": sm2}
 
 
+# ── 到期数缓存 ────────────────────────────────────────────────────────
+#
+# 统计页每次打开都要算"今日待复习"。按 (库, 用户, 日期) 缓存到期数，
+# 该用户有写入时作废。作废放在事务提交之后（_open 退出 / 写线程 COMMIT 之后）：
+# 若在提交前作废，并发的读请求可能读到旧快照并把旧值重新写回缓存。
+# 写入过程中先把涉及的用户记在线程局部变量里，提交后统一作废。
+
+_DUE_CACHE_MAX = 20000
+_due_counts: dict[tuple, tuple[int, int]] = {}   # (path, uid, today) → (代数, 到期数)
+_due_gens:   dict[tuple, int] = {}               # (path, uid) → 代数；uid=None 表示整库
+_due_lock  = threading.Lock()
+_due_local = threading.local()
+
+
+def _due_dirty(user_id: str | None) -> None:
+    """标记用户（None 表示全部用户）的到期数待作废。"""
+    pending = getattr(_due_local, "users", None)
+    if pending is None:
+        pending = _due_local.users = set()
+    pending.add(user_id)
+
+
+def _flush_due_dirty(path: str) -> None:
+    pending = getattr(_due_local, "users", None)
+    if not pending:
+        return
+    _due_local.users = None
+    with _due_lock:
+        for uid in pending:
+            _due_gens[(path, uid)] = _due_gens.get((path, uid), 0) + 1
+
+
+def _due_gen(path: str, user_id: str) -> tuple[int, int]:
+    return _due_gens.get((path, user_id), 0), _due_gens.get((path, None), 0)
+
+
+def _client_today(client_date: str) -> str:
+    try:
+        date.fromisoformat(client_date)
+        return client_date
+    except (ValueError, TypeError):
+        return date.today().isoformat()
+
+
+_UNSCHEDULED_SQL = """SELECT u.fingerprint FROM user_question_stats u
+    WHERE u.user_id=? AND NOT EXISTS (
+        SELECT 1 FROM sm2 s WHERE s.user_id=u.user_id AND s.fingerprint=u.fingerprint
+    )"""
+
+
+def _count_due(c, user_id: str, today: str) -> int:
+    return (c.execute("SELECT COUNT(*) FROM sm2 WHERE user_id=? AND next_due<=?",
+                      (user_id, today)).fetchone()[0]
+            + c.execute(f"SELECT COUNT(*) FROM ({_UNSCHEDULED_SQL})",
+                        (user_id,)).fetchone()[0])
+
+
+def get_due_count(db_path: Path, user_id: str = LEGACY_USER, client_date: str = "") -> int:
+    """今日待复习题数（带缓存）。"""
+    path  = os.fspath(db_path)
+    today = _client_today(client_date)
+    key   = (path, user_id, today)
+    gen   = _due_gen(path, user_id)
+    hit   = _due_counts.get(key)
+    if hit is not None and hit[0] == gen:
+        return hit[1]
+    with _open(db_path) as c:
+        n = _count_due(c, user_id, today)
+    with _due_lock:
+        if len(_due_counts) >= _DUE_CACHE_MAX:
+            _due_counts.clear()
+        _due_counts[key] = (gen, n)       # 读之前取的代数：期间有写入则此条立即失效
+    return n
+
+
 # ── 读操作 ────────────────────────────────────────────────────────────
 
 def get_due_fingerprints(
@@ -363,26 +983,74 @@ def get_due_fingerprints(
     user_id: str = LEGACY_USER,
     client_date: str = "",
 ) -> list[str]:
-    """返回到期待复习的 fingerprint 列表。
+    """返回到期待复习的 fingerprint 列表，最早到期的在前，做过但未排期的排最后。
     client_date: 客户端本地日期 YYYY-MM-DD，用于修正 UTC 与用户时区差异；
                  为空时回退到服务端当天日期。
     """
-    try:
-        date.fromisoformat(client_date)
-        today = client_date
-    except (ValueError, TypeError):
-        today = date.today().isoformat()
+    today = _client_today(client_date)
     with _open(db_path) as c:
-        rows = c.execute(
+        due = [r[0] for r in c.execute(
             """SELECT fingerprint FROM sm2 WHERE user_id=? AND next_due<=?
-               UNION
-               SELECT DISTINCT fingerprint FROM attempts
-               WHERE user_id=? AND fingerprint NOT IN (
-                   SELECT fingerprint FROM sm2 WHERE user_id=?
-               )""",
-            (user_id, today, user_id, user_id),
-        ).fetchall()
-    return [r["fingerprint"] for r in rows]
+               ORDER BY next_due, fingerprint""",
+            (user_id, today),
+        )]
+        due += [r[0] for r in c.execute(_UNSCHEDULED_SQL + " ORDER BY u.fingerprint",
+                                        (user_id,))]
+    return due
+
+
+def get_due_page(
+    db_path: Path,
+    user_id: str = LEGACY_USER,
+    client_date: str = "",
+    limit: int = 50,
+    cursor: str | None = None,
+) -> dict:
+    """分页返回到期题目，顺序同 get_due_fingerprints（逾期最久的在前）。
+
+    游标为上一页最后一条的位置："d:<next_due>:<fingerprint>" 或 "u:<fingerprint>"
+    （未排期部分）。游标格式错误抛出 ValueError。
+    返回 {items: [{fingerprint, next_due, overdue_days}], count, next_cursor}，
+    next_cursor 为空表示已到末尾。
+    """
+    today = _client_today(client_date)
+    phase, due_after, fp_after = "d", "", ""
+    if cursor:
+        parts = cursor.split(":", 2)
+        if parts[0] == "d" and len(parts) == 3:
+            phase, due_after, fp_after = parts
+        elif parts[0] == "u" and len(parts) == 2:
+            phase, fp_after = parts
+        else:
+            raise ValueError(f"无效的游标: {cursor!r}")
+    limit = max(1, limit)
+    today_d = date.fromisoformat(today)
+    items: list[dict] = []
+    with _open(db_path) as c:
+        if phase == "d":
+            for r in c.execute(
+                """SELECT fingerprint, next_due FROM sm2
+                   WHERE user_id=? AND next_due<=? AND (next_due, fingerprint) > (?, ?)
+                   ORDER BY next_due, fingerprint LIMIT ?""",
+                (user_id, today, due_after, fp_after, limit + 1),
+            ):
+                items.append({"fingerprint": r[0], "next_due": r[1],
+                              "overdue_days": (today_d - date.fromisoformat(r[1])).days})
+            fp_after = ""
+        if len(items) <= limit:
+            for r in c.execute(
+                _UNSCHEDULED_SQL + " AND u.fingerprint > ? ORDER BY u.fingerprint LIMIT ?",
+                (user_id, fp_after, limit + 1 - len(items)),
+            ):
+                items.append({"fingerprint": r[0], "next_due": None, "overdue_days": None})
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        last = items[-1]
+        next_cursor = (f"d:{last['next_due']}:{last['fingerprint']}" if last["next_due"]
+                       else f"u:{last['fingerprint']}")
+    return {"items": items, "count": get_due_count(db_path, user_id, today),
+            "next_cursor": next_cursor}
 
 
 def get_wrong_fingerprints(
@@ -390,14 +1058,9 @@ def get_wrong_fingerprints(
 ) -> list[dict]:
     with _open(db_path) as c:
         rows = c.execute(
-            """SELECT fingerprint,
-                COUNT(*) AS total,
-                SUM(CASE WHEN result=1 THEN 1 ELSE 0 END) AS correct,
-                SUM(CASE WHEN result=0 THEN 1 ELSE 0 END) AS wrong,
-                MAX(ts) AS last_ts
-               FROM attempts
-               WHERE user_id=? AND result!=-1
-               GROUP BY fingerprint HAVING wrong>0 AND correct*1.0/(correct+wrong) < 0.8
+            """SELECT fingerprint, total, correct, wrong, last_ts
+               FROM user_question_stats
+               WHERE user_id=? AND wrong>0 AND correct*1.0/(correct+wrong) < 0.8
                ORDER BY wrong DESC, last_ts DESC LIMIT ?""",
             (user_id, limit),
         ).fetchall()
@@ -407,6 +1070,44 @@ def get_wrong_fingerprints(
             for r in rows]
 
 
+def get_hot_wrong_answers(
+    db_path: Path, limit: int = 200, min_attempts: int = 5, per_question: int = 2,
+) -> list[dict]:
+    """全体用户的高错题排行（供 ai-warm 预生成 AI 解析）。
+
+    错误率取自 user_question_stats（含已压缩的历史），按错误率、错误次数排序，
+    作答不足 min_attempts 次的题不参与排名。每道题附上 attempts 中最常见的
+    per_question 个错误选项 [(sq_index, answer, 次数), ...]；压缩后的历史不含选项。
+    """
+    with _open(db_path) as c:
+        rows = c.execute(
+            """SELECT fingerprint, SUM(total) AS total, SUM(wrong) AS wrong
+               FROM user_question_stats GROUP BY fingerprint
+               HAVING SUM(total) >= ? AND SUM(wrong) > 0
+               ORDER BY SUM(wrong)*1.0/SUM(total) DESC, SUM(wrong) DESC LIMIT ?""",
+            (max(1, min_attempts), limit),
+        ).fetchall()
+        fps = [r["fingerprint"] for r in rows]
+        answers: dict[str, list[tuple]] = {}
+        for i in range(0, len(fps), _SQL_CHUNK):
+            chunk = fps[i:i + _SQL_CHUNK]
+            for r in c.execute(
+                f"""SELECT fingerprint, sq_index, answer, COUNT(*) AS n FROM attempts
+                    WHERE result=0 AND answer IS NOT NULL
+                      AND fingerprint IN ({",".join("?" * len(chunk))})
+                    GROUP BY fingerprint, sq_index, answer
+                    ORDER BY n DESC, fingerprint, sq_index, answer""",
+                chunk,
+            ):
+                top = answers.setdefault(r["fingerprint"], [])
+                if len(top) < per_question:
+                    top.append((r["sq_index"], r["answer"], r["n"]))
+    return [{"fingerprint": r["fingerprint"], "total": r["total"], "wrong": r["wrong"],
+             "wrong_rate": round(r["wrong"] / r["total"], 3),
+             "answers": answers.get(r["fingerprint"], [])}
+            for r in rows]
+
+
 def get_history(db_path: Path, user_id: str = LEGACY_USER, limit: int = 30) -> list[dict]:
     with _open(db_path) as c:
         rows = c.execute(
@@ -434,11 +1135,8 @@ def delete_session(db_path: Path, session_id: str, user_id: str = LEGACY_USER) -
 def get_unit_stats(db_path: Path, user_id: str = LEGACY_USER) -> list[dict]:
     with _open(db_path) as c:
         rows = c.execute(
-            """SELECT unit, COUNT(*) AS total,
-                SUM(CASE WHEN result=1 THEN 1 ELSE 0 END) AS correct
-               FROM attempts
-               WHERE user_id=? AND result!=-1 AND unit IS NOT NULL AND unit!=''
-               GROUP BY unit ORDER BY total DESC""",
+            """SELECT unit, total, correct FROM user_unit_stats
+               WHERE user_id=? AND total>0 ORDER BY total DESC""",
             (user_id,),
         ).fetchall()
     return [{"unit":r["unit"],"total":r["total"],"correct":r["correct"],
@@ -452,67 +1150,291 @@ def get_overall_stats(
     user_id: str = LEGACY_USER,
     client_date: str = "",
 ) -> dict:
-    try:
-        date.fromisoformat(client_date)
-        today = client_date
-    except (ValueError, TypeError):
-        today = date.today().isoformat()
     with _open(db_path) as c:
         att = c.execute(
-            """SELECT COUNT(*) AS total,
-                SUM(CASE WHEN result=1 THEN 1 ELSE 0 END) AS correct,
-                SUM(CASE WHEN result=0 THEN 1 ELSE 0 END) AS wrong
-               FROM attempts WHERE user_id=? AND result!=-1""",
+            """SELECT SUM(total) AS total, SUM(correct) AS correct, SUM(wrong) AS wrong,
+                      SUM(wrong>0) AS wrong_topics
+               FROM user_question_stats WHERE user_id=?""",
             (user_id,),
         ).fetchone()
         sessions = c.execute(
             "SELECT COUNT(*) AS cnt FROM sessions WHERE user_id=?", (user_id,)
         ).fetchone()["cnt"]
-        due = c.execute(
-            """SELECT COUNT(*) AS cnt FROM (
-                SELECT fingerprint FROM sm2 WHERE user_id=? AND next_due<=?
-                UNION
-                SELECT DISTINCT fingerprint FROM attempts
-                WHERE user_id=? AND fingerprint NOT IN (
-                    SELECT fingerprint FROM sm2 WHERE user_id=?
-                )
-            )""",
-            (user_id, today, user_id, user_id),
-        ).fetchone()["cnt"]
-        wrong_topics = c.execute(
-            "SELECT COUNT(DISTINCT fingerprint) FROM attempts WHERE user_id=? AND result=0",
-            (user_id,),
-        ).fetchone()[0]
+        wrong_topics = att["wrong_topics"] or 0
+    due = get_due_count(db_path, user_id, client_date)
     total = att["total"] or 0; correct = att["correct"] or 0
     return {"total_attempts":total,"correct":correct,
             "wrong_attempts":att["wrong"] or 0,
             "accuracy":round(correct/total*100) if total else 0,
             "sessions":sessions,"due_today":due,"wrong_topics":wrong_topics}
 
-def cleanup_stale_users(db_path: Path, max_age_days: int = 7) -> tuple[int, int]:
-    """Delete all data for users inactive for more than max_age_days.
-    The _legacy user is never deleted.
-    Returns (users_cleaned, rows_deleted)."""
-    cutoff = int((time.time() - max_age_days * 86400) * 1000)
-    users = 0
+# ── 清理不活跃用户 ────────────────────────────────────────────────────
+#
+# 匿名 cookie 用户每周成千上万，逐个 clear_user_data 会反复借连接、各跑一轮删除。
+# 这里先在读连接上一次选出全部过期用户（WAL 下不挡写入），再按用户分批、按行数分块，
+# 每块作为一个任务交给写线程：与在线答题记录按先后排队、组提交，不争抢写锁。
+# 每个任务先在事务内复查是否仍过期，再把这些用户各表的数据一起删掉，不会出现
+# attempts 已删、汇总表还在（或反过来）的半删状态。
+# 超出时间预算就停下，剩余用户下次接着删（仍然过期，会被重新选中）。
+
+_CLEANUP_USERS  = 50                 # 每批处理的用户数
+_CLEANUP_CHUNK  = 2000               # 每个任务删除的 attempts 行数上限（至少删一个用户）
+_CLEANUP_BUDGET = 5.0                # 单次清理的时间预算（秒）
+_VACUUM_STEP    = 256                # 每个任务归还的空闲页数
+
+# 用户最近活跃时间：sessions 每次提交一行，汇总表每 (用户, 题目) 一行，
+# 都比逐题的 attempts 小得多；压缩过的历史也已计入汇总表
+_STALE_SQL = """SELECT user_id FROM (
+                    SELECT user_id, MAX(ts) AS last_ts FROM sessions GROUP BY user_id
+                    UNION ALL
+                    SELECT user_id, MAX(MAX(last_ts, first_seen)) FROM user_question_stats
+                    GROUP BY user_id
+                ) GROUP BY user_id
+                HAVING MAX(last_ts) < ? AND user_id != ?
+                ORDER BY user_id"""
+
+
+def _stage_users(c, uids: list[str]) -> None:
+    """把本批用户 ID 放进写连接上的临时表，供各表按 JOIN / IN 成批删除。"""
+    c.execute("CREATE TEMP TABLE IF NOT EXISTS _stale_batch (user_id TEXT PRIMARY KEY)")
+    c.execute("DELETE FROM _stale_batch")
+    c.executemany("INSERT INTO _stale_batch VALUES (?)", [(u,) for u in uids])
+
+
+def _cleanup_users(c, uids: list[str], cutoff: int, chunk: int) -> tuple[int, int, int]:
+    """在一个事务里删除 uids 开头若干用户的全部数据（attempts 与汇总表一起删）。
+
+    删除前在同一事务内重新判断是否过期，清理途中回来的用户跳过；按 attempts 行数
+    凑够 chunk 为止（至少一个用户）。返回 (已处理的 uids 个数, 删除的用户数, 行数)。
+    """
+    _stage_users(c, uids)
+    c.execute(
+        """DELETE FROM _stale_batch WHERE user_id IN (
+               SELECT user_id FROM sessions
+               WHERE user_id IN (SELECT user_id FROM _stale_batch) AND ts >= ?
+               UNION
+               SELECT user_id FROM user_question_stats
+               WHERE user_id IN (SELECT user_id FROM _stale_batch)
+                 AND MAX(last_ts, first_seen) >= ?)""",
+        (cutoff, cutoff),
+    )
+    take, n = [], 0
+    for uid, k in c.execute(
+            """SELECT b.user_id, (SELECT COUNT(*) FROM attempts a WHERE a.user_id = b.user_id)
+               FROM _stale_batch b ORDER BY b.user_id"""):
+        if take and n + k > chunk:
+            break
+        take.append(uid)
+        n += k
+    if not take:
+        return len(uids), 0, 0
+    # 本次没轮到的第一个过期用户之前的 uids（含重新活跃的）都算处理过
+    left = c.execute("SELECT MIN(user_id) FROM _stale_batch WHERE user_id > ?",
+                     (take[-1],)).fetchone()[0]
+    consumed = uids.index(left) if left is not None else len(uids)
+
+    _stage_users(c, take)
     rows = 0
+    for table in ("attempts", "attempts_daily", "sessions", "sm2"):
+        rows += c.execute(
+            f"DELETE FROM {table} WHERE user_id IN (SELECT user_id FROM _stale_batch)"
+        ).rowcount
+    for table in ("user_question_stats", "user_unit_stats"):
+        c.execute(f"DELETE FROM {table} WHERE user_id IN (SELECT user_id FROM _stale_batch)")
+    for uid in take:
+        _due_dirty(uid)
+    return consumed, len(take), rows
+
+
+def _vacuum_step(c, pages: int) -> int:
+    """在写线程的事务内归还至多 pages 个空闲页。库不在 INCREMENTAL 模式时返回 0。"""
+    if c.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return 0
+    free = c.execute("PRAGMA freelist_count").fetchone()[0]
+    # 事务内不能用 executescript；execute 每次只归还一页，逐页执行
+    for _ in range(min(free, pages)):
+        c.execute("PRAGMA incremental_vacuum(1)")
+    return free - c.execute("PRAGMA freelist_count").fetchone()[0]
+
+
+def cleanup_stale_users(
+    db_path: Path,
+    max_age_days: int = 7,
+    budget: float = _CLEANUP_BUDGET,
+    batch: int = _CLEANUP_USERS,
+    chunk: int = _CLEANUP_CHUNK,
+) -> dict:
+    """删除超过 max_age_days 天未活动用户的全部数据，_legacy 用户永不删除。
+
+    删除经写线程分块提交，可与在线服务同时运行；超过 budget 秒即停止，剩余用户留到下次。
+    库处于 INCREMENTAL 模式时随后分步归还空闲页（不做整库转换）。
+    返回 {users, rows, remaining, vacuumed_pages, elapsed}
+    """
+    t0 = time.monotonic()
+    cutoff = int((time.time() - max_age_days * 86400) * 1000)
     with _open(db_path) as c:
-        stale = c.execute(
-            """SELECT user_id, MAX(ts) AS last_ts FROM (
-                SELECT user_id, ts FROM sessions
-                UNION ALL
-                SELECT user_id, ts FROM attempts
-            ) GROUP BY user_id
-            HAVING last_ts < ? AND user_id != ?""",
-            (cutoff, LEGACY_USER),
-        ).fetchall()
-    for row in stale:
-        uid = row["user_id"]
-        counts = clear_user_data(db_path, uid)
-        total = sum(counts.values())
-        rows += total
-        users += 1
-    return users, rows
+        stale = [r[0] for r in c.execute(_STALE_SQL, (cutoff, LEGACY_USER))]
+
+    w = _writer(db_path)
+    users = rows = pos = 0
+    while pos < len(stale) and time.monotonic() - t0 < budget:
+        k, n, r = w.submit(_cleanup_users, stale[pos:pos + batch], cutoff, chunk)
+        users += n
+        rows  += r
+        pos   += k
+
+    vacuumed = 0
+    if rows:
+        while time.monotonic() - t0 < budget:
+            k = w.submit(_vacuum_step, _VACUUM_STEP)
+            vacuumed += k
+            if k < _VACUUM_STEP:
+                break
+    return {
+        "users":          users,
+        "rows":           rows,
+        "remaining":      len(stale) - pos,
+        "vacuumed_pages": vacuumed,
+        "elapsed":        round(time.monotonic() - t0, 3),
+    }
+
+
+# ── 历史压缩 ──────────────────────────────────────────────────────────
+#
+# attempts 每答一题一行，只增不减。早于保留期的行按 (用户, 题目, 日期, 单元) 合并进
+# attempts_daily：错题本、统计页读的是汇总表，重算汇总表（迁移 / 升级）时两张表合并计算，
+# 计数结果与压缩前完全一致，只是丢失了同一天内每次作答的先后顺序和所属会话。
+
+_COMPACT_CHUNK = 20000               # 每个事务压缩的行数，避免长时间占住写锁
+
+
+def _db_bytes(c) -> int:
+    """数据库实际占用的页（不含空闲页）字节数。"""
+    page_size  = c.execute("PRAGMA page_size").fetchone()[0]
+    page_count = c.execute("PRAGMA page_count").fetchone()[0]
+    return page_size * page_count
+
+
+def _time_query(c, sql: str, args: tuple = ()) -> float:
+    t0 = time.perf_counter()
+    c.execute(sql, args).fetchall()
+    return round((time.perf_counter() - t0) * 1000, 2)
+
+
+# 仍需扫描作答历史的查询：按用户取最近作答时间、汇总表全量重算
+_PROBES = {
+    "活跃度扫描": """SELECT user_id, MAX(ts) FROM (
+                        SELECT user_id, ts FROM attempts
+                        UNION ALL
+                        SELECT user_id, MAX(first_ts, last_ts) FROM attempts_daily
+                     ) GROUP BY user_id""",
+    "汇总重算": f"""SELECT user_id, fingerprint, SUM(total), SUM(correct), SUM(wrong)
+                   FROM ({_ATTEMPT_ROWS.format(where="")}) GROUP BY user_id, fingerprint""",
+}
+
+
+def enable_incremental_vacuum(db_path: Path) -> bool:
+    """确保库处于 auto_vacuum=INCREMENTAL 模式，返回本次是否做了转换。
+
+    已有库切换模式需要一次完整 VACUUM（重写整个文件），只在首次调用时发生。
+    """
+    with _open(db_path) as c:
+        if c.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return False
+        c.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        c.execute("VACUUM")
+    return True
+
+
+def incremental_vacuum(db_path: Path, pages: int = 0) -> int:
+    """归还空闲页给文件系统（pages=0 表示全部），返回归还的页数。
+    库不在 INCREMENTAL 模式时不做任何事。"""
+    with _open(db_path) as c:
+        if c.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return 0
+        before = c.execute("PRAGMA freelist_count").fetchone()[0]
+        # sqlite3 模块的 execute 对该 PRAGMA 只单步执行一次（只释放一页），
+        # executescript 走 sqlite3_exec 才会执行到底
+        c.executescript(f"PRAGMA incremental_vacuum({int(pages)});" if pages
+                        else "PRAGMA incremental_vacuum;")
+        return before - c.execute("PRAGMA freelist_count").fetchone()[0]
+
+
+def _compact_chunk(c, cutoff: int, chunk: int) -> tuple[int, int]:
+    """在写线程的事务内把至多 chunk 行早于 cutoff 的 attempts 合并进 attempts_daily。
+
+    返回 (删除的 attempts 行数, 写入 / 更新的 attempts_daily 行数)。
+    """
+    hi = c.execute(
+        """SELECT MAX(id) FROM (
+               SELECT id FROM attempts WHERE ts<? ORDER BY id LIMIT ?)""",
+        (cutoff, chunk),
+    ).fetchone()[0]
+    if hi is None:
+        return 0, 0
+    daily = c.execute(
+        """INSERT INTO attempts_daily
+               (user_id, fingerprint, day, unit, total, correct, wrong, skipped,
+                first_ts, last_ts)
+           SELECT user_id, fingerprint, date(ts/1000, 'unixepoch'), COALESCE(unit, ''),
+                  SUM(result!=-1), SUM(result=1), SUM(result=0), SUM(result=-1),
+                  MIN(ts), COALESCE(MAX(CASE WHEN result!=-1 THEN ts END), 0)
+           FROM attempts WHERE ts<? AND id<=?
+           GROUP BY 1, 2, 3, 4
+           ON CONFLICT(user_id, fingerprint, day, unit) DO UPDATE SET
+               total=total+excluded.total, correct=correct+excluded.correct,
+               wrong=wrong+excluded.wrong, skipped=skipped+excluded.skipped,
+               first_ts=MIN(first_ts, excluded.first_ts),
+               last_ts=MAX(last_ts, excluded.last_ts)""",
+        (cutoff, hi),
+    ).rowcount
+    rows = c.execute("DELETE FROM attempts WHERE ts<? AND id<=?", (cutoff, hi)).rowcount
+    return rows, daily
+
+
+def compact_attempts(
+    db_path: Path,
+    older_than_days: int = 90,
+    vacuum: bool = True,
+    chunk: int = _COMPACT_CHUNK,
+) -> dict:
+    """把早于 older_than_days 天的 attempts 合并进 attempts_daily。
+
+    经写线程分批提交，每批 chunk 行；可与在线服务同时运行。vacuum=True 时随后做增量 VACUUM
+    （首次会把库转换为 INCREMENTAL 模式）。
+    返回 {rows_compacted, daily_rows, bytes_before, bytes_after, reclaimed, vacuum_converted,
+          queries: {名称: [压缩前 ms, 压缩后 ms]}}
+    """
+    cutoff = int((time.time() - older_than_days * 86400) * 1000)
+    with _open(db_path) as c:
+        bytes_before = _db_bytes(c)
+        before = {k: _time_query(c, q) for k, q in _PROBES.items()}
+
+    w = _writer(db_path)
+    rows = daily = 0
+    while True:
+        k, d = w.submit(_compact_chunk, cutoff, chunk)
+        rows  += k
+        daily += d
+        if k == 0:
+            break
+
+    converted = False
+    if vacuum:
+        converted = enable_incremental_vacuum(db_path)
+        incremental_vacuum(db_path)
+    with _open(db_path) as c:
+        bytes_after = _db_bytes(c)
+        after = {k: _time_query(c, q) for k, q in _PROBES.items()}
+    return {
+        "rows_compacted":   rows,
+        "daily_rows":       daily,
+        "bytes_before":     bytes_before,
+        "bytes_after":      bytes_after,
+        "reclaimed":        max(0, bytes_before - bytes_after),
+        "vacuum_converted": converted,
+        "queries":          {k: [before[k], after[k]] for k in _PROBES},
+    }
 
 
 # ── 考试会话持久化 ─────────────────────────────────────────────────────────
@@ -529,19 +1451,41 @@ def save_exam_session(
     """Upsert a single exam session into the database."""
     answers_json = json.dumps(answers, ensure_ascii=False)
     with _open(db_path) as c:
-        c.execute(
-            """
-            INSERT INTO exam_sessions(id, answers_json, ts, started_at, time_limit, revealed_at)
-            VALUES (?, ?, ?, ?, ?, ?)
-            ON CONFLICT(id) DO UPDATE SET
-                answers_json = excluded.answers_json,
-                ts           = excluded.ts,
-                started_at   = excluded.started_at,
-                time_limit   = excluded.time_limit,
-                revealed_at  = excluded.revealed_at
-            """,
-            (exam_id, answers_json, ts, started_at, time_limit, revealed_at),
-        )
+        c.execute(_EXAM_UPSERT,
+                  (exam_id, answers_json, ts, started_at, time_limit, revealed_at))
+
+
+_EXAM_UPSERT = """
+    INSERT INTO exam_sessions(id, answers_json, ts, started_at, time_limit, revealed_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(id) DO UPDATE SET
+        answers_json = excluded.answers_json,
+        ts           = excluded.ts,
+        started_at   = excluded.started_at,
+        time_limit   = excluded.time_limit,
+        revealed_at  = excluded.revealed_at
+"""
+
+
+def _write_exam_sessions(c, rows: list[tuple], deleted: list[tuple]) -> None:
+    if rows:
+        c.executemany(_EXAM_UPSERT, rows)
+    if deleted:
+        c.executemany("DELETE FROM exam_sessions WHERE id=?", deleted)
+
+
+def save_exam_sessions(db_path: Path, sessions: list[dict], deleted=()) -> None:
+    """批量写回考试会话：sessions 逐行 upsert，deleted 中的 id 从库中删除。
+
+    经写线程在同一事务内提交。sessions 的每项含 id / answers / ts / started_at /
+    time_limit / revealed_at。
+    """
+    rows = [(s["id"], json.dumps(s.get("answers", {}), ensure_ascii=False), s["ts"],
+             s.get("started_at", 0), s.get("time_limit", 0), s.get("revealed_at", 0))
+            for s in sessions]
+    deleted = [(eid,) for eid in deleted]
+    if rows or deleted:
+        _writer(db_path).submit(_write_exam_sessions, rows, deleted)
 
 
 def load_exam_sessions(db_path: Path) -> list[dict]:
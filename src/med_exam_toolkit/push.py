@@ -15,7 +15,7 @@ import os
 import struct
 import threading
 import time
-from dataclasses import dataclass, field
+from dataclasses import asdict, dataclass, field
 from typing import Optional
 
 import jwt as pyjwt
@@ -28,6 +28,8 @@ from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.primitives.hashes import SHA256
 from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 
+from med_exam_toolkit.state import MemoryStore, StateStore
+
 log = logging.getLogger(__name__)
 
 
@@ -166,47 +168,46 @@ class PushSubscription:
         )
 
 
-@dataclass
-class PushEntry:
-    sub: PushSubscription
-    uid: str = ""   # 用户 ID（med_exam_uid），可为空
+# ── Subscription store ───────────────────────────────────────────────────
 
+class PushStore:
+    """推送订阅：endpoint → {sub, uid}，另存 uid → endpoint 便于按用户查找。
 
-# ── In-memory subscription store ─────────────────────────────────────────
+    数据放在 StateStore 中，多进程运行时各 worker 共享同一份订阅。
+    """
 
-class PushStore:
-    def __init__(self) -> None:
-        self._lock  = threading.Lock()
-        self._by_ep:  dict[str, PushEntry] = {}   # endpoint → entry
-        self._by_uid: dict[str, PushEntry] = {}   # uid → entry
+    def __init__(self, state: Optional[StateStore] = None) -> None:
+        self._state = state or MemoryStore()
 
     def add(self, sub: PushSubscription, uid: str = "") -> None:
-        with self._lock:
-            entry = PushEntry(sub=sub, uid=uid)
-            # 同一 uid 的旧订阅先清理
-            if uid and uid in self._by_uid:
-                old_ep = self._by_uid[uid].sub.endpoint
-                if old_ep != sub.endpoint:
-                    self._by_ep.pop(old_ep, None)
-            if uid:
-                self._by_uid[uid] = entry
-            self._by_ep[sub.endpoint] = entry
+        # 同一 uid 的旧订阅先清理
+        if uid:
+            old_ep = self._state.get("push_uid", uid)
+            if old_ep and old_ep != sub.endpoint:
+                self._state.pop("push", old_ep)
+            self._state.set("push_uid", uid, sub.endpoint)
+        self._state.set("push", sub.endpoint, {"sub": asdict(sub), "uid": uid})
 
     def remove(self, endpoint: str) -> None:
-        with self._lock:
-            entry = self._by_ep.pop(endpoint, None)
-            if entry and entry.uid:
-                self._by_uid.pop(entry.uid, None)
+        entry = self._state.pop("push", endpoint)
+        if entry and entry["uid"]:
+            # 该用户已换了新订阅时保留新的映射
+            self._state.update("push_uid", entry["uid"],
+                               lambda ep: None if ep == endpoint else ep)
 
     def all(self) -> list[PushSubscription]:
-        with self._lock:
-            return [e.sub for e in self._by_ep.values()]
+        return [PushSubscription(**e["sub"]) for _, e in self._state.items("push")]
 
     def for_uid(self, uid: str) -> Optional[PushSubscription]:
         """按用户 ID 查询订阅，找不到返回 None。"""
-        with self._lock:
-            entry = self._by_uid.get(uid)
-            return entry.sub if entry else None
+        ep = self._state.get("push_uid", uid)
+        entry = self._state.get("push", ep) if ep else None
+        return PushSubscription(**entry["sub"]) if entry else None
+
+    def clear(self) -> None:
+        for ns in ("push", "push_uid"):
+            for key, _ in self._state.items(ns):
+                self._state.pop(ns, key)
 
 
 # ── Daily push scheduler ──────────────────────────────────────────────────
@@ -1,26 +1,88 @@
 from __future__ import annotations
 import hashlib
+import heapq
+import asyncio
 import hmac
 import json as _json
 import math
+import os
 import random
 import secrets
 import socket
 import threading
 import time
 import webbrowser
-from collections import defaultdict, deque
+from collections import OrderedDict, defaultdict
 from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Optional
 from flask import Flask, jsonify, request, render_template, make_response
 from flask_compress import Compress
 from flask_sock import Sock
+from med_exam_toolkit import progress
+from med_exam_toolkit.gateway import GATEWAY_KEY, STREAM_KEY, WebSocketClosed, connect_ws
+from med_exam_toolkit.json_provider import install_json_provider
+from med_exam_toolkit.serving import ServerOptions, describe, run_asyncio, run_gunicorn
+from med_exam_toolkit.state import MemoryStore, SQLiteStore, StateStore
+from med_exam_toolkit.static_assets import StaticAssets
 
 # ════════════════════════════════════════════
 # 多题库状态
 # ════════════════════════════════════════════
 
+class StrataIndex:
+    """按 (mode, unit, difficulty) 分桶的抽样索引，每个题库构建一次。
+
+    桶内保存 qi 升序列表及小题总数。/api/questions 只合并筛选条件命中的桶，
+    无需每次遍历全库、重新分组和计算难度；合并后的顺序与逐题遍历完全一致，
+    因此相同 seed 的抽题结果不变。
+    """
+
+    def __init__(self, flat_groups: list[list[dict]]):
+        self.buckets:    dict[tuple[str, str, str], list[int]] = {}
+        self.sq_totals:  dict[tuple[str, str, str], int] = {}
+        self.difficulty: list[str] = []   # qi → 难度档
+        self.mode_order: list[str] = []   # 全库首次出现顺序
+        self.unit_order: list[str] = []
+        seen_m: set[str] = set()
+        seen_u: set[str] = set()
+        for qi, grp in enumerate(flat_groups):
+            level = _classify_group_difficulty(grp) if grp else "medium"
+            self.difficulty.append(level)
+            if not grp:
+                continue
+            m, u = grp[0]["mode"], grp[0]["unit"]
+            if m not in seen_m:
+                seen_m.add(m)
+                self.mode_order.append(m)
+            if u not in seen_u:
+                seen_u.add(u)
+                self.unit_order.append(u)
+            key = (m, u, level)
+            self.buckets.setdefault(key, []).append(qi)
+            self.sq_totals[key] = self.sq_totals.get(key, 0) + len(grp)
+
+    def group(self, axis: str, modes: set[str], units: set[str]
+              ) -> tuple[list[str], dict[str, list[int]], dict[str, int]]:
+        """按 axis（"mode" 或 "unit"）合并 modes × units 命中的桶。
+
+        返回 (按首次出现排序的 key 列表, key → qi 升序列表, key → 小题总数)。
+        """
+        parts:  dict[str, list[list[int]]] = {}
+        totals: dict[str, int] = {}
+        for key, qis in self.buckets.items():
+            m, u, _ = key
+            if m not in modes or u not in units:
+                continue
+            k = m if axis == "mode" else u
+            parts.setdefault(k, []).append(qis)
+            totals[k] = totals.get(k, 0) + self.sq_totals[key]
+        merged = {k: (ls[0] if len(ls) == 1 else list(heapq.merge(*ls)))
+                  for k, ls in parts.items()}
+        order = sorted(merged, key=lambda k: merged[k][0])
+        return order, merged, totals
+
+
 @dataclass
 class BankState:
     """单个题库的全部运行时状态。"""
@@ -30,13 +92,106 @@ class BankState:
     db_path:        Optional[Path] = None
     record_enabled: bool          = True
 
+    # ── 只读缓存（题库在服务运行期间不变，首次访问时构建）──
+    _flat_groups: Optional[list] = field(default=None, init=False, repr=False)
+    _flat_json:   Optional[list] = field(default=None, init=False, repr=False)
+    _fp_index:    Optional[dict] = field(default=None, init=False, repr=False)
+    _strata:      Optional[StrataIndex] = field(default=None, init=False, repr=False)
+    _version:     Optional[str] = field(default=None, init=False, repr=False)
+    _cache_lock:  threading.Lock = field(default_factory=threading.Lock,
+                                         init=False, repr=False, compare=False)
+
     @property
     def name(self) -> str:
         return self.bank_path.stem
 
+    def flat_groups(self) -> list[list[dict]]:
+        """按 qi 索引的 sqFlat 字典列表（每道大题一组）。
+
+        返回的字典在所有请求间共享，调用方只能读取；需要修改时先 dict(row) 复制。
+        """
+        if self._flat_groups is None:
+            with self._cache_lock:
+                if self._flat_groups is None:
+                    self._flat_groups = [
+                        [_sq_flat(q, sq, qi, si) for si, sq in enumerate(q.sub_questions)]
+                        for qi, q in enumerate(self.questions)
+                    ]
+        return self._flat_groups
+
+    def flat_json(self) -> list[list[str]]:
+        """与 flat_groups() 一一对应的预序列化 JSON 片段，fragments[qi][si]。"""
+        if self._flat_json is None:
+            groups = self.flat_groups()
+            with self._cache_lock:
+                if self._flat_json is None:
+                    self._flat_json = [[_dumps_compact(row) for row in grp] for grp in groups]
+        return self._flat_json
+
+    def fp_index(self) -> dict[str, list[tuple[int, object]]]:
+        """fingerprint → [(qi, question), ...]，按题库顺序；指纹重复的题目全部保留。
+
+        按指纹筛题时返回全部命中，只取一道的查询（单题、错题本）用第一道。
+        """
+        if self._fp_index is None:
+            with self._cache_lock:
+                if self._fp_index is None:
+                    idx: dict[str, list[tuple[int, object]]] = {}
+                    for qi, q in enumerate(self.questions):
+                        fp = getattr(q, "fingerprint", "") or ""
+                        if fp:
+                            idx.setdefault(fp, []).append((qi, q))
+                    self._fp_index = idx
+        return self._fp_index
+
+    def strata(self) -> StrataIndex:
+        """(mode, unit, difficulty) 分桶抽样索引。"""
+        if self._strata is None:
+            groups = self.flat_groups()
+            with self._cache_lock:
+                if self._strata is None:
+                    self._strata = StrataIndex(groups)
+        return self._strata
+
+    def version(self) -> str:
+        """题库内容版本（全部小题 JSON 片段的 SHA-1），用作响应缓存键与 ETag 的组成部分。"""
+        if self._version is None:
+            frags = self.flat_json()
+            with self._cache_lock:
+                if self._version is None:
+                    h = hashlib.sha1()
+                    for grp in frags:
+                        for frag in grp:
+                            h.update(frag.encode())
+                            h.update(b"\n")
+                    self._version = h.hexdigest()
+        return self._version
+
 # 所有已加载的题库，索引即为 ?bank=N 中的 N
 _banks: list[BankState] = []
 
+# 跨题库指纹索引：fingerprint → 第一道命中的 (bank_idx, qi, question)，由 _index_banks() 构建
+_fp_global: dict[str, tuple[int, int, object]] = {}
+
+
+def _index_banks() -> None:
+    """构建每个题库的指纹索引及跨题库总索引（题库加载完成后调用一次）。"""
+    global _fp_global
+    merged: dict[str, tuple[int, int, object]] = {}
+    for bi, b in enumerate(_banks):
+        for fp, hits in b.fp_index().items():
+            merged.setdefault(fp, (bi, *hits[0]))
+    _fp_global = merged
+
+
+def _lookup_fp(fingerprint: str, bank_idx: int = -1) -> "tuple[int, int, object] | None":
+    """按指纹查题，优先在 bank_idx 指定的题库中查找，找不到再查跨题库索引。"""
+    if 0 <= bank_idx < len(_banks):
+        hits = _banks[bank_idx].fp_index().get(fingerprint)
+        if hits:
+            return bank_idx, *hits[0]
+    return _fp_global.get(fingerprint)
+
 # ── 共享服务级状态 ──
 _session_token: str  = ""
 _asset_ver:     str  = ""
@@ -58,6 +213,13 @@ _ai_provider: str  = ""
 _ai_enable_thinking: "bool | None" = None
 
 _ai_max_tokens: int = 2048  # AI 单次最大输出 token 数
+_ai_async: "tuple | None" = None   # (事件循环, 同步客户端, AsyncOpenAI)：--server asyncio 时使用
+_ai_limiter: "object | None" = None  # FairLimiter：上游并发 / token 预算 / 公平排队，None 表示不限
+_AI_QUEUE_TIMEOUT = 120.0   # 排队最长等待（秒），超时返回繁忙提示
+_AI_QUEUE_POLL    = 1.0     # 排队期间刷新名次的间隔（秒）
+_ai_cache: "object | None" = None    # ChatCache：首轮回答缓存，None 表示关闭
+_AI_REPLAY_CHUNK    = 24     # 缓存回放：每块字符数
+_AI_REPLAY_INTERVAL = 0.02   # 缓存回放：块间隔（秒），约 1200 字/秒，保留流式观感
 
 # ── ASR 语音识别 ──
 _asr_api_key:  str = ""
@@ -67,15 +229,17 @@ _asr_base_url: str = ""
 _cleanup_days: int = 7  # 不活跃用户数据保留天数
 _debug: bool = False    # 调试模式（启用 /api/debug 端点，仅限 loopback 访问）
 
+# ── 共享运行时状态 ──
+# 考试会话、分享令牌、限流 / 封禁计数等都放在这里；--workers N 时换成各进程共享的
+# SQLiteStore（见 state.py），单进程默认用内存实现
+_state: StateStore = MemoryStore()
+
 # ── 速率限制 ──
+# 每个请求都要计数，放进共享库会让所有 worker 的每个请求都抢同一把写锁；
+# 计数只在进程内做，多 worker 时单个 IP 的总上限约为 workers × _RATE_LIMIT
 _RATE_LIMIT  = 120
 _RATE_WINDOW = 60
-_rate_buckets: dict[str, deque] = defaultdict(deque)
-_rate_lock   = threading.Lock()
-
-# ── 扫描器封禁 ──
-_scan_bans: dict[str, float] = {}   # ip -> 解封时间戳（0=永久）
-_scan_lock = threading.Lock()
+_rate_state: StateStore = MemoryStore()
 
 _SCANNER_PREFIXES = (
     "/wp-", "/wordpress", "/xmlrpc", "/wp-admin", "/wp-login",
@@ -115,62 +279,101 @@ def _is_scanner_path(path: str) -> bool:
     return False
 
 def _ban_ip(ip: str, duration: float = 86400.0) -> None:
-    with _scan_lock:
-        _scan_bans[ip] = time.monotonic() + duration if duration > 0 else 0.0
+    """封禁扫描器 IP；duration <= 0 表示永久。"""
+    _state.set("ban", ip, True, ttl=duration if duration > 0 else None)
 
 def _is_banned(ip: str) -> bool:
-    with _scan_lock:
-        until = _scan_bans.get(ip)
-        if until is None:
-            return False
-        if until == 0.0:  # 永久
-            return True
-        if time.monotonic() < until:
-            return True
-        del _scan_bans[ip]
-        return False
+    return _state.get("ban", ip) is not None
 
 # ── 考试防作弊：sealed 模式答案暂存 ──
-_exam_sessions: dict[str, dict] = {}   # exam_id -> {"fingerprint:si": {answer, discuss}, ts}
+# _state 命名空间 "exam"：exam_id -> {answers: {"fingerprint:si": {answer, discuss}}, ts, ...}
 _exam_lock = threading.Lock()
+_EXAM_TTL = 86400           # 秒 — 考试会话最长保留时间
 _REVEAL_GRACE_WINDOW = 180  # 秒 — 交卷答案可重复领取的宽限窗口
 
 
 def _first_db_path() -> "Path | None":
     """返回第一个可用 bank 的 progress.db 路径（用于考试会话持久化）。"""
     for b in _banks:
-        if b.get("db_path"):
-            return Path(b["db_path"])
+        if b.db_path:
+            return b.db_path
     return None
 
 
-def _persist_exam_sessions() -> None:
-    """将所有考试会话快照写入数据库（best-effort，不抛异常）。"""
+# ── 考试会话写回：单个后台线程，只写变更过的会话 ──
+# 开考 / 首次交卷只把 exam_id 记入脏集合；写回线程等一小段时间合并一波事件，
+# 再把这些会话在一个事务里写回（内存中已不存在的从库中删除）。
+# _state 本身持久（SQLiteStore）时不需要写回。
+_exam_dirty: set[str] = set()           # 受 _exam_lock 保护
+_exam_wake = threading.Event()
+_exam_worker: "threading.Thread | None" = None
+_EXAM_PERSIST_DELAY = 0.5               # 合并突发事件的等待时间（秒）
+
+
+def _mark_exam_dirty(*eids: str) -> None:
+    """标记考试会话待写回。调用方须持有 _exam_lock。"""
+    global _exam_worker
+    if _state.durable:
+        return
+    _exam_dirty.update(eids)
+    _exam_wake.set()
+    if _exam_worker is None or not _exam_worker.is_alive():
+        _exam_worker = threading.Thread(target=_exam_persist_loop, daemon=True,
+                                        name="exam-persist")
+        _exam_worker.start()
+
+
+def _exam_persist_loop() -> None:
+    while True:
+        _exam_wake.wait()
+        time.sleep(_EXAM_PERSIST_DELAY)
+        _exam_wake.clear()
+        _persist_exam_sessions()
+
+
+def _persist_exam_sessions() -> int:
+    """把脏集合中的考试会话写回数据库，返回写回条数（best-effort，不抛异常）。
+
+    失败的会话留在脏集合里，下次写回时重试。
+    """
+    global _exam_dirty
     db = _first_db_path()
     if db is None:
-        return
+        return 0
     with _exam_lock:
-        snap = dict(_exam_sessions)
-    now_s = int(time.time())
-    for eid, sess in snap.items():
-        try:
-            progress.save_exam_session(
-                db,
-                eid,
-                sess.get("answers", {}),
-                sess.get("ts", now_s),
-                sess.get("started_at", 0),
-                sess.get("time_limit", 0),
-                sess.get("revealed_at", 0),
-            )
-        except Exception as e:
-            print(f"[exam-persist] 写入 session {eid} 失败: {e}")
+        dirty, _exam_dirty = _exam_dirty, set()
+    if not dirty:
+        return 0
+    rows, gone = [], []
+    for eid in dirty:
+        sess = _state.get("exam", eid)
+        if sess is None:
+            gone.append(eid)
+        else:
+            rows.append({"id": eid, **sess})
+    try:
+        progress.save_exam_sessions(db, rows, gone)
+    except Exception as e:
+        print(f"[exam-persist] 写入 {len(dirty)} 个会话失败: {e}")
+        with _exam_lock:
+            _exam_dirty |= dirty
+        return 0
+    return len(dirty)
+
+
+def _exam_ttl(sess: dict, now_s: int) -> int:
+    """考试会话剩余保留秒数：开考起最多 _EXAM_TTL；交卷后再保留两个宽限窗口
+    （第一个窗口内可重复领取答案，之后领取返回 410）。"""
+    ttl = sess["ts"] + _EXAM_TTL - now_s
+    if sess.get("revealed_at"):
+        ttl = min(ttl, sess["revealed_at"] + 2 * _REVEAL_GRACE_WINDOW - now_s)
+    return ttl
 
 
 def _load_exam_sessions() -> None:
     """从数据库恢复未过期的考试会话（服务启动时调用）。"""
     db = _first_db_path()
-    if db is None:
+    if db is None or _state.durable:
         return
     try:
         # 确保表存在（进行一次幂等 migration）
@@ -181,34 +384,29 @@ def _load_exam_sessions() -> None:
         return
     now_s = int(time.time())
     loaded = 0
-    with _exam_lock:
-        for r in rows:
-            if now_s - r["ts"] > 86400:
-                continue
-            if r["revealed_at"] != 0 and now_s - r["revealed_at"] > _REVEAL_GRACE_WINDOW:
-                continue
-            _exam_sessions[r["id"]] = {
-                "answers":    r["answers"],
-                "ts":         r["ts"],
-                "started_at": r["started_at"],
-                "time_limit": r["time_limit"],
-                "revealed_at": r["revealed_at"],
-            }
-            loaded += 1
+    for r in rows:
+        ttl = _exam_ttl(r, now_s)
+        if ttl <= 0:
+            continue
+        _state.set("exam", r["id"], {
+            "answers":    r["answers"],
+            "ts":         r["ts"],
+            "started_at": r["started_at"],
+            "time_limit": r["time_limit"],
+            "revealed_at": r["revealed_at"],
+        }, ttl=ttl)
+        loaded += 1
     if loaded:
         print(f"[exam-persist] 从数据库恢复 {loaded} 个考试会话")
 
-# ── 试卷分享令牌（内存存储，7天有效，服务重启后失效）──
-_share_tokens: dict[str, dict] = {}    # token -> {fingerprints, mode, bank_idx, time_limit, share_pin, ts, expires_at}
-_share_lock = threading.Lock()
+# ── 试卷分享令牌（_state 命名空间 "share"，7天有效）──
+# token -> {fingerprints, mode, bank_idx, time_limit, share_pin, ts, expires_at}
 _SHARE_TTL = 7 * 24 * 3600             # 7 天有效期（秒）
 _SHARE_COOKIE = "med_exam_share"       # 分享用户会话 cookie
 _SHARE_PIN_LEN = 6                     # 分享码长度
 _SHARE_PIN_CHARSET = "ABCDEFGHJKMNPQRTUVWXY346789"  # 无歧义字符集（与访问码一致）
 
 # 分享码暴破防护：每 IP+token 10 分钟内 5 次失败锁定
-_share_brute: dict[str, list[float]] = {}
-_share_brute_lock = threading.Lock()
 _SHARE_BRUTE_WINDOW = 600
 _SHARE_BRUTE_MAX = 5
 
@@ -264,49 +462,35 @@ def _verify_share_cookie() -> str:
     expected = _sign_share_cookie(token)
     if not hmac.compare_digest(sig, expected):
         return ""
-    with _share_lock:
-        cfg = _share_tokens.get(token)
-        if cfg is None or int(time.time()) > cfg.get("expires_at", 0):
-            return ""
+    cfg = _state.get("share", token)
+    if cfg is None or int(time.time()) > cfg.get("expires_at", 0):
+        return ""
     return token
 
 
 def _share_brute_check(ip: str, token: str) -> tuple[bool, int]:
-    key = f"{ip}:{token}"
-    now = time.monotonic()
-    with _share_brute_lock:
-        attempts = _share_brute.get(key, [])
-        attempts = [t for t in attempts if now - t < _SHARE_BRUTE_WINDOW]
-        _share_brute[key] = attempts
-        if len(attempts) >= _SHARE_BRUTE_MAX:
-            oldest = attempts[0]
-            retry = int(_SHARE_BRUTE_WINDOW - (now - oldest)) + 1
-            return False, max(retry, 1)
+    now = time.time()
+    attempts = [t for t in _state.get("share_brute", f"{ip}:{token}", [])
+                if now - t < _SHARE_BRUTE_WINDOW]
+    if len(attempts) >= _SHARE_BRUTE_MAX:
+        retry = int(_SHARE_BRUTE_WINDOW - (now - attempts[0])) + 1
+        return False, max(retry, 1)
     return True, 0
 
 
 def _share_brute_record_fail(ip: str, token: str) -> None:
-    key = f"{ip}:{token}"
-    with _share_brute_lock:
-        _share_brute.setdefault(key, []).append(time.monotonic())
+    now = time.time()
+    _state.update("share_brute", f"{ip}:{token}",
+                  lambda ts: [t for t in ts or () if now - t < _SHARE_BRUTE_WINDOW] + [now],
+                  ttl=_SHARE_BRUTE_WINDOW)
 
 
 def _share_brute_clear(ip: str, token: str) -> None:
-    key = f"{ip}:{token}"
-    with _share_brute_lock:
-        _share_brute.pop(key, None)
+    _state.pop("share_brute", f"{ip}:{token}")
 
 
 def _check_rate_limit(ip: str) -> bool:
-    now = time.monotonic()
-    with _rate_lock:
-        q = _rate_buckets[ip]
-        while q and now - q[0] > _RATE_WINDOW:
-            q.popleft()
-        if len(q) >= _RATE_LIMIT:
-            return False
-        q.append(now)
-        return True
+    return _rate_state.hit("rate", ip, _RATE_LIMIT, _RATE_WINDOW)[0]
 
 
 def _get_lan_ip() -> str:
@@ -377,12 +561,12 @@ def _get_bank_with_idx() -> tuple[BankState, int, bool]:
     return _banks[idx], idx, True
 
 
-def _select_questions_by_fp(questions: list, fp_set: set) -> list[dict]:
-    """将题库中 fingerprint 在 fp_set 内的题目展开为 sqFlat 风格字典列表。"""
+def _select_questions_by_fp(bank: BankState, fp_set: set) -> list[dict]:
+    """将题库中 fingerprint 在 fp_set 内的题目展开为 sqFlat 风格字典列表（按题库顺序）。"""
+    idx = bank.fp_index()
+    hits = sorted((h for fp in fp_set for h in idx.get(fp, ())), key=lambda h: h[0])
     rows = []
-    for qi, q in enumerate(questions):
-        if q.fingerprint not in fp_set:
-            continue
+    for qi, q in hits:
         shared = list(q.shared_options or [])
         for si, sq in enumerate(q.sub_questions):
             eff_opts = list(sq.options) if sq.options else shared
@@ -406,6 +590,7 @@ def _create_app():
     app = Flask(__name__, template_folder="templates", static_folder="static")
     app.config["JSON_AS_ASCII"] = False
     app.config["MAX_CONTENT_LENGTH"] = 32 * 1024 * 1024
+    install_json_provider(app)
     Compress(app)
     _sock = Sock(app)
 
@@ -526,6 +711,7 @@ def _create_app():
 
 
 app, sock = _create_app()
+_static = StaticAssets(app)
 
 
 @app.errorhandler(413)
@@ -560,6 +746,106 @@ def _sq_flat(q, sq, qi: int, si: int) -> dict:
     }
 
 
+def _dumps_compact(obj) -> str:
+    """按 app.json 的配置序列化（与 jsonify 非调试模式输出一致的紧凑格式）。"""
+    return app.json.dumps(obj, separators=(",", ":"))
+
+
+def _json_items_response(fragments, total: int, extra: dict | None = None):
+    """用预序列化片段拼装 {"items": [...], "total": N} 响应，避免重新编码整个列表。
+
+    extra 中的字段（如分页的 next_cursor）追加在 total 之后。
+    """
+    body = '{"items":[' + ",".join(fragments) + '],"total":' + str(total)
+    for k, v in (extra or {}).items():
+        body += "," + _dumps_compact(k) + ":" + _dumps_compact(v)
+    return app.response_class(body + "}\n", mimetype=app.json.mimetype)
+
+
+class _LRUCache:
+    """线程安全的定长 LRU 缓存。"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+# 只读接口的响应缓存：key = (路由, 题库版本, 规范化查询…) → (etag, body)
+_resp_cache = _LRUCache(128)
+# 确定性抽题结果（未打乱或带 seed）：key = (题库版本, 规范化查询) → 小题片段列表
+_selection_cache = _LRUCache(64)
+
+# 不影响抽题结果、只影响输出形态的参数
+_PAGING_ARGS = ("bank", "format", "page_size", "cursor")
+
+
+def _normalized_query(exclude=("bank",)) -> tuple:
+    """把查询串规范化为排序后的 (key, value) 元组，参数顺序不同视为同一请求。"""
+    return tuple(sorted((k, v) for k, v in request.args.items(multi=True) if k not in exclude))
+
+
+def _etag_matches(etag: str) -> bool:
+    """If-None-Match 是否命中 etag。
+
+    flask_compress 会把强 ETag 改写为 "<etag>:<算法>"，比较时忽略该后缀。
+    """
+    inm = request.if_none_match
+    if not inm:
+        return False
+    if inm.star_tag:
+        return True
+    return any(t.split(":", 1)[0] == etag for t in inm.as_set())
+
+
+def _with_etag(resp, etag: str):
+    resp.set_etag(etag)
+    # 允许浏览器缓存，但每次使用前必须带 If-None-Match 回源校验
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
+
+
+def _not_modified(etag: str):
+    return _with_etag(app.response_class(status=304), etag)
+
+
+def _cached_json(key: tuple, build):
+    """key 不变则响应体不变的只读接口：序列化结果缓存在服务端，并支持 304。"""
+    entry = _resp_cache.get(key)
+    if entry is None:
+        body = _dumps_compact(build()) + "\n"
+        entry = (hashlib.sha1(body.encode()).hexdigest(), body)
+        _resp_cache.put(key, entry)
+    etag, body = entry
+    if _etag_matches(etag):
+        return _not_modified(etag)
+    return _with_etag(app.response_class(body, mimetype=app.json.mimetype), etag)
+
+
 def _parse_rate(raw) -> float | None:
     if not raw:
         return None
@@ -599,60 +885,55 @@ def _distribute_by_ratio(total: int, weights: dict) -> dict:
     return result
 
 
+def _group_by_field(groups: list[list[dict]], key: str) -> tuple[list[str], dict[str, list]]:
+    """按首个小题的 key 字段分组，返回 (首次出现顺序, key → 组列表)。"""
+    order: list[str] = []
+    grouped: dict[str, list] = {}
+    for grp in groups:
+        k = grp[0][key]
+        if k not in grouped:
+            order.append(k)
+            grouped[k] = []
+        grouped[k].append(grp)
+    return order, grouped
+
+
+def _grp_key(grp: list) -> int:
+    """题组的身份：所属大题下标。截断后的题组是新 list，不能再用 id() 判重。"""
+    return grp[0]["qi"]
+
+
 def _greedy_fill(pool: list, target: int) -> list:
-    available = list(pool)
-    picked: list = []
-    total = 0
-    remaining: list = []
-    for grp in available:
-        c = len(grp)
-        if total + c <= target:
-            picked.append(grp)
-            total += c
-            if total == target:
-                return picked
-        else:
-            remaining.append(grp)
-    while total < target and remaining:
-        gap = target - total
-        best_idx, best_c = -1, 0
-        for i, grp in enumerate(remaining):
-            c = len(grp)
-            if c <= gap and c > best_c:
-                best_c = c
-                best_idx = i
-        if best_idx >= 0:
-            picked.append(remaining.pop(best_idx))
-            total += best_c
-        else:
-            break
-    if total < target and remaining:
-        gap = target - total
-        best_idx, best_size = -1, 0
-        for i, grp in enumerate(remaining):
-            c = len(grp)
-            if c > gap and (best_idx == -1 or c < best_size):
-                best_idx = i
-                best_size = c
-        if best_idx >= 0:
-            picked.append(remaining[best_idx][:gap])
+    """凑满 target 道小题：先精确凑数，实在凑不出再截断一组共享题干的题"""
+    from med_exam_toolkit.exam.fill import fill_exact
+    picked = fill_exact(pool, target, len)
+    gap = target - sum(len(grp) for grp in picked)
+    if gap > 0:
+        taken = {id(grp) for grp in picked}
+        best = None
+        for grp in pool:
+            if id(grp) not in taken and len(grp) > gap and (best is None or len(grp) < len(best)):
+                best = grp
+        if best is not None:
+            picked.append(best[:gap])
     return picked
 
 
-def _sample_with_difficulty(pool: list, target: int, difficulty: dict, rng) -> list:
+def _sample_with_difficulty(pool: list, target: int, difficulty: dict, rng,
+                            classify=_classify_group_difficulty) -> list:
     by_diff: dict = defaultdict(list)
     for grp in pool:
-        by_diff[_classify_group_difficulty(grp)].append(grp)
+        by_diff[classify(grp)].append(grp)
     targets = _distribute_by_ratio(target, difficulty)
     selected: list = []
     for level, need in targets.items():
         lvl_pool = list(by_diff.get(level, []))
         rng.shuffle(lvl_pool)
         selected.extend(_greedy_fill(lvl_pool, need))
-    used_ids = {id(g) for g in selected}
+    used = {_grp_key(g) for g in selected}
     got = sum(len(g) for g in selected)
     if got < target:
-        rest = [g for g in pool if id(g) not in used_ids]
+        rest = [g for g in pool if _grp_key(g) not in used]
         rng.shuffle(rest)
         selected.extend(_greedy_fill(rest, target - got))
     return selected
@@ -665,20 +946,25 @@ def _sample_with_difficulty(pool: list, target: int, difficulty: dict, rng) -> l
 @app.get("/api/banks")
 def api_banks():
     """返回所有已加载题库的元信息列表。"""
-    infos = []
-    for i, b in enumerate(_banks):
-        total_sq = sum(len(q.sub_questions) for q in b.questions)
-        infos.append({
-            "id":       i,
-            "name":     b.name,
-            "path":     str(b.bank_path),
-            "total_sq": total_sq,
-        })
-    return jsonify({
-        "banks":         infos,
-        "session_token": _session_token,
-        "asset_ver":     _asset_ver,
-    })
+    def build():
+        infos = []
+        for i, b in enumerate(_banks):
+            total_sq = sum(len(q.sub_questions) for q in b.questions)
+            infos.append({
+                "id":       i,
+                "name":     b.name,
+                "path":     str(b.bank_path),
+                "total_sq": total_sq,
+            })
+        return {
+            "banks":         infos,
+            "session_token": _session_token,
+            "asset_ver":     _asset_ver,
+        }
+
+    key = ("/api/banks", tuple((b.version(), str(b.bank_path)) for b in _banks),
+           _session_token, _asset_ver)
+    return _cached_json(key, build)
 
 
 # ════════════════════════════════════════════
@@ -694,15 +980,42 @@ def api_record():
         return jsonify({"ok": True, "skipped": True})
     if b.db_path is None:
         return jsonify({"ok": False, "error": "进度数据库未初始化"}), 503
+    from med_exam_toolkit.progress import WriterBusy, submit_session
     try:
-        from med_exam_toolkit.progress import record_session
         data = request.get_json(silent=True) or {}
-        record_session(b.db_path, data, user_id=_get_user_id())
+        submit_session(b.db_path, data, user_id=_get_user_id())
         return jsonify({"ok": True})
+    except WriterBusy as e:
+        return _writer_busy(e)
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 500
 
 
+def _writer_busy(e: Exception):
+    """写入队列繁忙：返回 503，客户端保留本地记录稍后重试。"""
+    resp = jsonify({"ok": False, "busy": True, "error": str(e)})
+    resp.status_code = 503
+    resp.headers["Retry-After"] = "5"
+    return resp
+
+
+@app.get("/api/record/metrics")
+def api_record_metrics():
+    """进度写线程指标：队列深度、组提交次数与提交 / 确认延迟。
+
+    按题库序号返回，不暴露服务器上的数据库路径。
+    """
+    from med_exam_toolkit.progress import writer_stats
+    writers = {}
+    for i, b in enumerate(_banks):
+        if b.db_path is None:
+            continue
+        st = next(iter(writer_stats(b.db_path).values()), None)
+        if st is not None:
+            writers[str(i)] = {"bank": b.name, **st}
+    return jsonify({"writers": writers})
+
+
 @app.get("/api/record/status")
 def api_record_status():
     b, ok = _get_bank()
@@ -779,9 +1092,18 @@ def api_review_due():
         return jsonify({"error": "bank not found"}), 404
     if b.db_path is None or not b.db_path.exists():
         return jsonify({"fingerprints": [], "count": 0})
-    from med_exam_toolkit.progress import get_due_fingerprints
+    from med_exam_toolkit.progress import get_due_fingerprints, get_due_page
     # 接受客户端本地日期以修正时区偏差（中国用户在 UTC 午夜到 08:00 间跨天时尤为关键）
     client_date = request.args.get("date", "")
+    page_size   = request.args.get("page_size", type=int)
+    if page_size:
+        # 分页：逾期最久的在前，复习可以先拿第一页开始，不必等整张到期表
+        try:
+            page = get_due_page(b.db_path, user_id=_get_user_id(), client_date=client_date,
+                                limit=min(page_size, 500), cursor=request.args.get("cursor"))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify({"fingerprints": [it["fingerprint"] for it in page["items"]], **page})
     fps = get_due_fingerprints(b.db_path, user_id=_get_user_id(), client_date=client_date)
     return jsonify({"fingerprints": fps, "count": len(fps)})
 
@@ -796,18 +1118,19 @@ def api_wrongbook():
     from med_exam_toolkit.progress import get_wrong_fingerprints
     entries = get_wrong_fingerprints(b.db_path, user_id=_get_user_id())
 
-    # 构建 fingerprint → question 索引，附上题目文字
-    fp_idx = {q.fingerprint: q for q in (b.questions or [])}
+    # 用题库的指纹索引附上题目文字
+    fp_idx = b.fp_index()
     items = []
     for e in entries:
         item = dict(e)
-        q = fp_idx.get(e.get("fingerprint", ""))
+        hits = fp_idx.get(e.get("fingerprint", ""))
+        q = hits[0][1] if hits else None
         if q and q.sub_questions:
             sq = q.sub_questions[0]
             item["text"]    = getattr(sq, "text", "") or ""
             item["stem"]    = getattr(q,  "stem", "") or ""
-            item["answer"]  = sq.eff_answer() if hasattr(sq, "eff_answer") else (getattr(sq, "answer", "") or "")
-            item["discuss"] = sq.eff_discuss() if hasattr(sq, "eff_discuss") else (getattr(sq, "discuss", "") or "")
+            item["answer"]  = getattr(sq, "eff_answer", None) or getattr(sq, "answer", "") or ""
+            item["discuss"] = getattr(sq, "eff_discuss", None) or getattr(sq, "discuss", "") or ""
             item["unit"]    = getattr(q, "unit", "") or ""
         items.append(item)
     return jsonify({"items": items, "count": len(items)})
@@ -859,11 +1182,13 @@ def api_sync():
         return jsonify({"ok": True, "processed": [], "skipped": [], "failed": []})
     if len(sessions) > 200:
         return jsonify({"ok": False, "error": "单次同步不超过 200 条"}), 400
+    from med_exam_toolkit.progress import WriterBusy, submit_sessions_batch
     try:
-        from med_exam_toolkit.progress import record_sessions_batch
         uid    = _get_user_id()
-        result = record_sessions_batch(b.db_path, sessions, user_id=uid)
+        result = submit_sessions_batch(b.db_path, sessions, user_id=uid)
         return jsonify({"ok": True, "failed": [], **result})
+    except WriterBusy as e:
+        return _writer_busy(e)
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 500
 
@@ -896,24 +1221,29 @@ def api_exam_reveal():
     断导致的重试、前端 submitExam 被意外双触发等情况都不会丢答案。
 
     宽限期过后拒绝 reveal，但不删除 session（让 /api/exam/time 仍可用）—
-    session 由创建时的 cleanup 逻辑统一清理。
+    session 在再过一个宽限窗口后按 TTL 过期。
     """
     eid = request.args.get("id", "")
     if not eid:
         return jsonify({"error": "缺少 exam id"}), 400
     now_s = int(time.time())
-    with _exam_lock:
-        sess = _exam_sessions.get(eid)
-        if sess is not None:
-            revealed_at = sess.get("revealed_at", 0)
-            if revealed_at == 0:
-                sess["revealed_at"] = now_s
-                threading.Thread(target=_persist_exam_sessions, daemon=True).start()
-            elif now_s - revealed_at > _REVEAL_GRACE_WINDOW:
-                # 宽限期已过，拒绝领取（但不删除 session）
-                return jsonify({"error": "答案领取窗口已过期"}), 410
+    sess = _state.get("exam", eid)
     if sess is None:
         return jsonify({"error": "考试会话已过期或不存在"}), 404
+    revealed_at = sess.get("revealed_at", 0)
+    if revealed_at == 0:
+        def _reveal(cur):
+            if cur is not None and not cur.get("revealed_at"):
+                cur["revealed_at"] = now_s
+            return cur
+        sess = _state.update("exam", eid, _reveal, ttl=_exam_ttl({**sess, "revealed_at": now_s}, now_s))
+        if sess is None:
+            return jsonify({"error": "考试会话已过期或不存在"}), 404
+        with _exam_lock:
+            _mark_exam_dirty(eid)
+    elif now_s - revealed_at > _REVEAL_GRACE_WINDOW:
+        # 宽限期已过，拒绝领取（但不删除 session）
+        return jsonify({"error": "答案领取窗口已过期"}), 410
     return jsonify({"answers": sess["answers"]})
 
 
@@ -931,8 +1261,7 @@ def api_exam_time():
     eid = request.args.get("id", "")
     if not eid:
         return jsonify({"error": "缺少 exam id"}), 400
-    with _exam_lock:
-        sess = _exam_sessions.get(eid)
+    sess = _state.get("exam", eid)
     if sess is None:
         return jsonify({"error": "考试会话已过期或不存在"}), 404
     now_ms       = int(time.time() * 1000)
@@ -952,7 +1281,7 @@ def api_exam_time():
 
 @app.post("/api/exam/share")
 def api_exam_share():
-    """生成试卷分享令牌（7天有效，内存存储）。"""
+    """生成试卷分享令牌（7天有效）。"""
     try:
         body = request.get_json(force=True) or {}
     except Exception:
@@ -997,11 +1326,7 @@ def api_exam_share():
         "expires_at":       expires_at,
     }
 
-    with _share_lock:
-        expired = [k for k, v in _share_tokens.items() if now > v.get("expires_at", 0)]
-        for k in expired:
-            del _share_tokens[k]
-        _share_tokens[token] = cfg
+    _state.set("share", token, cfg, ttl=_SHARE_TTL)
 
     return jsonify({"ok": True, "token": token, "share_pin": share_pin})
 
@@ -1025,8 +1350,7 @@ def api_exam_share_auth():
     if not allowed:
         return jsonify({"error": f"尝试次数过多，请 {(retry+59)//60} 分钟后重试"}), 429
 
-    with _share_lock:
-        cfg = _share_tokens.get(token)
+    cfg = _state.get("share", token)
     if cfg is None or int(time.time()) > cfg.get("expires_at", 0):
         return jsonify({"error": "分享链接已过期或无效"}), 404
 
@@ -1072,16 +1396,14 @@ def api_exam_join():
         return jsonify({"error": "缺少 token"}), 400
 
     now = int(time.time())
-    with _share_lock:
-        cfg = _share_tokens.get(token)
+    cfg = _state.get("share", token)
 
     if cfg is None:
         return jsonify({"error": "分享链接已过期或无效"}), 404
 
     # 校验 7 天有效期
     if now > cfg.get("expires_at", 0):
-        with _share_lock:
-            _share_tokens.pop(token, None)
+        _state.pop("share", token)
         return jsonify({"error": "分享链接已过期（7天有效期）"}), 404
 
     bank_idx = cfg["bank_idx"]
@@ -1092,7 +1414,7 @@ def api_exam_join():
     fp_set = set(cfg["fingerprints"])
 
     # 从该题库按 fingerprint 过滤题目并展开为 flat 列表
-    rows = _select_questions_by_fp(b.questions, fp_set)
+    rows = _select_questions_by_fp(b, fp_set)
 
     # 精确到小题级别：若分享时提供了 sub_ids（"fingerprint:si" 对），
     # 只保留接收端明确指定的那些小题，防止服务端自动把同一题干下所有小题
@@ -1122,20 +1444,16 @@ def api_exam_join():
         # 修改系统时间作弊 / 后台标签页 setInterval 漂移
         server_now_ms = int(time.time() * 1000)
         started_at_ms = server_now_ms
+        old = _state.purge("exam")
+        _state.set("exam", eid, {
+            "answers":    answers,
+            "ts":         now,
+            "started_at": started_at_ms,
+            "time_limit": time_limit_sec,
+            "revealed_at": 0,
+        }, ttl=_EXAM_TTL)
         with _exam_lock:
-            old = [k for k, v in _exam_sessions.items()
-                   if now - v["ts"] > 86400
-                   or (v.get("revealed_at", 0) != 0 and now - v["revealed_at"] > _REVEAL_GRACE_WINDOW)]
-            for k in old:
-                del _exam_sessions[k]
-            _exam_sessions[eid] = {
-                "answers":    answers,
-                "ts":         now,
-                "started_at": started_at_ms,
-                "time_limit": time_limit_sec,
-                "revealed_at": 0,
-            }
-            threading.Thread(target=_persist_exam_sessions, daemon=True).start()
+            _mark_exam_dirty(eid, *old)
 
     out_mode   = "exam" if is_exam_mode else cfg["mode"]
     time_limit = cfg.get("time_limit", 90 * 60)
@@ -1180,18 +1498,17 @@ def api_debug_exam_sessions():
     if not _debug or not _is_loopback():
         return "", 404
     now_s = int(time.time())
-    with _exam_lock:
-        sessions = []
-        for eid, v in _exam_sessions.items():
-            sessions.append({
-                "id":            eid,
-                "ts":            v.get("ts", 0),
-                "started_at":    v.get("started_at", 0),
-                "time_limit":    v.get("time_limit", 0),
-                "revealed_at":   v.get("revealed_at", 0),
-                "answer_count":  len(v.get("answers", {})),
-                "age_sec":       now_s - v.get("ts", now_s),
-            })
+    sessions = []
+    for eid, v in _state.items("exam"):
+        sessions.append({
+            "id":            eid,
+            "ts":            v.get("ts", 0),
+            "started_at":    v.get("started_at", 0),
+            "time_limit":    v.get("time_limit", 0),
+            "revealed_at":   v.get("revealed_at", 0),
+            "answer_count":  len(v.get("answers", {})),
+            "age_sec":       now_s - v.get("ts", now_s),
+        })
     return jsonify({
         "now":                 now_s,
         "reveal_grace_window": _REVEAL_GRACE_WINDOW,
@@ -1200,6 +1517,17 @@ def api_debug_exam_sessions():
     })
 
 
+@app.get("/api/debug/ai")
+def api_debug_ai():
+    """AI 上游排队与首轮答疑缓存的统计（命中率、节省的 token）。"""
+    if not _debug or not _is_loopback():
+        return "", 404
+    return jsonify({
+        "limiter": _ai_limiter.stats() if _ai_limiter is not None else None,
+        "cache":   _ai_cache.stats() if _ai_cache is not None else None,
+    })
+
+
 # ════════════════════════════════════════════
 # API — 题库信息
 # ════════════════════════════════════════════
@@ -1209,6 +1537,16 @@ def api_info():
     b, ok = _get_bank()
     if not ok:
         return jsonify({"error": "bank not found"}), 404
+    flags = (
+        _ai_client is not None,
+        bool(_asr_api_key),
+        bool(app.config.get("S3_ENDPOINT") and app.config.get("S3_BUCKET") and app.config.get("S3_ACCESS_KEY")),
+    )
+    return _cached_json(("/api/info", b.version(), b.name, flags),
+                        lambda: _bank_info(b, *flags))
+
+
+def _bank_info(b: BankState, ai_enabled: bool, asr_enabled: bool, s3_enabled: bool) -> dict:
     from collections import Counter
     questions = b.questions
     mc    = Counter(q.mode for q in questions)
@@ -1223,7 +1561,7 @@ def api_info():
             unit_mode_sq[u] = {}
         unit_mode_sq[u][m] = unit_mode_sq[u].get(m, 0) + len(q.sub_questions)
     unit_sq = {u: sum(v.values()) for u, v in unit_mode_sq.items()}
-    return jsonify({
+    return {
         "bank_name":      b.name,
         "total_q":        len(questions),
         "total_sq":       sum(len(q.sub_questions) for q in questions),
@@ -1234,31 +1572,109 @@ def api_info():
         "unit_counts":    dict(uc),
         "unit_sq":        unit_sq,
         "unit_mode_sq":   unit_mode_sq,
-        "ai_enabled":     _ai_client is not None,
-        "asr_enabled":    bool(_asr_api_key),
-        "s3_enabled":     bool(app.config.get("S3_ENDPOINT") and app.config.get("S3_BUCKET") and app.config.get("S3_ACCESS_KEY")),
-    })
+        "ai_enabled":     ai_enabled,
+        "asr_enabled":    asr_enabled,
+        "s3_enabled":     s3_enabled,
+    }
 
 
 # ════════════════════════════════════════════
 # API — 题目查询
 # ════════════════════════════════════════════
 
+_NDJSON_CHUNK = 256   # NDJSON 流式输出时每次 yield 的行数
+
+
 @app.get("/api/questions")
 def api_questions():
+    """按条件抽题。除默认的一次性 JSON 外支持两种增量输出：
+
+    - 分页：``page_size=N[&cursor=C]``，返回 ``next_cursor``（最后一页为 null），
+      客户端拿到第一页即可开始渲染，之后带上 cursor 继续取；
+    - 流式：``format=ndjson``，每行一道小题，总数放在 ``X-Total-Count`` 头里。
+
+    同一组参数 + 同一 seed 的抽题结果是确定的，所以各页顺序稳定；
+    随机抽题（shuffle=1 或 per_unit）且未指定 seed 时，分页和流式请求由服务端
+    生成一个 seed（分页放在响应体的 ``seed``，流式放在 ``X-Seed`` 头），
+    翻页时需原样带回。结果确定的请求会缓存抽题结果，并带强 ETag 支持 304。
+    """
     b, ok = _get_bank()
     if not ok:
         return jsonify({"error": "bank not found"}), 404
 
-    modes_filter  = request.args.getlist("mode")
-    units_filter  = request.args.getlist("unit")
-    limit         = int(request.args.get("limit", 0))
-    shuffle       = request.args.get("shuffle", "0") == "1"
-    seed          = request.args.get("seed", None)
-    per_mode_raw  = request.args.get("per_mode",   None)
-    per_unit_raw  = request.args.get("per_unit",   None)
-    difficulty_raw= request.args.get("difficulty", None)
-    fps_raw       = request.args.get("fingerprints", None)
+    fmt       = request.args.get("format", "json")
+    try:
+        page_size = int(request.args.get("page_size", 0))
+    except ValueError:
+        return jsonify({"error": "invalid page_size"}), 400
+    cursor    = request.args.get("cursor", None)
+    seed      = request.args.get("seed", None)
+    shuffle   = request.args.get("shuffle", "0") == "1"
+
+    # 结果确定（带 seed，或既不打乱也不按章节抽样）时可缓存并回 304
+    randomized = shuffle or bool(request.args.get("per_unit"))
+    cacheable = bool(seed) or not randomized
+    # 随机抽题的分页 / 流式请求：服务端定下 seed，后续翻页带回即可复现同一份抽题结果
+    issued_seed = None
+    if randomized and not seed and (page_size > 0 or cursor is not None or fmt == "ndjson"):
+        issued_seed = seed = str(secrets.randbits(31))
+
+    etag = None
+    if cacheable and fmt != "ndjson":
+        etag = hashlib.sha1(repr((b.version(), _normalized_query())).encode()).hexdigest()
+        if _etag_matches(etag):
+            return _not_modified(etag)
+
+    items = None
+    if cacheable or issued_seed:
+        # 新发的 seed 也并入 key，带着它来翻页的后续请求直接命中，不必重新抽题
+        query = _normalized_query(_PAGING_ARGS)
+        if issued_seed:
+            query = tuple(sorted(query + (("seed", issued_seed),)))
+        sel_key = (b.version(), query)
+        items = _selection_cache.get(sel_key)
+    if items is None:
+        items = _select_question_items(b, request.args, seed)
+        if cacheable or issued_seed:
+            _selection_cache.put(sel_key, items)
+    total = len(items)
+
+    if fmt == "ndjson":
+        def _stream():
+            for i in range(0, total, _NDJSON_CHUNK):
+                yield "\n".join(items[i:i + _NDJSON_CHUNK]) + "\n"
+        resp = app.response_class(_stream(), mimetype="application/x-ndjson")
+        resp.headers["X-Total-Count"] = str(total)
+        if issued_seed:
+            resp.headers["X-Seed"] = issued_seed
+        return resp
+
+    if page_size > 0 or cursor is not None:
+        try:
+            start = max(0, int(cursor or 0))
+        except ValueError:
+            return jsonify({"error": "invalid cursor"}), 400
+        size = page_size if page_size > 0 else total
+        end = min(start + size, total)
+        extra = {"next_cursor": str(end) if end < total else None}
+        if issued_seed:
+            extra["seed"] = issued_seed
+        resp = _json_items_response(items[start:end], total, extra)
+    else:
+        resp = _json_items_response(items, total)
+    return _with_etag(resp, etag) if etag else resp
+
+
+def _select_question_items(b: "BankState", args, seed) -> list[str]:
+    """执行 /api/questions 的筛选与抽样，返回预序列化的小题片段列表"""
+    modes_filter  = args.getlist("mode")
+    units_filter  = args.getlist("unit")
+    limit         = int(args.get("limit", 0))
+    shuffle       = args.get("shuffle", "0") == "1"
+    per_mode_raw  = args.get("per_mode",   None)
+    per_unit_raw  = args.get("per_unit",   None)
+    difficulty_raw= args.get("difficulty", None)
+    fps_raw       = args.get("fingerprints", None)
 
     per_mode   = _json.loads(per_mode_raw)   if per_mode_raw   else None
     per_unit   = _json.loads(per_unit_raw)   if per_unit_raw   else None
@@ -1267,43 +1683,44 @@ def api_questions():
 
     rng = random.Random(int(seed)) if seed else random.Random()
 
-    groups: list[list[dict]] = []
-    for qi, q in enumerate(b.questions):
-        if modes_filter and q.mode not in modes_filter:
-            continue
-        if units_filter and not any(u and u in (q.unit or "") for u in units_filter):
-            continue
-        if per_unit and (q.unit or "") not in per_unit:
-            continue
-        if fp_set is not None:
-            fp = getattr(q, "fingerprint", "") or ""
-            if fp not in fp_set:
+    flat = b.flat_groups()
+    mode_sq_total: dict[str, int] = {}
+    if fp_set is not None:
+        # 指定了 fingerprints：经索引直接取题，保持题库原顺序
+        fp_idx = b.fp_index()
+        hits = sorted((h for fp in fp_set for h in fp_idx.get(fp, ())), key=lambda h: h[0])
+        groups: list[list[dict]] = []
+        for qi, q in hits:
+            if modes_filter and q.mode not in modes_filter:
                 continue
-        grp = [_sq_flat(q, sq, qi, si) for si, sq in enumerate(q.sub_questions)]
-        if grp:
-            groups.append(grp)
-
-    # ── 按题型分组 ──
-    mode_order: list[str] = []
-    mode_map:  dict[str, list] = {}
-    for grp in groups:
-        mk = grp[0]["mode"]
-        if mk not in mode_map:
-            mode_order.append(mk)
-            mode_map[mk] = []
-        mode_map[mk].append(grp)
+            if units_filter and not any(u and u in (q.unit or "") for u in units_filter):
+                continue
+            if per_unit and (q.unit or "") not in per_unit:
+                continue
+            grp = flat[qi]
+            if grp:
+                groups.append(grp)
+        mode_order, mode_map = _group_by_field(groups, "mode")
+        unit_order, unit_map = _group_by_field(groups, "unit") if per_unit else ([], {})
+        classify = _classify_group_difficulty
+    else:
+        # 常规路径：只合并筛选条件命中的分桶
+        st    = b.strata()
+        modes = {m for m in st.mode_order if not modes_filter or m in modes_filter}
+        units = {u for u in st.unit_order
+                 if (not units_filter or any(f and f in u for f in units_filter))
+                 and (not per_unit or u in per_unit)}
+        mode_order, mode_qis, mode_sq_total = st.group("mode", modes, units)
+        mode_map = {mk: [flat[qi] for qi in qis] for mk, qis in mode_qis.items()}
+        if per_unit:
+            unit_order, unit_qis, _ = st.group("unit", modes, units)
+            unit_map = {uk: [flat[qi] for qi in qis] for uk, qis in unit_qis.items()}
+        difficulty_of = st.difficulty
+        classify = lambda grp: difficulty_of[grp[0]["qi"]]  # noqa: E731
 
     result_groups: list[list[dict]] = []
 
     if per_unit:
-        unit_order: list[str] = []
-        unit_map: dict[str, list] = {}
-        for grp in groups:
-            uk = grp[0]["unit"]
-            if uk not in unit_map:
-                unit_order.append(uk)
-                unit_map[uk] = []
-            unit_map[uk].append(grp)
         reorder: dict[str, list] = {}
         for uk in unit_order:
             need = per_unit.get(uk, 0)
@@ -1312,7 +1729,7 @@ def api_questions():
             pool = list(unit_map[uk])
             rng.shuffle(pool)
             if difficulty:
-                picked = _sample_with_difficulty(pool, need, difficulty, rng)
+                picked = _sample_with_difficulty(pool, need, difficulty, rng, classify)
             else:
                 picked = _greedy_fill(pool, need)
             for grp in picked:
@@ -1345,26 +1762,27 @@ def api_questions():
             pool = list(mode_map[mk])
             rng.shuffle(pool)
             if difficulty:
-                result_groups.extend(_sample_with_difficulty(pool, need, difficulty, rng))
+                result_groups.extend(_sample_with_difficulty(pool, need, difficulty, rng, classify))
             else:
                 result_groups.extend(_greedy_fill(pool, need))
         # shortfall recovery (per_mode)
         actual_pm = sum(len(g) for g in result_groups)
         if (shortfall := total_need_pm - actual_pm) > 0:
-            picked_ids = {id(g) for g in result_groups}
+            picked_ids = {_grp_key(g) for g in result_groups}
             for mk in mode_order:
                 if shortfall <= 0:
                     break
                 for grp in mode_map[mk]:
                     if shortfall <= 0:
                         break
-                    if id(grp) not in picked_ids and len(grp) <= shortfall:
+                    if _grp_key(grp) not in picked_ids and len(grp) <= shortfall:
                         result_groups.append(grp)
-                        picked_ids.add(id(grp))
+                        picked_ids.add(_grp_key(grp))
                         shortfall -= len(grp)
 
     else:
-        mode_sq_total = {mk: sum(len(g) for g in mode_map[mk]) for mk in mode_order}
+        if not mode_sq_total:
+            mode_sq_total = {mk: sum(len(g) for g in mode_map[mk]) for mk in mode_order}
         total_sq_all  = sum(mode_sq_total.values())
         total_need    = limit if limit > 0 else total_sq_all
         quotas = _distribute_by_ratio(total_need, mode_sq_total)
@@ -1388,7 +1806,7 @@ def api_questions():
             pool = list(mode_map[mk])
             if difficulty:
                 rng.shuffle(pool)
-                result_groups.extend(_sample_with_difficulty(pool, need, difficulty, rng))
+                result_groups.extend(_sample_with_difficulty(pool, need, difficulty, rng, classify))
             else:
                 rng.shuffle(pool)
                 result_groups.extend(_greedy_fill(pool, need))
@@ -1396,20 +1814,20 @@ def api_questions():
         # shortfall recovery
         actual = sum(len(g) for g in result_groups)
         if (shortfall := total_need - actual) > 0:
-            picked_ids = {id(g) for g in result_groups}
+            picked_ids = {_grp_key(g) for g in result_groups}
             for mk in mode_order:
                 if shortfall <= 0:
                     break
                 for grp in mode_map[mk]:
                     if shortfall <= 0:
                         break
-                    if id(grp) not in picked_ids and len(grp) <= shortfall:
+                    if _grp_key(grp) not in picked_ids and len(grp) <= shortfall:
                         result_groups.append(grp)
-                        picked_ids.add(id(grp))
+                        picked_ids.add(_grp_key(grp))
                         shortfall -= len(grp)
 
-    items = [sq for grp in result_groups for sq in grp]
-    return jsonify({"total": len(items), "items": items})
+    frags = b.flat_json()
+    return [frags[sq["qi"]][sq["si"]] for grp in result_groups for sq in grp]
 
 
 # ════════════════════════════════════════════
@@ -1420,7 +1838,8 @@ def api_questions():
 def index():
     import secrets as _sec
     from flask import Response
-    resp = make_response(render_template(
+    # 页面内容只取决于 Token 与资源版本，渲染并预压缩一次后复用
+    resp = _static.page(("quiz.html", _session_token, _asset_ver), lambda: render_template(
         "quiz.html",
         session_token=_session_token,
         asset_ver=_asset_ver,
@@ -1519,26 +1938,15 @@ def api_push_unsubscribe():
     return jsonify({"ok": True})
 
 
-_push_test_buckets: dict = {}
-_push_test_lock = __import__('threading').Lock()
-
 @app.post("/api/push/test")
 def api_push_test():
     """立即发送测试推送（调试用）。
     ?uid=<用户ID> → 只推给该用户；无参数 → 推给所有订阅者。
     每个 IP 限流：5次/小时，防止滥用。
     """
-    import time as _time
     ip = _get_real_ip()
-    with _push_test_lock:
-        now    = _time.time()
-        cutoff = now - 3600
-        fresh  = [t for t in _push_test_buckets.get(ip, []) if t > cutoff]
-        if len(fresh) >= 5:
-            _push_test_buckets[ip] = fresh
-            return jsonify({"error": "请求过于频繁，每小时最多测试 5 次"}), 429
-        fresh.append(now)
-        _push_test_buckets[ip] = fresh
+    if not _state.hit("push_test", ip, 5, 3600)[0]:
+        return jsonify({"error": "请求过于频繁，每小时最多测试 5 次"}), 429
 
     if _push_store is None or _vapid_keys is None:
         return jsonify({"error": "push not initialised"}), 503
@@ -2079,51 +2487,271 @@ def api_ai_chat():
     # Look up question
     if bank_idx < 0 or bank_idx >= len(_banks):
         bank_idx = 0
-    question = None
-    for b in _banks:
-        for q in b.questions:
-            if q.fingerprint == fingerprint:
-                question = q
-                break
-        if question:
-            break
-    if question is None:
+    hit = _lookup_fp(fingerprint, bank_idx)
+    if hit is None:
         return jsonify({"error": "题目未找到"}), 404
+    question = hit[2]
     if sq_index < 0 or sq_index >= len(question.sub_questions):
         return jsonify({"error": "小题索引无效"}), 400
 
     from med_exam_toolkit.ai.prompt import build_ai_chat_prompt
-    from med_exam_toolkit.ai.client import chat_completion_stream
 
     messages = build_ai_chat_prompt(question, sq_index, user_answer)
     if history:
         messages.extend(history)
+        return _ai_stream_response(messages, _ai_max_tokens, with_reasoning=True)
+    # 首轮：同题同选择的 prompt 完全相同，走内容寻址缓存
+    cache_key = None
+    if _ai_cache is not None:
+        from med_exam_toolkit.ai.chat_cache import prompt_key
+        cache_key = prompt_key(messages, _ai_max_tokens, _ai_enable_thinking)
+    return _ai_stream_response(messages, _ai_max_tokens, with_reasoning=True, cache_key=cache_key)
+
+
+def _sse_event(chunk: dict, with_reasoning: bool) -> tuple[str, bool]:
+    """把 chat_completion_stream 的一个事件编码成 SSE 文本，返回 (文本, 是否结束)。"""
+    if chunk.get("truncated"):
+        # 输出被 max_tokens 截断，通知前端显示「继续」按钮
+        return f"data: {_json.dumps({'truncated': True})}\n\n", False
+    if chunk.get("done"):
+        return "data: [DONE]\n\n", True
+    if chunk.get("error"):
+        return f"data: {_json.dumps({'error': chunk['error']})}\n\n", True
+    payload = {"content": chunk.get("content", "")}
+    if with_reasoning:
+        payload["reasoning"] = chunk.get("reasoning", "")
+    return f"data: {_json.dumps(payload)}\n\n", False
+
+
+def _queue_event(position: int) -> str:
+    """排队名次事件：前端据此显示「前面还有 N 人」。"""
+    return f"data: {_json.dumps({'queue': position})}\n\n"
+
+
+_SSE_PING = ": ping\n\n"   # SSE 注释行，前端忽略；用于排队期间探测连接是否还在
+
+
+def _ai_busy_event() -> str:
+    return f"data: {_json.dumps({'error': 'AI 答疑排队超时，请稍后再试'})}\n\n"
+
+
+def _ai_enqueue(messages: list[dict], max_tokens: int):
+    """在准入队列中登记本次请求，返回 (ticket, 预估输入 token)；排队已满时抛 QueueFull。
+
+    按用户（uid cookie，没有则按 IP）分队列轮转放行；预扣输入估算 + max_tokens，结束后按实际退回。
+    """
+    from med_exam_toolkit.ai.cost import estimate_prompt_tokens
+    prompt_tokens = estimate_prompt_tokens(_json.dumps(messages, ensure_ascii=False))
+    if _ai_limiter is None:
+        return None, prompt_tokens
+    user = request.cookies.get("med_exam_uid") or _get_real_ip()
+    return _ai_limiter.enqueue(user, tokens=prompt_tokens + max_tokens), prompt_tokens
+
+
+def _ai_used_tokens(prompt_tokens: int, output_chars: int) -> int:
+    from med_exam_toolkit.ai.cost import _CHARS_PER_TOKEN
+    return prompt_tokens + int(output_chars / _CHARS_PER_TOKEN)
+
+
+def _ai_cache_get(cache_key: str | None):
+    if cache_key is None:
+        return None
+    try:
+        return _ai_cache.get(cache_key, _ai_model)
+    except Exception as e:
+        print(f"[WARN] AI 缓存读取失败: {e}")
+        return None
+
+
+def _ai_cache_put(cache_key: str, content: str, reasoning: str, truncated: bool, tokens: int) -> None:
+    try:
+        _ai_cache.put(cache_key, _ai_model, content, reasoning, truncated, tokens)
+    except Exception as e:
+        print(f"[WARN] AI 缓存写入失败: {e}")
+
+
+class _AiTranscript:
+    """累计一次流式回答：用于按实际输出退回 token 预算，以及完整结束后写入缓存。"""
+    __slots__ = ("content", "reasoning", "truncated", "done")
+
+    def __init__(self) -> None:
+        self.content: list[str] = []
+        self.reasoning: list[str] = []
+        self.truncated = False
+        self.done = False
+
+    def add(self, chunk: dict) -> None:
+        self.content.append(chunk.get("content", ""))
+        self.reasoning.append(chunk.get("reasoning", ""))
+        self.truncated = self.truncated or bool(chunk.get("truncated"))
+        self.done = self.done or bool(chunk.get("done"))
+
+    @property
+    def chars(self) -> int:
+        return sum(map(len, self.content)) + sum(map(len, self.reasoning))
+
+    def store(self, cache_key: str | None, prompt_tokens: int) -> None:
+        """只缓存正常结束、有正文的回答（出错 / 中途断开的不缓存）。"""
+        content = "".join(self.content)
+        if cache_key is not None and self.done and content:
+            _ai_cache_put(cache_key, content, "".join(self.reasoning), self.truncated,
+                          _ai_used_tokens(prompt_tokens, self.chars))
+
+
+def _ai_stream_response(messages: list[dict], max_tokens: int, with_reasoning: bool,
+                        cache_key: str | None = None):
+    """AI 流式响应。asyncio 网关下只登记流式任务，由 _ai_stream_async 在事件循环上生成；
+    否则在当前线程里同步迭代上游流。两种方式都先在 _ai_limiter 中排队，排队期间推送名次。
+    cache_key 非空时（首轮答疑）先查缓存，命中则按流式节奏回放，不排队、不请求上游。"""
+    from flask import Response
+    from med_exam_toolkit.ai.limiter import QueueFull
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    gateway = request.environ.get(GATEWAY_KEY)
+
+    cached = _ai_cache_get(cache_key)
+    if cached is not None:
+        if gateway:
+            request.environ[STREAM_KEY] = {"kind": "ai", "cached": cached,
+                                           "reasoning": with_reasoning}
+            return Response("", mimetype="text/event-stream", headers=headers)
+        return Response(_ai_replay(cached, with_reasoning), mimetype="text/event-stream",
+                        headers=headers)
+
+    try:
+        ticket, prompt_tokens = _ai_enqueue(messages, max_tokens)
+    except QueueFull:
+        resp = jsonify({"error": "AI 答疑排队人数过多，请稍后再试"})
+        resp.headers["Retry-After"] = "30"
+        return resp, 429
+
+    release = (lambda: _ai_limiter.release(ticket)) if ticket is not None else None
+    if gateway:
+        request.environ[STREAM_KEY] = {
+            "kind": "ai", "messages": messages,
+            "max_tokens": max_tokens, "reasoning": with_reasoning,
+            "ticket": ticket, "prompt_tokens": prompt_tokens, "on_close": release,
+            "cache_key": cache_key,
+        }
+        return Response("", mimetype="text/event-stream", headers=headers)
+
+    from med_exam_toolkit.ai.client import chat_completion_stream
 
     def generate():
-        for chunk in chat_completion_stream(
-            client=_ai_client,
+        log = _AiTranscript()
+        try:
+            if ticket is not None and not ticket.granted:
+                last = -1
+                while not _ai_limiter.wait(ticket, _AI_QUEUE_POLL):
+                    if time.monotonic() - ticket.enqueued_at > _AI_QUEUE_TIMEOUT:
+                        yield _ai_busy_event()
+                        return
+                    pos = _ai_limiter.position(ticket)
+                    if pos != last:
+                        last = pos
+                        yield _queue_event(pos)
+                    else:
+                        # 同步服务器只能靠写失败发现客户端断开：名次不变也写一行 SSE 注释，
+                        # 断开后一两个轮询周期内即抛出写错误、关闭生成器并让出名额
+                        yield _SSE_PING
+            for chunk in chat_completion_stream(
+                client=_ai_client,
+                model=_ai_model,
+                messages=messages,
+                temperature=0.7,
+                max_tokens=max_tokens,
+                enable_thinking=_ai_enable_thinking,
+                provider=_ai_provider,
+            ):
+                log.add(chunk)
+                if chunk.get("done"):
+                    log.store(cache_key, prompt_tokens)
+                text, end = _sse_event(chunk, with_reasoning)
+                yield text
+                if end:
+                    return
+        finally:
+            if ticket is not None:
+                _ai_limiter.release(ticket, _ai_used_tokens(prompt_tokens, log.chars))
+
+    resp = Response(generate(), mimetype="text/event-stream", headers=headers)
+    if release is not None:
+        resp.call_on_close(release)   # 生成器未启动就被关闭时兜底释放名额
+    return resp
+
+
+def _async_ai_client():
+    """与 _ai_client 同配置的 AsyncOpenAI；连接池绑定事件循环，换了循环或客户端就重建。"""
+    global _ai_async
+    loop = asyncio.get_running_loop()
+    if _ai_async is None or _ai_async[0] is not loop or _ai_async[1] is not _ai_client:
+        from openai import AsyncOpenAI
+        _ai_async = (loop, _ai_client, AsyncOpenAI(
+            api_key=_ai_client.api_key, base_url=_ai_client.base_url,
+            timeout=_ai_client.timeout))
+    return _ai_async[2]
+
+
+def _ai_replay(cached, with_reasoning: bool):
+    """同步回放缓存的回答。"""
+    from med_exam_toolkit.ai.chat_cache import replay_events
+    for i, ev in enumerate(replay_events(cached, _AI_REPLAY_CHUNK)):
+        if i:
+            time.sleep(_AI_REPLAY_INTERVAL)
+        yield _sse_event(ev, with_reasoning)[0]
+
+
+async def _ai_replay_async(cached, with_reasoning: bool):
+    from med_exam_toolkit.ai.chat_cache import replay_events
+    for i, ev in enumerate(replay_events(cached, _AI_REPLAY_CHUNK)):
+        if i:
+            await asyncio.sleep(_AI_REPLAY_INTERVAL)
+        yield _sse_event(ev, with_reasoning)[0]
+
+
+async def _ai_stream_async(job: dict):
+    """网关的 "ai" 流式任务：排队（不占线程）后异步请求上游，逐条产出 SSE 文本；
+    job 带 cached 时直接回放缓存。"""
+    if job.get("cached") is not None:
+        async for text in _ai_replay_async(job["cached"], job["reasoning"]):
+            yield text
+        return
+
+    from med_exam_toolkit.ai.client import achat_completion_stream
+    ticket, log = job.get("ticket"), _AiTranscript()
+    try:
+        if ticket is not None and not ticket.granted:
+            last = -1
+            while not await _ai_limiter.wait_async(ticket, _AI_QUEUE_POLL):
+                if time.monotonic() - ticket.enqueued_at > _AI_QUEUE_TIMEOUT:
+                    yield _ai_busy_event()
+                    return
+                pos = _ai_limiter.position(ticket)
+                if pos != last:
+                    last = pos
+                    yield _queue_event(pos)
+        agen = achat_completion_stream(
+            client=_async_ai_client(),
             model=_ai_model,
-            messages=messages,
+            messages=job["messages"],
             temperature=0.7,
-            max_tokens=_ai_max_tokens,
+            max_tokens=job["max_tokens"],
             enable_thinking=_ai_enable_thinking,
             provider=_ai_provider,
-        ):
-            if chunk.get("truncated"):
-                # 输出被 max_tokens 截断，通知前端显示「继续」按钮
-                yield f"data: {_json.dumps({'truncated': True})}\n\n"
-                continue
-            if chunk.get("done"):
-                yield "data: [DONE]\n\n"
-                return
-            if chunk.get("error"):
-                yield f"data: {_json.dumps({'error': chunk['error']})}\n\n"
-                return
-            yield f"data: {_json.dumps({'content': chunk.get('content', ''), 'reasoning': chunk.get('reasoning', '')})}\n\n"
-
-    from flask import Response
-    return Response(generate(), mimetype="text/event-stream",
-                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+        )
+        try:
+            async for chunk in agen:
+                log.add(chunk)
+                if chunk.get("done") and job.get("cache_key"):
+                    await asyncio.to_thread(log.store, job["cache_key"], job["prompt_tokens"])
+                text, end = _sse_event(chunk, job["reasoning"])
+                yield text
+                if end:
+                    return
+        finally:
+            await agen.aclose()
+    finally:
+        if ticket is not None:
+            _ai_limiter.release(ticket, _ai_used_tokens(job["prompt_tokens"], log.chars))
 
 
 
@@ -2227,39 +2855,68 @@ def api_ai_report():
 
 请用鼓励且专业的语气，分析必须结合以上具体数据，不要泛泛而谈。"""
 
-    from med_exam_toolkit.ai.client import chat_completion_stream
     messages = [{"role": "user", "content": prompt}]
 
     # 报告需要更多 token，默认 4096
     report_max_tokens = _ai_max_tokens if _ai_max_tokens > 2048 else 4096
+    return _ai_stream_response(messages, report_max_tokens, with_reasoning=False)
 
-    def generate():
-        for chunk in chat_completion_stream(
-            client=_ai_client,
-            model=_ai_model,
-            messages=messages,
-            temperature=0.7,
-            max_tokens=report_max_tokens,
-            enable_thinking=_ai_enable_thinking,
-            provider=_ai_provider,
-        ):
-            if chunk.get("truncated"):
-                yield f"data: {_json.dumps({'truncated': True})}\n\n"
-                continue
-            if chunk.get("done"):
-                yield "data: [DONE]\n\n"
-                return
-            if chunk.get("error"):
-                yield f"data: {_json.dumps({'error': chunk['error']})}\n\n"
-                return
-            yield f"data: {_json.dumps({'content': chunk.get('content', '')})}\n\n"
 
-    from flask import Response
-    return Response(generate(), mimetype="text/event-stream",
-                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+# ── ASR WebSocket proxy ──────────────────────────────────────────────
+_ASR_FINISH_WAIT = 5.0   # 浏览器发 stop 后等待上游 task-finished 的时间（秒）
+
+
+def _asr_headers() -> list[str]:
+    return [f"Authorization: bearer {_asr_api_key}", "X-DashScope-DataInspection: enable"]
+
+
+def _asr_run_task(task_id: str) -> dict:
+    return {
+        "header": {"action": "run-task", "task_id": task_id, "streaming": "duplex"},
+        "payload": {
+            "task_group": "audio", "task": "asr", "function": "recognition",
+            "model": _asr_model,
+            "parameters": {"format": "pcm", "sample_rate": 16000},
+            "input": {},
+        },
+    }
+
+
+def _asr_finish_task(task_id: str) -> dict:
+    return {"header": {"action": "finish-task", "task_id": task_id}, "payload": {"input": {}}}
+
+
+def _asr_start_error(start_resp: dict) -> str:
+    """task-started 之外的首个应答 → 错误文本；正常启动返回空串。"""
+    if start_resp.get("header", {}).get("event") == "task-started":
+        return ""
+    return start_resp.get("header", {}).get("error_message", "unknown")
+
+
+def _asr_client_event(resp: dict) -> tuple[str, bool]:
+    """DashScope 事件 → (发给浏览器的消息，可能为空, 识别是否结束)。"""
+    event = resp.get("header", {}).get("event", "")
+    if event == "result-generated":
+        sentence = resp.get("payload", {}).get("output", {}).get("sentence", {})
+        if sentence.get("text"):
+            return _json.dumps({"type": "partial", "text": sentence["text"]}), False
+        return "", False
+    if event == "task-finished":
+        return _json.dumps({"type": "done"}), True
+    if event == "task-failed":
+        err = resp.get("header", {}).get("error_message", "")
+        return _json.dumps({"type": "error", "text": err}), True
+    return "", False
+
+
+@app.get("/api/asr/ws")
+def asr_ws_precheck():
+    """asyncio 网关的 WebSocket 准入检查：走到这里说明 before_request 已放行。"""
+    if not request.environ.get(GATEWAY_KEY):
+        return jsonify({"error": "需要 WebSocket 连接"}), 400
+    return "", 204
 
 
-# ── ASR WebSocket proxy ──────────────────────────────────────────────
 @sock.route("/api/asr/ws")
 def asr_ws(ws):
     """Proxy audio between browser and DashScope real-time ASR."""
@@ -2273,35 +2930,17 @@ def asr_ws(ws):
 
     # Connect to DashScope
     try:
-        ds = _ws_client.create_connection(
-            _asr_base_url,
-            header=[
-                f"Authorization: bearer {_asr_api_key}",
-                "X-DashScope-DataInspection: enable",
-            ],
-            timeout=10,
-        )
+        ds = _ws_client.create_connection(_asr_base_url, header=_asr_headers(), timeout=10)
     except Exception as e:
         ws.send(_json.dumps({"type": "error", "text": f"ASR 连接失败: {e}"}))
         return
 
-    # Send run-task
-    run_task = {
-        "header": {"action": "run-task", "task_id": task_id, "streaming": "duplex"},
-        "payload": {
-            "task_group": "audio", "task": "asr", "function": "recognition",
-            "model": _asr_model,
-            "parameters": {"format": "pcm", "sample_rate": 16000},
-            "input": {},
-        },
-    }
-    ds.send(_json.dumps(run_task))
+    ds.send(_json.dumps(_asr_run_task(task_id)))
 
     # Wait for task-started
     try:
-        start_resp = _json.loads(ds.recv())
-        if start_resp.get("header", {}).get("event") != "task-started":
-            err = start_resp.get("header", {}).get("error_message", "unknown")
+        err = _asr_start_error(_json.loads(ds.recv()))
+        if err:
             ws.send(_json.dumps({"type": "error", "text": f"ASR 启动失败: {err}"}))
             ds.close()
             return
@@ -2311,42 +2950,24 @@ def asr_ws(ws):
         return
 
     ws.send(_json.dumps({"type": "ready"}))
+    ds.settimeout(None)
 
     # Background thread: read from DashScope → send to browser
-    import threading
-    stop_event = threading.Event()
-
+    # 阻塞在 recv() 上，不再轮询；主循环结束时关闭 ds 即可让它退出
     def _ds_reader():
         try:
-            while not stop_event.is_set():
-                ds.settimeout(1.0)
+            while True:
                 try:
                     raw = ds.recv()
-                except _ws_client.WebSocketTimeoutException:
-                    continue
                 except Exception:
                     break
-                resp = _json.loads(raw)
-                event = resp.get("header", {}).get("event", "")
-                if event == "result-generated":
-                    sentence = resp.get("payload", {}).get("output", {}).get("sentence", {})
-                    if sentence.get("text"):
-                        try:
-                            ws.send(_json.dumps({"type": "partial", "text": sentence["text"]}))
-                        except Exception:
-                            break
-                elif event == "task-finished":
-                    try:
-                        ws.send(_json.dumps({"type": "done"}))
-                    except Exception:
-                        pass
-                    break
-                elif event == "task-failed":
-                    err = resp.get("header", {}).get("error_message", "")
+                msg, end = _asr_client_event(_json.loads(raw))
+                if msg:
                     try:
-                        ws.send(_json.dumps({"type": "error", "text": err}))
+                        ws.send(msg)
                     except Exception:
-                        pass
+                        break
+                if end:
                     break
         finally:
             try:
@@ -2358,6 +2979,7 @@ def asr_ws(ws):
     reader.start()
 
     # Main loop: read from browser → forward to DashScope
+    finishing = False
     try:
         while True:
             data = ws.receive(timeout=30)
@@ -2366,10 +2988,9 @@ def asr_ws(ws):
             if isinstance(data, str):
                 ctrl = _json.loads(data)
                 if ctrl.get("type") == "stop":
-                    finish = {"header": {"action": "finish-task", "task_id": task_id},
-                              "payload": {"input": {}}}
                     try:
-                        ds.send(_json.dumps(finish))
+                        ds.send(_json.dumps(_asr_finish_task(task_id)))
+                        finishing = True
                     except Exception:
                         pass
                     break
@@ -2382,10 +3003,98 @@ def asr_ws(ws):
     except Exception:
         pass
     finally:
-        stop_event.set()
+        if finishing:
+            reader.join(timeout=_ASR_FINISH_WAIT)   # 等最后一句结果和 done
+        try:
+            ds.close()
+        except Exception:
+            pass
         reader.join(timeout=3)
 
 
+async def _asr_ws_async(ws, environ: dict) -> None:
+    """asr_ws 的 asyncio 网关版本：两个方向各一个协程，上游用异步 WebSocket 客户端。"""
+    if not _asr_api_key:
+        await ws.send(_json.dumps({"type": "error", "text": "ASR not configured"}))
+        return
+
+    import uuid as _uuid
+    task_id = str(_uuid.uuid4())
+    try:
+        ds = await connect_ws(_asr_base_url, [tuple(h.split(": ", 1)) for h in _asr_headers()],
+                              timeout=10)
+    except Exception as e:
+        await ws.send(_json.dumps({"type": "error", "text": f"ASR 连接失败: {e}"}))
+        return
+
+    try:
+        try:
+            await ds.send(_json.dumps(_asr_run_task(task_id)))
+            raw = await ds.receive(timeout=10)
+            if raw is None:
+                raise ConnectionError("上游已关闭连接")
+            err = _asr_start_error(_json.loads(raw))
+        except Exception as e:
+            await ws.send(_json.dumps({"type": "error", "text": f"ASR 启动异常: {e}"}))
+            return
+        if err:
+            await ws.send(_json.dumps({"type": "error", "text": f"ASR 启动失败: {err}"}))
+            return
+        await ws.send(_json.dumps({"type": "ready"}))
+
+        async def _upstream():
+            while True:
+                raw = await ds.receive()
+                if raw is None:
+                    return
+                msg, end = _asr_client_event(_json.loads(raw))
+                if msg:
+                    try:
+                        await ws.send(msg)
+                    except WebSocketClosed:
+                        return
+                if end:
+                    return
+
+        reader = asyncio.ensure_future(_upstream())
+        finishing = False
+        try:
+            while True:
+                # 上游先结束（task-finished / task-failed）时不必等浏览器下一帧
+                recv = asyncio.ensure_future(ws.receive(timeout=30))
+                await asyncio.wait({recv, reader}, return_when=asyncio.FIRST_COMPLETED)
+                if not recv.done():
+                    recv.cancel()
+                    break
+                try:
+                    data = recv.result()
+                except asyncio.TimeoutError:
+                    break
+                if data is None:
+                    break
+                if isinstance(data, str):
+                    if _json.loads(data).get("type") == "stop":
+                        try:
+                            await ds.send(_json.dumps(_asr_finish_task(task_id)))
+                            finishing = True
+                        except WebSocketClosed:
+                            pass
+                        break
+                else:
+                    try:
+                        await ds.send(data)
+                    except WebSocketClosed:
+                        break
+        except (ValueError, WebSocketClosed):
+            pass
+        finally:
+            if finishing:
+                await asyncio.wait({reader}, timeout=_ASR_FINISH_WAIT)
+            reader.cancel()
+    finally:
+        await ds.close()
+
+
 # ════════════════════════════════════════════
 # 启动函数
 # ════════════════════════════════════════════
@@ -2405,15 +3114,30 @@ def start_quiz(
     ai_base_url: str = "",
     ai_thinking: bool | None = None,
     ai_max_tokens: int = 0,
+    ai_concurrency: int = 8,
+    ai_tpm:      int = 0,
+    ai_cache:    str = "",
+    ai_cache_ttl_days: int = 30,
+    ai_cache_max: int = 5000,
+    no_ai_cache: bool = False,
     asr_api_key: str = "",
     asr_model:   str = "",
     asr_base_url: str = "",
     cleanup_days: int = 0,
     debug:       bool = False,
+    workers:     int  = 1,
+    state_db:    str  = "",
+    server:      ServerOptions | None = None,
 ) -> None:
     """启动医考练习 Web 应用（支持多题库）。
 
     bank_paths 可以是单个路径字符串，也可以是路径列表。
+    workers > 1 时预先 fork 出多个 worker 进程共享同一个监听端口，
+    运行时状态放进共享的 SQLite 文件（state_db，默认在第一个题库的进度库旁边）。
+    server 选择 Werkzeug（默认）或 gunicorn 及其并发参数，见 serving.py。
+    ai_concurrency / ai_tpm：同时请求上游的 AI 流数与每分钟 token 预算（0=不限），
+    多 worker 时按 worker 数均分；超出的请求按用户轮转排队。
+    ai_cache：首轮答疑缓存文件（默认第一个题库旁的 ai_chat_cache.db），no_ai_cache 关闭缓存。
     """
     from med_exam_toolkit.bank import load_bank
     # 让 Werkzeug 内置日志也显示真实 IP（nginx 反代场景）
@@ -2435,7 +3159,7 @@ def start_quiz(
     _server_port    = port
     _server_host    = host
     _session_token  = secrets.token_hex(32)
-    _asset_ver      = secrets.token_hex(8)
+    _asset_ver      = _static.load(precompress=False)   # 内容哈希：静态文件不变则重启后客户端缓存仍有效
     _pin_enabled    = not no_pin or bool(pin)
 
     # ── AI 答疑初始化 ──
@@ -2505,13 +3229,16 @@ def start_quiz(
         else:
             print(f"[INFO]   学习记录已关闭（--no-record）")
 
-        _banks.append(BankState(
+        state = BankState(
             bank_path=bp,
             password=password,
             questions=questions,
             db_path=db_path,
             record_enabled=record_enabled,
-        ))
+        )
+        state.flat_json()  # 预热展开缓存，首个 /api/questions 请求无需等待
+        _banks.append(state)
+    _index_banks()
 
     # ── 打印启动信息 ──────────────────────────────────────────────
     local_url = f"http://127.0.0.1:{port}"
@@ -2540,17 +3267,54 @@ def start_quiz(
         print("\n  ⚠️  访问码验证已关闭（--no-pin），任何人可直接访问\n")
 
     if _debug:
-        print("  ⚠  调试模式已启用：/api/debug/exam-sessions 端点可访问（请勿在公网环境使用）")
+        print("  ⚠  调试模式已启用：/api/debug/exam-sessions、/api/debug/ai 端点可访问（请勿在公网环境使用）")
     print("[INFO] Ctrl+C 退出")
 
     if not no_browser:
         threading.Timer(0.9, lambda: webbrowser.open(local_url)).start()
 
+    # 运行时状态：多 worker 或显式指定 --state-db 时换成共享的 SQLite 文件
+    global _state
+    if workers > 1 and not hasattr(os, "fork"):
+        print("[WARN] 当前平台不支持 fork，--workers 回退为 1")
+        workers = 1
+    opts = (server or ServerOptions()).resolve()
+    print(f"[INFO] 服务器: {describe(opts, workers)}")
+    # 多 worker / gunicorn 会 fork：预压缩必须在 fork 前完成，子进程里没有后台压缩线程
+    _static.precompress(background=not (workers > 1 or opts.server == "gunicorn"))
+    global _ai_limiter
+    _ai_limiter = None
+    if _ai_client is not None and ai_concurrency > 0:
+        from med_exam_toolkit.ai.limiter import FairLimiter
+        _ai_limiter = FairLimiter(concurrency=-(-ai_concurrency // workers),
+                                  tpm=max(0, ai_tpm) // workers)
+        tpm_str = f"{_ai_limiter.bucket.capacity} token/分钟" if ai_tpm > 0 else "token 不限"
+        print(f"[INFO] AI 上游限流: 每 worker 并发 {_ai_limiter.concurrency} · {tpm_str}，超出按用户轮转排队")
+    global _ai_cache
+    _ai_cache = None
+    if _ai_client is not None and not no_ai_cache:
+        from med_exam_toolkit.ai.chat_cache import ChatCache, default_cache_path
+        try:
+            _ai_cache = ChatCache(ai_cache or default_cache_path(bank_paths[0]),
+                                  ttl=ai_cache_ttl_days * 86400, max_entries=ai_cache_max)
+            st = _ai_cache.stats()
+            print(f"[INFO] AI 答疑缓存: {_ai_cache.path}（{st['entries']} 条，"
+                  f"累计命中率 {st['hit_rate']:.0%}，约节省 {st['tokens_saved']} token）")
+        except Exception as e:
+            print(f"[WARN] AI 答疑缓存不可用: {e}")
+            _ai_cache = None
+    if workers > 1 or state_db:
+        _state = SQLiteStore(_state_db_path(state_db))
+        from med_exam_toolkit import auth
+        auth.use_store(_state)
+        print(f"[INFO] 运行时状态: {_state.path}")
+
     # 初始化 Web Push
     global _push_store, _vapid_keys
     try:
         from med_exam_toolkit.push import PushStore, generate_vapid_keys, start_daily_push_scheduler
-        _push_store = PushStore()
+        _push_store = PushStore(_state)
+        _push_store.clear()   # VAPID 密钥每次启动重新生成，旧订阅已无法推送
         _vapid_keys = generate_vapid_keys()
         start_daily_push_scheduler(_vapid_keys, _push_store)
     except Exception as _e:
@@ -2563,26 +3327,49 @@ def start_quiz(
         _t.sleep(60)  # 启动后 1 分钟首次执行
         while True:
             for b in _banks:
-                if b.get("db_path"):
-                    try:
-                        users, rows = progress.cleanup_stale_users(Path(b["db_path"]), _cleanup_days)
-                        if users > 0:
-                            print(f"[cleanup] {b.get('name','?')}: removed {users} stale users ({rows} rows) [threshold={_cleanup_days}d]")
-                    except Exception:
-                        pass
+                if not b.db_path:
+                    continue
+                users = rows = 0
+                try:
+                    # 每轮受时间预算限制，没删完的隔一会儿再继续，不长时间占住写锁
+                    while True:
+                        r = progress.cleanup_stale_users(b.db_path, _cleanup_days)
+                        users += r["users"]
+                        rows  += r["rows"]
+                        if not r["remaining"]:
+                            break
+                        _t.sleep(5)
+                except Exception as e:
+                    print(f"[WARN] {b.name}: 清理不活跃用户失败: {e}")
+                if users > 0:
+                    print(f"[cleanup] {b.name}: removed {users} stale users ({rows} rows) [threshold={_cleanup_days}d]")
             _t.sleep(86400)  # 每 24 小时
     threading.Thread(target=_cleanup_loop, daemon=True).start()
 
     # 恢复未完成的考试会话
     _load_exam_sessions()
 
+    if opts.server == "gunicorn":
+        # gunicorn 主进程自己处理 SIGINT/SIGTERM（优雅退出），worker 退出前写回
+        run_gunicorn(app, host, port, opts, workers, on_worker_exit=_on_worker_exit)
+        return
+    if opts.server == "asyncio":
+        serve = lambda sock=None: run_asyncio(
+            app, host, port, opts, sse={"ai": _ai_stream_async},
+            ws={"/api/asr/ws": _asr_ws_async}, sock=sock)
+    else:
+        serve = None
+    if workers > 1:
+        _serve_prefork(host, port, workers, serve)
+        return
+
     # SIGINT/SIGTERM 保护：有进行中考试时第一次信号只警告，第二次才退出
     import signal as _signal
     _warned_active = False
 
     def _shutdown_handler(sig, frame):
         nonlocal _warned_active
-        active = sum(1 for v in _exam_sessions.values() if not v.get("revealed_at"))
+        active = sum(1 for _, v in _state.items("exam") if not v.get("revealed_at"))
         if active > 0 and not _warned_active:
             _persist_exam_sessions()
             _warned_active = True
@@ -2593,16 +3380,112 @@ def start_quiz(
                 flush=True,
             )
             return
-        # 第二次信号或无活跃考试：持久化后退出
+        # 第二次信号或无活跃考试：持久化、写完排队中的答题记录后退出
         _persist_exam_sessions()
-        import os as _os
-        _os.kill(_os.getpid(), _signal.SIGTERM)
+        from med_exam_toolkit.progress import close_writers
+        close_writers()
+        os.kill(os.getpid(), _signal.SIGTERM)
 
     _signal.signal(_signal.SIGINT, _shutdown_handler)
 
+    if serve is not None:
+        serve()
+        return
     app.run(host=host, port=port, debug=False, use_reloader=False, threaded=True)
 
 
+def _on_worker_exit() -> None:
+    """gunicorn worker 退出前：写回考试会话，写完排队中的答题记录。"""
+    _persist_exam_sessions()
+    progress.close_writers()
+
+
+def _state_db_path(state_db: str) -> Path:
+    """--state-db 未指定时放在第一个题库的进度库旁边，没有进度库则放临时目录。"""
+    if state_db:
+        return Path(state_db)
+    db = _first_db_path()
+    if db is not None:
+        return Path(db).with_name("quiz_state.db")
+    import tempfile
+    return Path(tempfile.gettempdir()) / f"med_exam_quiz_state_{os.getpid()}.db"
+
+
+def _serve_prefork(host: str, port: int, workers: int, serve=None) -> None:
+    """多进程模式：父进程绑定端口后 fork 出 workers 个子进程，各自在同一个
+    监听 socket 上 accept（每个子进程内仍是多线程）。serve(sock) 为子进程的
+    服务函数，默认用 Werkzeug。
+
+    父进程只负责后台任务（清理、推送调度）和看护子进程：子进程意外退出时
+    补起一个，收到 SIGINT/SIGTERM 时通知所有子进程退出并等待它们写完队列。
+    考试会话等状态都在共享的 SQLiteStore 里，哪个 worker 处理请求都一样。
+    """
+    import signal as _signal
+    from werkzeug.serving import make_server
+    from med_exam_toolkit.progress import close_writers
+
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(128)
+    sock.set_inheritable(True)
+
+    def _child() -> None:
+        def _stop(sig, frame):
+            close_writers()
+            os._exit(0)
+        _signal.signal(_signal.SIGTERM, _stop)
+        _signal.signal(_signal.SIGINT, _signal.SIG_IGN)   # 由父进程统一处理 Ctrl+C
+        try:
+            if serve is not None:
+                serve(sock)
+            else:
+                make_server(host, port, app, threaded=True, fd=sock.fileno()).serve_forever()
+        finally:
+            close_writers()
+            os._exit(0)
+
+    def _spawn() -> int:
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _child()
+            finally:
+                os._exit(1)
+        return pid
+
+    children = {_spawn() for _ in range(workers)}
+    print(f"[INFO] 已启动 {workers} 个 worker 进程: {sorted(children)}")
+    stopping = False
+
+    def _stop_all(sig, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, _signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    _signal.signal(_signal.SIGINT, _stop_all)
+    _signal.signal(_signal.SIGTERM, _stop_all)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        children.discard(pid)
+        if not stopping:
+            print(f"[WARN] worker {pid} 异常退出（status={status}），重新启动")
+            children.add(_spawn())
+    sock.close()
+    close_writers()
+    _state.close()
+
+
 if __name__ == "__main__":
     import argparse
     p = argparse.ArgumentParser(description="医考练习 Web 应用")
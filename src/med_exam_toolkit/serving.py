@@ -0,0 +1,120 @@
+"""Web 服务启动：Werkzeug 开发服务器 / gunicorn 生产服务器 / asyncio 网关
+
+quiz 与 edit 默认用 Werkzeug 的多线程服务器：每个连接一个线程、没有上限，
+人多时线程数和内存一起涨。--server gunicorn 改用 gunicorn 的 gthread worker：
+
+  - workers × threads 个线程处理请求，超出的连接留在 worker 队列 / 监听 backlog 中排队（背压）
+  - keep-alive 连接空闲 keepalive 秒后关闭
+  - 每个 worker 最多同时持有 max_connections 个连接，含 keep-alive 空闲连接
+  - SSE（/api/ai/chat 等）与 WebSocket（/api/asr/ws）各占一个线程直到结束，threads 需留足余量
+
+gunicorn 只支持 POSIX，作为可选依赖：pip install "med-exam-kit[server]"
+
+--server asyncio 见 gateway.py：threads 只用于调用 Flask 处理普通请求，不需要额外依赖。
+quiz 的 AI 流与 ASR WebSocket 在事件循环上处理，长连接不再占线程；edit 没有长连接，
+只用到网关的连接管理（keep-alive、背压）。
+"""
+from __future__ import annotations
+
+import asyncio
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+try:
+    from gunicorn.app.base import BaseApplication
+    HAS_GUNICORN = True
+except ImportError:
+    HAS_GUNICORN = False
+
+SERVERS = ("werkzeug", "gunicorn", "asyncio")
+
+
+@dataclass
+class ServerOptions:
+    server:          str = "werkzeug"
+    threads:         int = 32      # 每个 worker 的线程数（gunicorn / asyncio）
+    keepalive:       int = 5       # keep-alive 空闲超时（秒，gunicorn / asyncio）
+    backlog:         int = 2048    # 监听队列长度（gunicorn / asyncio）
+    max_connections: int = 1000    # 每个 worker 的最大连接数（仅 gunicorn）
+
+    def resolve(self) -> "ServerOptions":
+        """校验选项；gunicorn 不可用时回退到 werkzeug。"""
+        if self.server not in SERVERS:
+            print(f"[WARN] 未知的服务器 {self.server!r}，改用 werkzeug")
+            self.server = "werkzeug"
+        if self.server == "gunicorn" and not HAS_GUNICORN:
+            print('[WARN] 未安装 gunicorn（仅支持 Linux/macOS），回退到 Werkzeug：'
+                  'pip install "med-exam-kit[server]"')
+            self.server = "werkzeug"
+        self.threads = max(1, self.threads)
+        self.keepalive = max(0, self.keepalive)
+        self.backlog = max(1, self.backlog)
+        self.max_connections = max(self.threads, self.max_connections)
+        return self
+
+
+def describe(opts: ServerOptions, workers: int = 1) -> str:
+    if opts.server == "asyncio":
+        return (f"asyncio 网关 · {workers} worker · 流式接口在事件循环上，"
+                f"普通请求 {opts.threads} 线程 · keep-alive {opts.keepalive}s · backlog {opts.backlog}")
+    if opts.server == "gunicorn":
+        return (f"gunicorn gthread · {workers} worker × {opts.threads} 线程 · "
+                f"每 worker 最多 {opts.max_connections} 连接 · "
+                f"keep-alive {opts.keepalive}s · backlog {opts.backlog}")
+    if workers > 1:
+        return f"Werkzeug · {workers} 个 worker 进程 · 每连接一个线程（无上限）"
+    return "Werkzeug · 每连接一个线程（无上限，生产环境建议 --server gunicorn）"
+
+
+def run_gunicorn(app, host: str, port: int, opts: ServerOptions, workers: int = 1,
+                 on_worker_exit: Optional[Callable[[], None]] = None) -> None:
+    """在 gunicorn 下运行已配置好的 Flask app（阻塞直到收到退出信号）。
+
+    app 在主进程中已完成初始化（含静态资源预压缩），worker 由主进程 fork 得到，无需重新导入；
+    on_worker_exit 在每个 worker 退出前于该 worker 进程内调用（如写完排队中的记录）。
+    """
+    bind = f"[{host}]:{port}" if ":" in host else f"{host}:{port}"
+    settings = {
+        "bind":              bind,
+        "worker_class":      "gthread",
+        "workers":           workers,
+        "threads":           opts.threads,
+        "worker_connections": opts.max_connections,
+        "keepalive":         opts.keepalive,
+        "backlog":           opts.backlog,
+        "timeout":           120,   # gthread 由主循环发心跳，长连接不会因此被杀
+        "graceful_timeout":  30,
+        "accesslog":         "-",
+    }
+    if on_worker_exit is not None:
+        settings["worker_exit"] = lambda server, worker: on_worker_exit()
+
+    class _App(BaseApplication):
+        def load_config(self):
+            for key, value in settings.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    _App().run()
+
+
+def run_asyncio(app, host: str, port: int, opts: ServerOptions, *,
+                sse: dict | None = None, ws: dict | None = None, sock=None) -> None:
+    """在 asyncio 网关下运行 app（阻塞）；sock 为已绑定的监听 socket（多进程时由父进程传入）。"""
+    from med_exam_toolkit.gateway import Gateway
+
+    async def _main() -> None:
+        gw = Gateway(app, sse=sse, ws=ws, threads=opts.threads, keepalive=opts.keepalive,
+                     server_name=host, server_port=port)
+        await gw.start(host, port, sock=sock, backlog=opts.backlog)
+        try:
+            await gw.serve_forever()
+        finally:
+            await gw.stop()
+
+    try:
+        asyncio.run(_main())
+    except KeyboardInterrupt:
+        pass
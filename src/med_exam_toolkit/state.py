@@ -0,0 +1,307 @@
+"""quiz 服务的共享运行时状态
+
+考试会话、分享令牌、限流 / 封禁计数、访问码暴破计数、验证码、推送订阅
+都通过 StateStore 读写，按命名空间（ns）分组，可带过期时间：
+
+  MemoryStore  — 进程内字典，单进程运行时的默认实现
+  SQLiteStore  — 多个 worker 进程共享同一个 SQLite 文件（WAL），用于 --workers N
+
+每个请求都会碰到的高频计数（全局限流）不走这里，留在各进程内存中，见 quiz._rate_state。
+
+约定：
+  - 值必须可 JSON 序列化（SQLiteStore 落盘时编码）
+  - 取出的值不要原地修改后指望生效，读-改-写一律用 update()
+  - 时间戳统一用 time.time()，不同进程之间可以比较
+"""
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable
+
+_SWEEP_EVERY = 1024     # 每写入多少次顺带清理一次过期键
+_POOL_MAX    = 16       # SQLiteStore 每个进程最多缓存的空闲连接数
+
+
+class StateStore(ABC):
+    durable = False     # True：进程退出 / 重启后状态仍在
+
+    @abstractmethod
+    def get(self, ns: str, key: str, default: Any = None) -> Any:
+        ...
+
+    @abstractmethod
+    def set(self, ns: str, key: str, value: Any, ttl: float | None = None) -> None:
+        """写入键值；ttl 为秒数，None 表示不过期。"""
+
+    @abstractmethod
+    def pop(self, ns: str, key: str, default: Any = None) -> Any:
+        ...
+
+    @abstractmethod
+    def items(self, ns: str) -> list[tuple[str, Any]]:
+        """命名空间下全部未过期的键值。"""
+
+    @abstractmethod
+    def update(self, ns: str, key: str, fn: Callable[[Any], Any],
+               ttl: float | None = None) -> Any:
+        """原子地读-改-写：new = fn(旧值或 None)，new 为 None 时删除该键，返回 new。
+
+        ttl 为 None 时沿用原有的过期时间。
+        """
+
+    @abstractmethod
+    def purge(self, ns: str) -> list[str]:
+        """删除命名空间下已过期的键，返回被删除的键。"""
+
+    def hit(self, ns: str, key: str, limit: int, window: float) -> tuple[bool, int]:
+        """滑动窗口计数：窗口内不足 limit 次则记一次，返回 (True, 0)；
+        否则不计数，返回 (False, 距最早一次移出窗口的秒数)。"""
+        now = time.time()
+        result = (True, 0)
+
+        def fn(stamps):
+            nonlocal result
+            stamps = [t for t in stamps or () if now - t < window]
+            if len(stamps) >= limit:
+                result = (False, max(1, int(window - (now - stamps[0])) + 1))
+            else:
+                stamps.append(now)
+            return stamps
+
+        self.update(ns, key, fn, ttl=window)
+        return result
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryStore(StateStore):
+    """进程内实现：值不做拷贝，读写都在一把锁内完成。"""
+
+    def __init__(self) -> None:
+        self._data: dict[str, dict[str, tuple[Any, float]]] = {}   # ns → key → (值, 过期时间；0=不过期)
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    @staticmethod
+    def _live(entry, now: float) -> bool:
+        return entry[1] == 0 or entry[1] > now
+
+    def _put(self, ns: str, key: str, value: Any, expires: float) -> None:
+        self._data.setdefault(ns, {})[key] = (value, expires)
+        self._writes += 1
+        if self._writes % _SWEEP_EVERY == 0:
+            now = time.time()
+            for space in self._data.values():
+                for k in [k for k, e in space.items() if not self._live(e, now)]:
+                    del space[k]
+
+    def get(self, ns, key, default=None):
+        with self._lock:
+            entry = self._data.get(ns, {}).get(key)
+            if entry is None or not self._live(entry, time.time()):
+                return default
+            return entry[0]
+
+    def set(self, ns, key, value, ttl=None):
+        with self._lock:
+            self._put(ns, key, value, time.time() + ttl if ttl else 0)
+
+    def pop(self, ns, key, default=None):
+        with self._lock:
+            entry = self._data.get(ns, {}).pop(key, None)
+        if entry is None or not self._live(entry, time.time()):
+            return default
+        return entry[0]
+
+    def items(self, ns):
+        now = time.time()
+        with self._lock:
+            return [(k, e[0]) for k, e in self._data.get(ns, {}).items() if self._live(e, now)]
+
+    def update(self, ns, key, fn, ttl=None):
+        now = time.time()
+        with self._lock:
+            space = self._data.get(ns, {})
+            entry = space.get(key)
+            if entry is not None and not self._live(entry, now):
+                entry = None
+            new = fn(entry[0] if entry else None)
+            if new is None:
+                space.pop(key, None)
+            else:
+                expires = now + ttl if ttl else (entry[1] if entry else 0)
+                self._put(ns, key, new, expires)
+            return new
+
+    def purge(self, ns):
+        now = time.time()
+        with self._lock:
+            space = self._data.get(ns, {})
+            gone = [k for k, e in space.items() if not self._live(e, now)]
+            for k in gone:
+                del space[k]
+        return gone
+
+
+_DDL = """
+CREATE TABLE IF NOT EXISTS kv (
+    ns         TEXT NOT NULL,
+    key        TEXT NOT NULL,
+    value      TEXT NOT NULL,
+    expires_at REAL NOT NULL DEFAULT 0,     -- 0 = 不过期
+    PRIMARY KEY (ns, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_kv_expires ON kv(expires_at) WHERE expires_at > 0;
+"""
+
+
+class SQLiteStore(StateStore):
+    """多进程共享实现：每个进程一个连接池（请求线程借用、用完归还），写操作走 BEGIN IMMEDIATE。
+
+    Werkzeug 每个连接新开一个线程，按线程建连接等于每个请求都重新打开数据库文件。
+    """
+
+    durable = True
+
+    def __init__(self, path: Path | str) -> None:
+        self.path = os.fspath(path)
+        self._pool: list[sqlite3.Connection] = []
+        self._inherited: list[sqlite3.Connection] = []
+        self._pool_lock = threading.Lock()
+        self._pid = os.getpid()
+        self._writes = 0
+        with self._conn() as c:
+            c.executescript(_DDL)
+
+    def _connect(self) -> sqlite3.Connection:
+        c = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        c.execute("PRAGMA journal_mode=WAL")
+        c.execute("PRAGMA synchronous=NORMAL")
+        c.execute("PRAGMA busy_timeout=10000")
+        return c
+
+    @contextmanager
+    def _conn(self):
+        with self._pool_lock:
+            if self._pid != os.getpid():
+                # fork 出的子进程不能沿用父进程的连接；也不在子进程里关闭它们，只留着引用
+                self._inherited += self._pool
+                self._pool, self._pid = [], os.getpid()
+            c = self._pool.pop() if self._pool else None
+        if c is None:
+            c = self._connect()
+        try:
+            yield c
+        finally:
+            with self._pool_lock:
+                if self._pid == os.getpid() and len(self._pool) < _POOL_MAX:
+                    self._pool.append(c)
+                    c = None
+            if c is not None:
+                c.close()
+
+    def _write(self, fn):
+        with self._conn() as c:
+            c.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(c)
+                self._writes += 1
+                if self._writes % _SWEEP_EVERY == 0:
+                    c.execute("DELETE FROM kv WHERE expires_at > 0 AND expires_at <= ?",
+                              (time.time(),))
+                c.execute("COMMIT")
+            except BaseException:
+                c.execute("ROLLBACK")
+                raise
+            return result
+
+    def _read(self, sql: str, params: tuple) -> list:
+        with self._conn() as c:
+            return c.execute(sql, params).fetchall()
+
+    @staticmethod
+    def _upsert(c, ns, key, value, expires) -> None:
+        c.execute(
+            """INSERT INTO kv(ns, key, value, expires_at) VALUES (?, ?, ?, ?)
+               ON CONFLICT(ns, key) DO UPDATE SET
+                   value = excluded.value, expires_at = excluded.expires_at""",
+            (ns, key, json.dumps(value, ensure_ascii=False), expires),
+        )
+
+    def get(self, ns, key, default=None):
+        rows = self._read(
+            "SELECT value FROM kv WHERE ns=? AND key=? AND (expires_at=0 OR expires_at>?)",
+            (ns, key, time.time()),
+        )
+        return json.loads(rows[0][0]) if rows else default
+
+    def set(self, ns, key, value, ttl=None):
+        expires = time.time() + ttl if ttl else 0
+        self._write(lambda c: self._upsert(c, ns, key, value, expires))
+
+    # 不用 DELETE ... RETURNING（需 SQLite ≥ 3.35）：在同一个 BEGIN IMMEDIATE 事务里先查后删
+    def pop(self, ns, key, default=None):
+        def txn(c):
+            row = c.execute("SELECT value, expires_at FROM kv WHERE ns=? AND key=?",
+                            (ns, key)).fetchone()
+            if row is not None:
+                c.execute("DELETE FROM kv WHERE ns=? AND key=?", (ns, key))
+            return row
+        row = self._write(txn)
+        if row is None or (row[1] and row[1] <= time.time()):
+            return default
+        return json.loads(row[0])
+
+    def items(self, ns):
+        rows = self._read(
+            "SELECT key, value FROM kv WHERE ns=? AND (expires_at=0 OR expires_at>?)",
+            (ns, time.time()),
+        )
+        return [(k, json.loads(v)) for k, v in rows]
+
+    def update(self, ns, key, fn, ttl=None):
+        def txn(c):
+            now = time.time()
+            row = c.execute("SELECT value, expires_at FROM kv WHERE ns=? AND key=?",
+                            (ns, key)).fetchone()
+            if row is not None and row[1] and row[1] <= now:
+                row = None
+            new = fn(json.loads(row[0]) if row else None)
+            if new is None:
+                c.execute("DELETE FROM kv WHERE ns=? AND key=?", (ns, key))
+            else:
+                expires = now + ttl if ttl else (row[1] if row else 0)
+                self._upsert(c, ns, key, new, expires)
+            return new
+        return self._write(txn)
+
+    def purge(self, ns):
+        def txn(c):
+            now = time.time()
+            keys = [r[0] for r in c.execute(
+                "SELECT key FROM kv WHERE ns=? AND expires_at > 0 AND expires_at <= ?",
+                (ns, now))]
+            c.execute("DELETE FROM kv WHERE ns=? AND expires_at > 0 AND expires_at <= ?",
+                      (ns, now))
+            return keys
+        return self._write(txn)
+
+    def close(self) -> None:
+        with self._pool_lock:
+            pool = self._pool if self._pid == os.getpid() else []
+            self._pool = []
+        for c in pool:
+            c.close()
+
+
+def make_store(path: Path | str | None = None) -> StateStore:
+    """path 为空时返回 MemoryStore，否则返回指向该文件的 SQLiteStore。"""
+    return SQLiteStore(path) if path else MemoryStore()
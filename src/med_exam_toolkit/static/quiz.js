@@ -4454,7 +4454,15 @@ async function showAIReport() {
         try {
           const obj = JSON.parse(data);
           if (obj.error) throw new Error(obj.error);
+          if (obj.queue != null) {
+            contentEl.textContent = `AI 分析人数较多，正在排队，前面还有 ${obj.queue} 人…`;
+            continue;
+          }
           if (obj.content) {
+            if (contentEl.dataset.started !== '1') {
+              contentEl.dataset.started = '1';
+              contentEl.textContent = '';   // 清掉排队提示
+            }
             if (renderer) {
               renderer.push(obj.content);
             } else {
@@ -4795,17 +4803,21 @@ async function _recordSessionToServer(results, questions, ans, sessionId) {
     if (sel && sel.__set) sel = new Set(sel.v);
     const isEmpty  = !sel || (sel instanceof Set && sel.size === 0);
     let   result   = -1;  // -1=skip
+    let   answer;         // 所选选项，与 AI 答疑的 user_answer 同格式（多选排序拼接）
     if (!isEmpty) {
       const isMulti   = isMultiQ(q);
       const correctSet= new Set(isMulti ? q.answer.split('') : [q.answer]);
       if (isMulti) {
         const selSet = sel instanceof Set ? sel : new Set([sel]);
         result = (selSet.size === correctSet.size && [...correctSet].every(l => selSet.has(l))) ? 1 : 0;
+        answer = [...selSet].sort().join('');
       } else {
         result = (sel === q.answer) ? 1 : 0;
+        answer = sel;
       }
     }
-    items.push({ fingerprint: fp, result, mode: q.mode, unit: q.unit, quality: result === 1 ? 4 : result === 0 ? 1 : undefined });
+    items.push({ fingerprint: fp, result, mode: q.mode, unit: q.unit, quality: result === 1 ? 4 : result === 0 ? 1 : undefined,
+                 answer, si: q.si ?? 0 });
   });
 
   const today = _localDate();
@@ -838,6 +838,7 @@ function sendAIMessage(key) {
   let contentRenderer = null; // streaming renderer for content
   let reasoningRenderer = null; // streaming renderer for thinking
   let fullRawText = ''; // raw text for history saving
+  let queueNotice = null; // 上游繁忙时的排队提示，收到第一块内容后移除
 
   fetch('/api/ai/chat', {
     method: 'POST',
@@ -893,6 +894,19 @@ function sendAIMessage(key) {
           try {
             const obj = JSON.parse(data);
             chunkCount++;
+            // 排队名次：服务端在放行前推送 {"queue": N}
+            if (obj.queue != null) {
+              if (!queueNotice) {
+                queueNotice = document.createElement('div');
+                queueNotice.className = 'ai-queue-notice';
+                msgEl.insertBefore(queueNotice, thinkingWrap);
+              }
+              queueNotice.textContent = obj.queue > 0
+                ? `AI 答疑人数较多，正在排队，前面还有 ${obj.queue} 人…`
+                : 'AI 答疑人数较多，即将开始…';
+              continue;
+            }
+            if (queueNotice) { queueNotice.remove(); queueNotice = null; }
             if (obj.error) {
               contentWrap.textContent = '[错误] ' + obj.error;
               fullRawText = '[错误] ' + obj.error;
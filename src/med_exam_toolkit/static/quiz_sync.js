@@ -178,6 +178,11 @@ const SyncManager = (() => {
           body:    JSON.stringify({ sessions: bankItems.map(e => e.payload) }),
         });
 
+        if (res.status === 503) {
+          // 服务端写入队列繁忙（交卷高峰），保留队列下次再传，不计入重试次数
+          console.warn('[Sync] Server busy, will retry later for bank', bankIdx);
+          continue;
+        }
         if (!res.ok) {
           console.warn('[Sync] Server returned', res.status, 'for bank', bankIdx);
           // 401/403 = token 过期或无权限，重试无意义，直接按失败计数
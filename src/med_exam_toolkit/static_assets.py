@@ -0,0 +1,167 @@
+"""静态资源：内容哈希版本号 + 预压缩（gzip / brotli）
+
+启动时扫描 static 目录，为每个文件计算内容哈希：
+
+- 模板用 asset_url("quiz.js") 生成 /static/quiz.js?v=<哈希>。v 与当前内容一致的请求
+  返回 Cache-Control: immutable（一年）；文件不变时重启服务也不会让客户端重新下载。
+  不带 v 的请求（JS 里动态加载的 katex / mermaid 等）返回 no-cache + 强 ETag，
+  浏览器每次回源校验，未变化时只收到 304。
+- 文本类资源在后台线程里一次性压缩为 gzip / brotli，之后按 Accept-Encoding 直接返回
+  预压缩内容，不再每个请求都经 flask_compress 重新压缩。后台压缩完成前的请求
+  仍由 flask_compress 即时压缩，行为与原来一致。会 fork 的服务在 fork 前同步压缩，
+  子进程继承压好的内容。
+"""
+from __future__ import annotations
+
+import gzip
+import hashlib
+import mimetypes
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+from flask import Flask, request, url_for
+
+try:
+    import brotli
+    HAS_BROTLI = True
+except ImportError:
+    HAS_BROTLI = False
+
+_COMPRESSIBLE = {".js", ".css", ".svg", ".json", ".html", ".txt", ".map"}
+_MIN_SIZE = 512                  # 更小的文件压缩收益可以忽略
+_IMMUTABLE = "public, max-age=31536000, immutable"
+_REVALIDATE = "public, no-cache"
+
+
+@dataclass
+class _Asset:
+    digest:   str
+    mimetype: str
+    data:     Optional[bytes]                     # 仅可压缩资源常驻内存
+    variants: dict[str, bytes] = field(default_factory=dict)   # "br" / "gzip" → 压缩内容
+
+
+class StaticAssets:
+    """接管 app 的 static 端点，并向模板注册 asset_url()。"""
+
+    def __init__(self, app: Flask):
+        self.app = app
+        self.root = Path(app.static_folder)
+        self.version = ""
+        self._assets: dict[str, _Asset] = {}
+        self._pages:  dict[tuple, _Asset] = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+        app.view_functions["static"] = self.serve
+        app.jinja_env.globals["asset_url"] = self.url
+
+    # ── 扫描与预压缩 ──
+
+    def load(self, precompress: bool = True, background: bool = True) -> str:
+        """扫描 static 目录并返回整体内容版本号（所有文件哈希的哈希）。"""
+        assets: dict[str, _Asset] = {}
+        total = hashlib.sha256()
+        for p in sorted(self.root.rglob("*")):
+            if not p.is_file() or p.name.startswith("."):
+                continue
+            rel = p.relative_to(self.root).as_posix()
+            data = p.read_bytes()
+            digest = hashlib.sha256(data).hexdigest()[:16]
+            total.update(f"{rel}\0{digest}\n".encode())
+            compressible = p.suffix.lower() in _COMPRESSIBLE and len(data) >= _MIN_SIZE
+            assets[rel] = _Asset(
+                digest=digest,
+                mimetype=mimetypes.guess_type(p.name)[0] or "application/octet-stream",
+                data=data if compressible else None,
+            )
+        with self._lock:
+            self._assets = assets
+            self.version = total.hexdigest()[:16]
+            self._loaded = True
+
+        if precompress:
+            self.precompress(background)
+        return self.version
+
+    def precompress(self, background: bool = True) -> None:
+        """为已扫描的资源生成 gzip / brotli 版本。
+
+        background=True 时在后台线程里进行。之后要 fork 的服务（多 worker / gunicorn）
+        必须在 fork 前同步压完：子进程里没有这个线程，否则永远只能逐请求压缩。
+        """
+        if background:
+            threading.Thread(target=self._precompress, daemon=True,
+                             name="static-precompress").start()
+        else:
+            self._precompress()
+
+    def _ensure_loaded(self) -> None:
+        if not self._loaded:
+            self.load(precompress=False)
+
+    def _precompress(self) -> None:
+        # 小文件先压，首屏用到的 common/quiz 资源最先就绪；mermaid 最后
+        todo = sorted((a for a in self._assets.values() if a.data is not None),
+                      key=lambda a: len(a.data))
+        for a in todo:
+            _compress(a)
+        saved = sum(len(a.data) - min((len(v) for v in a.variants.values()), default=len(a.data))
+                    for a in todo)
+        print(f"[INFO] 静态资源预压缩完成: {len(todo)} 个文件，节省 {saved // 1024} KB/次")
+
+    # ── 模板与请求 ──
+
+    def url(self, filename: str) -> str:
+        """带内容哈希的静态资源地址，供模板使用：{{ asset_url('quiz.js') }}"""
+        self._ensure_loaded()
+        a = self._assets.get(filename)
+        if a is None:
+            return url_for("static", filename=filename)
+        return url_for("static", filename=filename, v=a.digest)
+
+    def serve(self, filename: str):
+        self._ensure_loaded()
+        a = self._assets.get(filename)
+        if a is None or a.data is None:
+            resp = self.app.send_static_file(filename)
+        else:
+            resp = self._respond(a)
+            resp.make_conditional(request)
+        versioned = a is not None and request.args.get("v") == a.digest
+        resp.headers["Cache-Control"] = _IMMUTABLE if versioned else _REVALIDATE
+        return resp
+
+    def page(self, key: tuple, render):
+        """渲染结果在进程内固定的页面（如注入了会话 Token 的 quiz.html）：
+        只渲染、压缩一次，之后直接返回预压缩内容。不设置缓存头。"""
+        a = self._pages.get(key)
+        if a is None:
+            data = render().encode()
+            a = _Asset(digest=hashlib.sha256(data).hexdigest()[:16],
+                       mimetype="text/html", data=data)
+            _compress(a)
+            self._pages = {key: a}   # 只保留最新一份（key 只在重启时变化）
+        return self._respond(a, etag=False)
+
+    def _respond(self, a: _Asset, etag: bool = True):
+        enc = next((e for e in ("br", "gzip")
+                    if e in a.variants and request.accept_encodings[e]), None)
+        resp = self.app.response_class(a.variants[enc] if enc else a.data,
+                                       mimetype=a.mimetype)
+        if enc:
+            resp.headers["Content-Encoding"] = enc
+        resp.vary.add("Accept-Encoding")
+        if etag:
+            # 与 flask_compress 的 "<etag>:<算法>" 写法保持一致
+            resp.set_etag(f"{a.digest}:{enc}" if enc else a.digest)
+        return resp
+
+
+def _compress(a: _Asset) -> None:
+    variants = {"gzip": gzip.compress(a.data, 9, mtime=0)}
+    if HAS_BROTLI:
+        variants["br"] = brotli.compress(a.data, quality=11)
+    # 一次性整体替换，请求线程看到的要么是空表要么是完整结果；压缩后反而更大的丢弃
+    a.variants = {k: v for k, v in variants.items() if len(v) < len(a.data)}
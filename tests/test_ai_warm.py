@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import json
+
+import pytest
+from click.testing import CliRunner
+from openai import OpenAI
+
+from med_exam_toolkit import progress, quiz
+from med_exam_toolkit.ai.chat_cache import ChatCache
+from med_exam_toolkit.ai.warm import plan_targets, warm_cache
+from med_exam_toolkit.bank import save_bank
+from med_exam_toolkit.cli import cli
+
+from .test_gateway import _content, app_state, upstream  # noqa: F401
+from .test_quiz import _TOKEN, _sample_questions
+
+
+def _hot(fp: str, *answers: tuple) -> dict:
+    return {"fingerprint": fp, "total": 10, "wrong": 8, "wrong_rate": 0.8,
+            "answers": list(answers)}
+
+
+# ═══════════════════════════════════════════════════
+# 1. 排行 → 预生成任务
+# ═══════════════════════════════════════════════════
+
+class TestPlan:
+    def test_targets_follow_ranking(self):
+        qs = _sample_questions()
+        hot = [_hot("fp13", (2, "B", 5), (0, "C", 3)),
+               _hot("gone", (0, "B", 9)),                 # 题库里已删除
+               _hot("fp1", (0, "C", 4), (5, "B", 2))]     # 小题序号越界
+        targets = plan_targets(qs, hot, 2048, None)
+        assert [(t.fingerprint, t.sq_index, t.user_answer) for t in targets] == [
+            ("fp13", 2, "B"), ("fp13", 0, "C"), ("fp1", 0, "C")]
+        assert "我的选择: B" in targets[0].messages[1]["content"]
+
+    def test_keys_depend_on_quiz_params(self):
+        qs = _sample_questions()
+        hot = [_hot("fp1", (0, "B", 1))]
+        k = plan_targets(qs, hot, 2048, None)[0].key
+        assert k != plan_targets(qs, hot, 1024, None)[0].key
+        assert k != plan_targets(qs, hot, 2048, True)[0].key
+
+
+# ═══════════════════════════════════════════════════
+# 2. 预生成后在线答疑直接命中
+# ═══════════════════════════════════════════════════
+
+class TestWarm:
+    def test_warmed_answer_served_from_cache(self, app_state, upstream, monkeypatch, tmp_path):
+        cache = ChatCache(tmp_path / "ai_chat_cache.db")
+        monkeypatch.setattr(quiz, "_ai_cache", cache)
+        monkeypatch.setattr(quiz, "_AI_REPLAY_INTERVAL", 0)
+        client = OpenAI(api_key="x", base_url=upstream.base_url)
+        targets = plan_targets(app_state.questions,
+                               [_hot("fp2", (0, "B", 6), (0, "C", 2))],
+                               quiz._ai_max_tokens, quiz._ai_enable_thinking)
+        r = warm_cache(targets, cache, client, "mock", "", quiz._ai_max_tokens,
+                       quiz._ai_enable_thinking, workers=2)
+        assert r["generated"] == 2 and r["failed"] == 0 and r["tokens"] > 0
+        assert len(upstream.requests) == 2
+
+        c = quiz.app.test_client()
+        c.environ_base["HTTP_X_SESSION_TOKEN"] = _TOKEN
+        sse = c.post("/api/ai/chat", content_type="application/json",
+                     data=json.dumps({"fingerprint": "fp2", "bank": 0, "user_answer": "B"})
+                     ).get_data(as_text=True)
+        assert _content(sse) == "答案" * 3 and len(upstream.requests) == 2
+        assert cache.stats()["hits"] == 1
+
+        again = warm_cache(targets, cache, client, "mock", "", quiz._ai_max_tokens,
+                           quiz._ai_enable_thinking)
+        assert again["skipped"] == 2 and len(upstream.requests) == 2
+
+    def test_failures_not_cached(self, tmp_path):
+        cache = ChatCache(tmp_path / "c.db")
+        client = OpenAI(api_key="x", base_url="http://127.0.0.1:9/v1", max_retries=0)
+        targets = plan_targets(_sample_questions(), [_hot("fp1", (0, "B", 1))], 2048, None)
+        r = warm_cache(targets, cache, client, "mock", "", 2048, None)
+        assert r["failed"] == 1 and cache.stats()["entries"] == 0
+
+
+# ═══════════════════════════════════════════════════
+# 3. 命令行
+# ═══════════════════════════════════════════════════
+
+class TestCommand:
+    @pytest.fixture
+    def bank(self, tmp_path):
+        path = save_bank(_sample_questions(), tmp_path / "内科")
+        db = progress.db_path_for_bank(path)
+        progress.init_db(db)
+        items = [{"fingerprint": "fp3", "result": 0, "answer": "C", "si": 0}] * 6
+        progress.record_session(db, {"id": "s1", "items": items}, user_id="u")
+        yield path
+        progress.close_connections(db)
+
+    def test_dry_run_lists_targets(self, bank):
+        res = CliRunner().invoke(cli, ["-c", "none.yaml", "ai-warm", "--bank", str(bank),
+                                       "--dry-run"])
+        assert res.exit_code == 0, res.output
+        assert "待预生成 1 条" in res.output and "fp3" in res.output and "选C" in res.output
+
+    def test_fills_default_cache(self, bank, upstream):
+        res = CliRunner().invoke(cli, ["-c", "none.yaml", "ai-warm", "--bank", str(bank),
+                                       "--provider", "openai", "--model", "mock",
+                                       "--api-key", "x", "--base-url", upstream.base_url])
+        assert res.exit_code == 0, res.output
+        assert "新生成 1 条" in res.output
+        cache = ChatCache(bank.with_name("ai_chat_cache.db"))
+        assert cache.stats()["entries"] == 1
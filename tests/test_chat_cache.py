@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import time
+
+from med_exam_toolkit.ai.chat_cache import (
+    CachedAnswer, ChatCache, default_cache_path, prompt_key, replay_events,
+)
+
+_MSGS = [{"role": "system", "content": "老师"}, {"role": "user", "content": "题目"}]
+
+
+# ═══════════════════════════════════════════════════
+# 1. 键与回放
+# ═══════════════════════════════════════════════════
+
+class TestKeyAndReplay:
+    def test_key_is_content_addressed(self):
+        k = prompt_key(_MSGS, 2048, None)
+        assert k == prompt_key([dict(m) for m in _MSGS], 2048, None)
+        assert k != prompt_key(_MSGS, 1024, None)
+        assert k != prompt_key(_MSGS, 2048, True)
+        assert k != prompt_key(_MSGS[:1], 2048, None)
+
+    def test_default_path_beside_bank(self, tmp_path):
+        assert default_cache_path(tmp_path / "内科.mqb") == tmp_path / "ai_chat_cache.db"
+
+    def test_replay_chunks_and_terminators(self):
+        entry = CachedAnswer("abcdefg", "xyz", True, 10)
+        events = list(replay_events(entry, 3))
+        assert events[0] == {"content": "", "reasoning": "xyz"}
+        assert "".join(e.get("content", "") for e in events) == "abcdefg"
+        assert events[-2:] == [{"truncated": True}, {"done": True}]
+
+
+# ═══════════════════════════════════════════════════
+# 2. 存取、过期、淘汰、统计
+# ═══════════════════════════════════════════════════
+
+class TestChatCache:
+    def test_roundtrip_and_counters(self, tmp_path):
+        c = ChatCache(tmp_path / "c.db")
+        assert c.get("k", "m") is None
+        c.put("k", "m", "答案", "思考", tokens=900)
+        assert c.get("k", "m") == CachedAnswer("答案", "思考", False, 900)
+        assert c.get("k", "other-model") is None
+        st = c.stats()
+        assert st["entries"] == 1 and st["hits"] == 1 and st["misses"] == 2
+        assert st["tokens_saved"] == 900 and st["hit_rate"] == round(1 / 3, 3)
+
+    def test_ttl_expiry(self, tmp_path):
+        c = ChatCache(tmp_path / "c.db", ttl=0.05)
+        c.put("k", "m", "答案")
+        assert c.contains("k", "m")
+        time.sleep(0.1)
+        assert not c.contains("k", "m") and c.get("k", "m") is None
+        c.put("k2", "m", "新")                     # 写入时清掉过期条目
+        assert c.stats()["entries"] == 1
+
+    def test_evicts_least_recently_hit(self, tmp_path):
+        c = ChatCache(tmp_path / "c.db", max_entries=2)
+        c.put("a", "m", "A")
+        c.put("b", "m", "B")
+        c.get("a", "m")                             # a 最近被命中
+        c.put("c", "m", "C")
+        assert c.contains("a", "m") and c.contains("c", "m") and not c.contains("b", "m")
+        assert c.stats()["evictions"] == 1
+
+    def test_shared_between_instances(self, tmp_path):
+        ChatCache(tmp_path / "c.db").put("k", "m", "答案")
+        other = ChatCache(tmp_path / "c.db")       # 另一个 worker 打开同一文件
+        assert other.get("k", "m").content == "答案"
@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import json
+import threading
+
+from med_exam_toolkit.ai.checkpoint import Checkpoint
+
+
+def _ckpt(tmp_path, **kw) -> Checkpoint:
+    c = Checkpoint("t", checkpoint_dir=tmp_path, **kw)
+    c.load()
+    return c
+
+
+# ═══════════════════════════════════════════════════
+# 1. 追加日志与重放
+# ═══════════════════════════════════════════════════
+
+class TestJournal:
+    def test_done_appends_one_line(self, tmp_path):
+        c = _ckpt(tmp_path)
+        c.done("a", {"answer": "B"})
+        c.done("b", None)
+        lines = c.journal_path.read_text(encoding="utf-8").splitlines()
+        assert [json.loads(x) for x in lines] == [{"id": "a", "result": {"answer": "B"}},
+                                                  {"id": "b", "result": None}]
+        assert not c.path.exists()                  # 没有整份重写
+
+    def test_replay_without_close(self, tmp_path):
+        c = _ckpt(tmp_path)
+        c.done("a", 1)
+        c.done("a", 2)                              # 同一条重做：以最后一次为准
+        c.done("b", None)
+        d = _ckpt(tmp_path)                         # 模拟进程被杀后重启
+        assert d.results == {"a": 2, "b": None}
+        c.close()
+
+    def test_torn_tail_ignored(self, tmp_path):
+        c = _ckpt(tmp_path)
+        c.done("a", 1)
+        c.close()
+        with open(c.journal_path, "a", encoding="utf-8") as f:
+            f.write('{"id": "b", "res')             # 写到一半断电
+        d = _ckpt(tmp_path)
+        assert d.results == {"a": 1}
+        d.done("c", 3)
+        assert _ckpt(tmp_path).results == {"a": 1, "c": 3}
+        d.close()
+
+    def test_reads_legacy_snapshot(self, tmp_path):
+        (tmp_path / "t.ckpt.json").write_text(
+            json.dumps({"meta": {}, "completed": {"old": 1}}), encoding="utf-8")
+        c = _ckpt(tmp_path)
+        c.done("new", 2)
+        c.close()
+        assert _ckpt(tmp_path).results == {"old": 1, "new": 2}
+
+
+# ═══════════════════════════════════════════════════
+# 2. 合并、清除、并发
+# ═══════════════════════════════════════════════════
+
+class TestCompaction:
+    def test_compacts_when_journal_outgrows_snapshot(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(Checkpoint, "_COMPACT_MIN", 4)
+        c = _ckpt(tmp_path)
+        for i in range(4):
+            c.done(f"k{i}", i)
+        assert c.path.exists() and not c.journal_path.exists()
+        for i in range(4, 7):                       # 快照 4 条：日志到 4 条前不再合并
+            c.done(f"k{i}", i)
+        assert len(c.journal_path.read_text().splitlines()) == 3
+        snap = json.loads(c.path.read_text(encoding="utf-8"))
+        assert len(snap["completed"]) == 4
+        c.close()
+        assert _ckpt(tmp_path).results == {f"k{i}": i for i in range(7)}
+
+    def test_clear_removes_both_files(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(Checkpoint, "_COMPACT_MIN", 2)
+        c = _ckpt(tmp_path)
+        for i in range(3):
+            c.done(str(i), i)
+        c.clear()
+        assert not c.path.exists() and not c.journal_path.exists()
+        assert _ckpt(tmp_path).results == {}
+
+    def test_threaded_done(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(Checkpoint, "_COMPACT_MIN", 50)
+        c = _ckpt(tmp_path)
+
+        def worker(w):
+            for i in range(200):
+                c.done(f"{w}-{i}", {"w": w, "i": i})
+
+        threads = [threading.Thread(target=worker, args=(w,)) for w in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        c.close()
+        got = _ckpt(tmp_path).results
+        assert len(got) == 1600 and got["7-199"] == {"w": 7, "i": 199}
@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import json
+
+import openai
+import pytest
+
+from benchmarks.mock_upstream import MockUpstream
+from med_exam_toolkit.ai import enricher as enricher_mod
+from med_exam_toolkit.ai.client import classify_error
+from med_exam_toolkit.ai.enricher import BankEnricher
+from med_exam_toolkit.bank import load_bank, save_bank
+
+from .test_quiz import _sample_questions
+
+_RESULT = json.dumps({"answer": "B", "discuss": "模拟解析", "confidence": 0.9}, ensure_ascii=False)
+
+
+class _Resp:
+    def __init__(self, status: int, headers: dict | None = None) -> None:
+        self.status_code = status
+        self.headers = headers or {}
+        self.request = None
+
+
+def _status_error(status: int, headers: dict | None = None) -> openai.APIStatusError:
+    cls = openai.RateLimitError if status == 429 else openai.APIStatusError
+    return cls("err", response=_Resp(status, headers), body=None)
+
+
+# ═══════════════════════════════════════════════════
+# 1. 按异常类型分类
+# ═══════════════════════════════════════════════════
+
+class TestClassifyError:
+    def test_rate_limit_with_retry_after(self):
+        assert classify_error(_status_error(429, {"retry-after": "3"})) == ("congestion", 3.0)
+        assert classify_error(_status_error(429, {"retry-after-ms": "250"})) == ("congestion", 0.25)
+        assert classify_error(_status_error(429)) == ("congestion", None)
+
+    def test_timeout_and_overload_are_congestion(self):
+        assert classify_error(openai.APITimeoutError(request=None))[0] == "congestion"
+        assert classify_error(_status_error(503))[0] == "congestion"
+
+    def test_transient_and_fatal(self):
+        assert classify_error(openai.APIConnectionError(request=None))[0] == "transient"
+        assert classify_error(_status_error(502))[0] == "transient"
+        assert classify_error(_status_error(401))[0] == "fatal"
+        # 文本里带 "429" 的普通异常不再被当成限流
+        assert classify_error(ValueError("HTTP 429 rate limit"))[0] == "fatal"
+
+
+# ═══════════════════════════════════════════════════
+# 2. asyncio 引擎：限流下自适应并发，结果与断点完整
+# ═══════════════════════════════════════════════════
+
+def _enricher(tmp_path, up: MockUpstream, **kw) -> BankEnricher:
+    bank = tmp_path / "t.mqb"
+    save_bank(_sample_questions(), bank)
+    return BankEnricher(
+        bank_path=bank, provider="openai", model="mock", api_key="x",
+        base_url=up.base_url, checkpoint_dir=tmp_path / "ckpt",
+        only_missing=False, **kw,
+    )
+
+
+@pytest.fixture
+def limited():
+    up = MockUpstream(chunks=1, text=_RESULT, first_delay=0.02,
+                      max_streams=3, retry_after=0.05).start()
+    yield up
+    up.stop()
+
+
+class TestAsyncEngine:
+    def test_adapts_to_rate_limit(self, tmp_path, limited, monkeypatch):
+        monkeypatch.setattr(enricher_mod, "_BASE_DELAY", 0.01)
+        e = _enricher(tmp_path, limited, max_workers=2, max_concurrency=8)
+        e.run()
+
+        out = load_bank(tmp_path / "t_ai.mqb")
+        subs = [sq for q in out for sq in q.sub_questions]
+        assert len(subs) == 30 and all(sq.ai_answer == "B" for sq in subs)
+        assert limited.rejected > 0                 # 确实撞到了限流
+        assert limited.peak_streams <= 3
+        assert e._aimd.cuts > 0 and e._aimd.peak >= 3
+        assert e._tracker.requests == 30 and e._tracker.failed_requests == 0
+        assert not (tmp_path / "ckpt" / "ai_enrich.ckpt.jsonl").exists()   # 全部成功后清除
+
+    def test_congestion_budget_exhausted_keeps_checkpoint(self, tmp_path, limited, monkeypatch):
+        monkeypatch.setattr(enricher_mod, "_MAX_CONGESTION", 0)
+        limited.max_streams = 1
+        limited.first_delay = 0.1
+        e = _enricher(tmp_path, limited, max_workers=4, limit=4)
+        e.run()
+        assert e._tracker.failed_requests > 0
+        ckpt = tmp_path / "ckpt" / "ai_enrich.ckpt.jsonl"
+        assert ckpt.exists()                        # 有失败时保留断点
+        assert sum(json.loads(x)["result"] is None for x in ckpt.read_text().splitlines()) \
+            == e._tracker.failed_requests
+
+    def test_threads_engine_still_works(self, tmp_path, limited):
+        limited.max_streams = 0
+        e = _enricher(tmp_path, limited, engine="threads", max_workers=4, limit=5)
+        e.run()
+        assert e._tracker.requests == 5 and e._aimd is None
+
+
+# ═══════════════════════════════════════════════════
+# 3. RPM / TPM 配额
+# ═══════════════════════════════════════════════════
+
+class TestRateBudget:
+    def test_settles_actual_usage_and_shows_utilisation(self, tmp_path, limited, capsys):
+        limited.max_streams = 0
+        e = _enricher(tmp_path, limited, rpm=1000, tpm=1_000_000, limit=6)
+        e.run()
+        u = e._budget.utilisation()
+        assert u["rpm"] == 6 and u["tpm"] == e._tracker.total_tokens   # 按实际 usage 结算
+        out = capsys.readouterr().out
+        assert "[RPM:" in out and "/1000 TPM:" in out and "配额利用" in out
+
+    def test_cli_reads_provider_budget(self, tmp_path, monkeypatch):
+        from click.testing import CliRunner
+        from med_exam_toolkit.cli import cli
+
+        seen = {}
+
+        class _Fake:
+            def __init__(self, **kw):
+                seen.update(kw)
+
+            def run(self):
+                pass
+
+        monkeypatch.setattr(enricher_mod, "BankEnricher", _Fake)
+        bank = tmp_path / "t.mqb"
+        save_bank(_sample_questions(), bank)
+        cfg = tmp_path / "config.yaml"
+        cfg.write_text("ai:\n  rate_limits:\n    deepseek: {rpm: 300, tpm: 50000}\n",
+                       encoding="utf-8")
+        args = ["-c", str(cfg), "enrich", "--bank", str(bank), "--provider", "deepseek"]
+        assert CliRunner().invoke(cli, args).exit_code == 0
+        assert (seen["rpm"], seen["tpm"]) == (300, 50000)
+        assert CliRunner().invoke(cli, args + ["--tpm", "0"]).exit_code == 0
+        assert (seen["rpm"], seen["tpm"]) == (300, 0)                  # 命令行覆盖
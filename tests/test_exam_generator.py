@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import random
+
+from med_exam_toolkit.exam import ExamConfig, ExamGenerator
+from med_exam_toolkit.exam.fill import fill_exact
+from med_exam_toolkit.models import Question, SubQuestion
+
+
+def _make_q(i: int, n_sub: int = 1, mode: str = "A1型题", rate: str = "70%") -> Question:
+    subs = [SubQuestion(text=f"题{i}-{j}", options=["A.甲", "B.乙"], answer="A", rate=rate)
+            for j in range(n_sub)]
+    return Question(fingerprint=f"fp{i}", mode=mode, unit="第一章", sub_questions=subs)
+
+
+# ═══════════════════════════════════════════════════
+# 1. 精确凑数
+# ═══════════════════════════════════════════════════
+
+class TestFillExact:
+    def test_greedy_hit_keeps_order(self):
+        items = [1, 2, 3, 4]
+        assert fill_exact(items, 6, lambda x: x) == [1, 2, 3]
+
+    def test_exact_when_greedy_misses(self):
+        # 贪心会先拿 3、再拿 3，剩 1 凑不上；4+4+... 不行，3+4 可以
+        items = [3, 3, 4, 4]
+        picked = fill_exact(items, 7, lambda x: x)
+        assert sum(picked) == 7
+
+    def test_best_effort_when_infeasible(self):
+        assert sum(fill_exact([4, 4, 4], 10, lambda x: x)) == 8
+
+    def test_randomized_matches_brute_force(self):
+        rng = random.Random(0)
+        for _ in range(200):
+            items = [rng.randint(1, 5) for _ in range(rng.randint(1, 10))]
+            target = rng.randint(1, 25)
+            reachable = {0}
+            for c in items:
+                reachable |= {s + c for s in reachable}
+            best = max(s for s in reachable if s <= target)
+            picked = fill_exact(items, target, lambda x: x)
+            assert sum(picked) == best
+
+
+# ═══════════════════════════════════════════════════
+# 2. 组卷
+# ═══════════════════════════════════════════════════
+
+class TestExamGenerator:
+    def test_sub_mode_hits_target_without_truncation(self):
+        pool = [_make_q(i, n_sub=3, mode="A3/A4型题") for i in range(10)]
+        pool += [_make_q(i, n_sub=2, mode="A3/A4型题") for i in range(10, 13)]
+        for seed in range(20):
+            gen = ExamGenerator(pool, ExamConfig(count=7, seed=seed))
+            selected = gen.generate()
+            assert gen._total_subs(selected) == 7
+            assert all(len(q.sub_questions) in (2, 3) for q in selected)
+
+    def test_truncation_does_not_mutate_pool(self):
+        pool = [_make_q(i, n_sub=3, mode="A3/A4型题") for i in range(4)]
+        selected = ExamGenerator(pool, ExamConfig(count=5, seed=1)).generate()
+        assert sum(len(q.sub_questions) for q in selected) == 5
+        assert all(len(q.sub_questions) == 3 for q in pool)
+
+    def test_copies_respect_max_overlap(self):
+        pool = [_make_q(i) for i in range(100)]
+        gen = ExamGenerator(pool, ExamConfig(count=20, seed=3, copies=5, max_overlap=0.0))
+        papers = gen.generate_batch()
+        assert len(papers) == 5
+        for i, a in enumerate(papers):
+            assert len(a) == 20
+            for b in papers[i + 1:]:
+                assert gen.overlap(a, b) == 0.0
+
+    def test_single_copy_matches_generate(self):
+        pool = [_make_q(i, n_sub=1 + i % 3) for i in range(40)]
+        a = ExamGenerator(pool, ExamConfig(count=25, seed=9)).generate()
+        b = ExamGenerator(pool, ExamConfig(count=25, seed=9)).generate_batch()
+        assert [q.fingerprint for q in a] == [q.fingerprint for q in b[0]]
+
+
+# ═══════════════════════════════════════════════════
+# 3. 命令行
+# ═══════════════════════════════════════════════════
+
+class TestGenerateCommand:
+    def test_copies_with_docx_output_do_not_overwrite(self, tmp_path):
+        from click.testing import CliRunner
+        from med_exam_toolkit.bank import save_bank
+        from med_exam_toolkit.cli import cli
+
+        bank = tmp_path / "b.mqb"
+        save_bank([_make_q(i) for i in range(60)], bank)
+        out = tmp_path / "paper.docx"
+        res = CliRunner().invoke(cli, ["generate", "--bank", str(bank), "-o", str(out),
+                                       "-n", "10", "--copies", "3", "--seed", "1"])
+        assert res.exit_code == 0, res.output
+        assert sorted(p.name for p in tmp_path.glob("*.docx")) == [
+            "paper_01.docx", "paper_02.docx", "paper_03.docx"]
@@ -295,7 +295,7 @@ class TestBankEncryption:
 
 class TestSM2:
     """
-    验证 progress._update_sm2 的核心行为：
+    验证 progress 中 SM-2 状态转移（_sm2_step）的核心行为：
       - 初次正确 → interval=1, reps=1
       - 第二次正确 → interval=6, reps=2
       - 第三次正确 → interval=round(6 * 2.5)=15, reps=3
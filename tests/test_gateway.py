@@ -0,0 +1,377 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import http.client
+import json
+import os
+import socket
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from benchmarks.mock_upstream import MockUpstream
+from med_exam_toolkit import quiz
+from med_exam_toolkit.gateway import Gateway
+from med_exam_toolkit.state import MemoryStore
+
+from .test_quiz import _TOKEN, _sample_questions
+
+
+def _wait(cond, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not cond() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return cond()
+
+
+@pytest.fixture
+def upstream():
+    up = MockUpstream(chunks=3).start()
+    yield up
+    up.stop()
+
+
+@pytest.fixture
+def app_state(monkeypatch, upstream):
+    """装载内存题库、关闭访问码，AI / ASR 指向本地模拟上游。"""
+    from openai import OpenAI
+    bank = quiz.BankState(bank_path=Path("t.mqb"), password=None,
+                          questions=_sample_questions())
+    monkeypatch.setattr(quiz, "_banks", [bank])
+    monkeypatch.setattr(quiz, "_fp_global", {})
+    monkeypatch.setattr(quiz, "_pin_enabled", False)
+    monkeypatch.setattr(quiz, "_session_token", _TOKEN)
+    monkeypatch.setattr(quiz, "_state", MemoryStore())
+    monkeypatch.setattr(quiz, "_rate_state", MemoryStore())
+    monkeypatch.setattr(quiz, "_RATE_LIMIT", 100000)
+    monkeypatch.setattr(quiz, "_ai_client", OpenAI(api_key="x", base_url=upstream.base_url))
+    monkeypatch.setattr(quiz, "_ai_model", "mock")
+    monkeypatch.setattr(quiz, "_asr_api_key", "k")
+    monkeypatch.setattr(quiz, "_asr_model", "m")
+    monkeypatch.setattr(quiz, "_asr_base_url", upstream.ws_url)
+    quiz._index_banks()
+    return bank
+
+
+@pytest.fixture
+def gateway(app_state, monkeypatch):
+    loop = asyncio.new_event_loop()
+    gw = Gateway(quiz.app, sse={"ai": quiz._ai_stream_async},
+                 ws={"/api/asr/ws": quiz._asr_ws_async}, threads=4)
+    port = loop.run_until_complete(gw.start("127.0.0.1", 0))
+    monkeypatch.setattr(quiz, "_server_port", port)
+    t = threading.Thread(target=loop.run_forever, daemon=True)
+    t.start()
+    gw.loop = loop
+    yield gw
+    asyncio.run_coroutine_threadsafe(gw.stop(), loop).result(5)
+    loop.call_soon_threadsafe(loop.stop)
+    t.join(5)
+    loop.run_until_complete(loop.shutdown_asyncgens())
+    loop.close()
+
+
+def _chat_body(bank) -> str:
+    return json.dumps({"fingerprint": bank.questions[0].fingerprint, "bank": 0})
+
+
+def _content(sse: str) -> str:
+    """拼出 SSE 流中全部 content 片段。"""
+    out = []
+    for event in sse.strip().split("\n\n"):
+        data = event[6:]
+        if data != "[DONE]":
+            out.append(json.loads(data).get("content", ""))
+    return "".join(out)
+
+
+def _post(port: int, path: str, body: str, conn=None):
+    conn = conn or http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    conn.request("POST", path, body=body, headers={
+        "X-Session-Token": _TOKEN, "Content-Type": "application/json"})
+    resp = conn.getresponse()
+    return resp, resp.read().decode()
+
+
+# ═══════════════════════════════════════════════════
+# 1. SSE 格式（同步路径与网关路径一致）
+# ═══════════════════════════════════════════════════
+
+class TestStreamFormat:
+    def test_sync_stream(self, app_state):
+        c = quiz.app.test_client()
+        c.environ_base["HTTP_X_SESSION_TOKEN"] = _TOKEN
+        resp = c.post("/api/ai/chat", data=_chat_body(app_state), content_type="application/json")
+        events = resp.get_data(as_text=True).strip().split("\n\n")
+        assert events[-1] == "data: [DONE]"
+        assert [json.loads(e[6:]) for e in events[:-1]] == [{"content": "答案", "reasoning": ""}] * 3
+
+    def test_gateway_stream_matches_sync(self, app_state, gateway, upstream):
+        resp, text = _post(gateway.server_port, "/api/ai/chat", _chat_body(app_state))
+        assert resp.status == 200
+        assert resp.getheader("Content-Type").startswith("text/event-stream")
+        assert resp.getheader("X-Content-Type-Options") == "nosniff"   # after_request 仍生效
+        events = text.strip().split("\n\n")
+        assert events[-1] == "data: [DONE]"
+        assert [json.loads(e[6:]) for e in events[:-1]] == [{"content": "答案", "reasoning": ""}] * 3
+        assert upstream.requests[-1]["stream"] is True
+
+    def test_report_has_no_reasoning(self, app_state, gateway):
+        _, text = _post(gateway.server_port, "/api/ai/report", json.dumps({"total": 1}))
+        first = json.loads(text.split("\n\n")[0][6:])
+        assert first == {"content": "答案"}
+
+
+# ═══════════════════════════════════════════════════
+# 2. 网关：普通请求、鉴权、keep-alive
+# ═══════════════════════════════════════════════════
+
+class TestGatewayHttp:
+    def test_keepalive_reuses_connection(self, gateway):
+        conn = http.client.HTTPConnection("127.0.0.1", gateway.server_port, timeout=10)
+        for _ in range(3):
+            conn.request("GET", "/api/questions?bank=0", headers={"X-Session-Token": _TOKEN})
+            resp = conn.getresponse()
+            assert resp.status == 200
+            assert len(json.loads(resp.read())["items"]) == 30
+        conn.close()
+
+    def test_keepalive_zero_closes_after_response(self, gateway):
+        gateway.keepalive = 0
+        conn = http.client.HTTPConnection("127.0.0.1", gateway.server_port, timeout=10)
+        conn.request("GET", "/api/questions?bank=0", headers={"X-Session-Token": _TOKEN})
+        resp = conn.getresponse()
+        assert resp.status == 200 and resp.getheader("Connection") == "close"
+        resp.read()
+        conn.close()
+
+    def test_keepalive_not_applied_to_first_request(self, gateway):
+        gateway.keepalive = 0.1
+        sock = socket.create_connection(("127.0.0.1", gateway.server_port), timeout=10)
+        time.sleep(0.3)                             # 连上后晚一点才发请求，不算空闲超时
+        sock.sendall(f"GET /api/questions?bank=0 HTTP/1.1\r\n"
+                     f"Host: 127.0.0.1:{gateway.server_port}\r\n"
+                     f"X-Session-Token: {_TOKEN}\r\n\r\n".encode())
+        head = sock.recv(64)
+        assert head.startswith(b"HTTP/1.1 200"), head
+        sock.close()
+
+    def test_before_request_still_applies(self, gateway):
+        conn = http.client.HTTPConnection("127.0.0.1", gateway.server_port, timeout=10)
+        conn.request("POST", "/api/ai/chat", body="{}", headers={"Content-Type": "application/json"})
+        assert conn.getresponse().status == 401
+
+    def test_view_errors_returned_directly(self, gateway):
+        resp, text = _post(gateway.server_port, "/api/ai/chat",
+                           json.dumps({"fingerprint": "missing", "bank": 0}))
+        assert resp.status == 404 and "题目未找到" in text
+
+    def test_idle_streams_do_not_hold_threads(self, app_state, gateway, upstream):
+        upstream.first_delay = 3.0
+        n = 50
+        before = threading.active_count()
+        conns = []
+        for _ in range(n):
+            conn = http.client.HTTPConnection("127.0.0.1", gateway.server_port, timeout=10)
+            conn.request("POST", "/api/ai/chat", body=_chat_body(app_state), headers={
+                "X-Session-Token": _TOKEN, "Content-Type": "application/json"})
+            conns.append(conn)
+        assert _wait(lambda: upstream.open_streams == n)
+        assert gateway.streams == n
+        # 只允许有界线程池：网关的 4 个 + asyncio 默认 executor（异步客户端解析域名用），与流数无关
+        default_executor = min(32, (os.cpu_count() or 1) + 4)
+        assert threading.active_count() - before <= min(4 + default_executor + 2, n // 2)
+        for conn in conns:
+            conn.close()
+        assert _wait(lambda: upstream.open_streams == 0)     # 浏览器断开后上游流也被关闭
+        assert _wait(lambda: gateway.streams == 0)
+
+
+# ═══════════════════════════════════════════════════
+# 3. ASR WebSocket 代理
+# ═══════════════════════════════════════════════════
+
+class TestAsrProxy:
+    def test_proxy_roundtrip(self, gateway, upstream):
+        from simple_websocket import Client, ConnectionClosed
+        ws = Client.connect(f"ws://127.0.0.1:{gateway.server_port}/api/asr/ws?token={_TOKEN}")
+        assert json.loads(ws.receive(timeout=5)) == {"type": "ready"}
+        ws.send(b"\0" * 320)
+        assert json.loads(ws.receive(timeout=5)) == {"type": "partial", "text": "答案1"}
+        ws.send(json.dumps({"type": "stop"}))
+        assert json.loads(ws.receive(timeout=5)) == {"type": "partial", "text": "答案完"}
+        assert json.loads(ws.receive(timeout=5)) == {"type": "done"}
+        with contextlib.suppress(ConnectionClosed):   # 服务端发完 done 即关闭
+            ws.close()
+        assert upstream.audio_frames == 1
+        assert _wait(lambda: gateway.streams == 0)
+
+    def test_rejected_before_handshake(self, gateway):
+        from simple_websocket import Client, ConnectionError as WsRejected
+        with pytest.raises(WsRejected, match="401"):
+            Client.connect(f"ws://127.0.0.1:{gateway.server_port}/api/asr/ws?token=bad")
+
+    def test_precheck_route_requires_gateway(self, app_state):
+        c = quiz.app.test_client()
+        c.environ_base["HTTP_X_SESSION_TOKEN"] = _TOKEN
+        assert c.get("/api/asr/ws").status_code == 400
+
+
+# ═══════════════════════════════════════════════════
+# 4. AI 上游限流与排队
+# ═══════════════════════════════════════════════════
+
+class TestAiQueue:
+    @pytest.fixture
+    def limiter(self, monkeypatch):
+        from med_exam_toolkit.ai.limiter import FairLimiter
+        lim = FairLimiter(concurrency=1, max_queue=2)
+        monkeypatch.setattr(quiz, "_ai_limiter", lim)
+        monkeypatch.setattr(quiz, "_AI_QUEUE_POLL", 0.05)
+        return lim
+
+    def test_sync_queue_position_then_stream(self, app_state, limiter):
+        held = limiter.enqueue("other", 0)
+        c = quiz.app.test_client()
+        c.environ_base["HTTP_X_SESSION_TOKEN"] = _TOKEN
+        resp = c.post("/api/ai/chat", data=_chat_body(app_state), content_type="application/json")
+        it = iter(resp.response)
+        assert json.loads(next(it)[6:]) == {"queue": 0}
+        limiter.release(held)
+        rest = b"".join(it).decode()
+        assert rest.endswith("data: [DONE]\n\n") and "\"content\"" in rest
+        assert limiter.active == 0 and limiter.granted == 2
+
+    def test_gateway_queue_position_then_stream(self, app_state, gateway, limiter):
+        held = limiter.enqueue("other", 0)
+        conn = http.client.HTTPConnection("127.0.0.1", gateway.server_port, timeout=10)
+        conn.request("POST", "/api/ai/chat", body=_chat_body(app_state), headers={
+            "X-Session-Token": _TOKEN, "Content-Type": "application/json"})
+        resp = conn.getresponse()
+        assert json.loads(resp.readline()[6:]) == {"queue": 0}
+        limiter.release(held)
+        rest = resp.read().decode()
+        assert rest.rstrip().endswith("data: [DONE]") and "\"content\"" in rest
+        assert _wait(lambda: limiter.active == 0)
+
+    def test_disconnect_while_queued_frees_slot(self, app_state, gateway, limiter):
+        held = limiter.enqueue("other", 0)
+        conn = http.client.HTTPConnection("127.0.0.1", gateway.server_port, timeout=10)
+        conn.request("POST", "/api/ai/chat", body=_chat_body(app_state), headers={
+            "X-Session-Token": _TOKEN, "Content-Type": "application/json"})
+        conn.getresponse().readline()
+        conn.close()
+        assert _wait(lambda: limiter.stats()["waiting"] == 0)
+        limiter.release(held)
+        assert limiter.active == 0
+
+    def test_sync_disconnect_while_queued_frees_slot(self, app_state, limiter, monkeypatch):
+        from werkzeug.serving import make_server
+        srv = make_server("127.0.0.1", 0, quiz.app, threaded=True)
+        monkeypatch.setattr(quiz, "_server_port", srv.server_port)
+        threading.Thread(target=srv.serve_forever, daemon=True).start()
+        try:
+            held = limiter.enqueue("other", 0)
+            conn = http.client.HTTPConnection("127.0.0.1", srv.server_port, timeout=10)
+            conn.request("POST", "/api/ai/chat", body=_chat_body(app_state), headers={
+                "X-Session-Token": _TOKEN, "Content-Type": "application/json"})
+            assert json.loads(conn.getresponse().readline()[6:]) == {"queue": 0}
+            conn.close()
+            # 名次不变时的心跳写失败，Werkzeug 关闭生成器并让出排队名额
+            assert _wait(lambda: limiter.stats()["waiting"] == 0)
+            limiter.release(held)
+            assert limiter.active == 0 and limiter.granted == 1
+        finally:
+            srv.shutdown()
+
+    def test_queue_full_returns_429(self, app_state, limiter):
+        for _ in range(3):
+            limiter.enqueue("other", 0)
+        c = quiz.app.test_client()
+        c.environ_base["HTTP_X_SESSION_TOKEN"] = _TOKEN
+        resp = c.post("/api/ai/chat", data=_chat_body(app_state), content_type="application/json")
+        assert resp.status_code == 429 and resp.headers["Retry-After"] == "30"
+
+    def test_burst_stays_under_provider_limit(self, app_state, gateway, upstream, limiter):
+        limiter.concurrency = 2
+        limiter.max_queue = 100
+        upstream.max_streams = 2
+        upstream.chunk_delay = 0.02
+        results = []
+
+        def one():
+            _, text = _post(gateway.server_port, "/api/ai/chat", _chat_body(app_state))
+            results.append(text.rstrip().endswith("data: [DONE]") and "error" not in text)
+
+        threads = [threading.Thread(target=one) for _ in range(12)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(20)
+        assert results == [True] * 12
+        assert upstream.rejected == 0 and upstream.peak_streams <= 2
+
+
+# ═══════════════════════════════════════════════════
+# 5. 首轮答疑缓存
+# ═══════════════════════════════════════════════════
+
+class TestAiCache:
+    @pytest.fixture
+    def cache(self, monkeypatch, tmp_path):
+        from med_exam_toolkit.ai.chat_cache import ChatCache
+        c = ChatCache(tmp_path / "ai_chat_cache.db")
+        monkeypatch.setattr(quiz, "_ai_cache", c)
+        monkeypatch.setattr(quiz, "_AI_REPLAY_INTERVAL", 0)
+        return c
+
+    @staticmethod
+    def _chat(body: str) -> str:
+        c = quiz.app.test_client()
+        c.environ_base["HTTP_X_SESSION_TOKEN"] = _TOKEN
+        return c.post("/api/ai/chat", data=body, content_type="application/json").get_data(as_text=True)
+
+    def test_second_request_replayed_from_cache(self, app_state, upstream, cache):
+        first = self._chat(_chat_body(app_state))
+        n = len(upstream.requests)
+        second = self._chat(_chat_body(app_state))
+        assert len(upstream.requests) == n           # 没有再请求上游
+        assert _content(second) == _content(first) == "答案" * 3
+        assert second.endswith("data: [DONE]\n\n")
+        st = cache.stats()
+        assert st["entries"] == 1 and st["hits"] == 1 and st["tokens_saved"] > 0
+
+    def test_gateway_replay(self, app_state, gateway, upstream, cache):
+        _, first = _post(gateway.server_port, "/api/ai/chat", _chat_body(app_state))
+        assert _wait(lambda: cache.stats()["entries"] == 1)
+        n = len(upstream.requests)
+        _, second = _post(gateway.server_port, "/api/ai/chat", _chat_body(app_state))
+        assert len(upstream.requests) == n and _content(second) == _content(first)
+
+    def test_replay_bypasses_queue(self, app_state, upstream, cache, monkeypatch):
+        from med_exam_toolkit.ai.limiter import FairLimiter
+        self._chat(_chat_body(app_state))
+        lim = FairLimiter(concurrency=1)
+        lim.enqueue("someone-else", 0)               # 上游名额被占满
+        monkeypatch.setattr(quiz, "_ai_limiter", lim)
+        assert self._chat(_chat_body(app_state)).endswith("data: [DONE]\n\n")
+        assert lim.granted == 1
+
+    def test_followups_and_other_answers_not_shared(self, app_state, upstream, cache):
+        fp = app_state.questions[0].fingerprint
+        self._chat(json.dumps({"fingerprint": fp, "bank": 0, "user_answer": "A"}))
+        self._chat(json.dumps({"fingerprint": fp, "bank": 0, "user_answer": "B"}))
+        self._chat(json.dumps({"fingerprint": fp, "bank": 0, "user_answer": "A",
+                               "history": [{"role": "user", "content": "为什么"}]}))
+        assert cache.stats()["entries"] == 2 and cache.stats()["hits"] == 0
+        assert len(upstream.requests) == 3
+
+    def test_failed_stream_not_cached(self, app_state, cache, monkeypatch):
+        from openai import OpenAI
+        monkeypatch.setattr(quiz, "_ai_client",
+                            OpenAI(api_key="x", base_url="http://127.0.0.1:9/v1", max_retries=0))
+        assert '"error"' in self._chat(_chat_body(app_state))
+        assert cache.stats()["entries"] == 0
@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import json
+
+import pytest
+from flask import Flask
+
+from med_exam_toolkit.json_provider import (
+    HAS_ORJSON, OrjsonProvider, StdJSONProvider, install_json_provider,
+)
+
+_PAYLOAD = {"b": [1, 2.5, None, True], "a": "中文题干", "n": {"z": 1, "y": "选项"}}
+
+
+def _app() -> Flask:
+    app = Flask(__name__)
+    app.config["JSON_AS_ASCII"] = False
+    return app
+
+
+# ═══════════════════════════════════════════════════
+# 1. 标准库后端
+# ═══════════════════════════════════════════════════
+
+class TestStdProvider:
+    def test_honours_json_as_ascii(self):
+        app = _app()
+        install_json_provider(app, "json")
+        assert isinstance(app.json, StdJSONProvider)
+        assert "中文题干" in app.json.dumps(_PAYLOAD)
+
+    def test_unknown_backend_falls_back_to_auto(self, capsys):
+        app = _app()
+        name = install_json_provider(app, "simdjson")
+        assert name == ("orjson" if HAS_ORJSON else "json")
+        assert "[WARN]" in capsys.readouterr().out
+
+    def test_env_selects_backend(self, monkeypatch):
+        monkeypatch.setenv("MED_EXAM_JSON", "json")
+        assert install_json_provider(_app()) == "json"
+
+
+# ═══════════════════════════════════════════════════
+# 2. orjson 后端
+# ═══════════════════════════════════════════════════
+
+@pytest.mark.skipif(not HAS_ORJSON, reason="orjson 未安装")
+class TestOrjsonProvider:
+    def _pair(self):
+        std, fast = _app(), _app()
+        install_json_provider(std, "json")
+        install_json_provider(fast, "orjson")
+        return std, fast
+
+    def test_compact_output_identical_to_stdlib(self):
+        std, fast = self._pair()
+        assert isinstance(fast.json, OrjsonProvider)
+        sep = (",", ":")
+        assert fast.json.dumps(_PAYLOAD, separators=sep) == std.json.dumps(_PAYLOAD, separators=sep)
+
+    def test_default_separators_match_stdlib(self):
+        std, fast = self._pair()
+        assert fast.json.dumps(_PAYLOAD) == std.json.dumps(_PAYLOAD)
+        assert ", " in fast.json.dumps(_PAYLOAD, separators=None)
+
+    def test_response_matches_stdlib(self):
+        std, fast = self._pair()
+        with std.app_context():
+            a = std.json.response(_PAYLOAD).get_data()
+        with fast.app_context():
+            b = fast.json.response(_PAYLOAD).get_data()
+        assert a == b
+
+    def test_falls_back_for_unsupported_values(self):
+        _, fast = self._pair()
+        big = 2 ** 70
+        assert json.loads(fast.json.dumps({"v": big})) == {"v": big}
+        assert fast.json.loads('{"v": NaN}')["v"] != 0
+        assert fast.json.dumps({"a": 1}, indent=2) == '{\n  "a": 1\n}'
@@ -0,0 +1,277 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+
+import pytest
+
+from med_exam_toolkit.ai.limiter import AimdLimiter, FairLimiter, QueueFull, RateBudget, TokenBucket
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.t = 0.0
+
+    def __call__(self) -> float:
+        return self.t
+
+
+# ═══════════════════════════════════════════════════
+# 1. TokenBucket
+# ═══════════════════════════════════════════════════
+
+class TestTokenBucket:
+    def test_unlimited(self):
+        b = TokenBucket(0)
+        assert b.try_take(10 ** 9) == 0
+        assert b.level == float("inf")
+
+    def test_take_and_refill(self):
+        clock = _Clock()
+        b = TokenBucket(600, clock=clock)          # 10 token/秒
+        assert b.try_take(600) == 0
+        assert b.try_take(100) == pytest.approx(10.0)
+        clock.t = 10
+        assert b.try_take(100) == 0
+
+    def test_oversized_request_capped(self):
+        clock = _Clock()
+        b = TokenBucket(100, clock=clock)
+        assert b.try_take(5000) == 0               # 按容量扣，不会永远等下去
+
+    def test_refund_and_overdraft(self):
+        clock = _Clock()
+        b = TokenBucket(600, clock=clock)
+        b.try_take(600)
+        b.refund(200)
+        assert b.level == pytest.approx(200)
+        b.refund(-300)                             # 实际用量超过预扣：补扣
+        assert b.level == pytest.approx(-100)
+        b.refund(10 ** 6)
+        assert b.level == pytest.approx(600)       # 不超过容量
+
+
+# ═══════════════════════════════════════════════════
+# 2. 并发上限与公平轮转
+# ═══════════════════════════════════════════════════
+
+class TestFairLimiter:
+    def test_concurrency_cap(self):
+        lim = FairLimiter(concurrency=2)
+        t = [lim.enqueue("u", 0) for _ in range(3)]
+        assert [x.granted for x in t] == [True, True, False]
+        lim.release(t[0])
+        assert t[2].granted and lim.active == 2
+
+    def test_round_robin_between_users(self):
+        lim = FairLimiter(concurrency=1)
+        first = lim.enqueue("a", 0)
+        a = [lim.enqueue("a", 0) for _ in range(3)]     # a 连点三次
+        b = lim.enqueue("b", 0)
+        c = lim.enqueue("c", 0)
+        assert lim.position(a[0]) == 0
+        assert lim.position(b) == 1 and lim.position(c) == 2
+        assert lim.position(a[1]) == 3 and lim.position(a[2]) == 4
+        order, cur = [], first
+        for _ in range(5):
+            lim.release(cur)
+            cur = next(x for x in a + [b, c] if x.granted and not x.done)
+            order.append(cur)
+        assert order == [a[0], b, c, a[1], a[2]]
+
+    def test_cancel_waiting_ticket(self):
+        lim = FairLimiter(concurrency=1)
+        held = lim.enqueue("a", 0)
+        waiting = lim.enqueue("b", 0)
+        lim.release(waiting)                        # 浏览器在排队中断开
+        assert lim.stats()["waiting"] == 0 and lim.cancelled == 1
+        lim.release(waiting)                        # 重复释放无副作用
+        lim.release(held)
+        assert lim.active == 0
+
+    def test_queue_full(self):
+        lim = FairLimiter(concurrency=1, max_queue=2)
+        for _ in range(3):
+            lim.enqueue("u", 0)
+        with pytest.raises(QueueFull):
+            lim.enqueue("v", 0)
+        assert lim.rejected == 1
+
+    def test_token_budget_blocks_until_refill(self):
+        clock = _Clock()
+        lim = FairLimiter(concurrency=10, tpm=600, clock=clock)
+        a = lim.enqueue("a", 500)
+        b = lim.enqueue("b", 500)
+        assert a.granted and not b.granted
+        lim.release(a, used_tokens=100)            # 退回 400：桶里 500，够 b
+        assert b.granted
+        c = lim.enqueue("c", 300)
+        assert not c.granted
+        clock.t = 30                                # 回填 300
+        assert lim.wait(c, 0)
+
+    def test_release_without_usage_refunds_precharge(self):
+        lim = FairLimiter(concurrency=10, tpm=600, clock=_Clock())
+        a = lim.enqueue("a", 500)
+        lim.release(a)                              # 生成器未启动：预扣的 500 全部退回
+        assert lim.bucket.level == 600
+
+    def test_threaded_waiters(self):
+        lim = FairLimiter(concurrency=3)
+        peak, cur, lock = [0], [0], threading.Lock()
+
+        def worker(i):
+            t = lim.enqueue(f"u{i % 5}", 0)
+            while not lim.wait(t, 0.5):
+                pass
+            with lock:
+                cur[0] += 1
+                peak[0] = max(peak[0], cur[0])
+            with lock:
+                cur[0] -= 1
+            lim.release(t)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(40)]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join(10)
+        assert peak[0] <= 3 and lim.granted == 40 and lim.active == 0
+
+    def test_async_waiters(self):
+        lim = FairLimiter(concurrency=2)
+
+        async def main():
+            held = [lim.enqueue("a", 0), lim.enqueue("b", 0)]
+            t = lim.enqueue("c", 0)
+            assert not await lim.wait_async(t, 0.01)
+            loop = asyncio.get_running_loop()
+            loop.call_later(0.02, lambda: threading.Thread(
+                target=lim.release, args=(held[0],)).start())   # 另一线程释放也能唤醒
+            assert await lim.wait_async(t, 2)
+
+        asyncio.run(main())
+
+
+# ═══════════════════════════════════════════════════
+# 3. AIMD 自适应并发
+# ═══════════════════════════════════════════════════
+
+class TestAimdLimiter:
+    def test_slow_start_then_additive(self):
+        lim = AimdLimiter(initial=2, ceiling=64)
+
+        async def main():
+            for _ in range(6):                            # 慢启动：每个成功 +1
+                await lim.release(await lim.acquire(), "ok")
+            assert lim.window == 8
+            await lim.release(await lim.acquire(), "congestion")
+            assert lim.window == 4
+            for _ in range(4):                            # 线性：一整个窗口才 +1
+                await lim.release(await lim.acquire(), "ok")
+            assert lim.window == 4 and lim.limit > 4.5
+
+        asyncio.run(main())
+
+    def test_ceiling(self):
+        lim = AimdLimiter(initial=2, ceiling=4)
+
+        async def main():
+            for _ in range(20):
+                await lim.release(await lim.acquire(), "ok")
+
+        asyncio.run(main())
+        assert lim.window == 4 and lim.peak == 4
+
+    def test_halves_once_per_window(self):
+        lim = AimdLimiter(initial=8, ceiling=16)
+
+        async def main():
+            epochs = [await lim.acquire() for _ in range(8)]
+            for e in epochs:                              # 同一窗口 8 个请求都被限流
+                await lim.release(e, "congestion")
+
+        asyncio.run(main())
+        assert lim.window == 4 and lim.cuts == 1
+
+    def test_floor_and_error_outcome(self):
+        lim = AimdLimiter(initial=1, ceiling=4)
+
+        async def main():
+            for _ in range(3):
+                await lim.release(await lim.acquire(), "congestion")
+            await lim.release(await lim.acquire(), "error")
+
+        asyncio.run(main())
+        assert lim.window == 1 and lim.cuts == 3 and lim.inflight == 0
+
+    def test_window_blocks_acquire(self):
+        lim = AimdLimiter(initial=1, ceiling=1)
+
+        async def main():
+            e = await lim.acquire()
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(lim.acquire(), 0.05)
+            await lim.release(e, "ok")
+            await asyncio.wait_for(lim.acquire(), 1)
+
+        asyncio.run(main())
+
+
+# ═══════════════════════════════════════════════════
+# 4. RPM / TPM 配额
+# ═══════════════════════════════════════════════════
+
+class TestRateBudget:
+    def test_takes_both_or_neither(self):
+        clock = _Clock()
+        b = RateBudget(rpm=2, tpm=600, clock=clock)
+        assert b.try_take(400) == 0
+        wait = b.try_take(400)                      # token 不够：请求数也不扣
+        assert wait == pytest.approx(20)
+        assert b.requests.level == 1
+        assert b.try_take(100) == 0
+        assert b.try_take(1) == pytest.approx(30)   # 请求数用完
+
+    def test_settle_refunds_estimate(self):
+        clock = _Clock()
+        b = RateBudget(tpm=1000, clock=clock)
+        b.try_take(600)
+        b.settle(600, 150)                          # 实际只用了 150
+        assert b.tokens.level == 850
+        b.try_take(100)
+        b.settle(100, 0)                            # 响应没带 usage：按预估计
+        assert b.tokens.level == 750
+        b.try_take(200)
+        b.cancel(200)
+        assert b.tokens.level == 750
+
+    def test_utilisation_window(self):
+        clock = _Clock()
+        b = RateBudget(rpm=100, tpm=10000, clock=clock)
+        b.settle(0, 300)
+        clock.t = 30
+        b.settle(0, 500)
+        assert b.utilisation() == {"rpm": 2, "tpm": 800, "rpm_limit": 100, "tpm_limit": 10000}
+        clock.t = 61
+        assert b.utilisation()["tpm"] == 500
+        b.settle(0, 100)
+        assert (b.peak_rpm, b.peak_tpm) == (2, 800)
+
+    def test_unlimited(self):
+        b = RateBudget()
+        assert not b.enabled and b.try_take(10 ** 9) == 0
+
+    def test_take_async_waits(self):
+        b = RateBudget(rpm=600)                     # 每 0.1 秒回填 1 个
+        for _ in range(600):
+            assert b.try_take(0) == 0
+
+        async def main():
+            loop = asyncio.get_running_loop()
+            t0 = loop.time()
+            await b.take_async(0)
+            return loop.time() - t0
+
+        assert 0.05 <= asyncio.run(main()) < 1
+        assert b.waited > 0
@@ -0,0 +1,592 @@
+from __future__ import annotations
+
+import sqlite3
+import threading
+
+import pytest
+
+from med_exam_toolkit import progress
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = tmp_path / "t.progress.db"
+    progress.init_db(path)
+    yield path
+    progress.close_writers()
+    progress.close_connections(path)
+
+
+def _session(sid: str, items: list[tuple[str, int]], **kw) -> dict:
+    return {"id": sid, "mode": "practice", "total": len(items),
+            "items": [{"fingerprint": fp, "result": r, "unit": "第一章"} for fp, r in items], **kw}
+
+
+# ═══════════════════════════════════════════════════
+# 1. 连接池
+# ═══════════════════════════════════════════════════
+
+class TestConnectionPool:
+    def test_connection_reused_with_pragmas(self, db):
+        with progress._open(db) as c1:
+            pass
+        with progress._open(db) as c2:
+            assert c2 is c1
+            assert c2.execute("PRAGMA synchronous").fetchone()[0] == 1   # NORMAL
+            assert c2.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    def test_error_rolls_back_before_reuse(self, db):
+        with pytest.raises(RuntimeError):
+            with progress._open(db) as c:
+                c.execute("INSERT INTO sessions(id,user_id,ts) VALUES ('x','u',1)")
+                raise RuntimeError
+        assert progress.get_sync_status(db, "u")["session_count"] == 0
+
+    def test_concurrent_borrowers_get_distinct_connections(self, db):
+        with progress._open(db) as a, progress._open(db) as b:
+            assert a is not b
+
+    def test_replaced_file_gets_fresh_pool(self, db):
+        progress.record_session(db, _session("s1", [("fp1", 1)]), user_id="u")
+        db.unlink()
+        for suffix in ("-wal", "-shm"):
+            db.with_name(db.name + suffix).unlink(missing_ok=True)
+        progress.init_db(db)
+        assert progress.get_sync_status(db, "u")["session_count"] == 0
+        assert sqlite3.connect(db).execute("SELECT COUNT(*) FROM sessions").fetchone()[0] == 0
+
+
+# ═══════════════════════════════════════════════════
+# 2. 批量写入 SM-2
+# ═══════════════════════════════════════════════════
+
+def _sm2_rows(db, uid: str) -> dict:
+    with progress._open(db) as c:
+        return {r["fingerprint"]: (round(r["ef"], 6), r["interval"], r["reps"], r["next_due"])
+                for r in c.execute("SELECT * FROM sm2 WHERE user_id=?", (uid,))}
+
+
+def _sequential_sm2(sessions: list[dict]) -> dict:
+    """逐条推进的参考实现"""
+    from datetime import date, timedelta
+    state: dict = {}
+    for s in sessions:
+        for it in s["items"]:
+            if it["result"] == -1:
+                continue
+            q = 4 if it["result"] == 1 else 1
+            ef, iv, reps = progress._sm2_step(*state.get(it["fingerprint"], (2.5, 0, 0))[:3], q)
+            due = (date.fromisoformat(s["date"]) + timedelta(days=iv)).isoformat()
+            state[it["fingerprint"]] = (ef, iv, reps, due)
+    return {fp: (round(v[0], 6), *v[1:]) for fp, v in state.items()}
+
+
+class TestBulkSM2:
+    def test_batch_matches_sequential_with_repeated_fingerprints(self, db):
+        seq = [("a", 1), ("b", 0), ("a", 1), ("c", -1), ("a", 0), ("b", 1)]
+        sessions = [_session(f"s{i}", seq[i:] + seq[:i], date=f"2026-01-0{i + 1}")
+                    for i in range(4)]
+        r = progress.record_sessions_batch(db, sessions, user_id="u")
+        assert r == {"processed": ["s0", "s1", "s2", "s3"], "skipped": []}
+        assert _sm2_rows(db, "u") == _sequential_sm2(sessions)
+
+    def test_record_session_matches_batch(self, db):
+        sessions = [_session(f"s{i}", [("a", 1), ("b", i % 2)], date="2026-02-01")
+                    for i in range(3)]
+        for s in sessions:
+            progress.record_session(db, s, user_id="one")
+        progress.record_sessions_batch(db, sessions, user_id="many")
+        assert _sm2_rows(db, "one") == _sm2_rows(db, "many")
+
+    def test_interval_capped(self):
+        assert progress._sm2_step(2.5, 30000, 10, 5)[1] == progress._MAX_INTERVAL
+
+    def test_duplicate_sessions_skipped(self, db):
+        progress.record_session(db, _session("old", [("a", 1)], date="2026-01-01"), user_id="u")
+        r = progress.record_sessions_batch(db, [
+            _session("old", [("a", 0)], date="2026-01-02"),
+            _session("new", [("a", 1)], date="2026-01-02"),
+            _session("new", [("a", 0)], date="2026-01-02"),
+        ], user_id="u")
+        assert r == {"processed": ["new"], "skipped": ["old", "new"]}
+        assert _sm2_rows(db, "u")["a"][1:3] == (6, 2)   # 两次答对
+        with progress._open(db) as c:
+            assert c.execute("SELECT COUNT(*) FROM attempts").fetchone()[0] == 2
+
+
+# ═══════════════════════════════════════════════════
+# 3. 单写线程 / 组提交
+# ═══════════════════════════════════════════════════
+
+class TestWriteBehind:
+    def test_concurrent_submits_are_group_committed(self, db):
+        started, gate = threading.Event(), threading.Event()
+
+        def slow(c):
+            started.set()
+            gate.wait(5)          # 挡住写线程，让后续请求在队列里堆积
+
+        blocker = threading.Thread(target=lambda: progress._writer(db).submit(slow))
+        blocker.start()
+        assert started.wait(5)
+        threads = [threading.Thread(target=progress.submit_session, args=(
+            db, _session(f"s{i}", [(f"fp{i}", 1), ("common", i % 2)]), f"u{i % 5}"))
+            for i in range(40)]
+        for t in threads:
+            t.start()
+        while progress._writer(db).queue.qsize() < 40:
+            threading.Event().wait(0.01)
+        gate.set()
+        for t in threads + [blocker]:
+            t.join(10)
+
+        with progress._open(db) as c:
+            assert c.execute("SELECT COUNT(*) FROM sessions").fetchone()[0] == 40
+            assert c.execute("SELECT COUNT(*) FROM attempts").fetchone()[0] == 80
+        st = progress.writer_stats(db)[str(db)]
+        assert st["jobs"] == 41
+        assert st["commits"] <= 3
+        assert st["max_depth"] >= 40
+        assert st["queue_depth"] == 0
+
+    def test_failed_job_does_not_abort_group(self, db):
+        w = progress._writer(db)
+        started, gate = threading.Event(), threading.Event()
+        errors = []
+
+        def hold(c):
+            started.set()
+            gate.wait(5)
+
+        def bad(c):
+            c.execute("INSERT INTO sessions(id,user_id,ts) VALUES ('bad','u',1)")
+            raise ValueError("boom")
+
+        def run(fn, *args):
+            try:
+                w.submit(fn, *args)
+            except ValueError as e:
+                errors.append(e)
+
+        ts = [threading.Thread(target=run, args=(hold,))]
+        ts += [threading.Thread(target=run, args=(bad,))]
+        ts += [threading.Thread(target=run, args=(progress._record_session,
+                                                  _session("good", [("a", 1)]), "u"))]
+        # 写线程先卡在 hold 里，后两个请求才会排队进入同一组
+        ts[0].start()
+        assert started.wait(5)
+        for t in ts[1:]:
+            t.start()
+            while w.queue.qsize() < ts.index(t):
+                threading.Event().wait(0.01)
+        gate.set()
+        for t in ts:
+            t.join(10)
+
+        assert len(errors) == 1
+        with progress._open(db) as c:
+            assert [r[0] for r in c.execute("SELECT id FROM sessions")] == ["good"]
+        assert progress.writer_stats(db)[str(db)]["failed"] == 1
+
+    def test_batch_result_and_close_flushes(self, db):
+        r = progress.submit_sessions_batch(db, [_session("a", [("x", 1)]),
+                                                _session("a", [("x", 0)])], "u")
+        assert r == {"processed": ["a"], "skipped": ["a"]}
+        progress.close_writers()
+        assert progress.writer_stats() == {}
+        assert progress.get_sync_status(db, "u")["session_count"] == 1
+
+    def test_full_queue_raises_busy(self, db, monkeypatch):
+        monkeypatch.setattr(progress, "_QUEUE_MAX", 1)
+        progress.close_writers()
+        w = progress._writer(db)
+        started, gate = threading.Event(), threading.Event()
+        threading.Thread(target=w.submit,
+                         args=(lambda c: started.set() or gate.wait(5),)).start()
+        assert started.wait(5)                       # 写线程已取走第一个任务
+        threading.Thread(target=w.submit, args=(lambda c: None,)).start()
+        while not w.queue.full():
+            threading.Event().wait(0.01)
+        with pytest.raises(progress.WriterBusy):
+            w.submit(lambda c: None, timeout=0.05)
+        gate.set()
+
+    def test_retry_after_busy_timeout_not_duplicated(self, db):
+        w = progress._writer(db)
+        started, gate = threading.Event(), threading.Event()
+        blocker = threading.Thread(target=w.submit,
+                                   args=(lambda c: started.set() or gate.wait(5),))
+        blocker.start()
+        assert started.wait(5)
+        sess = _session("s1", [("a", 1), ("b", 0)])
+        # 第一次等待超时，但任务已在队列里，之后仍会落盘
+        with pytest.raises(progress.WriterBusy):
+            w.submit(progress._record_session, sess, "u", timeout=0.05)
+        gate.set()
+        blocker.join(5)
+        progress.submit_session(db, sess, user_id="u")   # 客户端重试
+        with progress._open(db) as c:
+            assert c.execute("SELECT COUNT(*) FROM sessions").fetchone()[0] == 1
+            assert c.execute("SELECT COUNT(*) FROM attempts").fetchone()[0] == 2
+        assert _sm2_rows(db, "u")["a"][1:3] == (1, 1)    # SM-2 只推进一次
+
+    def test_group_failure_closes_connection(self, db):
+        class _Broken:
+            in_transaction = False
+            closed = False
+
+            def execute(self, sql, *a):
+                raise sqlite3.OperationalError("disk I/O error")
+
+            def close(self):
+                self.closed = True
+
+        w = progress._writer(db)
+        w.submit(lambda c: None)                     # 先建立正常连接
+        broken = _Broken()
+        w._conn = broken
+        with pytest.raises(sqlite3.OperationalError):
+            w.submit(lambda c: None)
+        assert broken.closed and w._conn is None
+        progress.submit_session(db, _session("after", [("a", 1)]), "u")   # 下一组重新连接
+        assert progress.get_sync_status(db, "u")["session_count"] == 1
+
+
+# ═══════════════════════════════════════════════════
+# 4. 汇总表
+# ═══════════════════════════════════════════════════
+
+def _stats_tables(db) -> tuple[list, list]:
+    with progress._open(db) as c:
+        return ([tuple(r) for r in c.execute(
+                    "SELECT * FROM user_question_stats ORDER BY user_id, fingerprint")],
+                [tuple(r) for r in c.execute(
+                    "SELECT * FROM user_unit_stats ORDER BY user_id, unit")])
+
+
+class TestQuestionStats:
+    def _fill(self, db):
+        for i in range(6):
+            items = [{"fingerprint": f"fp{(i + j) % 4}", "result": (i * j) % 3 - 1,
+                      "unit": f"第{j % 2}章" if j else ""} for j in range(5)]
+            progress.record_session(db, {"id": f"s{i}", "items": items}, user_id=f"u{i % 2}")
+        progress.record_sessions_batch(db, [_session("b1", [("fp9", 0), ("fp9", 1)])], "u0")
+
+    def test_incremental_matches_rebuild(self, db):
+        self._fill(db)
+        progress.migrate_user_data(db, "u1", "u2")
+        incremental = _stats_tables(db)
+        with progress._open(db) as c:
+            progress._rebuild_stats(c)
+        assert _stats_tables(db) == incremental
+        assert not any(r[0] == "u1" for r in incremental[0])
+
+    def test_reads_match_attempts_aggregation(self, db):
+        self._fill(db)
+        with progress._open(db) as c:
+            ref = {r[0]: tuple(r[1:]) for r in c.execute(
+                """SELECT fingerprint, COUNT(*), SUM(result=1), SUM(result=0) FROM attempts
+                   WHERE user_id='u0' AND result!=-1 GROUP BY fingerprint""")}
+        wrong = progress.get_wrong_fingerprints(db, "u0")
+        assert wrong and all(ref[w["fingerprint"]] == (w["total"], w["correct"], w["wrong"])
+                             for w in wrong)
+        overall = progress.get_overall_stats(db, "u0")
+        assert overall["total_attempts"] == sum(v[0] for v in ref.values())
+        assert overall["wrong_topics"] == sum(1 for v in ref.values() if v[2])
+        units = {u["unit"]: u["total"] for u in progress.get_unit_stats(db, "u0")}
+        assert "" not in units and sum(units.values()) > 0
+
+    def test_clear_removes_stats(self, db):
+        self._fill(db)
+        progress.clear_user_data(db, "u0")
+        qs, units = _stats_tables(db)
+        assert {r[0] for r in qs} == {"u1"} and {r[0] for r in units} == {"u1"}
+
+    def test_existing_db_backfilled_on_upgrade(self, db):
+        self._fill(db)
+        before = _stats_tables(db)
+        with progress._open(db) as c:
+            c.execute("DROP TABLE user_question_stats")
+            c.execute("DROP TABLE user_unit_stats")
+        progress.init_db(db)
+        assert _stats_tables(db) == before
+
+    def test_wrongbook_uses_covering_index(self, db):
+        with progress._open(db) as c:
+            plan = " ".join(r[3] for r in c.execute(
+                """EXPLAIN QUERY PLAN
+                   SELECT fingerprint, total, correct, wrong, last_ts FROM user_question_stats
+                   WHERE user_id=? AND wrong>0 AND correct*1.0/(correct+wrong) < 0.8
+                   ORDER BY wrong DESC, last_ts DESC LIMIT 10""", ("u",)))
+        assert "COVERING INDEX idx_uqs_wrong" in plan and "TEMP B-TREE" not in plan
+
+
+# ═══════════════════════════════════════════════════
+# 5. 复习队列
+# ═══════════════════════════════════════════════════
+
+class TestDueQueue:
+    def _seed(self, db):
+        # fp0..fp5 在不同日期答错 → 次日到期；skip 只跳过过，未排期
+        for i in range(6):
+            progress.record_session(db, _session(f"s{i}", [(f"fp{i}", 0)],
+                                                 date=f"2026-01-0{6 - i}"), user_id="u")
+        progress.record_session(db, _session("sk", [("skip1", -1), ("skip0", -1)],
+                                             date="2026-01-01"), user_id="u")
+
+    def test_pages_most_overdue_first(self, db):
+        self._seed(db)
+        pages, cursor = [], None
+        while True:
+            page = progress.get_due_page(db, "u", "2026-02-01", limit=3, cursor=cursor)
+            pages.append([it["fingerprint"] for it in page["items"]])
+            assert page["count"] == 8
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        assert pages == [["fp5", "fp4", "fp3"], ["fp2", "fp1", "fp0"], ["skip0", "skip1"]]
+        assert sum(pages, []) == progress.get_due_fingerprints(db, "u", "2026-02-01")
+        first = progress.get_due_page(db, "u", "2026-02-01", limit=1)["items"][0]
+        assert first == {"fingerprint": "fp5", "next_due": "2026-01-02", "overdue_days": 30}
+
+    def test_not_yet_due_excluded(self, db):
+        self._seed(db)
+        page = progress.get_due_page(db, "u", "2026-01-03", limit=10)
+        assert [it["fingerprint"] for it in page["items"]] == ["fp5", "fp4", "skip0", "skip1"]
+
+    def test_bad_cursor(self, db):
+        with pytest.raises(ValueError):
+            progress.get_due_page(db, "u", cursor="x:1")
+
+    def test_count_cached_and_invalidated_on_write(self, db):
+        self._seed(db)
+        assert progress.get_due_count(db, "u", "2026-02-01") == 8
+        with progress._open(db) as c:     # 绕过写入路径改库：缓存值不变
+            c.execute("DELETE FROM sm2 WHERE user_id='u'")
+        assert progress.get_due_count(db, "u", "2026-02-01") == 8
+        progress.submit_session(db, _session("n", [("new", -1)]), "u")
+        assert progress.get_due_count(db, "u", "2026-02-01") == 9   # 6 个 fp 变为未排期 + 3 个 skip
+        assert progress.get_overall_stats(db, "u", "2026-02-01")["due_today"] == 9
+        progress.clear_user_data(db, "u")
+        assert progress.get_due_count(db, "u", "2026-02-01") == 0
+
+
+# ═══════════════════════════════════════════════════
+# 6. 历史压缩
+# ═══════════════════════════════════════════════════
+
+_DAY_MS = 86400 * 1000
+
+
+class TestCompaction:
+    def _fill(self, db):
+        for i in range(30):
+            items = [{"fingerprint": f"fp{(i + j) % 7}", "result": (i * j) % 3 - 1,
+                      "unit": f"第{j % 3}章" if j % 4 else ""} for j in range(6)]
+            progress.record_session(db, {"id": f"s{i}", "items": items}, user_id=f"u{i % 3}")
+        with progress._open(db) as c:     # 前 2/3 的记录挪到 100 天前，分散在不同日期
+            c.execute("UPDATE attempts SET ts = ts - ? - (id % 5) * ? WHERE id % 3 != 0",
+                      (100 * _DAY_MS, _DAY_MS))
+            progress._rebuild_stats(c)
+
+    def _snapshot(self, db):
+        return (_stats_tables(db), progress.get_wrong_fingerprints(db, "u1"),
+                progress.get_unit_stats(db, "u1"), progress.get_overall_stats(db, "u1"))
+
+    def test_compaction_preserves_stats(self, db):
+        self._fill(db)
+        before = self._snapshot(db)
+        r = progress.compact_attempts(db, older_than_days=90, chunk=7)
+        assert r["rows_compacted"] == 120 and 0 < r["daily_rows"] <= 120
+        # 每批经写线程提交，不与在线写入争抢写锁
+        assert progress.writer_stats(db)[str(db)]["jobs"] == -(-120 // 7) + 1
+        with progress._open(db) as c:
+            assert c.execute("SELECT COUNT(*) FROM attempts").fetchone()[0] == 60
+            progress._rebuild_stats(c)          # 由 attempts + attempts_daily 重算
+        assert self._snapshot(db) == before
+        assert set(r["queries"]) == set(progress._PROBES)
+
+    def test_second_run_is_noop(self, db):
+        self._fill(db)
+        progress.compact_attempts(db, 90)
+        assert progress.compact_attempts(db, 90)["rows_compacted"] == 0
+
+    def test_migrate_and_clear_include_daily_rows(self, db):
+        self._fill(db)
+        progress.compact_attempts(db, 90)
+        totals = progress.get_overall_stats(db, "u1")["total_attempts"]
+        progress.migrate_user_data(db, "u1", "new")
+        assert progress.get_overall_stats(db, "new")["total_attempts"] == totals
+        progress.clear_user_data(db, "new")
+        with progress._open(db) as c:
+            assert not c.execute(
+                "SELECT 1 FROM attempts_daily WHERE user_id IN ('u1','new')").fetchone()
+
+    def test_converts_legacy_db_and_reclaims_space(self, tmp_path):
+        path = tmp_path / "old.progress.db"
+        with sqlite3.connect(path) as c:        # auto_vacuum=NONE 的旧库
+            c.execute("CREATE TABLE t(x)")
+        progress.init_db(path)
+        progress.record_session(path, {"id": "s", "items": [
+            {"fingerprint": f"fp{i}", "result": 1, "unit": "x" * 200} for i in range(3000)]})
+        with progress._open(path) as c:
+            c.execute("UPDATE attempts SET ts = ts - ?", (200 * _DAY_MS,))
+        r = progress.compact_attempts(path, 90)
+        assert r["vacuum_converted"] and r["reclaimed"] > 0
+        with progress._open(path) as c:
+            assert c.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+        progress.close_connections(path)
+
+    def test_new_db_uses_incremental_vacuum(self, db):
+        with progress._open(db) as c:
+            assert c.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+
+class TestCompactCommand:
+    def test_reports_and_compacts(self, db):
+        from click.testing import CliRunner
+        from med_exam_toolkit.cli import cli
+        TestCompaction()._fill(db)
+        res = CliRunner().invoke(cli, ["progress", "compact", "--db", str(db), "--days", "90"])
+        assert res.exit_code == 0, res.output
+        assert "合并 120 条作答" in res.output and "活跃度扫描" in res.output
+
+    def test_requires_target(self):
+        from click.testing import CliRunner
+        from med_exam_toolkit.cli import cli
+        assert CliRunner().invoke(cli, ["progress", "compact"]).exit_code == 2
+
+
+# ═══════════════════════════════════════════════════
+# 7. 清理不活跃用户
+# ═══════════════════════════════════════════════════
+
+class TestStaleCleanup:
+    def _fill(self, db, users=("old1", "old2", "old3", "live", progress.LEGACY_USER)):
+        for uid in users:
+            for i in range(4):
+                progress.record_session(db, _session(f"{uid}-{i}", [(f"fp{j}", j % 2)
+                                                                    for j in range(20)]), uid)
+        with progress._open(db) as c:     # 除 live 外全部挪到 30 天前
+            for table, cols in (("sessions", ("ts",)), ("attempts", ("ts",)),
+                                ("user_question_stats", ("last_ts", "first_seen"))):
+                sets = ", ".join(f"{col} = {col} - {30 * _DAY_MS}" for col in cols)
+                c.execute(f"UPDATE {table} SET {sets} WHERE user_id != 'live'")
+
+    def _users(self, db):
+        with progress._open(db) as c:
+            return {t: {r[0] for r in c.execute(f"SELECT DISTINCT user_id FROM {t}")}
+                    for t in ("sessions", "attempts", "sm2", "user_question_stats",
+                              "user_unit_stats")}
+
+    def test_deletes_stale_users_in_chunks(self, db):
+        self._fill(db)
+        r = progress.cleanup_stale_users(db, 7, batch=2, chunk=7)
+        assert r["users"] == 3 and r["remaining"] == 0
+        assert r["rows"] == 3 * (4 + 80 + 20)          # sessions + attempts + sm2
+        for users in self._users(db).values():
+            assert users == {"live", progress.LEGACY_USER}
+        assert progress.cleanup_stale_users(db, 7)["users"] == 0
+
+    def test_user_returning_mid_cleanup_kept_whole(self, db, monkeypatch):
+        self._fill(db)
+        real, calls = progress._cleanup_users, []
+
+        def job(c, uids, cutoff, chunk):
+            if not calls:    # 第一块删完前 old2 回来答了一题
+                progress._record_session(c, _session("back", [("fp0", 1)]), "old2")
+            calls.append(uids[0])
+            return real(c, uids, cutoff, chunk)
+
+        monkeypatch.setattr(progress, "_cleanup_users", job)
+        r = progress.cleanup_stale_users(db, 7, chunk=80)
+        assert r["users"] == 2 and r["remaining"] == 0
+        assert calls == ["old1", "old3"]              # 每块一个用户，old2 被复查后跳过
+        for users in self._users(db).values():
+            assert "old2" in users and not users & {"old1", "old3"}
+        with progress._open(db) as c:
+            assert c.execute("SELECT COUNT(*) FROM attempts WHERE user_id='old2'"
+                             ).fetchone()[0] == 81
+
+    def test_budget_leaves_rest_for_next_run(self, db):
+        self._fill(db)
+        r = progress.cleanup_stale_users(db, 7, budget=0)
+        assert r["users"] == 0 and r["remaining"] == 3
+        assert "old1" in self._users(db)["sessions"]
+        assert progress.cleanup_stale_users(db, 7)["users"] == 3
+
+    def test_reclaims_free_pages(self, db):
+        self._fill(db)
+        with progress._open(db) as c:
+            c.execute("UPDATE sessions SET units = ? WHERE user_id = 'old1'", ("x" * 50000,))
+        assert progress.cleanup_stale_users(db, 7)["vacuumed_pages"] > 0
+        with progress._open(db) as c:
+            assert c.execute("PRAGMA freelist_count").fetchone()[0] == 0
+
+    def test_due_cache_invalidated(self, db):
+        self._fill(db)
+        assert progress.get_due_count(db, "old1", "2099-01-01") == 20
+        progress.cleanup_stale_users(db, 7)
+        assert progress.get_due_count(db, "old1", "2099-01-01") == 0
+
+
+# ═══════════════════════════════════════════════════
+# 8. 全体高错题排行（ai-warm）
+# ═══════════════════════════════════════════════════
+
+class TestHotWrongAnswers:
+    @staticmethod
+    def _answer(db, uid: str, fp: str, result: int, answer=None, si: int = 0) -> None:
+        item = {"fingerprint": fp, "result": result, "si": si}
+        if answer is not None:
+            item["answer"] = answer
+        progress.record_session(db, {"id": f"{uid}-{fp}-{si}-{answer}-{result}",
+                                     "items": [item]}, user_id=uid)
+
+    def test_records_choice(self, db):
+        self._answer(db, "u", "fp1", 0, "B", si=2)
+        self._answer(db, "u", "fp2", -1, "C")           # 跳过不记选项
+        self._answer(db, "u", "fp3", 0, "A" * 40)       # 异常输入丢弃
+        self._answer(db, "u", "fp4", 1)                 # 旧客户端不带 answer
+        with progress._open(db) as c:
+            rows = {r[0]: (r[1], r[2]) for r in c.execute(
+                "SELECT fingerprint, answer, sq_index FROM attempts")}
+        assert rows == {"fp1": ("B", 2), "fp2": (None, None),
+                        "fp3": (None, None), "fp4": (None, None)}
+
+    def test_ranking_and_popular_options(self, db):
+        for i in range(10):                             # hard：错 8 / 10，多数选 C
+            self._answer(db, f"u{i}", "hard", 0 if i < 8 else 1,
+                         "C" if i < 5 else "D" if i < 7 else "E" if i < 8 else "A")
+        for i in range(10):                             # mid：错 3 / 10
+            self._answer(db, f"u{i}", "mid", 0 if i < 3 else 1, "B" if i < 3 else "A", si=1)
+        for i in range(2):                              # rare：作答太少不参与排名
+            self._answer(db, f"u{i}", "rare", 0, "B")
+        hot = progress.get_hot_wrong_answers(db, min_attempts=5, per_question=2)
+        assert [h["fingerprint"] for h in hot] == ["hard", "mid"]
+        assert hot[0]["wrong_rate"] == 0.8 and hot[0]["total"] == 10
+        assert hot[0]["answers"] == [(0, "C", 5), (0, "D", 2)]
+        assert hot[1]["answers"] == [(1, "B", 3)]
+        assert progress.get_hot_wrong_answers(db, limit=1)[0]["fingerprint"] == "hard"
+
+    def test_merge_keeps_choice(self, db):
+        self._answer(db, "a", "fp", 0, "D", si=1)
+        progress.migrate_user_data(db, "a", "b")
+        hot = progress.get_hot_wrong_answers(db, min_attempts=1)
+        assert hot[0]["answers"] == [(1, "D", 1)]
+
+    def test_old_db_upgraded(self, tmp_path):
+        path = tmp_path / "old.progress.db"
+        with sqlite3.connect(path) as c:
+            c.execute("""CREATE TABLE attempts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL DEFAULT '_legacy',
+                fingerprint TEXT NOT NULL, session_id TEXT, result INTEGER NOT NULL,
+                mode TEXT, unit TEXT, ts INTEGER NOT NULL)""")
+            c.execute("INSERT INTO attempts (fingerprint, result, ts) VALUES ('fp', 0, 1)")
+        progress.init_db(path)
+        try:
+            self._answer(path, "u", "fp", 0, "B")
+            hot = progress.get_hot_wrong_answers(path, min_attempts=1)
+            assert hot[0]["wrong"] == 2 and hot[0]["answers"] == [(0, "B", 1)]
+        finally:
+            progress.close_connections(path)
@@ -0,0 +1,461 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+import pytest
+
+from med_exam_toolkit import quiz
+from med_exam_toolkit.models import Question, SubQuestion
+from med_exam_toolkit.state import MemoryStore, SQLiteStore
+
+_TOKEN = "test-token"
+
+
+# ── 测试数据工厂 ──────────────────────────────────────────────────────────
+
+def _make_q(i: int, *, mode: str = "A1型题", unit: str = "第一章", n_sub: int = 1,
+            rate: str = "70%") -> Question:
+    subs = [
+        SubQuestion(text=f"题{i}-{j}", options=["A.甲", "B.乙", "C.丙"],
+                    answer="A", rate=rate, discuss=f"解析{i}-{j}")
+        for j in range(n_sub)
+    ]
+    return Question(fingerprint=f"fp{i}", mode=mode, unit=unit, sub_questions=subs)
+
+
+def _sample_questions() -> list[Question]:
+    qs = []
+    for i in range(12):
+        qs.append(_make_q(i, mode="A1型题", unit=f"第{i % 3}章", rate=f"{40 + i * 5}%"))
+    for i in range(12, 18):
+        qs.append(_make_q(i, mode="A3/A4型题", unit=f"第{i % 3}章", n_sub=3))
+    return qs
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """装载内存题库、关闭访问码的 quiz 测试客户端。"""
+    bank = quiz.BankState(bank_path=Path("t.mqb"), password=None,
+                          questions=_sample_questions())
+    monkeypatch.setattr(quiz, "_banks", [bank])
+    monkeypatch.setattr(quiz, "_fp_global", {})
+    monkeypatch.setattr(quiz, "_pin_enabled", False)
+    monkeypatch.setattr(quiz, "_session_token", _TOKEN)
+    monkeypatch.setattr(quiz, "_state", MemoryStore())
+    monkeypatch.setattr(quiz, "_rate_state", MemoryStore())
+    quiz._index_banks()
+    c = quiz.app.test_client()
+    c.environ_base["HTTP_X_SESSION_TOKEN"] = _TOKEN
+    return c
+
+
+# ═══════════════════════════════════════════════════
+# 1. /api/questions 展开缓存
+# ═══════════════════════════════════════════════════
+
+class TestFlatCache:
+    def test_flat_groups_built_once(self):
+        bank = quiz.BankState(bank_path=Path("t.mqb"), password=None,
+                              questions=_sample_questions())
+        assert bank.flat_groups() is bank.flat_groups()
+        assert bank.flat_json() is bank.flat_json()
+
+    def test_fragments_match_flat_records(self):
+        bank = quiz.BankState(bank_path=Path("t.mqb"), password=None,
+                              questions=_sample_questions())
+        for grp, frags in zip(bank.flat_groups(), bank.flat_json()):
+            assert [json.loads(f) for f in frags] == grp
+
+    def test_full_bank_response(self, client):
+        data = client.get("/api/questions?bank=0").get_json()
+        assert data["total"] == 12 + 6 * 3
+        assert [it["id"] for it in data["items"][:2]] == ["0-0", "1-0"]
+        assert data["items"][-1]["fingerprint"] == "fp17"
+
+    def test_seeded_response_is_stable(self, client):
+        url = "/api/questions?bank=0&shuffle=1&seed=5&limit=10"
+        assert client.get(url).get_data() == client.get(url).get_data()
+
+
+# ═══════════════════════════════════════════════════
+# 2. 指纹索引
+# ═══════════════════════════════════════════════════
+
+class TestFingerprintIndex:
+    def test_bank_index(self):
+        bank = quiz.BankState(bank_path=Path("t.mqb"), password=None,
+                              questions=_sample_questions())
+        [(qi, q)] = bank.fp_index()["fp13"]
+        assert qi == 13 and q is bank.questions[13]
+
+    def test_duplicate_fingerprints_all_selected(self, client, monkeypatch):
+        qs = _sample_questions() + [_make_q(3, unit="第0章")]       # 与第 3 题同指纹
+        bank = quiz.BankState(bank_path=Path("t.mqb"), password=None, questions=qs)
+        monkeypatch.setattr(quiz, "_banks", [bank])
+        quiz._index_banks()
+        assert [qi for qi, _ in bank.fp_index()["fp3"]] == [3, 18]
+        items = client.get("/api/questions?bank=0&fingerprints=fp3,fp5").get_json()["items"]
+        assert [it["id"] for it in items] == ["3-0", "5-0", "18-0"]
+        assert quiz._lookup_fp("fp3", 0)[:2] == (0, 3)                # 单题查询取第一道
+
+    def test_lookup_prefers_requested_bank(self, monkeypatch):
+        a = quiz.BankState(bank_path=Path("a.mqb"), password=None, questions=[_make_q(1)])
+        b = quiz.BankState(bank_path=Path("b.mqb"), password=None,
+                           questions=[_make_q(2), _make_q(1)])
+        monkeypatch.setattr(quiz, "_banks", [a, b])
+        monkeypatch.setattr(quiz, "_fp_global", {})
+        quiz._index_banks()
+        assert quiz._lookup_fp("fp1")[:2] == (0, 0)
+        assert quiz._lookup_fp("fp1", 1)[:2] == (1, 1)
+        assert quiz._lookup_fp("fp2", 0)[:2] == (1, 0)
+        assert quiz._lookup_fp("missing") is None
+
+    def test_questions_by_fingerprints_keep_bank_order(self, client):
+        data = client.get("/api/questions?bank=0&fingerprints=fp5,fp1,fp13").get_json()
+        assert [it["fingerprint"] for it in data["items"]] == ["fp1", "fp5"] + ["fp13"] * 3
+
+    def test_wrongbook_attaches_question_text(self, client, tmp_path):
+        from med_exam_toolkit.progress import init_db, record_session
+        db = tmp_path / "t.progress.db"
+        init_db(db)
+        record_session(db, {"id": "s1", "items": [{"fingerprint": "fp3", "result": 0}]},
+                       user_id="u1")
+        quiz._banks[0].db_path = db
+        client.set_cookie("med_exam_uid", "u1")
+        items = client.get("/api/wrongbook?bank=0").get_json()["items"]
+        assert items[0]["fingerprint"] == "fp3"
+        assert items[0]["text"] == "题3-0"
+        assert items[0]["answer"] == "A"
+
+    def test_exam_join_selects_shared_fingerprints(self, client):
+        token = client.post("/api/exam/share?bank=0", json={
+            "fingerprints": ["fp14", "fp2"], "mode": "practice",
+        }).get_json()["token"]
+        data = client.get(f"/api/exam/join?token={token}").get_json()
+        assert [r["id"] for r in data["items"]] == ["2-0", "14-0", "14-1", "14-2"]
+
+
+# ═══════════════════════════════════════════════════
+# 3. 分桶抽样索引
+# ═══════════════════════════════════════════════════
+
+class TestStrataIndex:
+    def _bank(self):
+        return quiz.BankState(bank_path=Path("t.mqb"), password=None,
+                              questions=_sample_questions())
+
+    def test_buckets_cover_every_group_once(self):
+        st = self._bank().strata()
+        qis = sorted(qi for lst in st.buckets.values() for qi in lst)
+        assert qis == list(range(18))
+        assert st.difficulty[0] == "hard" and st.difficulty[11] == "easy"
+
+    def test_group_by_mode_keeps_bank_order(self):
+        st = self._bank().strata()
+        order, merged, totals = st.group("mode", {"A1型题", "A3/A4型题"}, {"第1章", "第2章"})
+        assert order == ["A1型题", "A3/A4型题"]
+        assert merged["A1型题"] == [1, 2, 4, 5, 7, 8, 10, 11]
+        assert totals["A3/A4型题"] == 4 * 3
+
+    def test_per_unit_quota(self, client):
+        url = ('/api/questions?bank=0&shuffle=1&seed=1'
+               '&per_unit={"第0章":4,"第1章":3}&difficulty={"easy":1,"hard":1}')
+        items = client.get(url).get_json()["items"]
+        assert sum(1 for it in items if it["unit"] == "第0章") == 4
+        assert sum(1 for it in items if it["unit"] == "第1章") == 3
+
+    def test_truncated_group_not_added_twice(self, monkeypatch):
+        # A3 只有 3、4 题的题组，凑 5 题必须截断一组；A1 数量不够触发补足，
+        # 补足阶段不能把被截断的原题组整组再加回来
+        qs = [_make_q(i, mode="A3/A4型题", n_sub=3 + i % 2) for i in range(40)]
+        qs += [_make_q(i, mode="A1型题") for i in range(40, 60)]
+        bank = quiz.BankState(bank_path=Path("t.mqb"), password=None, questions=qs)
+        monkeypatch.setattr(quiz, "_banks", [bank])
+        monkeypatch.setattr(quiz, "_fp_global", {})
+        monkeypatch.setattr(quiz, "_pin_enabled", False)
+        monkeypatch.setattr(quiz, "_session_token", _TOKEN)
+        quiz._index_banks()
+        c = quiz.app.test_client()
+        c.environ_base["HTTP_X_SESSION_TOKEN"] = _TOKEN
+        for seed in range(10):
+            url = f'/api/questions?bank=0&shuffle=1&seed={seed}&per_mode={{"A3/A4型题":5,"A1型题":30}}'
+            ids = [it["id"] for it in c.get(url).get_json()["items"]]
+            assert len(ids) == len(set(ids)) == 35
+
+
+# ═══════════════════════════════════════════════════
+# 4. 分页 / NDJSON 流式输出
+# ═══════════════════════════════════════════════════
+
+class TestIncrementalQuestions:
+    _URL = "/api/questions?bank=0&shuffle=1&seed=7"
+
+    def test_pages_concatenate_to_full_result(self, client):
+        full = client.get(self._URL).get_json()["items"]
+        got, cursor = [], "0"
+        while cursor is not None:
+            page = client.get(f"{self._URL}&page_size=7&cursor={cursor}").get_json()
+            assert page["total"] == len(full)
+            got.extend(page["items"])
+            cursor = page["next_cursor"]
+        assert got == full
+
+    def test_unseeded_pagination_issues_seed(self, client):
+        first = client.get("/api/questions?bank=0&shuffle=1&page_size=5").get_json()
+        seed = first["seed"]
+        again = client.get(f"/api/questions?bank=0&shuffle=1&page_size=5&seed={seed}").get_json()
+        assert again["items"] == first["items"]
+        assert "seed" not in again
+
+    def test_per_unit_pages_reuse_issued_seed(self, client, monkeypatch):
+        url = '/api/questions?bank=0&per_unit={"第0章":4,"第1章":3}&page_size=3'
+        first = client.get(url).get_json()
+        calls = []
+        real = quiz._select_question_items
+        monkeypatch.setattr(quiz, "_select_question_items",
+                            lambda *a: calls.append(1) or real(*a))
+        got, page = list(first["items"]), first
+        while page["next_cursor"] is not None:
+            page = client.get(f"{url}&seed={first['seed']}&cursor={page['next_cursor']}").get_json()
+            got.extend(page["items"])
+        # 后续页命中首页写入的抽题缓存，拼起来不重不漏
+        assert calls == []
+        assert len(got) == first["total"] == 7
+        assert len({it["id"] for it in got}) == 7
+
+    def test_ndjson_issues_seed(self, client):
+        resp = client.get("/api/questions?bank=0&shuffle=1&format=ndjson")
+        seed = resp.headers["X-Seed"]
+        lines = [json.loads(ln) for ln in resp.get_data(as_text=True).splitlines()]
+        again = client.get(f"/api/questions?bank=0&shuffle=1&seed={seed}").get_json()
+        assert again["items"] == lines
+
+    def test_invalid_cursor(self, client):
+        assert client.get("/api/questions?bank=0&cursor=abc").status_code == 400
+
+    def test_invalid_page_size(self, client):
+        resp = client.get("/api/questions?bank=0&page_size=abc")
+        assert resp.status_code == 400 and resp.get_json() == {"error": "invalid page_size"}
+
+    def test_ndjson_stream(self, client):
+        resp = client.get(self._URL + "&format=ndjson")
+        assert resp.mimetype == "application/x-ndjson"
+        lines = [json.loads(ln) for ln in resp.get_data(as_text=True).splitlines()]
+        assert lines == client.get(self._URL).get_json()["items"]
+        assert resp.headers["X-Total-Count"] == str(len(lines))
+
+
+# ═══════════════════════════════════════════════════
+# 5. 响应缓存 / ETag
+# ═══════════════════════════════════════════════════
+
+class TestResponseCache:
+    def test_info_etag_roundtrip(self, client):
+        first = client.get("/api/info?bank=0")
+        etag = first.headers["ETag"]
+        assert first.headers["Cache-Control"] == "private, no-cache"
+        again = client.get("/api/info?bank=0", headers={"If-None-Match": etag})
+        assert again.status_code == 304 and again.get_data() == b""
+
+    def test_compressed_etag_suffix_matches(self, client):
+        etag = client.get("/api/banks").get_etag()[0]
+        resp = client.get("/api/banks", headers={"If-None-Match": f'"{etag}:gzip"'})
+        assert resp.status_code == 304
+
+    def test_seeded_questions_cached(self, client, monkeypatch):
+        url = "/api/questions?bank=0&shuffle=1&seed=3&limit=8"
+        etag = client.get(url).headers["ETag"]
+        calls = []
+        real = quiz._select_question_items
+        monkeypatch.setattr(quiz, "_select_question_items",
+                            lambda *a: calls.append(1) or real(*a))
+        # 参数顺序不同、只翻页：都复用已缓存的抽题结果
+        client.get("/api/questions?limit=8&seed=3&shuffle=1&bank=0&page_size=3")
+        assert calls == []
+        assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+
+    def test_unseeded_shuffle_not_cached(self, client):
+        resp = client.get("/api/questions?bank=0&shuffle=1")
+        assert "ETag" not in resp.headers
+
+
+# ═══════════════════════════════════════════════════
+# 6. 答题记录写线程
+# ═══════════════════════════════════════════════════
+
+class TestRecordWriter:
+    @pytest.fixture
+    def db(self, client, tmp_path):
+        from med_exam_toolkit import progress
+        db = tmp_path / "t.progress.db"
+        progress.init_db(db)
+        quiz._banks[0].db_path = db
+        yield db
+        progress.close_writers()
+        progress.close_connections(db)
+
+    def test_sync_goes_through_writer(self, client, db):
+        sessions = [{"id": f"s{i}", "items": [{"fingerprint": "fp1", "result": 1}]}
+                    for i in range(3)]
+        data = client.post("/api/sync?bank=0", json={"sessions": sessions}).get_json()
+        assert data["processed"] == ["s0", "s1", "s2"]
+        assert client.post("/api/record?bank=0", json=sessions[0]).get_json() == {"ok": True}
+        writers = client.get("/api/record/metrics").get_json()["writers"]
+        assert str(db) not in writers and str(db.parent) not in str(writers)
+        st = writers["0"]
+        assert st["jobs"] == 2 and st["queue_depth"] == 0
+
+    def test_due_pagination(self, client, db):
+        client.post("/api/sync?bank=0", json={"sessions": [
+            {"id": "s", "date": "2026-01-01",
+             "items": [{"fingerprint": f"fp{i}", "result": 0} for i in range(5)]}]})
+        page = client.get("/api/review/due?bank=0&date=2026-02-01&page_size=2").get_json()
+        assert page["fingerprints"] == ["fp0", "fp1"] and page["count"] == 5
+        nxt = client.get(f"/api/review/due?bank=0&date=2026-02-01&page_size=2"
+                         f"&cursor={page['next_cursor']}").get_json()
+        assert nxt["fingerprints"] == ["fp2", "fp3"]
+        assert client.get("/api/review/due?bank=0&page_size=2&cursor=bad").status_code == 400
+
+    def test_busy_writer_returns_503(self, client, db, monkeypatch):
+        from med_exam_toolkit import progress
+
+        def busy(*a, **kw):
+            raise progress.WriterBusy("写入队列已满")
+        monkeypatch.setattr(progress, "submit_session", busy)
+        resp = client.post("/api/record?bank=0", json={"id": "x", "items": []})
+        assert resp.status_code == 503
+        assert resp.headers["Retry-After"] == "5"
+
+
+# ═══════════════════════════════════════════════════
+# 7. 考试会话写回
+# ═══════════════════════════════════════════════════
+
+class TestExamPersistence:
+    @pytest.fixture
+    def db(self, client, tmp_path, monkeypatch):
+        from med_exam_toolkit import progress
+        db = tmp_path / "t.progress.db"
+        progress.init_db(db)
+        quiz._banks[0].db_path = db
+        monkeypatch.setattr(quiz, "_exam_dirty", set())
+        monkeypatch.setattr(quiz, "_EXAM_PERSIST_DELAY", 60)   # 后台线程不介入，测试里手动写回
+        self.saved = []
+        orig = progress.save_exam_sessions
+
+        def spy(db_path, sessions, deleted=()):
+            self.saved.append(([s["id"] for s in sessions], list(deleted)))
+            return orig(db_path, sessions, deleted)
+        monkeypatch.setattr(progress, "save_exam_sessions", spy)
+        yield db
+        progress.close_writers()
+        progress.close_connections(db)
+
+    def _join(self, client) -> str:
+        token = client.post("/api/exam/share?bank=0", json={
+            "fingerprints": ["fp1", "fp2"], "mode": "exam"}).get_json()["token"]
+        return client.get(f"/api/exam/join?token={token}").get_json()["exam_id"]
+
+    def _rows(self, db):
+        from med_exam_toolkit import progress
+        return {r["id"]: r for r in progress.load_exam_sessions(db)}
+
+    def test_burst_written_once(self, client, db):
+        eids = {self._join(client) for _ in range(5)}
+        assert quiz._persist_exam_sessions() == 5
+        assert len(self.saved) == 1 and set(self.saved[0][0]) == eids
+        assert set(self._rows(db)) == eids
+        assert quiz._persist_exam_sessions() == 0 and len(self.saved) == 1
+
+    def test_reveal_writes_only_that_session(self, client, db):
+        eids = [self._join(client) for _ in range(3)]
+        quiz._persist_exam_sessions()
+        client.get(f"/api/exam/reveal?id={eids[1]}")
+        client.get(f"/api/exam/reveal?id={eids[1]}")        # 重复领取不再写
+        assert quiz._persist_exam_sessions() == 1
+        assert self.saved[-1] == ([eids[1]], [])
+        assert self._rows(db)[eids[1]]["revealed_at"] > 0
+
+    def test_evicted_sessions_deleted(self, client, db):
+        old = self._join(client)
+        quiz._persist_exam_sessions()
+        quiz._state.set("exam", old, quiz._state.get("exam", old), ttl=-1)   # 已过期
+        new = self._join(client)
+        quiz._persist_exam_sessions()
+        assert self.saved[-1] == ([new], [old])
+        assert set(self._rows(db)) == {new}
+
+    def test_single_background_worker(self, client, db, monkeypatch):
+        import threading
+        import time
+        monkeypatch.setattr(quiz, "_EXAM_PERSIST_DELAY", 0.01)
+        monkeypatch.setattr(quiz, "_exam_worker", None)
+        before = set(threading.enumerate())
+        eids = {self._join(client) for _ in range(3)}
+        deadline = time.monotonic() + 5
+        while set(self._rows(db)) != eids and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert set(self._rows(db)) == eids
+        started = [t for t in set(threading.enumerate()) - before if t.name == "exam-persist"]
+        assert started == [quiz._exam_worker]
+
+
+# ═══════════════════════════════════════════════════
+# 8. 多 worker 共享状态
+# ═══════════════════════════════════════════════════
+
+class TestSharedState:
+    """两个 SQLiteStore 实例指向同一文件，模拟两个 worker 进程。"""
+
+    @pytest.fixture
+    def stores(self, client, tmp_path, monkeypatch):
+        a, b = SQLiteStore(tmp_path / "state.db"), SQLiteStore(tmp_path / "state.db")
+        monkeypatch.setattr(quiz, "_state", a)
+        yield a, b
+        a.close()
+        b.close()
+
+    def test_exam_visible_across_workers(self, client, stores, monkeypatch):
+        a, b = stores
+        token = client.post("/api/exam/share?bank=0", json={
+            "fingerprints": ["fp1", "fp2"], "mode": "exam"}).get_json()["token"]
+        monkeypatch.setattr(quiz, "_state", b)
+        eid = client.get(f"/api/exam/join?token={token}").get_json()["exam_id"]
+        monkeypatch.setattr(quiz, "_state", a)
+        assert client.get(f"/api/exam/time?id={eid}").status_code == 200
+        first = client.get(f"/api/exam/reveal?id={eid}").get_json()["answers"]
+        monkeypatch.setattr(quiz, "_state", b)
+        assert client.get(f"/api/exam/reveal?id={eid}").get_json()["answers"] == first
+        assert b.get("exam", eid)["revealed_at"] > 0
+        assert not quiz._exam_dirty          # 持久存储无需再写回进度库
+
+    def test_rate_limit_stays_in_process(self, client, stores, monkeypatch):
+        # 限流计数每个请求都写，不进共享库（否则所有 worker 抢同一把写锁）
+        a, b = stores
+        monkeypatch.setattr(quiz, "_rate_state", MemoryStore())
+        monkeypatch.setattr(quiz, "_RATE_LIMIT", 3)
+        for _ in range(3):
+            assert quiz._check_rate_limit("1.2.3.4")
+        assert not quiz._check_rate_limit("1.2.3.4")
+        assert quiz._check_rate_limit("5.6.7.8")
+        client.get("/api/banks")
+        assert a.items("rate") == [] and b.items("rate") == []
+
+    def test_ban_shared(self, client, stores, monkeypatch):
+        a, b = stores
+        quiz._ban_ip("9.9.9.9", 60)
+        monkeypatch.setattr(quiz, "_state", b)
+        assert quiz._is_banned("9.9.9.9")
+        assert not quiz._is_banned("8.8.8.8")
+
+    def test_share_brute_shared(self, client, stores, monkeypatch):
+        a, b = stores
+        for _ in range(quiz._SHARE_BRUTE_MAX):
+            quiz._share_brute_record_fail("1.1.1.1", "tok")
+        monkeypatch.setattr(quiz, "_state", b)
+        allowed, retry = quiz._share_brute_check("1.1.1.1", "tok")
+        assert not allowed and retry > 0
+        quiz._share_brute_clear("1.1.1.1", "tok")
+        monkeypatch.setattr(quiz, "_state", a)
+        assert quiz._share_brute_check("1.1.1.1", "tok") == (True, 0)
@@ -0,0 +1,38 @@
+from __future__ import annotations
+
+import pytest
+
+from med_exam_toolkit import serving
+from med_exam_toolkit.serving import ServerOptions, describe
+
+
+# ═══════════════════════════════════════════════════
+# 1. 服务器选项
+# ═══════════════════════════════════════════════════
+
+class TestServerOptions:
+    def test_defaults_to_werkzeug(self):
+        opts = ServerOptions().resolve()
+        assert opts.server == "werkzeug"
+        assert "Werkzeug" in describe(opts)
+
+    def test_unknown_server_falls_back(self, capsys):
+        assert ServerOptions(server="uwsgi").resolve().server == "werkzeug"
+        assert "[WARN]" in capsys.readouterr().out
+
+    def test_missing_gunicorn_falls_back(self, monkeypatch, capsys):
+        monkeypatch.setattr(serving, "HAS_GUNICORN", False)
+        assert ServerOptions(server="gunicorn").resolve().server == "werkzeug"
+        assert "gunicorn" in capsys.readouterr().out
+
+    def test_clamps_limits(self):
+        opts = ServerOptions(threads=0, keepalive=-1, backlog=0, max_connections=2).resolve()
+        assert (opts.threads, opts.keepalive, opts.backlog) == (1, 0, 1)
+        opts = ServerOptions(threads=64, max_connections=10).resolve()
+        assert opts.max_connections == 64      # 连接上限不低于线程数
+
+    @pytest.mark.skipif(not serving.HAS_GUNICORN, reason="gunicorn 未安装")
+    def test_describe_gunicorn(self):
+        opts = ServerOptions(server="gunicorn", threads=8, keepalive=3).resolve()
+        text = describe(opts, workers=4)
+        assert "4 worker × 8 线程" in text and "keep-alive 3s" in text
@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import threading
+
+import pytest
+
+from med_exam_toolkit import auth
+from med_exam_toolkit.push import PushStore, PushSubscription
+from med_exam_toolkit.state import MemoryStore, SQLiteStore, make_store
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    s = MemoryStore() if request.param == "memory" else SQLiteStore(tmp_path / "state.db")
+    yield s
+    s.close()
+
+
+# ═══════════════════════════════════════════════════
+# 1. 基本读写与过期
+# ═══════════════════════════════════════════════════
+
+class TestStore:
+    def test_get_set_pop(self, store):
+        assert store.get("ns", "k") is None
+        assert store.get("ns", "k", 1) == 1
+        store.set("ns", "k", {"a": [1, 2]})
+        assert store.get("ns", "k") == {"a": [1, 2]}
+        assert store.get("other", "k") is None
+        assert store.pop("ns", "k") == {"a": [1, 2]}
+        assert store.pop("ns", "k", "gone") == "gone"
+
+    def test_ttl(self, store):
+        store.set("ns", "live", 1, ttl=60)
+        store.set("ns", "dead", 2, ttl=-1)
+        store.set("ns", "forever", 3)
+        assert store.get("ns", "dead") is None
+        assert store.pop("ns", "dead") is None
+        store.set("ns", "dead", 2, ttl=-1)
+        assert sorted(store.items("ns")) == [("forever", 3), ("live", 1)]
+        assert store.purge("ns") == ["dead"]
+        assert store.purge("ns") == []
+
+    def test_update(self, store):
+        assert store.update("ns", "n", lambda v: (v or 0) + 1) == 1
+        assert store.update("ns", "n", lambda v: (v or 0) + 1) == 2
+        assert store.update("ns", "n", lambda v: None) is None
+        assert store.get("ns", "n") is None
+
+    def test_update_keeps_expiry(self, store):
+        store.set("ns", "k", 1, ttl=-1)
+        assert store.update("ns", "k", lambda v: v) is None     # 已过期视为不存在
+        store.set("ns", "k", 1, ttl=60)
+        store.update("ns", "k", lambda v: v + 1)
+        assert store.get("ns", "k") == 2
+
+    def test_hit(self, store):
+        assert [store.hit("rate", "ip", 3, 60)[0] for _ in range(4)] == [True, True, True, False]
+        allowed, retry = store.hit("rate", "ip", 3, 60)
+        assert not allowed and 0 < retry <= 61
+        assert store.hit("rate", "other", 3, 60) == (True, 0)
+
+    def test_concurrent_update(self, store):
+        def work():
+            for _ in range(50):
+                store.update("ns", "n", lambda v: (v or 0) + 1)
+        ts = [threading.Thread(target=work) for _ in range(4)]
+        for t in ts:
+            t.start()
+        for t in ts:
+            t.join()
+        assert store.get("ns", "n") == 200
+
+    def test_make_store(self, tmp_path):
+        assert isinstance(make_store(), MemoryStore)
+        s = make_store(tmp_path / "s.db")
+        assert isinstance(s, SQLiteStore) and s.durable
+        s.close()
+
+
+# ═══════════════════════════════════════════════════
+# 2. SQLiteStore 跨实例共享
+# ═══════════════════════════════════════════════════
+
+class TestSQLiteShared:
+    def test_two_instances_share(self, tmp_path):
+        a, b = SQLiteStore(tmp_path / "s.db"), SQLiteStore(tmp_path / "s.db")
+        a.set("exam", "e1", {"answers": {}}, ttl=60)
+        assert b.get("exam", "e1") == {"answers": {}}
+        assert b.pop("exam", "e1") is not None
+        assert a.get("exam", "e1") is None
+        a.close()
+        b.close()
+
+    def test_no_returning_clause(self, tmp_path):
+        # DELETE ... RETURNING 需要 SQLite ≥ 3.35，旧系统库上会直接报错
+        s = SQLiteStore(tmp_path / "s.db")
+        sql = []
+        with s._conn() as c:
+            c.set_trace_callback(sql.append)
+        s.set("ns", "a", 1)
+        s.set("ns", "b", 2, ttl=-1)
+        assert s.pop("ns", "a") == 1 and s.pop("ns", "a") is None
+        assert s.purge("ns") == ["b"]
+        assert sql and not any("RETURNING" in q.upper() for q in sql)
+        s.close()
+
+    def test_connections_pooled_across_threads(self, tmp_path):
+        # Werkzeug 每个请求一个新线程：连接要复用，不能每个线程新开一个
+        s = SQLiteStore(tmp_path / "s.db")
+        for i in range(20):
+            t = threading.Thread(target=lambda: (s.set("k", str(i), i), s.get("k", str(i))))
+            t.start()
+            t.join()
+        assert len(s._pool) == 1
+        s.close()
+        assert s._pool == []
+
+
+# ═══════════════════════════════════════════════════
+# 3. 访问码暴破计数 / 验证码 / 推送订阅
+# ═══════════════════════════════════════════════════
+
+class TestConsumers:
+    @pytest.fixture(autouse=True)
+    def _use(self, store):
+        old = auth._store
+        auth.use_store(store)
+        yield
+        auth.use_store(old)
+
+    def test_brute_force_lockout(self):
+        ip = "10.0.0.1"
+        assert auth.check_brute_force(ip) == (True, 0)
+        assert not auth.needs_captcha(ip)
+        for _ in range(auth._LOCK_STAGES[0][0]):
+            auth.record_failure(ip)
+        assert auth.needs_captcha(ip)
+        allowed, retry = auth.check_brute_force(ip)
+        assert not allowed and retry > 0
+        auth.record_success(ip)
+        assert auth.check_brute_force(ip) == (True, 0)
+
+    def test_captcha_single_use(self):
+        cid, _ = auth.new_captcha()
+        answer = str(auth._store.get("captcha", cid))
+        assert auth.verify_captcha(cid, answer)
+        assert not auth.verify_captcha(cid, answer)
+
+    def test_push_store(self, store):
+        ps = PushStore(store)
+        sub = PushSubscription(endpoint="https://e/1", keys_p256dh="k", keys_auth="a")
+        ps.add(sub, uid="u1")
+        assert ps.for_uid("u1") == sub
+        assert ps.all() == [sub]
+        ps.add(PushSubscription(endpoint="https://e/2", keys_p256dh="k", keys_auth="a"), uid="u1")
+        ps.remove("https://e/1")
+        assert ps.for_uid("u1").endpoint == "https://e/2"
+        ps.clear()
+        assert ps.all() == [] and ps.for_uid("u1") is None
@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import gzip
+import os
+
+import pytest
+from flask import Flask, render_template_string
+
+from med_exam_toolkit.static_assets import HAS_BROTLI, StaticAssets
+
+_JS = b"function hello() { return '" + b"x" * 4000 + b"'; }\n"
+
+
+@pytest.fixture
+def assets(tmp_path):
+    static = tmp_path / "static"
+    static.mkdir()
+    (static / "app.js").write_bytes(_JS)
+    (static / "icon.png").write_bytes(b"\x89PNG" + b"\0" * 100)
+    app = Flask(__name__, static_folder=str(static))
+    sa = StaticAssets(app)
+    sa.load(background=False)
+    return sa
+
+
+def _url(sa, name):
+    with sa.app.test_request_context():
+        return render_template_string("{{ asset_url(%r) }}" % name)
+
+
+# ═══════════════════════════════════════════════════
+# 1. 内容哈希版本号
+# ═══════════════════════════════════════════════════
+
+class TestVersioning:
+    def test_version_is_content_hash(self, assets, tmp_path):
+        again = StaticAssets(Flask("other", static_folder=str(tmp_path / "static")))
+        assert again.load(precompress=False) == assets.version
+        (tmp_path / "static" / "app.js").write_bytes(_JS + b"//")
+        assert again.load(precompress=False) != assets.version
+
+    def test_versioned_url_is_immutable(self, assets):
+        url = _url(assets, "app.js")
+        assert url.startswith("/static/app.js?v=")
+        c = assets.app.test_client()
+        assert "immutable" in c.get(url).headers["Cache-Control"]
+        assert c.get("/static/app.js").headers["Cache-Control"] == "public, no-cache"
+        assert c.get("/static/app.js?v=stale").headers["Cache-Control"] == "public, no-cache"
+
+    def test_binary_assets_served_from_disk(self, assets):
+        resp = assets.app.test_client().get(_url(assets, "icon.png"))
+        assert resp.status_code == 200 and "immutable" in resp.headers["Cache-Control"]
+
+
+# ═══════════════════════════════════════════════════
+# 2. 预压缩
+# ═══════════════════════════════════════════════════
+
+class TestPrecompressed:
+    def test_gzip_variant(self, assets):
+        resp = assets.app.test_client().get("/static/app.js",
+                                            headers={"Accept-Encoding": "gzip"})
+        assert resp.headers["Content-Encoding"] == "gzip"
+        assert gzip.decompress(resp.get_data()) == _JS
+        assert "Accept-Encoding" in resp.headers["Vary"]
+
+    @pytest.mark.skipif(not HAS_BROTLI, reason="brotli 未安装")
+    def test_brotli_preferred(self, assets):
+        import brotli
+        resp = assets.app.test_client().get("/static/app.js",
+                                            headers={"Accept-Encoding": "gzip, br"})
+        assert resp.headers["Content-Encoding"] == "br"
+        assert brotli.decompress(resp.get_data()) == _JS
+
+    def test_identity_and_304(self, assets):
+        c = assets.app.test_client()
+        resp = c.get("/static/app.js")
+        assert "Content-Encoding" not in resp.headers and resp.get_data() == _JS
+        again = c.get("/static/app.js", headers={"If-None-Match": resp.headers["ETag"]})
+        assert again.status_code == 304
+
+    def test_page_rendered_once(self, assets):
+        calls = []
+        with assets.app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+            for _ in range(2):
+                resp = assets.page(("p", 1), lambda: calls.append(1) or "<p>" + "题" * 500)
+                assert resp.headers["Content-Encoding"] == "gzip"
+        assert calls == [1]
+
+    @pytest.mark.skipif(not hasattr(os, "fork"), reason="需要 fork")
+    def test_forked_worker_inherits_variants(self, tmp_path):
+        # 多 worker / gunicorn：fork 前同步预压缩，子进程直接拿到压好的内容
+        static = tmp_path / "static"
+        static.mkdir()
+        (static / "app.js").write_bytes(_JS)
+        sa = StaticAssets(Flask("fork", static_folder=str(static)))
+        sa.load(precompress=False)
+        sa.precompress(background=False)
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0 if sa._assets["app.js"].variants.get("gzip") else 1)
+        _, status = os.waitpid(pid, 0)
+        assert os.waitstatus_to_exitcode(status) == 0